@@ -5,7 +5,10 @@ Punto de entrada principal usando patrón Factory MVC
 import datetime
 from flask import Flask
 from config import Config
-from models import db
+from models import db, init_conexion_por_peticion
+from services.outbox_service import init_outbox
+from services.trabajos_service import init_trabajos
+from services.foto_service import miniatura
 
 
 def create_app(config_class=Config):
@@ -24,9 +27,21 @@ def create_app(config_class=Config):
     # Inicializar extensiones
     db.init_app(app)
     
+    # Una conexión del pool por petición, reutilizada por todas las consultas
+    init_conexion_por_peticion(app)
+    
+    # Worker que envía los correos guardados en el outbox
+    init_outbox(app)
+    
+    # Pool de trabajos en segundo plano (recupera los interrumpidos por un reinicio)
+    init_trabajos(app)
+    
     # Hacer disponible la función now() en todos los templates
     app.jinja_env.globals['now'] = datetime.datetime.now
     
+    # Miniaturas de las fotos de prendas: {{ url_for('static', filename=foto|miniatura) }}
+    app.jinja_env.filters['miniatura'] = miniatura
+    
     # Registrar blueprints
     from routes.auth import bp as auth_bp
     from routes.cliente import bp as cliente_bp
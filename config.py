@@ -54,6 +54,69 @@ class Config:
         'max_overflow': 10,
     }
     
+    # Reutilizar una sola conexión del pool durante cada petición (run_query)
+    DB_CONEXION_POR_PETICION = os.getenv('DB_CONEXION_POR_PETICION', '1') != '0'
+    
+    # Trabajos en segundo plano (exportaciones y recibos PDF, ver services/trabajos_service.py)
+    TRABAJOS_WORKERS = int(os.getenv('TRABAJOS_WORKERS', 2))
+    TRABAJOS_DIR = os.getenv('TRABAJOS_DIR', '')  # vacío = carpeta temporal del sistema
+    TRABAJOS_RETENCION_HORAS = int(os.getenv('TRABAJOS_RETENCION_HORAS', 24))
+    # Un trabajo en_proceso más antiguo que esto se da por interrumpido (mayor que el trabajo más largo)
+    TRABAJOS_ABANDONO_MINUTOS = int(os.getenv('TRABAJOS_ABANDONO_MINUTOS', 60))
+    
+    # Claves de reporte_pendiente que aplica cada visita a admin.reportes; el resto
+    # lo procesa scripts/refrescar_reportes.py (ver services/reportes_service.py)
+    REPORTES_REFRESCO_LOTE = int(os.getenv('REPORTES_REFRESCO_LOTE', 200))
+    
+    # Outbox de correos (ver services/outbox_service.py)
+    OUTBOX_LOTE = int(os.getenv('OUTBOX_LOTE', 50))
+    OUTBOX_INTERVALO = float(os.getenv('OUTBOX_INTERVALO', 5))  # segundos entre revisiones
+    OUTBOX_MAX_INTENTOS = int(os.getenv('OUTBOX_MAX_INTENTOS', 5))
+    
+    # Conteos de los listados (ver services/conteo_service.py)
+    CONTEO_UMBRAL_ESTIMADO = int(os.getenv('CONTEO_UMBRAL_ESTIMADO', 10000))  # 0 = siempre exacto
+    CONTEO_CACHE_SEGUNDOS = int(os.getenv('CONTEO_CACHE_SEGUNDOS', 300))
+    
+    # Autocompletado de clientes con índice en memoria (ver services/autocompletado_service.py)
+    AUTOCOMPLETADO_MEMORIA = os.getenv('AUTOCOMPLETADO_MEMORIA', '1') != '0'
+    AUTOCOMPLETADO_RECARGA_SEGUNDOS = int(os.getenv('AUTOCOMPLETADO_RECARGA_SEGUNDOS', 600))
+    
+    # Caché de username -> id_usuario del usuario en sesión (ver helpers.usuario_actual)
+    IDENTIDAD_CACHE_SEGUNDOS = int(os.getenv('IDENTIDAD_CACHE_SEGUNDOS', 60))
+    
+    # Long-poll de notificaciones (ver services/notificacion_service.py).
+    # Cada espera ocupa un hilo de waitress: dejar hilos libres para el resto de peticiones
+    NOTIFICACIONES_ESPERA_SEGUNDOS = int(os.getenv('NOTIFICACIONES_ESPERA_SEGUNDOS', 25))  # 0 = sin esperas
+    NOTIFICACIONES_ESPERAS_MAX = int(os.getenv('NOTIFICACIONES_ESPERAS_MAX', 2))
+    NOTIFICACIONES_REINTENTO_SEGUNDOS = int(os.getenv('NOTIFICACIONES_REINTENTO_SEGUNDOS', 60))
+    
+    # Retención de notificaciones (ver notificacion_service.archivar_notificaciones); 0 = no aplicar la regla
+    NOTIFICACIONES_RETENCION_LEIDAS_DIAS = int(os.getenv('NOTIFICACIONES_RETENCION_LEIDAS_DIAS', 90))
+    NOTIFICACIONES_RETENCION_DIAS = int(os.getenv('NOTIFICACIONES_RETENCION_DIAS', 365))
+    NOTIFICACIONES_ARCHIVO_DIAS = int(os.getenv('NOTIFICACIONES_ARCHIVO_DIAS', 730))
+    NOTIFICACIONES_LOTE_ARCHIVO = int(os.getenv('NOTIFICACIONES_LOTE_ARCHIVO', 1000))
+    
+    # Caché de descuento_config (ver services/descuento_service.py); se invalida al editar niveles
+    DESCUENTO_CACHE_SEGUNDOS = int(os.getenv('DESCUENTO_CACHE_SEGUNDOS', 300))
+    
+    # Imágenes de códigos de barras (ver services/codigo_barras_service.py)
+    CODIGO_BARRAS_CACHE_MAX = int(os.getenv('CODIGO_BARRAS_CACHE_MAX', 256))  # imágenes en memoria; 0 = sin caché
+    CODIGO_BARRAS_DIR = os.getenv('CODIGO_BARRAS_DIR', '')  # vacío = sin caché en disco
+    CODIGO_BARRAS_DIR_MAX_MB = int(os.getenv('CODIGO_BARRAS_DIR_MAX_MB', 50))
+    
+    # Caché de recibos PDF en disco (ver services/recibo_service.py)
+    RECIBOS_CACHE_DIR = os.getenv('RECIBOS_CACHE_DIR', '')  # vacío = carpeta temporal del sistema
+    RECIBOS_CACHE_MAX_MB = int(os.getenv('RECIBOS_CACHE_MAX_MB', 200))
+    
+    # Recibos masivos (admin.recibos_masivos): hasta RECIBOS_MASIVOS_DIRECTO se generan en la petición
+    RECIBOS_MASIVOS_DIRECTO = int(os.getenv('RECIBOS_MASIVOS_DIRECTO', 20))
+    RECIBOS_MASIVOS_MAX = int(os.getenv('RECIBOS_MASIVOS_MAX', 2000))
+    
+    # Fotos de prendas (ver services/foto_service.py): se procesan en segundo plano
+    FOTOS_WORKERS = int(os.getenv('FOTOS_WORKERS', 1))
+    FOTOS_ORIGINAL_MAX = int(os.getenv('FOTOS_ORIGINAL_MAX', 2048))  # lado máximo del original re-codificado
+    FOTOS_MAX_PIXELES = int(os.getenv('FOTOS_MAX_PIXELES', 40_000_000))  # se rechazan imágenes más grandes
+    
     # Desactivar track modifications de SQLAlchemy
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
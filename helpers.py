@@ -2,9 +2,10 @@
 Funciones auxiliares reutilizables
 """
 import os
-import json
-from flask import session, request, url_for
-from models import run_query
+import threading
+import time
+from flask import session, request, url_for, g, current_app, has_request_context
+from models import run_query, transaccion, al_confirmar
 
 
 def admin_only():
@@ -20,6 +21,81 @@ def admin_only():
     return str(rol).strip().lower() == 'administrador'
 
 
+# Caché username -> (vence, id_usuario, rol) compartida entre peticiones
+_identidades = {}
+_identidades_lock = threading.Lock()
+_IDENTIDADES_MAX = 5000
+
+
+def _buscar_identidad(username):
+    """(id_usuario, rol) de un username, con caché de IDENTIDAD_CACHE_SEGUNDOS."""
+    clave = username.lower()
+    ahora = time.monotonic()
+    entrada = _identidades.get(clave)
+    if entrada and entrada[0] > ahora:
+        return entrada[1], entrada[2]
+
+    # idx_usuario_username_lower (migrations/create_indices_usuario.sql)
+    fila = run_query(
+        "SELECT id_usuario, rol FROM usuario WHERE LOWER(username) = :u",
+        {"u": clave},
+        fetchone=True
+    )
+    if not fila:
+        with _identidades_lock:
+            _identidades.pop(clave, None)
+        return None
+
+    identidad = (fila[0], str(fila[1] or '').strip().lower())
+    ttl = current_app.config.get('IDENTIDAD_CACHE_SEGUNDOS', 60)
+    with _identidades_lock:
+        if len(_identidades) >= _IDENTIDADES_MAX:
+            _identidades.clear()
+        _identidades[clave] = (ahora + ttl, identidad[0], identidad[1])
+    return identidad
+
+
+def invalidar_identidad(username=None):
+    """Olvida la identidad cacheada de un username (o todas) tras editarlo o eliminarlo."""
+    with _identidades_lock:
+        if username is None:
+            _identidades.clear()
+        else:
+            _identidades.pop(username.lower(), None)
+
+
+def usuario_actual():
+    """
+    Identidad del usuario en sesión, resuelta una sola vez por petición.
+    
+    El username de la sesión se resuelve con caché y se compara con el
+    id_usuario guardado al iniciar sesión (si el username pasó a otra cuenta no
+    es el mismo usuario).
+    
+    Returns:
+        dict con id_usuario y rol, o None si no hay sesión o el usuario ya no existe
+    """
+    if has_request_context() and 'usuario_actual' in g:
+        return g.usuario_actual
+
+    identidad = None
+    username = session.get('username')
+    if username:
+        encontrada = _buscar_identidad(username)
+        if encontrada and session.get('id_usuario') in (None, encontrada[0]):
+            identidad = {'id_usuario': encontrada[0], 'rol': encontrada[1]}
+
+    if has_request_context():
+        g.usuario_actual = identidad
+    return identidad
+
+
+def id_usuario_actual():
+    """id_usuario del usuario en sesión (None si no hay sesión o ya no existe)."""
+    identidad = usuario_actual()
+    return identidad['id_usuario'] if identidad else None
+
+
 def tabla_descuento_existe():
     """
     Verifica si la tabla descuento_config existe en la base de datos.
@@ -57,10 +133,20 @@ def parse_sql_statements(sql_text):
             line = line.split('--', 1)[0]
         cleaned_lines.append(line)
     cleaned = "\n".join(cleaned_lines)
-    for stmt in cleaned.split(';'):
-        stmt = stmt.strip()
-        if stmt:
-            statements.append(stmt)
+    # Los ';' dentro de bloques $$ ... $$ (cuerpos de funciones) no separan sentencias
+    actual = ''
+    for i, trozo in enumerate(cleaned.split('$$')):
+        if i % 2:
+            actual += '$$' + trozo + '$$'
+            continue
+        partes = trozo.split(';')
+        actual += partes[0]
+        for parte in partes[1:]:
+            if actual.strip():
+                statements.append(actual.strip())
+            actual = parte
+    if actual.strip():
+        statements.append(actual.strip())
     return statements
 
 
@@ -90,10 +176,13 @@ def ejecutar_sql_file(nombre_archivo):
 
 def obtener_esquema_descuento_cliente(id_cliente):
     """
-    Obtiene el esquema de descuento para un cliente específico.
+    Obtiene el esquema de descuento para un cliente específico (solo lectura).
     - Si tiene pedidos activos (Pendiente/En proceso), usa esquema congelado
     - Si NO tiene pedidos activos, usa esquema actual (actualizado)
-    - Si completó el último nivel, actualiza al esquema actual
+    - Si completó el último nivel, usa el esquema actual
+    
+    El esquema se congela y se libera en las transiciones de los pedidos
+    (ver services/descuento_service.py).
     
     Args:
         id_cliente: ID del cliente
@@ -101,115 +190,9 @@ def obtener_esquema_descuento_cliente(id_cliente):
     Returns:
         lista de dicts con nivel, porcentaje, min, max
     """
-    # Obtener configuración actual
-    config_actual = run_query("""
-        SELECT nivel, porcentaje, pedidos_minimos, pedidos_maximos
-        FROM descuento_config
-        WHERE activo = true
-        ORDER BY pedidos_minimos ASC
-    """, fetchall=True)
-    
-    if not config_actual:
-        # Valores por defecto si no hay configuración
-        return [
-            {"nivel": "Bronce", "porcentaje": 5, "min": 0, "max": 2},
-            {"nivel": "Plata", "porcentaje": 10, "min": 3, "max": 5},
-            {"nivel": "Oro", "porcentaje": 15, "min": 6, "max": 9},
-            {"nivel": "Platino", "porcentaje": 20, "min": 10, "max": None}
-        ]
-    
-    esquema_actual = [
-        {
-            "nivel": c[0],
-            "porcentaje": int(c[1]),
-            "min": int(c[2]),
-            "max": int(c[3]) if c[3] is not None else None
-        }
-        for c in config_actual
-    ]
-    
-    # Verificar si tiene pedidos activos (NO completados)
-    pedidos_activos = run_query("""
-        SELECT COUNT(*) FROM pedido 
-        WHERE id_cliente = :id AND estado IN ('Pendiente', 'En proceso')
-    """, {"id": id_cliente}, fetchone=True)[0] or 0
-    
-    # Si NO tiene pedidos activos, usar SIEMPRE el esquema actual
-    if pedidos_activos == 0:
-        # Desactivar cualquier esquema congelado anterior
-        try:
-            run_query("""
-                UPDATE cliente_esquema_descuento
-                SET activo = false
-                WHERE id_cliente = :id AND activo = true
-            """, {"id": id_cliente}, commit=True)
-        except:
-            pass
-        
-        return esquema_actual
-    
-    # Tiene pedidos activos - verificar si tiene esquema congelado
-    try:
-        esquema_guardado = run_query("""
-            SELECT id_esquema, esquema_json, fecha_inicio
-            FROM cliente_esquema_descuento
-            WHERE id_cliente = :id AND activo = true
-        """, {"id": id_cliente}, fetchone=True)
-    except:
-        esquema_guardado = None
-    
-    if esquema_guardado:
-        # Tiene esquema congelado - verificar si completó TODOS los niveles
-        try:
-            esquema_json = json.loads(esquema_guardado[1])
-            
-            # Contar todos los pedidos del cliente (excepto cancelados)
-            pedidos_count = run_query(
-                "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado != 'Cancelado'",
-                {"id": id_cliente},
-                fetchone=True
-            )[0] or 0
-            
-            # Verificar si completó el último nivel del esquema
-            # Solo actualizar si el último nivel tiene máximo definido Y lo superó
-            ultimo_nivel = esquema_json[-1] if esquema_json else None
-            if ultimo_nivel:
-                max_ultimo = ultimo_nivel.get("max")
-                # Si el último nivel es ilimitado (None), NUNCA actualizar
-                # Si tiene máximo y lo superó, actualizar al esquema actual
-                if max_ultimo is not None and pedidos_count > max_ultimo:
-                    # Desactivar esquema anterior
-                    run_query("""
-                        UPDATE cliente_esquema_descuento
-                        SET activo = false
-                        WHERE id_esquema = :id
-                    """, {"id": esquema_guardado[0]}, commit=True)
-                    
-                    # Crear nuevo esquema con config actual
-                    run_query("""
-                        INSERT INTO cliente_esquema_descuento (id_cliente, esquema_json, activo)
-                        VALUES (:id, :json, true)
-                    """, {"id": id_cliente, "json": json.dumps(esquema_actual)}, commit=True)
-                    
-                    return esquema_actual
-            
-            # Mantener esquema congelado (tiene pedidos activos)
-            return esquema_json
-        except:
-            # Error parseando JSON, usar actual
-            return esquema_actual
-    else:
-        # Tiene pedidos activos pero NO tiene esquema congelado - congelar el actual
-        try:
-            run_query("""
-                INSERT INTO cliente_esquema_descuento (id_cliente, esquema_json, activo)
-                VALUES (:id, :json, true)
-            """, {"id": id_cliente, "json": json.dumps(esquema_actual)}, commit=True)
-        except:
-            # Si falla (tabla no existe), continuar sin guardar
-            pass
-        
-        return esquema_actual
+    # Import local: services importa helpers
+    from services.descuento_service import resolver_esquema
+    return resolver_esquema(id_cliente)
 
 
 def get_safe_redirect():
@@ -246,16 +229,27 @@ def crear_notificacion(id_usuario, titulo, mensaje, tipo='info', url=None):
         bool: True si se creó correctamente, False en caso contrario
     """
     try:
-        run_query("""
-            INSERT INTO notificacion (id_usuario, titulo, mensaje, tipo, url)
-            VALUES (:id_usuario, :titulo, :mensaje, :tipo, :url)
-        """, {
-            'id_usuario': id_usuario,
-            'titulo': titulo,
-            'mensaje': mensaje,
-            'tipo': tipo,
-            'url': url
-        }, commit=True)
+        # Dentro de una transacción del llamador se guarda con ella (como SAVEPOINT,
+        # para que un fallo aquí no aborte el cambio principal)
+        with transaccion():
+            fila = run_query("""
+                INSERT INTO notificacion (id_usuario, titulo, mensaje, tipo, url)
+                VALUES (:id_usuario, :titulo, :mensaje, :tipo, :url)
+                RETURNING id_notificacion
+            """, {
+                'id_usuario': id_usuario,
+                'titulo': titulo,
+                'mensaje': mensaje,
+                'tipo': tipo,
+                'url': url
+            }, fetchone=True, commit=True)
+        # Despertar las esperas de /api/notificaciones/esperar cuando la
+        # notificación ya sea visible, es decir, tras el commit de la transacción
+        # externa (import local: services importa helpers)
+        from services.notificacion_service import publicar_local, programar_archivo
+        id_notificacion = fila[0]
+        al_confirmar(lambda: publicar_local(int(id_usuario), id_notificacion))
+        programar_archivo(current_app._get_current_object())
         return True
     except Exception as e:
         print(f"[ERROR] crear_notificacion: {e}")
@@ -0,0 +1,13 @@
+-- Agregar cantidad a la tabla prenda para guardar N unidades idénticas en una sola fila
+-- Las filas existentes representan una unidad cada una, por eso el valor por defecto es 1
+
+ALTER TABLE prenda
+ADD COLUMN IF NOT EXISTS cantidad INTEGER NOT NULL DEFAULT 1;
+
+ALTER TABLE prenda DROP CONSTRAINT IF EXISTS chk_prenda_cantidad_positiva;
+ALTER TABLE prenda ADD CONSTRAINT chk_prenda_cantidad_positiva CHECK (cantidad > 0);
+
+-- Índice para agrupar prendas por pedido
+CREATE INDEX IF NOT EXISTS idx_prenda_pedido ON prenda(id_pedido);
+
+COMMENT ON COLUMN prenda.cantidad IS 'Número de unidades idénticas (mismo tipo, descripción y foto) que representa la fila';
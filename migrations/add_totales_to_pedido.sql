@@ -0,0 +1,102 @@
+-- Totales por pedido guardados en la tabla pedido (número de prendas, subtotal y total)
+-- Los listados leen estas columnas en lugar de agrupar la tabla prenda.
+-- Se mantienen con triggers: cualquier INSERT/UPDATE/DELETE en prenda recalcula los
+-- pedidos afectados (una sola vez por sentencia) y el total se deriva del subtotal y
+-- del porcentaje_descuento guardado en el pedido.
+-- Para los pedidos existentes ejecutar una vez: python scripts/backfill_totales_pedido.py
+
+ALTER TABLE pedido
+ADD COLUMN IF NOT EXISTS total_prendas INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE pedido
+ADD COLUMN IF NOT EXISTS subtotal NUMERIC(12, 2) NOT NULL DEFAULT 0;
+
+ALTER TABLE pedido
+ADD COLUMN IF NOT EXISTS total NUMERIC(12, 2) NOT NULL DEFAULT 0;
+
+-- Recalcula total_prendas y subtotal de los pedidos indicados (precios de precio_prenda)
+CREATE OR REPLACE FUNCTION pedido_recalcular_totales(p_ids INTEGER[]) RETURNS void AS $$
+BEGIN
+    UPDATE pedido p
+    SET total_prendas = COALESCE(t.prendas, 0),
+        subtotal = COALESCE(t.subtotal, 0)
+    FROM (
+        -- Un pedido sin prendas llega del LEFT JOIN como una fila con prenda NULL:
+        -- el FILTER la deja fuera para que sume 0 prendas y subtotal 0
+        SELECT ids.id_pedido,
+               SUM(COALESCE(pr.cantidad, 1)) FILTER (WHERE pr.id_prenda IS NOT NULL) AS prendas,
+               SUM(COALESCE(pr.cantidad, 1) * COALESCE(pp.precio, 5000))
+                   FILTER (WHERE pr.id_prenda IS NOT NULL) AS subtotal
+        FROM (SELECT DISTINCT unnest(p_ids) AS id_pedido) ids
+        LEFT JOIN prenda pr ON pr.id_pedido = ids.id_pedido
+        LEFT JOIN precio_prenda pp ON pp.tipo = pr.tipo
+        GROUP BY ids.id_pedido
+    ) t
+    WHERE p.id_pedido = t.id_pedido
+      AND (p.total_prendas IS DISTINCT FROM COALESCE(t.prendas, 0)
+           OR p.subtotal IS DISTINCT FROM COALESCE(t.subtotal, 0));
+END;
+$$ LANGUAGE plpgsql;
+
+-- total = subtotal - descuento (mismo cálculo que el recibo al crear el pedido)
+CREATE OR REPLACE FUNCTION pedido_calcular_total() RETURNS trigger AS $$
+BEGIN
+    NEW.total := ROUND(NEW.subtotal * (100 - COALESCE(NEW.porcentaje_descuento, 0)) / 100.0, 2);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_pedido_total ON pedido;
+CREATE TRIGGER trg_pedido_total
+    BEFORE INSERT OR UPDATE OF subtotal, porcentaje_descuento ON pedido
+    FOR EACH ROW EXECUTE PROCEDURE pedido_calcular_total();
+
+-- Triggers por sentencia sobre prenda (tablas de transición: un solo recálculo por
+-- INSERT masivo de prendas). PostgreSQL exige un trigger por evento.
+CREATE OR REPLACE FUNCTION prenda_totales_insert() RETURNS trigger AS $$
+BEGIN
+    PERFORM pedido_recalcular_totales(ARRAY(SELECT DISTINCT id_pedido FROM nuevas WHERE id_pedido IS NOT NULL));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION prenda_totales_update() RETURNS trigger AS $$
+BEGIN
+    PERFORM pedido_recalcular_totales(ARRAY(
+        SELECT id_pedido FROM nuevas WHERE id_pedido IS NOT NULL
+        UNION
+        SELECT id_pedido FROM viejas WHERE id_pedido IS NOT NULL
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION prenda_totales_delete() RETURNS trigger AS $$
+BEGIN
+    PERFORM pedido_recalcular_totales(ARRAY(SELECT DISTINCT id_pedido FROM viejas WHERE id_pedido IS NOT NULL));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_prenda_totales_insert ON prenda;
+CREATE TRIGGER trg_prenda_totales_insert
+    AFTER INSERT ON prenda
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE PROCEDURE prenda_totales_insert();
+
+DROP TRIGGER IF EXISTS trg_prenda_totales_update ON prenda;
+CREATE TRIGGER trg_prenda_totales_update
+    AFTER UPDATE ON prenda
+    REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE PROCEDURE prenda_totales_update();
+
+DROP TRIGGER IF EXISTS trg_prenda_totales_delete ON prenda;
+CREATE TRIGGER trg_prenda_totales_delete
+    AFTER DELETE ON prenda
+    REFERENCING OLD TABLE AS viejas
+    FOR EACH STATEMENT EXECUTE PROCEDURE prenda_totales_delete();
+
+-- Comentarios
+COMMENT ON COLUMN pedido.total_prendas IS 'Suma de prenda.cantidad del pedido (mantenido por trigger)';
+COMMENT ON COLUMN pedido.subtotal IS 'Suma de cantidad x precio de las prendas al momento de escribirlas (mantenido por trigger)';
+COMMENT ON COLUMN pedido.total IS 'subtotal menos porcentaje_descuento (mantenido por trigger)';
@@ -0,0 +1,52 @@
+-- Búsqueda de clientes (services/busqueda_service.py)
+-- usuario.busqueda guarda nombre, username, email e id normalizados (minúsculas y sin
+-- tildes) y la mantiene un trigger; los índices permiten buscar subcadenas sin
+-- recorrer la tabla.
+
+-- Minúsculas sin tildes (misma tabla de reemplazos que busqueda_service.normalizar)
+CREATE OR REPLACE FUNCTION normalizar_busqueda(texto TEXT) RETURNS TEXT AS $$
+    SELECT translate(lower(COALESCE(texto, '')),
+                     'áàäâãéèëêíìïîóòöôõúùüûñç',
+                     'aaaaaeeeeiiiiooooouuuunc');
+$$ LANGUAGE sql IMMUTABLE;
+
+ALTER TABLE usuario ADD COLUMN IF NOT EXISTS busqueda TEXT;
+
+CREATE OR REPLACE FUNCTION usuario_busqueda_actualizar() RETURNS trigger AS $$
+BEGIN
+    NEW.busqueda := normalizar_busqueda(
+        COALESCE(NEW.nombre, '') || ' ' || COALESCE(NEW.username, '') || ' ' ||
+        COALESCE(NEW.email, '') || ' ' || NEW.id_usuario
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_usuario_busqueda ON usuario;
+CREATE TRIGGER trg_usuario_busqueda
+    BEFORE INSERT OR UPDATE OF nombre, username, email ON usuario
+    FOR EACH ROW EXECUTE PROCEDURE usuario_busqueda_actualizar();
+
+-- Llenar las filas existentes
+UPDATE usuario SET busqueda = normalizar_busqueda(
+    COALESCE(nombre, '') || ' ' || COALESCE(username, '') || ' ' ||
+    COALESCE(email, '') || ' ' || id_usuario
+)
+WHERE busqueda IS NULL;
+
+-- Prefijos (consultas de 1-2 caracteres, donde los trigramas no ayudan)
+CREATE INDEX IF NOT EXISTS idx_usuario_busqueda_prefijo
+    ON usuario (busqueda text_pattern_ops) WHERE rol = 'cliente';
+
+-- Subcadenas con pg_trgm (si la extensión no se puede instalar se usa solo el índice de prefijos)
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXECUTE 'CREATE INDEX IF NOT EXISTS idx_usuario_busqueda_trgm
+             ON usuario USING gin (busqueda gin_trgm_ops) WHERE rol = ''cliente''';
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE USING MESSAGE = 'pg_trgm no disponible: ' || SQLERRM;
+END;
+$$;
+
+COMMENT ON COLUMN usuario.busqueda IS 'nombre, username, email e id normalizados para la búsqueda (mantenida por trg_usuario_busqueda)';
@@ -0,0 +1,20 @@
+-- Estado de lealtad precalculado por cliente (services/lealtad_service.py)
+-- Pedidos (sin cancelados), nivel actual y siguiente nivel según el esquema de
+-- descuento del cliente. Se actualiza al crear, cambiar de estado o eliminar un
+-- pedido; tras modificar descuento_config se recalcula con
+-- python scripts/recalcular_lealtad.py (el panel lo lanza solo en segundo plano).
+-- Los paneles leen esta fila en lugar de contar el historial de pedidos.
+
+CREATE TABLE IF NOT EXISTS cliente_lealtad (
+    id_cliente INTEGER PRIMARY KEY REFERENCES cliente(id_cliente) ON DELETE CASCADE,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    nivel VARCHAR(50),
+    porcentaje INTEGER NOT NULL DEFAULT 0,
+    siguiente_nivel VARCHAR(50),
+    pedidos_faltantes INTEGER NOT NULL DEFAULT 0,
+    progreso NUMERIC(5, 1) NOT NULL DEFAULT 0,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE cliente_lealtad IS 'Nivel de descuento precalculado por cliente (ver services/lealtad_service.py)';
+COMMENT ON COLUMN cliente_lealtad.siguiente_nivel IS 'NULL si el cliente está en el último nivel de su esquema';
@@ -0,0 +1,47 @@
+-- Versiones para invalidar los conteos cacheados de los listados (services/conteo_service.py)
+-- Cada escritura en pedido/cliente avanza la versión del grupo 'pedido' y cada escritura en
+-- usuario la del grupo 'usuario'. La versión se guarda en filas que se actualizan dentro de
+-- la misma transacción que la escritura: la nueva versión se vuelve visible junto con los
+-- datos al confirmar (una secuencia avanzaba antes del COMMIT y un lector podía guardar un
+-- conteo viejo con la versión nueva). Cada grupo tiene 16 ranuras (la versión es la suma)
+-- y cada conexión usa la suya, así las transacciones que crean pedidos casi nunca se
+-- esperan entre sí.
+CREATE TABLE IF NOT EXISTS conteo_version (
+    grupo VARCHAR(20) NOT NULL,
+    ranura SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (grupo, ranura)
+);
+
+INSERT INTO conteo_version (grupo, ranura)
+SELECT g.grupo, r.ranura
+FROM (VALUES ('pedido'), ('usuario')) AS g(grupo), generate_series(0, 15) AS r(ranura)
+ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION conteo_version_avanzar() RETURNS trigger AS $$
+BEGIN
+    UPDATE conteo_version SET version = version + 1
+    WHERE grupo = TG_ARGV[0] AND ranura = pg_backend_pid() % 16;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_conteo_pedido ON pedido;
+CREATE TRIGGER trg_conteo_pedido
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON pedido
+    FOR EACH STATEMENT EXECUTE PROCEDURE conteo_version_avanzar('pedido');
+
+-- admin.pedidos filtra por nombre de cliente
+DROP TRIGGER IF EXISTS trg_conteo_cliente ON cliente;
+CREATE TRIGGER trg_conteo_cliente
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON cliente
+    FOR EACH STATEMENT EXECUTE PROCEDURE conteo_version_avanzar('pedido');
+
+DROP TRIGGER IF EXISTS trg_conteo_usuario ON usuario;
+CREATE TRIGGER trg_conteo_usuario
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON usuario
+    FOR EACH STATEMENT EXECUTE PROCEDURE conteo_version_avanzar('usuario');
+
+-- Versión anterior (secuencias)
+DROP SEQUENCE IF EXISTS conteo_pedido_seq;
+DROP SEQUENCE IF EXISTS conteo_usuario_seq;
@@ -0,0 +1,3 @@
+-- Filtro de pedidos por fecha de entrega (recibos masivos de las entregas del día,
+-- admin.recibos_masivos con campo_fecha=entrega)
+CREATE INDEX IF NOT EXISTS idx_pedido_fecha_entrega ON pedido(fecha_entrega);
@@ -0,0 +1,8 @@
+-- Índices para la paginación por cursor de admin.pedidos y admin.clientes
+-- (WHERE <filtro> AND id < :cursor ORDER BY id LIMIT n)
+
+-- Pedidos filtrados por estado, recorridos por id
+CREATE INDEX IF NOT EXISTS idx_pedido_estado_id ON pedido(estado, id_pedido);
+
+-- Clientes (usuario con rol = 'cliente') recorridos por id
+CREATE INDEX IF NOT EXISTS idx_usuario_rol_id ON usuario(rol, id_usuario);
@@ -0,0 +1,7 @@
+-- Búsquedas de usuario sin distinguir mayúsculas
+-- (login, registro y helpers.usuario_actual consultan WHERE LOWER(username) = :u;
+-- un índice sobre la columna sola no sirve para esa condición)
+
+CREATE INDEX IF NOT EXISTS idx_usuario_username_lower ON usuario (LOWER(username));
+
+CREATE INDEX IF NOT EXISTS idx_usuario_email_lower ON usuario (LOWER(email));
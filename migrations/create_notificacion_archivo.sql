@@ -0,0 +1,30 @@
+-- Archivo de notificaciones antiguas (services/notificacion_service.archivar_notificaciones)
+-- Las notificaciones leídas con más de NOTIFICACIONES_RETENCION_LEIDAS_DIAS y todas las
+-- de más de NOTIFICACIONES_RETENCION_DIAS se mueven aquí por lotes, para que la tabla
+-- notificacion (listado, conteos, long-poll) se mantenga pequeña. El archivo se purga
+-- pasados NOTIFICACIONES_ARCHIVO_DIAS.
+-- Se usa una tabla de archivo y no particiones: particionar notificacion obligaría a
+-- recrearla (la clave primaria tendría que incluir la fecha) y el efecto sobre el
+-- tamaño de la tabla caliente es el mismo.
+
+CREATE TABLE IF NOT EXISTS notificacion_archivo (
+    id_notificacion INTEGER PRIMARY KEY,
+    id_usuario INTEGER NOT NULL,
+    titulo VARCHAR(200) NOT NULL,
+    mensaje TEXT NOT NULL,
+    tipo VARCHAR(50),
+    leida BOOLEAN,
+    url VARCHAR(500),
+    fecha_creacion TIMESTAMP,
+    fecha_archivo TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_notificacion_archivo_usuario
+    ON notificacion_archivo (id_usuario, fecha_creacion DESC);
+
+-- Purga del archivo por antigüedad
+CREATE INDEX IF NOT EXISTS idx_notificacion_archivo_fecha
+    ON notificacion_archivo (fecha_archivo);
+
+COMMENT ON TABLE notificacion_archivo IS 'Notificaciones antiguas movidas desde notificacion por archivar_notificaciones()';
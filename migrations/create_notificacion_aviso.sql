@@ -0,0 +1,15 @@
+-- Aviso de notificaciones nuevas por LISTEN/NOTIFY (services/notificacion_service.py)
+-- Cada INSERT en notificacion envía "id_usuario:id_notificacion" por el canal
+-- notificacion_nueva; PostgreSQL lo entrega al confirmar la transacción.
+
+CREATE OR REPLACE FUNCTION notificacion_avisar() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('notificacion_nueva', NEW.id_usuario || ':' || NEW.id_notificacion);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notificacion_aviso ON notificacion;
+CREATE TRIGGER trg_notificacion_aviso
+    AFTER INSERT ON notificacion
+    FOR EACH ROW EXECUTE PROCEDURE notificacion_avisar();
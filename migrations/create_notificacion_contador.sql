@@ -0,0 +1,120 @@
+-- Contador de notificaciones no leídas por usuario (services/notificacion_service.py)
+-- /api/notificaciones/no-leidas lee no_leidas en lugar de contar, y version (que
+-- avanza con cada cambio en las notificaciones del usuario) es el ETag de
+-- /api/notificaciones. Lo mantienen triggers por sentencia sobre notificacion:
+-- crear_notificacion (INSERT) y los endpoints de marcar como leída (UPDATE).
+-- Sin clave foránea: al borrar un usuario el DELETE en cascada de sus
+-- notificaciones no debe tocar una fila que referencie al usuario borrado.
+
+CREATE TABLE IF NOT EXISTS notificacion_contador (
+    id_usuario INTEGER PRIMARY KEY,
+    no_leidas INTEGER NOT NULL DEFAULT 0,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- Suma a cada usuario la diferencia de no leídas de la sentencia y avanza su versión
+CREATE OR REPLACE FUNCTION notificacion_contador_sumar(p_usuarios INTEGER[], p_deltas INTEGER[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO notificacion_contador (id_usuario, no_leidas, version)
+    SELECT d.id_usuario, SUM(d.delta), 1
+    FROM unnest(p_usuarios, p_deltas) AS d(id_usuario, delta)
+    GROUP BY d.id_usuario
+    ON CONFLICT (id_usuario) DO UPDATE
+    SET no_leidas = GREATEST(notificacion_contador.no_leidas + EXCLUDED.no_leidas, 0),
+        version = notificacion_contador.version + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notificacion_contador_insert() RETURNS trigger AS $$
+DECLARE
+    v_usuarios INTEGER[];
+    v_deltas INTEGER[];
+BEGIN
+    SELECT array_agg(id_usuario), array_agg(delta) INTO v_usuarios, v_deltas
+    FROM (
+        SELECT id_usuario, COUNT(*) FILTER (WHERE leida = FALSE)::INTEGER AS delta
+        FROM nuevas
+        GROUP BY id_usuario
+    ) d;
+    IF v_usuarios IS NOT NULL THEN
+        PERFORM notificacion_contador_sumar(v_usuarios, v_deltas);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notificacion_contador_update() RETURNS trigger AS $$
+DECLARE
+    v_usuarios INTEGER[];
+    v_deltas INTEGER[];
+BEGIN
+    SELECT array_agg(id_usuario), array_agg(delta) INTO v_usuarios, v_deltas
+    FROM (
+        SELECT id_usuario, SUM(delta)::INTEGER AS delta
+        FROM (
+            SELECT id_usuario, CASE WHEN leida = FALSE THEN 1 ELSE 0 END AS delta FROM nuevas
+            UNION ALL
+            SELECT id_usuario, CASE WHEN leida = FALSE THEN -1 ELSE 0 END FROM viejas
+        ) t
+        GROUP BY id_usuario
+    ) d;
+    IF v_usuarios IS NOT NULL THEN
+        PERFORM notificacion_contador_sumar(v_usuarios, v_deltas);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Al borrar solo se actualizan contadores existentes (ver nota sobre la clave foránea)
+CREATE OR REPLACE FUNCTION notificacion_contador_delete() RETURNS trigger AS $$
+BEGIN
+    UPDATE notificacion_contador c
+    SET no_leidas = GREATEST(c.no_leidas - v.no_leidas, 0),
+        version = c.version + 1
+    FROM (
+        SELECT id_usuario, COUNT(*) FILTER (WHERE leida = FALSE) AS no_leidas
+        FROM viejas
+        GROUP BY id_usuario
+    ) v
+    WHERE c.id_usuario = v.id_usuario;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notificacion_contador_insert ON notificacion;
+CREATE TRIGGER trg_notificacion_contador_insert
+    AFTER INSERT ON notificacion
+    REFERENCING NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE PROCEDURE notificacion_contador_insert();
+
+DROP TRIGGER IF EXISTS trg_notificacion_contador_update ON notificacion;
+CREATE TRIGGER trg_notificacion_contador_update
+    AFTER UPDATE ON notificacion
+    REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+    FOR EACH STATEMENT EXECUTE PROCEDURE notificacion_contador_update();
+
+DROP TRIGGER IF EXISTS trg_notificacion_contador_delete ON notificacion;
+CREATE TRIGGER trg_notificacion_contador_delete
+    AFTER DELETE ON notificacion
+    REFERENCING OLD TABLE AS viejas
+    FOR EACH STATEMENT EXECUTE PROCEDURE notificacion_contador_delete();
+
+-- Llenar los contadores de las notificaciones existentes
+INSERT INTO notificacion_contador (id_usuario, no_leidas, version)
+SELECT id_usuario, COUNT(*) FILTER (WHERE leida = FALSE), 1
+FROM notificacion
+GROUP BY id_usuario
+ON CONFLICT (id_usuario) DO UPDATE
+SET no_leidas = EXCLUDED.no_leidas,
+    version = notificacion_contador.version + 1;
+
+-- Listado (WHERE id_usuario ORDER BY fecha_creacion DESC LIMIT 20) y no leídas por usuario.
+-- Reemplazan a los índices sueltos por id_usuario y por el booleano leida.
+CREATE INDEX IF NOT EXISTS idx_notificacion_usuario_leida_fecha
+    ON notificacion (id_usuario, leida, fecha_creacion DESC);
+CREATE INDEX IF NOT EXISTS idx_notificacion_usuario_fecha
+    ON notificacion (id_usuario, fecha_creacion DESC);
+DROP INDEX IF EXISTS idx_notificacion_usuario;
+DROP INDEX IF EXISTS idx_notificacion_leida;
+
+COMMENT ON TABLE notificacion_contador IS 'No leídas y versión de las notificaciones de cada usuario (mantenida por triggers)';
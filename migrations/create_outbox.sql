@@ -0,0 +1,24 @@
+-- Outbox transaccional para correos
+-- Los correos se guardan aquí en la misma transacción que el cambio que los origina
+-- (ej. actualizar_pedido) y services/outbox_service.py los envía en lotes desde un hilo
+-- en segundo plano, reintentando hasta OUTBOX_MAX_INTENTOS veces.
+CREATE TABLE IF NOT EXISTS outbox (
+    id_outbox SERIAL PRIMARY KEY,
+    tipo VARCHAR(20) NOT NULL DEFAULT 'email',
+    payload TEXT NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ultimo_error TEXT,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_proceso TIMESTAMP
+);
+
+-- Índice parcial: el worker solo busca entre los pendientes
+CREATE INDEX IF NOT EXISTS idx_outbox_pendiente ON outbox(proximo_intento, id_outbox) WHERE estado = 'pendiente';
+CREATE INDEX IF NOT EXISTS idx_outbox_estado_fecha ON outbox(estado, fecha_proceso);
+
+-- Comentarios
+COMMENT ON TABLE outbox IS 'Mensajes salientes (correos) pendientes de entrega';
+COMMENT ON COLUMN outbox.estado IS 'Estado: pendiente, procesando, enviado, error';
+COMMENT ON COLUMN outbox.payload IS 'JSON con destinatario, asunto, cuerpo_html y adjuntos (base64)';
@@ -0,0 +1,68 @@
+-- Catálogo de precios por tipo de prenda
+-- Reemplaza los CASE con precios fijos repetidos en las consultas: las consultas hacen
+-- LEFT JOIN precio_prenda ON precio_prenda.tipo = prenda.tipo y services/precio_service.py
+-- mantiene una copia en memoria que se recarga cuando cambia precio_prenda_version.
+CREATE TABLE IF NOT EXISTS precio_prenda (
+    tipo VARCHAR(100) PRIMARY KEY,
+    precio NUMERIC(12, 2) NOT NULL CHECK (precio >= 0),
+    orden INTEGER NOT NULL DEFAULT 0,
+    activo BOOLEAN NOT NULL DEFAULT TRUE,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS precio_prenda_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1
+);
+
+INSERT INTO precio_prenda_version (id, version) VALUES (1, 1)
+ON CONFLICT (id) DO NOTHING;
+
+-- Precios actuales (los mismos que tenía el formulario de pedidos)
+INSERT INTO precio_prenda (tipo, precio, orden) VALUES
+    ('Camisa', 5000, 1),
+    ('Pantalón', 6000, 2),
+    ('Vestido', 8000, 3),
+    ('Chaqueta', 10000, 4),
+    ('Saco', 7000, 5),
+    ('Falda', 5500, 6),
+    ('Blusa', 4500, 7),
+    ('Abrigo', 12000, 8),
+    ('Suéter', 6500, 9),
+    ('Jeans', 7000, 10),
+    ('Corbata', 3000, 11),
+    ('Bufanda', 3500, 12),
+    ('Sábana', 8000, 13),
+    ('Edredón', 15000, 14),
+    ('Cortina', 12000, 15)
+ON CONFLICT (tipo) DO NOTHING;
+
+-- Índice para el JOIN desde prenda
+CREATE INDEX IF NOT EXISTS idx_prenda_tipo ON prenda(tipo);
+
+-- Cada cambio de precios sube la versión (invalida las cachés en memoria) y marca
+-- para recalcular el gasto de los clientes con prendas (los cambios de precio son raros)
+CREATE OR REPLACE FUNCTION precio_prenda_cambio() RETURNS trigger AS $$
+BEGIN
+    UPDATE precio_prenda_version SET version = version + 1 WHERE id = 1;
+    IF to_regclass('reporte_pendiente') IS NOT NULL THEN
+        INSERT INTO reporte_pendiente (dimension, clave)
+        SELECT DISTINCT 'cliente', p.id_cliente::text
+        FROM prenda pr
+        JOIN pedido p ON p.id_pedido = pr.id_pedido
+        WHERE p.id_cliente IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_precio_prenda_cambio ON precio_prenda;
+CREATE TRIGGER trg_precio_prenda_cambio
+    AFTER INSERT OR UPDATE OR DELETE ON precio_prenda
+    FOR EACH STATEMENT EXECUTE PROCEDURE precio_prenda_cambio();
+
+-- Comentarios
+COMMENT ON TABLE precio_prenda IS 'Precio por tipo de prenda (se usa con LEFT JOIN; tipos sin fila usan el precio por defecto)';
+COMMENT ON COLUMN precio_prenda.activo IS 'Si aparece en el formulario de nuevos pedidos';
+COMMENT ON TABLE precio_prenda_version IS 'Versión del catálogo de precios para invalidar cachés en memoria';
@@ -0,0 +1,170 @@
+-- Capa de reportes pre-agregados para admin.reportes
+-- Los triggers solo marcan las claves (día / cliente) que cambiaron en reporte_pendiente;
+-- services/reportes_service.py recalcula únicamente esas claves (al abrir reportes o
+-- desde scripts/refrescar_reportes.py) y la vista lee solo estas tablas.
+
+CREATE TABLE IF NOT EXISTS reporte_pendiente (
+    dimension VARCHAR(10) NOT NULL,
+    clave VARCHAR(20) NOT NULL,
+    PRIMARY KEY (dimension, clave)
+);
+
+CREATE TABLE IF NOT EXISTS reporte_diario (
+    fecha DATE PRIMARY KEY,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    clientes INTEGER NOT NULL DEFAULT 0,
+    ingresos NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS reporte_mensual (
+    mes DATE PRIMARY KEY,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    prendas INTEGER NOT NULL DEFAULT 0,
+    pedidos_con_prendas INTEGER NOT NULL DEFAULT 0,
+    ingresos NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS reporte_mensual_estado (
+    mes DATE NOT NULL,
+    estado VARCHAR(50) NOT NULL,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    dias_entrega INTEGER NOT NULL DEFAULT 0,
+    con_entrega INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (mes, estado)
+);
+
+CREATE TABLE IF NOT EXISTS reporte_mensual_prenda (
+    mes DATE NOT NULL,
+    tipo VARCHAR(100) NOT NULL,
+    cantidad INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (mes, tipo)
+);
+
+CREATE TABLE IF NOT EXISTS reporte_cliente (
+    id_cliente INTEGER PRIMARY KEY,
+    nombre VARCHAR(200),
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    prendas INTEGER NOT NULL DEFAULT 0,
+    gasto NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS reporte_resumen (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    clientes INTEGER NOT NULL DEFAULT 0,
+    gasto_total NUMERIC(16, 2) NOT NULL DEFAULT 0,
+    fecha_actualizacion TIMESTAMP
+);
+
+INSERT INTO reporte_resumen (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- Índices para recalcular un día / mes / cliente sin recorrer todo el histórico
+CREATE INDEX IF NOT EXISTS idx_pedido_fecha_ingreso ON pedido(fecha_ingreso);
+CREATE INDEX IF NOT EXISTS idx_pedido_cliente ON pedido(id_cliente);
+CREATE INDEX IF NOT EXISTS idx_recibo_fecha ON recibo(fecha);
+CREATE INDEX IF NOT EXISTS idx_reporte_cliente_pedidos ON reporte_cliente(pedidos DESC);
+
+-- Marcado de claves pendientes
+CREATE OR REPLACE FUNCTION reporte_marcar(p_dimension VARCHAR, p_clave VARCHAR) RETURNS void AS $$
+BEGIN
+    IF p_clave IS NOT NULL THEN
+        INSERT INTO reporte_pendiente (dimension, clave)
+        VALUES (p_dimension, p_clave)
+        ON CONFLICT DO NOTHING;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reporte_marcar_pedido() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM reporte_marcar('dia', to_char(OLD.fecha_ingreso, 'YYYY-MM-DD'));
+        PERFORM reporte_marcar('cliente', OLD.id_cliente::text);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM reporte_marcar('dia', to_char(NEW.fecha_ingreso, 'YYYY-MM-DD'));
+        PERFORM reporte_marcar('cliente', NEW.id_cliente::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reporte_marcar_prenda() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM reporte_marcar('dia', to_char(p.fecha_ingreso, 'YYYY-MM-DD')),
+                reporte_marcar('cliente', p.id_cliente::text)
+        FROM pedido p WHERE p.id_pedido = OLD.id_pedido;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM reporte_marcar('dia', to_char(p.fecha_ingreso, 'YYYY-MM-DD')),
+                reporte_marcar('cliente', p.id_cliente::text)
+        FROM pedido p WHERE p.id_pedido = NEW.id_pedido;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reporte_marcar_recibo() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM reporte_marcar('dia', to_char(OLD.fecha, 'YYYY-MM-DD'));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM reporte_marcar('dia', to_char(NEW.fecha, 'YYYY-MM-DD'));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION reporte_marcar_cliente() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM reporte_marcar('cliente', OLD.id_cliente::text);
+    ELSE
+        PERFORM reporte_marcar('cliente', NEW.id_cliente::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_reporte_pedido ON pedido;
+CREATE TRIGGER trg_reporte_pedido
+    AFTER INSERT OR UPDATE OR DELETE ON pedido
+    FOR EACH ROW EXECUTE PROCEDURE reporte_marcar_pedido();
+
+DROP TRIGGER IF EXISTS trg_reporte_prenda ON prenda;
+CREATE TRIGGER trg_reporte_prenda
+    AFTER INSERT OR UPDATE OR DELETE ON prenda
+    FOR EACH ROW EXECUTE PROCEDURE reporte_marcar_prenda();
+
+DROP TRIGGER IF EXISTS trg_reporte_recibo ON recibo;
+CREATE TRIGGER trg_reporte_recibo
+    AFTER INSERT OR UPDATE OR DELETE ON recibo
+    FOR EACH ROW EXECUTE PROCEDURE reporte_marcar_recibo();
+
+DROP TRIGGER IF EXISTS trg_reporte_cliente ON cliente;
+CREATE TRIGGER trg_reporte_cliente
+    AFTER INSERT OR DELETE OR UPDATE OF nombre ON cliente
+    FOR EACH ROW EXECUTE PROCEDURE reporte_marcar_cliente();
+
+-- Carga inicial: marcar todo el histórico para que el primer refresco lo agregue
+INSERT INTO reporte_pendiente (dimension, clave)
+SELECT DISTINCT 'dia', to_char(fecha_ingreso, 'YYYY-MM-DD') FROM pedido WHERE fecha_ingreso IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO reporte_pendiente (dimension, clave)
+SELECT DISTINCT 'dia', to_char(fecha, 'YYYY-MM-DD') FROM recibo WHERE fecha IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO reporte_pendiente (dimension, clave)
+SELECT 'cliente', id_cliente::text FROM cliente
+ON CONFLICT DO NOTHING;
+
+-- Comentarios
+COMMENT ON TABLE reporte_pendiente IS 'Claves (dia YYYY-MM-DD / cliente id) cuyos agregados deben recalcularse';
+COMMENT ON TABLE reporte_diario IS 'Pedidos, clientes distintos e ingresos por día';
+COMMENT ON TABLE reporte_mensual IS 'Pedidos, prendas e ingresos por mes';
+COMMENT ON TABLE reporte_mensual_estado IS 'Pedidos por mes y estado, con días de entrega acumulados';
+COMMENT ON TABLE reporte_mensual_prenda IS 'Cantidad de prendas por mes y tipo';
+COMMENT ON TABLE reporte_cliente IS 'Pedidos, prendas y gasto estimado acumulados por cliente';
+COMMENT ON TABLE reporte_resumen IS 'Totales globales (fila única) mantenidos por diferencia en cada refresco';
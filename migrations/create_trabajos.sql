@@ -0,0 +1,29 @@
+-- Tabla de trabajos en segundo plano (exportaciones y recibos PDF)
+-- services/trabajos_service.py encola cada trabajo aquí y lo ejecuta en un pool de hilos;
+-- la página de estado consulta esta tabla y el archivo generado se descarga al terminar.
+CREATE TABLE IF NOT EXISTS trabajo (
+    id_trabajo SERIAL PRIMARY KEY,
+    token VARCHAR(32) NOT NULL UNIQUE,
+    tipo VARCHAR(50) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    parametros TEXT NOT NULL DEFAULT '{}',
+    id_usuario INTEGER,
+    archivo VARCHAR(500),
+    nombre_descarga VARCHAR(200),
+    mimetype VARCHAR(100),
+    error TEXT,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_inicio TIMESTAMP,
+    fecha_fin TIMESTAMP,
+    FOREIGN KEY (id_usuario) REFERENCES usuario(id_usuario) ON DELETE SET NULL
+);
+
+-- Índices para mejorar rendimiento
+CREATE INDEX IF NOT EXISTS idx_trabajo_estado ON trabajo(estado);
+CREATE INDEX IF NOT EXISTS idx_trabajo_fecha ON trabajo(fecha_creacion);
+
+-- Comentarios
+COMMENT ON TABLE trabajo IS 'Trabajos en segundo plano (exportación Excel, recibos PDF)';
+COMMENT ON COLUMN trabajo.token IS 'Identificador público del trabajo usado en las URLs de estado y descarga';
+COMMENT ON COLUMN trabajo.estado IS 'Estado: pendiente, en_proceso, completado, error';
+COMMENT ON COLUMN trabajo.archivo IS 'Ruta del archivo generado en TRABAJOS_DIR';
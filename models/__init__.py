@@ -1,6 +1,10 @@
 """
 Módulo de modelos y base de datos
 """
-from .database import db, run_query, ensure_cliente_exists
+from .database import (
+    db, run_query, run_query_stream, run_many, transaccion, ensure_cliente_exists, init_conexion_por_peticion,
+    liberar_conexion_peticion, al_confirmar
+)
 
-__all__ = ['db', 'run_query', 'ensure_cliente_exists']
+__all__ = ['db', 'run_query', 'run_query_stream', 'run_many', 'transaccion', 'ensure_cliente_exists',
+           'init_conexion_por_peticion', 'liberar_conexion_peticion', 'al_confirmar']
@@ -1,6 +1,8 @@
 """
 Configuración de la base de datos y funciones de consulta
 """
+from contextlib import contextmanager
+from flask import g, current_app, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import text
 
@@ -8,12 +10,153 @@ from sqlalchemy import text
 db = SQLAlchemy()
 
 
+def init_conexion_por_peticion(app):
+    """
+    Activa el modo "una conexión por petición" (unit of work).
+
+    La primera consulta de cada petición saca una conexión del pool y todas las
+    siguientes la reutilizan; al terminar la petición se devuelve al pool.
+    Se desactiva con DB_CONEXION_POR_PETICION = False en la configuración.
+
+    Args:
+        app: instancia de Flask
+    """
+    if not app.config.get('DB_CONEXION_POR_PETICION', True):
+        return
+    app.extensions['conexion_por_peticion'] = True
+    app.teardown_appcontext(_cerrar_conexion_peticion)
+
+
+def _conexion_peticion():
+    """Devuelve (creándola la primera vez) la conexión compartida de la petición actual."""
+    if not has_request_context() or 'conexion_por_peticion' not in current_app.extensions:
+        return None
+    conn = g.get('_db_conexion')
+    if conn is None:
+        conn = db.engine.connect()
+        g._db_conexion = conn
+    return conn
+
+
+def _cerrar_conexion_peticion(exc=None):
+    """Revierte lo no confirmado y devuelve la conexión de la petición al pool."""
+    conn = g.pop('_db_conexion', None)
+    if conn is None:
+        return
+    try:
+        if conn.in_transaction():
+            conn.rollback()
+    finally:
+        conn.close()
+
+
+def liberar_conexion_peticion():
+    """
+    Devuelve antes de tiempo la conexión de la petición al pool (para
+    peticiones que después quedan esperando sin consultar la base de datos).
+    Dentro de una transacción explícita no hace nada.
+    """
+    if has_app_context() and g.get('_db_transaccion') is None:
+        _cerrar_conexion_peticion()
+
+
+def _conexion_transaccion():
+    """Devuelve la conexión de la transacción explícita activa (ver transaccion()), si existe."""
+    if not has_app_context():
+        return None
+    return g.get('_db_transaccion')
+
+
+@contextmanager
+def transaccion():
+    """
+    Abre una transacción explícita.
+
+    Todas las llamadas a run_query/run_many dentro del bloque usan la misma
+    conexión y se confirman juntas al salir; si ocurre una excepción se
+    revierte todo. Anidar transaccion() crea un SAVEPOINT, útil para
+    sentencias que pueden fallar sin abortar la transacción externa.
+
+    Yields:
+        conexión SQLAlchemy de la transacción
+    """
+    conn = _conexion_transaccion()
+    if conn is not None:
+        with conn.begin_nested():
+            yield conn
+        return
+
+    g._db_al_confirmar = []
+    try:
+        conn = _conexion_peticion()
+        if conn is not None:
+            # Cerrar la transacción implícita de las lecturas previas antes de abrir la explícita
+            if conn.in_transaction():
+                conn.commit()
+            with conn.begin():
+                g._db_transaccion = conn
+                try:
+                    yield conn
+                finally:
+                    g.pop('_db_transaccion', None)
+        else:
+            with db.engine.begin() as conn:
+                g._db_transaccion = conn
+                try:
+                    yield conn
+                finally:
+                    g.pop('_db_transaccion', None)
+        pendientes = g.get('_db_al_confirmar') or []
+    finally:
+        g.pop('_db_al_confirmar', None)
+
+    # Solo se llega aquí si la transacción externa se confirmó
+    for funcion in pendientes:
+        try:
+            funcion()
+        except Exception as e:
+            print(f"[WARN] Error en una acción posterior al commit: {e}")
+
+
+def al_confirmar(funcion):
+    """
+    Ejecuta funcion() cuando se confirme la transacción externa (ver
+    transaccion()); si se revierte no se ejecuta. Fuera de una transacción
+    se ejecuta en el momento.
+
+    Args:
+        funcion: callable sin argumentos
+    """
+    if _conexion_transaccion() is not None:
+        g._db_al_confirmar.append(funcion)
+    else:
+        funcion()
+
+
+def _leer_resultado(result, fetchone=False, fetchall=False, get_lastrowid=False):
+    """Extrae del resultado lo que pidió run_query."""
+    if fetchone:
+        return result.fetchone()
+    if fetchall:
+        return result.fetchall()
+    if get_lastrowid:
+        try:
+            return result.lastrowid
+        except Exception:
+            return None
+    return None
+
+
 def run_query(query, params=None, fetchone=False, fetchall=False, commit=False, get_lastrowid=False):
     """
     Utilidad para ejecutar consultas SQL.
 
     - Para lecturas: usar fetchone=True o fetchall=True.
     - Para escrituras (commit=True): si get_lastrowid=True la función devuelve el último id insertado (si está disponible).
+    - Dentro de un bloque transaccion() la consulta usa la conexión de la
+      transacción y el commit se hace al cerrar el bloque.
+    - Durante una petición (ver init_conexion_por_peticion) todas las consultas
+      reutilizan la misma conexión; commit=True confirma en ese momento.
     
     Args:
         query: consulta SQL con placeholders :param
@@ -29,72 +172,103 @@ def run_query(query, params=None, fetchone=False, fetchall=False, commit=False,
         - Si get_lastrowid: último id insertado
         - None en otros casos
     """
+    conn = _conexion_transaccion()
+    if conn is not None:
+        result = conn.execute(text(query), params or {})
+        return _leer_resultado(result, fetchone, fetchall, get_lastrowid)
+
+    conn = _conexion_peticion()
+    if conn is not None:
+        try:
+            result = conn.execute(text(query), params or {})
+            valor = _leer_resultado(result, fetchone, fetchall, get_lastrowid)
+            if commit:
+                conn.commit()
+            return valor
+        except Exception:
+            # Un error no debe dejar abortada la conexión para las siguientes consultas
+            conn.rollback()
+            raise
+
     if commit:
         # Para INSERT, UPDATE, DELETE
         with db.engine.begin() as conn:  # begin() hace commit al salir del bloque
             result = conn.execute(text(query), params or {})
-            
-            # Si piden fetchone, devolver la fila
-            if fetchone:
-                return result.fetchone()
-            
-            # Si piden fetchall, devolver todas las filas
-            if fetchall:
-                return result.fetchall()
-            
-            # Si piden lastrowid, intentar extraerlo
-            if get_lastrowid:
-                try:
-                    return result.lastrowid
-                except Exception:
-                    return None
-            
-            return None
+            return _leer_resultado(result, fetchone, fetchall, get_lastrowid)
     else:
         # Para SELECT
         with db.engine.connect() as conn:
             result = conn.execute(text(query), params or {})
-            if fetchone:
-                return result.fetchone()
-            if fetchall:
-                return result.fetchall()
-            return None
+            return _leer_resultado(result, fetchone, fetchall)
+
+
+def run_query_stream(query, params=None, chunk_size=1000):
+    """
+    Itera las filas de una consulta de lectura usando un cursor del lado del
+    servidor, trayendo chunk_size filas por vez (memoria acotada sin importar
+    el tamaño de la tabla).
+
+    Usa su propia conexión para que el cursor abierto no interfiera con los
+    commits de run_query durante la iteración.
+
+    Args:
+        query: consulta SQL con placeholders :param
+        params: diccionario de parámetros
+        chunk_size: filas por bloque
+
+    Yields:
+        filas de la consulta
+    """
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+            text(query), params or {}
+        )
+        for bloque in result.partitions(chunk_size):
+            yield from bloque
+
+
+def run_many(query, params_list):
+    """
+    Ejecuta una misma sentencia para varios juegos de parámetros en una sola
+    transacción (executemany), con un único commit.
+    
+    Args:
+        query: consulta SQL con placeholders :param
+        params_list: lista de diccionarios de parámetros
+        
+    Returns:
+        número de filas enviadas
+    """
+    if not params_list:
+        return 0
+    with transaccion() as conn:
+        conn.execute(text(query), list(params_list))
+    return len(params_list)
 
 
 def ensure_cliente_exists(id_usuario):
     """
     Garantiza que existe un registro en la tabla cliente para un usuario.
-    Si no existe, lo crea automáticamente.
-    
+    Si no existe, lo crea automáticamente a partir de los datos de usuario
+    con una sola sentencia (INSERT ... SELECT ... ON CONFLICT DO NOTHING).
+
     Args:
         id_usuario: ID del usuario
     """
     try:
-        cliente_exists = run_query(
-            "SELECT id_cliente FROM cliente WHERE id_cliente = :id",
+        creado = run_query(
+            """
+            INSERT INTO cliente (id_cliente, nombre, email)
+            SELECT id_usuario, nombre, email FROM usuario WHERE id_usuario = :id
+            ON CONFLICT (id_cliente) DO NOTHING
+            RETURNING id_cliente
+            """,
             {"id": id_usuario},
-            fetchone=True
+            fetchone=True,
+            commit=True
         )
-        
-        if not cliente_exists:
-            # Obtener datos del usuario para crear el cliente
-            usuario = run_query(
-                "SELECT nombre, email FROM usuario WHERE id_usuario = :id",
-                {"id": id_usuario},
-                fetchone=True
-            )
-            
-            if usuario:
-                run_query(
-                    "INSERT INTO cliente (id_cliente, nombre, email) VALUES (:ic, :n, :e)",
-                    {
-                        "ic": id_usuario,
-                        "n": usuario[0],
-                        "e": usuario[1]
-                    },
-                    commit=True
-                )
-                print(f"✓ Cliente creado automáticamente para id_usuario={id_usuario}")
+        if creado:
+            print(f"✓ Cliente creado automáticamente para id_usuario={id_usuario}")
     except Exception as e:
         print(f"✗ Error en ensure_cliente_exists: {e}")
         raise
@@ -2,30 +2,37 @@
 Blueprint de admin
 Rutas del panel de administración
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, Response, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, Response, jsonify, current_app
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 from sqlalchemy import text
-from models import run_query, ensure_cliente_exists, db
-from services import limpiar_texto, validar_email, send_email_async
+from models import run_query, transaccion, ensure_cliente_exists
+from services import limpiar_texto, validar_email, send_email_async, crear_pedido
+from services.reportes_service import refrescar_reportes, obtener_reportes, hay_pendientes
+from services.trabajos_service import encolar_trabajo
+from services.outbox_service import encolar_email, despertar_outbox
+from services.precio_service import sql_join_precio, sql_precio, catalogo_prendas, precio_de
+from services.paginacion_service import paginar_keyset, huella_filtros
+from services.conteo_service import contar, GRUPO_PEDIDO, GRUPO_USUARIO
+from services.busqueda_service import filtro_clientes
+from services.autocompletado_service import actualizar_cliente_indice, eliminar_cliente_indice
+from services.descuento_service import invalidar_config_descuento
+from services.lealtad_service import registrar_cambio_pedido, programar_recalculo, obtener_lealtad
+from services.codigo_barras_service import png_codigo_barras
+from services.recibo_service import invalidar_recibos, contar_pedidos_filtro, iterar_datos_recibos, construir_recibos_pdf
+from services.pedido_service import filtro_pedidos
+from services.foto_service import guardar_foto_prenda, programar_fotos
 from decorators import login_requerido, admin_requerido
-from helpers import admin_only, obtener_esquema_descuento_cliente, ejecutar_sql_file, get_safe_redirect
-from io import BytesIO
-import pandas as pd
+from helpers import admin_only, ejecutar_sql_file, get_safe_redirect, crear_notificacion, usuario_actual, id_usuario_actual, invalidar_identidad
 import datetime
-import barcode
-from barcode.writer import ImageWriter
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib import colors
+from io import BytesIO
 from pyzbar.pyzbar import decode
 from PIL import Image as PILImage
 import cv2
 import numpy as np
 import os
 import json
+import uuid
 
 bp = Blueprint('admin', __name__)
 
@@ -130,10 +137,20 @@ def parse_sql_statements(sql_text):
             line = line.split('--', 1)[0]
         cleaned_lines.append(line)
     cleaned = "\n".join(cleaned_lines)
-    for stmt in cleaned.split(';'):
-        stmt = stmt.strip()
-        if stmt:
-            statements.append(stmt)
+    # Los ';' dentro de bloques $$ ... $$ (cuerpos de funciones) no separan sentencias
+    actual = ''
+    for i, trozo in enumerate(cleaned.split('$$')):
+        if i % 2:
+            actual += '$$' + trozo + '$$'
+            continue
+        partes = trozo.split(';')
+        actual += partes[0]
+        for parte in partes[1:]:
+            if actual.strip():
+                statements.append(actual.strip())
+            actual = parte
+    if actual.strip():
+        statements.append(actual.strip())
     return statements
 
 
@@ -167,25 +184,6 @@ def validar_contrasena(password):
     return True
 
 
-def crear_notificacion(id_usuario, titulo, mensaje, tipo='info', url=None):
-    """Crea una notificación para un usuario."""
-    try:
-        run_query("""
-            INSERT INTO notificacion (id_usuario, titulo, mensaje, tipo, url)
-            VALUES (:id_usuario, :titulo, :mensaje, :tipo, :url)
-        """, {
-            'id_usuario': id_usuario,
-            'titulo': titulo,
-            'mensaje': mensaje,
-            'tipo': tipo,
-            'url': url
-        }, commit=True)
-        return True
-    except Exception as e:
-        print(f"[ERROR] crear_notificacion: {e}")
-        return False
-
-
 # -----------------------------------------------
 # PÁGINA PRINCIPAL DEL PANEL (administrador)
 # -----------------------------------------------
@@ -214,73 +212,28 @@ def pedidos():
     fecha_desde = request.args.get('desde', '').strip()
     fecha_hasta = request.args.get('hasta', '').strip()
     orden = request.args.get('orden', 'desc').strip().lower()  # 'asc' o 'desc'
-    pagina = request.args.get('pagina', 1, type=int)
+    cursor = request.args.get('cursor')
     por_pagina = 10
     
-    # Construir query base para contar
-    count_query = """
-        SELECT COUNT(*) FROM pedido p
-        LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-        WHERE 1=1
-    """
-    
-    # Construir query base para datos
-    query = """
-        SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras
+    # FROM/WHERE común para los datos y el conteo
+    desde_sql = """
         FROM pedido p
         LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
         WHERE 1=1
     """
-    params = {}
-    
-    # Agregar filtros dinámicamente
-    filtro_where = ""
-    if cliente_filter:
-        filtro_where += " AND (LOWER(c.nombre) LIKE LOWER(:cliente) OR c.id_cliente = :cliente_id)"
-        params['cliente'] = f"%{cliente_filter}%"
-        try:
-            params['cliente_id'] = int(cliente_filter)
-        except:
-            params['cliente_id'] = -1
-    
-    if estado_filter:
-        filtro_where += " AND p.estado = :estado"
-        params['estado'] = estado_filter
-    
-    if fecha_desde:
-        filtro_where += " AND DATE(p.fecha_ingreso) >= :desde"
-        params['desde'] = fecha_desde
-    
-    if fecha_hasta:
-        filtro_where += " AND DATE(p.fecha_ingreso) <= :hasta"
-        params['hasta'] = fecha_hasta
-    
-    # Aplicar filtros a ambas queries
-    count_query += filtro_where
-    query += filtro_where
-    
-    # Contar total de registros
-    total_result = run_query(count_query, params, fetchall=True)
-    total_count = total_result[0][0] if total_result else 0
-    total_paginas = (total_count + por_pagina - 1) // por_pagina if total_count > 0 else 1
-    
-    # Ajustar página si está fuera de rango
-    if pagina < 1:
-        pagina = 1
-    if pagina > total_paginas and total_paginas > 0:
-        pagina = total_paginas
-    
-    # Agregar orden
-    if orden == 'asc':
-        query += " ORDER BY p.id_pedido ASC"
-    else:
-        query += " ORDER BY p.id_pedido DESC"
-    
-    # Agregar paginación
-    offset = (pagina - 1) * por_pagina
-    query += f" LIMIT {por_pagina} OFFSET {offset}"
-    
-    pedidos = run_query(query, params, fetchall=True)
+    filtro_where, params = filtro_pedidos(cliente_filter, estado_filter, fecha_desde, fecha_hasta)
+    desde_sql += filtro_where
+    query = "SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras" + desde_sql
+    
+    # Paginación por cursor sobre id_pedido; el total (cacheado o estimado, ver
+    # conteo_service) se obtiene solo en la primera página
+    huella = huella_filtros(cliente=cliente_filter, estado=estado_filter,
+                            desde=fecha_desde, hasta=fecha_hasta, orden=orden)
+    pagina = paginar_keyset(
+        query, params, 'p.id_pedido', orden, cursor, huella, por_pagina=por_pagina,
+        conteo=lambda: contar(desde_sql, params, GRUPO_PEDIDO,
+                              tabla=None if filtro_where else 'pedido')
+    )
     
     # Obtener opciones de estado únicas
     estados = run_query("""
@@ -288,23 +241,16 @@ def pedidos():
     """, fetchall=True)
     estados = [e[0] for e in estados] if estados else []
     
-    # Calcular rango de registros mostrados
-    registro_desde = offset + 1 if total_count > 0 else 0
-    registro_hasta = min(offset + por_pagina, total_count)
-    
     return render_template('pedidos.html', 
-                         pedidos=pedidos,
+                         pedidos=pagina['filas'],
                          cliente_filter=cliente_filter,
                          estado_filter=estado_filter,
                          fecha_desde=fecha_desde,
                          fecha_hasta=fecha_hasta,
                          estados=estados,
                          orden=orden,
-                         pagina=pagina,
-                         total_paginas=total_paginas,
-                         total_count=total_count,
-                         registro_desde=registro_desde,
-                         registro_hasta=registro_hasta)
+                         paginacion=pagina,
+                         hoy=datetime.date.today().isoformat())
 
 
 # -----------------------------------------------
@@ -389,109 +335,117 @@ def actualizar_pedido(id_pedido):
             flash('No se aplicaron cambios: el pedido ya tenía ese estado.', 'info')
             return redirect(url_for('admin.pedido_detalles', id_pedido=id_pedido))
         
-        # Actualizar estado
-        run_query(
-            "UPDATE pedido SET estado = :e WHERE id_pedido = :id",
-            {"e": estado, "id": id_pedido},
-            commit=True
-        )
+        # Cambio de estado, notificación y correo (outbox) en una sola transacción
+        with transaccion():
+            # Actualizar estado
+            run_query(
+                "UPDATE pedido SET estado = :e WHERE id_pedido = :id",
+                {"e": estado, "id": id_pedido},
+                commit=True
+            )
+            if id_cliente:
+                registrar_cambio_pedido(id_cliente)
         
-        # Crear notificación para el cliente si el estado cambió
-        if id_cliente and estado != estado_anterior:
-            titulo = ""
-            mensaje = ""
-            tipo = "info"
-            
-            if estado == "En proceso":
-                titulo = f"🔄 Pedido {codigo} en Proceso"
-                mensaje = "Tu pedido está siendo procesado. Estamos lavando tu ropa con el mayor cuidado."
+            # Crear notificación para el cliente si el estado cambió
+            if id_cliente and estado != estado_anterior:
+                titulo = ""
+                mensaje = ""
                 tipo = "info"
-            elif estado == "Completado":
-                titulo = f"✅ Pedido {codigo} Completado"
-                mensaje = "¡Tu pedido está listo! Tu ropa está limpia y lista para ser entregada."
-                tipo = "success"
-            elif estado == "Cancelado":
-                titulo = f"❌ Pedido {codigo} Cancelado"
-                mensaje = "Tu pedido ha sido cancelado. Si tienes dudas, contacta con nosotros."
-                tipo = "error"
-            elif estado == "Pendiente":
-                titulo = f"🕐 Pedido {codigo} Pendiente"
-                mensaje = "Tu pedido está registrado y pronto será procesado."
-                tipo = "warning"
             
-            if titulo:
-                crear_notificacion(
-                    id_usuario=id_cliente,
-                    titulo=titulo,
-                    mensaje=mensaje,
-                    tipo=tipo,
-                    url=f'/cliente_pedidos'
-                )
+                if estado == "En proceso":
+                    titulo = f"🔄 Pedido {codigo} en Proceso"
+                    mensaje = "Tu pedido está siendo procesado. Estamos lavando tu ropa con el mayor cuidado."
+                    tipo = "info"
+                elif estado == "Completado":
+                    titulo = f"✅ Pedido {codigo} Completado"
+                    mensaje = "¡Tu pedido está listo! Tu ropa está limpia y lista para ser entregada."
+                    tipo = "success"
+                elif estado == "Cancelado":
+                    titulo = f"❌ Pedido {codigo} Cancelado"
+                    mensaje = "Tu pedido ha sido cancelado. Si tienes dudas, contacta con nosotros."
+                    tipo = "error"
+                elif estado == "Pendiente":
+                    titulo = f"🕐 Pedido {codigo} Pendiente"
+                    mensaje = "Tu pedido está registrado y pronto será procesado."
+                    tipo = "warning"
+            
+                if titulo:
+                    crear_notificacion(
+                        id_usuario=id_cliente,
+                        titulo=titulo,
+                        mensaje=mensaje,
+                        tipo=tipo,
+                        url=f'/cliente_pedidos'
+                    )
         
-        # Enviar correo por cualquier cambio de estado (si hay email)
-        if pedido_data and pedido_data[4] and estado != estado_anterior:
-            fecha_entrega_raw = pedido_data[2]
-            fecha_entrega = fecha_entrega_raw.strftime('%Y-%m-%d') if fecha_entrega_raw else 'Por definir'
-            email_cliente = pedido_data[4]
-
-            estados_email = {
-                "Pendiente": {
-                    "titulo": "🕐 Pedido Pendiente",
-                    "color_1": "#FFB300",
-                    "color_2": "#F57C00",
-                    "mensaje": f"Tu pedido <strong>{codigo}</strong> fue registrado y está pendiente de procesamiento."
-                },
-                "En proceso": {
-                    "titulo": "🔄 Pedido en Proceso",
-                    "color_1": "#2196F3",
-                    "color_2": "#1976D2",
-                    "mensaje": f"Tu pedido <strong>{codigo}</strong> está siendo procesado. La entrega estimada es el <strong>{fecha_entrega}</strong>."
-                },
-                "Completado": {
-                    "titulo": "✅ Pedido Completado",
-                    "color_1": "#4CAF50",
-                    "color_2": "#388E3C",
-                    "mensaje": f"Tu pedido <strong>{codigo}</strong> está completo y listo para entrega."
-                },
-                "Cancelado": {
-                    "titulo": "❌ Pedido Cancelado",
-                    "color_1": "#E53935",
-                    "color_2": "#C62828",
-                    "mensaje": f"Tu pedido <strong>{codigo}</strong> fue cancelado. Si tienes dudas, contáctanos."
+            # Enviar correo por cualquier cambio de estado (si hay email)
+            if pedido_data and pedido_data[4] and estado != estado_anterior:
+                fecha_entrega_raw = pedido_data[2]
+                fecha_entrega = fecha_entrega_raw.strftime('%Y-%m-%d') if fecha_entrega_raw else 'Por definir'
+                email_cliente = pedido_data[4]
+
+                estados_email = {
+                    "Pendiente": {
+                        "titulo": "🕐 Pedido Pendiente",
+                        "color_1": "#FFB300",
+                        "color_2": "#F57C00",
+                        "mensaje": f"Tu pedido <strong>{codigo}</strong> fue registrado y está pendiente de procesamiento."
+                    },
+                    "En proceso": {
+                        "titulo": "🔄 Pedido en Proceso",
+                        "color_1": "#2196F3",
+                        "color_2": "#1976D2",
+                        "mensaje": f"Tu pedido <strong>{codigo}</strong> está siendo procesado. La entrega estimada es el <strong>{fecha_entrega}</strong>."
+                    },
+                    "Completado": {
+                        "titulo": "✅ Pedido Completado",
+                        "color_1": "#4CAF50",
+                        "color_2": "#388E3C",
+                        "mensaje": f"Tu pedido <strong>{codigo}</strong> está completo y listo para entrega."
+                    },
+                    "Cancelado": {
+                        "titulo": "❌ Pedido Cancelado",
+                        "color_1": "#E53935",
+                        "color_2": "#C62828",
+                        "mensaje": f"Tu pedido <strong>{codigo}</strong> fue cancelado. Si tienes dudas, contáctanos."
+                    }
                 }
-            }
 
-            data_estado = estados_email.get(
-                estado,
-                {
-                    "titulo": f"📌 Pedido actualizado: {estado}",
-                    "color_1": "#546E7A",
-                    "color_2": "#37474F",
-                    "mensaje": f"El estado de tu pedido <strong>{codigo}</strong> cambió a <strong>{estado}</strong>."
-                }
-            )
+                data_estado = estados_email.get(
+                    estado,
+                    {
+                        "titulo": f"📌 Pedido actualizado: {estado}",
+                        "color_1": "#546E7A",
+                        "color_2": "#37474F",
+                        "mensaje": f"El estado de tu pedido <strong>{codigo}</strong> cambió a <strong>{estado}</strong>."
+                    }
+                )
 
-            html = f"""
-            <html>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; color: #333;">
-                    <div style="background: linear-gradient(135deg, {data_estado['color_1']} 0%, {data_estado['color_2']} 100%); padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
-                        <h1 style="color: white; margin: 0;">{data_estado['titulo']}</h1>
-                    </div>
-                    <div style="padding: 30px; background: #f9f9f9;">
-                        <h2 style="color: #1a4e7b;">Hola {nombre_cliente},</h2>
-                        <p>{data_estado['mensaje']}</p>
-                        <div style="background: white; border-left: 4px solid #1a4e7b; padding: 16px; margin-top: 16px; border-radius: 5px;">
-                            <p style="margin: 6px 0;"><strong>Pedido:</strong> {codigo}</p>
-                            <p style="margin: 6px 0;"><strong>Estado anterior:</strong> {estado_anterior}</p>
-                            <p style="margin: 6px 0;"><strong>Estado actual:</strong> {estado}</p>
-                            <p style="margin: 6px 0;"><strong>Entrega estimada:</strong> {fecha_entrega}</p>
+                html = f"""
+                <html>
+                    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; color: #333;">
+                        <div style="background: linear-gradient(135deg, {data_estado['color_1']} 0%, {data_estado['color_2']} 100%); padding: 30px; text-align: center; border-radius: 10px 10px 0 0;">
+                            <h1 style="color: white; margin: 0;">{data_estado['titulo']}</h1>
                         </div>
-                    </div>
-                </body>
-            </html>
-            """
+                        <div style="padding: 30px; background: #f9f9f9;">
+                            <h2 style="color: #1a4e7b;">Hola {nombre_cliente},</h2>
+                            <p>{data_estado['mensaje']}</p>
+                            <div style="background: white; border-left: 4px solid #1a4e7b; padding: 16px; margin-top: 16px; border-radius: 5px;">
+                                <p style="margin: 6px 0;"><strong>Pedido:</strong> {codigo}</p>
+                                <p style="margin: 6px 0;"><strong>Estado anterior:</strong> {estado_anterior}</p>
+                                <p style="margin: 6px 0;"><strong>Estado actual:</strong> {estado}</p>
+                                <p style="margin: 6px 0;"><strong>Entrega estimada:</strong> {fecha_entrega}</p>
+                            </div>
+                        </div>
+                    </body>
+                </html>
+                """
 
-            send_email_async(email_cliente, f"Actualización de pedido {codigo}: {estado}", html)
+                encolar_email(email_cliente, f"Actualización de pedido {codigo}: {estado}", html)
+
+        # El correo sale desde el worker del outbox, fuera de la petición
+        despertar_outbox()
+        invalidar_recibos(id_pedido)
         
         flash('Pedido actualizado correctamente.', 'success')
     except Exception as e:
@@ -526,11 +480,15 @@ def eliminar_pedido(id_pedido):
         )
         
         # 3. Eliminar el pedido
-        run_query(
-            "DELETE FROM pedido WHERE id_pedido = :id",
+        eliminado = run_query(
+            "DELETE FROM pedido WHERE id_pedido = :id RETURNING id_cliente",
             {"id": id_pedido},
+            fetchone=True,
             commit=True
         )
+        if eliminado and eliminado[0]:
+            registrar_cambio_pedido(eliminado[0])
+        invalidar_recibos(id_pedido)
         flash('Pedido eliminado correctamente.', 'success')
     except Exception as e:
         flash(f'Error al eliminar: {e}', 'danger')
@@ -555,7 +513,7 @@ def pedido_detalles(id_pedido):
         return redirect(url_for('admin.pedidos'))
     
     prendas = run_query(
-        "SELECT id_prenda, tipo, descripcion, observaciones, foto FROM prenda WHERE id_pedido = :id",
+        "SELECT id_prenda, tipo, descripcion, observaciones, foto, cantidad FROM prenda WHERE id_pedido = :id",
         {"id": id_pedido},
         fetchall=True
     )
@@ -594,44 +552,24 @@ def pedido_prendas(id_pedido):
     
     # Verificar permisos (cliente solo ve sus propios pedidos, admin ve todos)
     if rol != 'administrador':
-        usuario = run_query(
-            "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-            {"u": username.lower()},
-            fetchone=True
-        )
-        if usuario[0] != pedido[1]:
+        if id_usuario_actual() != pedido[1]:
             flash("No tienes acceso a este pedido.", "danger")
             return redirect(url_for('cliente.cliente_pedidos'))
     
     # Obtener prendas del pedido (individuales para mostrar fotos)
-    prendas = run_query("""
+    prendas = run_query(f"""
         SELECT 
-            id_prenda,
-            tipo,
-            descripcion,
-            observaciones,
-            foto,
-            CASE tipo
-                WHEN 'Camisa' THEN 5000
-                WHEN 'Pantalón' THEN 6000
-                WHEN 'Vestido' THEN 8000
-                WHEN 'Chaqueta' THEN 10000
-                WHEN 'Saco' THEN 7000
-                WHEN 'Falda' THEN 5500
-                WHEN 'Blusa' THEN 4500
-                WHEN 'Abrigo' THEN 12000
-                WHEN 'Suéter' THEN 6500
-                WHEN 'Jeans' THEN 7000
-                WHEN 'Corbata' THEN 3000
-                WHEN 'Bufanda' THEN 3500
-                WHEN 'Sábana' THEN 8000
-                WHEN 'Edredón' THEN 15000
-                WHEN 'Cortina' THEN 12000
-                ELSE 5000
-            END as precio
-        FROM prenda
-        WHERE id_pedido = :id
-        ORDER BY id_prenda
+            pr.id_prenda,
+            pr.tipo,
+            pr.descripcion,
+            pr.observaciones,
+            pr.foto,
+            pr.cantidad,
+            {sql_precio()} as precio
+        FROM prenda pr
+        {sql_join_precio('pr.tipo')}
+        WHERE pr.id_pedido = :id
+        ORDER BY pr.id_prenda
     """, {"id": id_pedido}, fetchall=True)
     
     # Calcular precio total
@@ -641,7 +579,8 @@ def pedido_prendas(id_pedido):
     
     for prenda in prendas:
         tipo = prenda[1]
-        precio = prenda[5]
+        cantidad = prenda[5] or 1
+        precio = prenda[6]
         precio_dict[tipo] = float(precio)
         
         if tipo not in prendas_agrupadas:
@@ -653,10 +592,10 @@ def pedido_prendas(id_pedido):
                 'fotos': []
             }
         
-        prendas_agrupadas[tipo]['cantidad'] += 1
+        prendas_agrupadas[tipo]['cantidad'] += cantidad
         if prenda[4]:  # foto
             prendas_agrupadas[tipo]['fotos'].append(prenda[4])
-        total_costo += float(precio)
+        total_costo += float(precio) * cantidad
     
     # Convertir a lista para la plantilla
     prendas_lista = list(prendas_agrupadas.values())
@@ -679,226 +618,61 @@ def pedido_prendas(id_pedido):
 # -----------------------------------------------
 @bp.route('/generar_recibo/<int:id_pedido>')
 def generar_recibo(id_pedido):
-    """Genera y descarga el recibo en formato PDF."""
+    """Genera el recibo PDF como trabajo en segundo plano (ver utils.descargar_recibo_pdf)."""
+    return redirect(url_for('utils.descargar_recibo_pdf', id_pedido=id_pedido))
+
+
+# -----------------------------------------------
+# RECIBOS MASIVOS
+# -----------------------------------------------
+@bp.route('/recibos_masivos')
+def recibos_masivos():
+    """
+    Recibos (sin fotos) de todos los pedidos del filtro en un solo PDF, con los
+    mismos filtros que admin.pedidos y campo_fecha=entrega para filtrar por
+    fecha de entrega. Los lotes grandes se generan como trabajo en segundo plano.
+    """
+    if not admin_only():
+        flash('Acceso denegado.', 'danger')
+        return redirect(url_for('auth.index'))
+
+    filtro = {
+        'cliente': request.args.get('cliente', '').strip(),
+        'estado': request.args.get('estado', '').strip(),
+        'desde': request.args.get('desde', '').strip(),
+        'hasta': request.args.get('hasta', '').strip(),
+        'campo_fecha': request.args.get('campo_fecha', 'ingreso').strip(),
+    }
+    volver = url_for('admin.pedidos', cliente=filtro['cliente'], estado=filtro['estado'],
+                     desde=filtro['desde'], hasta=filtro['hasta'])
+
     try:
-        # Obtener datos del pedido (compatible con o sin columnas de descuento)
-        try:
-            # Intentar con columnas de descuento
-            pedido = run_query("""
-                SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega, p.porcentaje_descuento, p.nivel_descuento
-                FROM pedido p
-                LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-                LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
-                WHERE p.id_pedido = :id
-            """, {"id": id_pedido}, fetchone=True)
-            tiene_columnas_descuento = True
-        except Exception as e:
-            # Si falla, usar sin columnas de descuento
-            pedido = run_query("""
-                SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega
-                FROM pedido p
-                LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-                LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
-                WHERE p.id_pedido = :id
-            """, {"id": id_pedido}, fetchone=True)
-            tiene_columnas_descuento = False
-        
-        if not pedido:
-            return "Pedido no encontrado", 404
-        
-        # Obtener prendas con fotos
-        prendas = run_query("""
-            SELECT tipo, descripcion, foto,
-                CASE tipo
-                    WHEN 'Camisa' THEN 5000
-                    WHEN 'Pantalón' THEN 6000
-                    WHEN 'Vestido' THEN 8000
-                    WHEN 'Chaqueta' THEN 10000
-                    WHEN 'Saco' THEN 7000
-                    WHEN 'Falda' THEN 5500
-                    WHEN 'Blusa' THEN 4500
-                    WHEN 'Abrigo' THEN 12000
-                    WHEN 'Suéter' THEN 6500
-                    WHEN 'Jeans' THEN 7000
-                    WHEN 'Corbata' THEN 3000
-                    WHEN 'Bufanda' THEN 3500
-                    WHEN 'Sábana' THEN 8000
-                    WHEN 'Edredón' THEN 15000
-                    WHEN 'Cortina' THEN 12000
-                    ELSE 5000
-                END as precio
-            FROM prenda
-            WHERE id_pedido = :id
-            ORDER BY id_prenda
-        """, {"id": id_pedido}, fetchall=True)
-        
-        # Obtener recibo
-        recibo = run_query("""
-            SELECT r.monto, r.fecha, r.id_cliente FROM recibo r WHERE id_pedido = :id
-        """, {"id": id_pedido}, fetchone=True)
-        
-        # Calcular descuento
-        subtotal = sum(p[3] for p in prendas)
-        
-        if tiene_columnas_descuento and len(pedido) >= 11:
-            descuento_porcentaje = pedido[9] or 0
-            nivel_descuento = pedido[10] or "Sin nivel"
-        else:
-            descuento_porcentaje = 0
-            nivel_descuento = "Sin nivel"
-        
-        descuento_monto = (subtotal * descuento_porcentaje) / 100 if descuento_porcentaje > 0 else 0
-        
-        # Crear PDF
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Título
-        title_style = styles['Title']
-        story.append(Paragraph("RECIBO - LA LAVANDERÍA", title_style))
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Información del pedido
-        info_data = [
-            ['Pedido #:', str(pedido[0])],
-            ['Cliente:', pedido[4] or 'N/A'],
-            ['Email:', pedido[6] or 'No registrado'],
-            ['Fecha Ingreso:', str(pedido[1])],
-            ['Fecha Entrega:', str(pedido[2]) if pedido[2] else 'Por definir'],
-            ['Estado:', pedido[3]],
-        ]
-        
-        # Agregar direcciones si existen
-        if pedido[7]:
-            info_data.append(['Dirección Recogida:', pedido[7]])
-        if pedido[8]:
-            info_data.append(['Dirección Entrega:', pedido[8]])
-        
-        info_table = Table(info_data, colWidths=[2*inch, 4*inch])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ]))
-        story.append(info_table)
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Agregar código de barras si existe
-        if pedido[5]:
-            story.append(Paragraph("Código de Barras:", styles['Heading3']))
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Generar imagen del código de barras
-            code128 = barcode.get_barcode_class('code128')
-            barcode_instance = code128(pedido[5], writer=ImageWriter())
-            barcode_buffer = BytesIO()
-            barcode_instance.write(barcode_buffer, options={
-                'module_width': 0.3,
-                'module_height': 10.0,
-                'quiet_zone': 2.0,
-                'font_size': 10,
-                'text_distance': 3.0,
-                'write_text': True
-            })
-            barcode_buffer.seek(0)
-            
-            # Agregar imagen al PDF
-            barcode_img = Image(barcode_buffer, width=4*inch, height=1*inch)
-            story.append(barcode_img)
-            story.append(Spacer(1, 0.3*inch))
-        
-        # Tabla de prendas
-        story.append(Paragraph("Prendas:", styles['Heading2']))
-        story.append(Spacer(1, 0.1*inch))
-        
-        prendas_data = [['Tipo', 'Descripción', 'Foto', 'Precio']]
-        total = 0
-        for prenda in prendas:
-            # Agregar fila de prenda
-            foto_cell = ""
-            if prenda[2]:  # foto existe
-                try:
-                    foto_path = os.path.join('static', prenda[2])
-                    if os.path.exists(foto_path):
-                        img = Image(foto_path, width=0.8*inch, height=0.8*inch)
-                        foto_cell = img
-                    else:
-                        foto_cell = "Foto no encontrada"
-                except Exception as e:
-                    foto_cell = "Error al cargar foto"
-            else:
-                foto_cell = "Sin foto"
-            
-            prendas_data.append([prenda[0], prenda[1] or '-', foto_cell, f'${prenda[3]:,}'])
-            total += prenda[3]
-        
-        prendas_table = Table(prendas_data, colWidths=[1.5*inch, 2*inch, 1.2*inch, 1.3*inch])
-        prendas_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ALIGN', (3, 0), (3, -1), 'RIGHT'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        story.append(prendas_table)
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Subtotal y descuento
-        if recibo:
-            # Subtotal
-            subtotal_data = [['Subtotal:', f'${subtotal:,.0f}']]
-            subtotal_table = Table(subtotal_data, colWidths=[4.5*inch, 1.5*inch])
-            subtotal_table.setStyle(TableStyle([
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ]))
-            story.append(subtotal_table)
-            
-            # Descuento si aplica
-            if descuento_monto > 0:
-                story.append(Spacer(1, 0.1*inch))
-                descuento_data = [[f'Descuento {nivel_descuento} ({descuento_porcentaje}%):', f'-${descuento_monto:,.0f}']]
-                descuento_table = Table(descuento_data, colWidths=[4.5*inch, 1.5*inch])
-                descuento_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.lightyellow),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                    ('TEXTCOLOR', (1, 0), (1, -1), colors.red),
-                    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                ]))
-                story.append(descuento_table)
-            
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Total final
-            total_data = [['TOTAL A PAGAR:', f'${recibo[0]:,.0f}']]
-            total_table = Table(total_data, colWidths=[4.5*inch, 1.5*inch])
-            total_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.lightgreen),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 14),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ]))
-            story.append(total_table)
-        
-        # Generar PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'recibo_pedido_{id_pedido}.pdf'
-        )
+        filtro_where, params = filtro_pedidos(**filtro)
+        cantidad = contar_pedidos_filtro(filtro_where, params)
+        if not cantidad:
+            flash('Ningún pedido cumple el filtro.', 'info')
+            return redirect(volver)
+
+        maximo = current_app.config.get('RECIBOS_MASIVOS_MAX', 2000)
+        if cantidad > maximo:
+            flash(f'El filtro incluye {cantidad} pedidos; el máximo por PDF es {maximo}. Acota las fechas.', 'warning')
+            return redirect(volver)
+
+        # Pocos pedidos: el PDF se genera en la petición
+        if cantidad <= current_app.config.get('RECIBOS_MASIVOS_DIRECTO', 20):
+            buffer = BytesIO()
+            construir_recibos_pdf(iterar_datos_recibos(filtro_where, params), buffer)
+            buffer.seek(0)
+            fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
+            return send_file(buffer, mimetype='application/pdf', as_attachment=True,
+                             download_name=f'recibos_{fecha_actual}.pdf')
+
+        token = encolar_trabajo('recibos_pdf', {"filtro": filtro}, id_usuario=session.get('id_usuario'))
+        return redirect(url_for('utils.trabajo_estado', token=token))
     except Exception as e:
-        print(f"Error generando PDF: {e}")
-        return "Error generando PDF", 500
+        print(f"Error generando recibos masivos: {e}")
+        flash(f'Error generando los recibos: {e}', 'danger')
+        return redirect(volver)
 
 
 # -----------------------------------------------
@@ -913,69 +687,33 @@ def clientes():
     """
     # Obtener parámetros de orden y paginación
     orden = request.args.get('orden', 'desc').strip().lower()  # 'asc' o 'desc'
-    pagina = request.args.get('pagina', 1, type=int)
+    cursor = request.args.get('cursor')
     por_pagina = 10
-    orden_sql = "ASC" if orden == 'asc' else "DESC"
     
+    # La búsqueda llega por POST desde el formulario y por GET en los enlaces de paginación
     if request.method == 'POST':
         q = request.form.get('q', '').strip()
-        
-        # Contar total de resultados
-        count_result = run_query(
-            "SELECT COUNT(*) FROM usuario WHERE rol = 'cliente' AND (nombre LIKE :q OR email LIKE :q OR username LIKE :q)",
-            {"q": f"%{q}%"},
-            fetchall=True
-        )
-        total_count = count_result[0][0] if count_result else 0
-        total_paginas = (total_count + por_pagina - 1) // por_pagina
-        
-        # Ajustar página si está fuera de rango
-        if pagina < 1:
-            pagina = 1
-        if pagina > total_paginas and total_paginas > 0:
-            pagina = total_paginas
-        
-        # Obtener datos con paginación
-        offset = (pagina - 1) * por_pagina
-        data = run_query(
-            f"SELECT id_usuario, nombre, username, email FROM usuario WHERE rol = 'cliente' AND (nombre LIKE :q OR email LIKE :q OR username LIKE :q) ORDER BY id_usuario {orden_sql} LIMIT {por_pagina} OFFSET {offset}",
-            {"q": f"%{q}%"},
-            fetchall=True
-        )
     else:
-        # Contar total de clientes
-        count_result = run_query(
-            "SELECT COUNT(*) FROM usuario WHERE rol = 'cliente'",
-            fetchall=True
-        )
-        total_count = count_result[0][0] if count_result else 0
-        total_paginas = (total_count + por_pagina - 1) // por_pagina
-        
-        # Ajustar página si está fuera de rango
-        if pagina < 1:
-            pagina = 1
-        if pagina > total_paginas and total_paginas > 0:
-            pagina = total_paginas
-        
-        # Obtener datos con paginación
-        offset = (pagina - 1) * por_pagina
-        data = run_query(
-            f"SELECT id_usuario, nombre, username, email FROM usuario WHERE rol = 'cliente' ORDER BY id_usuario {orden_sql} LIMIT {por_pagina} OFFSET {offset}",
-            fetchall=True
-        )
-    
-    # Calcular rango de registros mostrados
-    registro_desde = offset + 1 if total_count > 0 else 0
-    registro_hasta = min(offset + por_pagina, total_count)
+        q = request.args.get('q', '').strip()
+    
+    # Filtro sobre usuario.busqueda (sin tildes ni mayúsculas, con índice)
+    filtro, params = filtro_clientes(q)
+    desde_sql = " FROM usuario WHERE rol = 'cliente'" + filtro
+    query = "SELECT id_usuario, nombre, username, email" + desde_sql
+    
+    # Paginación por cursor sobre id_usuario; el total (cacheado o estimado) se
+    # obtiene solo en la primera página
+    pagina = paginar_keyset(
+        query, params, 'id_usuario', orden, cursor, huella_filtros(q=q, orden=orden),
+        por_pagina=por_pagina,
+        conteo=lambda: contar(desde_sql, params, GRUPO_USUARIO)
+    )
     
     return render_template('clientes.html', 
-                         clients=data, 
+                         clients=pagina['filas'], 
                          orden=orden,
-                         pagina=pagina,
-                         total_paginas=total_paginas,
-                         total_count=total_count,
-                         registro_desde=registro_desde,
-                         registro_hasta=registro_hasta)
+                         q=q,
+                         paginacion=pagina)
 
 
 # -----------------------------------------------
@@ -1045,6 +783,7 @@ def registro_rapido():
             {"uid": usuario_id, "n": nombre, "e": email},
             commit=True
         )
+        actualizar_cliente_indice(usuario_id, nombre, email, username)
         
         # Enviar email con contraseña
         html = f"""
@@ -1138,11 +877,13 @@ def agregar_cliente():
             hashed_password = generate_password_hash(password)
             
             # Insertar en la tabla usuario
-            run_query(
-                "INSERT INTO usuario (nombre, username, email, password, rol) VALUES (:n, :u, :e, :p, 'cliente')",
+            usuario_id = run_query(
+                "INSERT INTO usuario (nombre, username, email, password, rol) VALUES (:n, :u, :e, :p, 'cliente') RETURNING id_usuario",
                 {"n": nombre, "u": username, "e": email, "p": hashed_password},
+                fetchone=True,
                 commit=True
-            )
+            )[0]
+            actualizar_cliente_indice(usuario_id, nombre, email, username)
             flash('✅ Cliente agregado correctamente.', 'success')
             return redirect(url_for('admin.clientes'))
         except Exception as e:
@@ -1272,6 +1013,8 @@ def actualizar_cliente(id_cliente):
                 {"id": id_cliente, "n": nombre, "e": email, "t": telefono, "d": direccion},
                 commit=True
             )
+            actualizar_cliente_indice(id_cliente, nombre, email, username)
+            invalidar_identidad(cliente_data['username'])
 
             flash('Cliente actualizado correctamente.', 'success')
             return redirect(url_for('admin.actualizar_cliente', id_cliente=id_cliente))
@@ -1293,7 +1036,7 @@ def eliminar_cliente(id_cliente):
     
     try:
         usuario_obj = run_query(
-            "SELECT id_usuario FROM usuario WHERE id_usuario = :id AND rol = 'cliente'",
+            "SELECT id_usuario, username FROM usuario WHERE id_usuario = :id AND rol = 'cliente'",
             {"id": id_cliente},
             fetchone=True
         )
@@ -1303,7 +1046,7 @@ def eliminar_cliente(id_cliente):
             return redirect(get_safe_redirect())
 
         # Eliminar datos relacionados en una transacción para evitar huérfanos.
-        with db.engine.begin() as conn:
+        with transaccion() as conn:
             conn.execute(
                 text("""
                     DELETE FROM recibo
@@ -1327,6 +1070,8 @@ def eliminar_cliente(id_cliente):
                 text("DELETE FROM usuario WHERE id_usuario = :id AND rol = 'cliente'"),
                 {"id": id_cliente}
             )
+        eliminar_cliente_indice(id_cliente)
+        invalidar_identidad(usuario_obj[1] or '')
 
         flash('Cliente eliminado correctamente.', 'success')
     except Exception as e:
@@ -1458,7 +1203,7 @@ def ejecutar_migraciones_admin():
         flash('Acceso denegado.', 'danger')
         return redirect(url_for('auth.index'))
 
-    archivos = ['add_direcciones_to_pedido.sql', 'create_descuento_config.sql', 'add_descuento_to_pedido.sql', 'create_cliente_esquema_descuento.sql', 'create_verification_codes.sql', 'alter_verification_codes_token.sql', 'add_foto_to_prenda.sql']
+    archivos = ['add_direcciones_to_pedido.sql', 'create_descuento_config.sql', 'add_descuento_to_pedido.sql', 'create_cliente_esquema_descuento.sql', 'create_verification_codes.sql', 'alter_verification_codes_token.sql', 'add_foto_to_prenda.sql', 'add_cantidad_to_prenda.sql', 'create_reportes_rollup.sql', 'create_trabajos.sql', 'create_outbox.sql', 'create_precio_prenda.sql', 'add_totales_to_pedido.sql', 'create_indices_paginacion.sql', 'create_conteo_version.sql', 'create_busqueda_clientes.sql', 'create_indices_usuario.sql', 'create_notificacion_aviso.sql', 'create_notificacion_contador.sql', 'create_notificacion_archivo.sql', 'create_cliente_lealtad.sql', 'create_indice_pedido_entrega.sql']
     errores = []
 
     for archivo in archivos:
@@ -1519,6 +1264,8 @@ def crear_descuento():
             "max": pedidos_maximos,
             "a": activo
         }, commit=True)
+        invalidar_config_descuento()
+        programar_recalculo()
         
         flash(f'Nivel de descuento "{nivel}" creado exitosamente. Se aplicará a CLIENTES NUEVOS o que completen su ciclo actual.', 'success')
     except Exception as e:
@@ -1574,6 +1321,8 @@ def editar_descuento(id_config):
             "a": activo,
             "id": id_config
         }, commit=True)
+        invalidar_config_descuento()
+        programar_recalculo()
         
         flash(f'Nivel de descuento "{nivel}" actualizado exitosamente. Los cambios se aplicarán solo a CLIENTES NUEVOS o que completen su ciclo actual.', 'success')
     except Exception as e:
@@ -1599,6 +1348,8 @@ def eliminar_descuento(id_config):
         run_query("""
             DELETE FROM descuento_config WHERE id_config = :id
         """, {"id": id_config}, commit=True)
+        invalidar_config_descuento()
+        programar_recalculo()
         
         flash('Nivel de descuento eliminado exitosamente.', 'success')
     except Exception as e:
@@ -1713,7 +1464,7 @@ def lector_barcode():
             # Obtener prendas del pedido
             try:
                 prendas = run_query("""
-                    SELECT tipo, descripcion, observaciones
+                    SELECT tipo, descripcion, observaciones, cantidad
                     FROM prenda
                     WHERE id_pedido = :id
                 """, {"id": pedido[0]}, fetchall=True)
@@ -1764,7 +1515,7 @@ def lector_barcode():
                         'direccion': pedido[7] or 'No registrada',
                         'email': pedido[8] or 'No registrado'
                     },
-                    'prendas': [{'tipo': p[0], 'descripcion': p[1] or '', 'observaciones': p[2] or ''} for p in (prendas or [])],
+                    'prendas': [{'tipo': p[0], 'descripcion': p[1] or '', 'observaciones': p[2] or '', 'cantidad': p[3] or 1} for p in (prendas or [])],
                     'recibo': None
                 }
                 
@@ -1824,177 +1575,38 @@ def reportes():
         return redirect(url_for('auth.index'))
 
     import json
-    from datetime import datetime, timedelta
-    
-    # 1. CLIENTES NUEVOS (últimos 30 días)
-    clientes_nuevos = run_query("""
-        SELECT p.fecha_ingreso::date as fecha, COUNT(DISTINCT p.id_cliente) as cantidad
-        FROM pedido p
-        WHERE p.fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
-        GROUP BY p.fecha_ingreso::date
-        ORDER BY fecha
-    """, fetchall=True) or []
-    
-    # 2. PEDIDOS POR DÍA (últimos 30 días)
-    pedidos_por_dia = run_query("""
-        SELECT fecha_ingreso::date as fecha, COUNT(*) as cantidad
-        FROM pedido
-        WHERE fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
-        GROUP BY fecha_ingreso::date
-        ORDER BY fecha
-    """, fetchall=True) or []
-    
-    # 3. TIPOS DE PRENDAS Y SU CANTIDAD
-    prendas_por_tipo = run_query("""
-        SELECT tipo, COUNT(*) as cantidad
-        FROM prenda
-        GROUP BY tipo
-        ORDER BY cantidad DESC
-    """, fetchall=True) or []
-    
-    # 4. INGRESOS POR MES
-    ingresos_por_mes = run_query("""
-        SELECT DATE_TRUNC('month', fecha)::date as mes, SUM(monto) as total
-        FROM recibo
-        GROUP BY DATE_TRUNC('month', fecha)
-        ORDER BY mes DESC
-        LIMIT 12
-    """, fetchall=True) or []
-    
-    # 5. ESTADO DE PEDIDOS
-    estado_pedidos = run_query("""
-        SELECT estado, COUNT(*) as cantidad
-        FROM pedido
-        GROUP BY estado
-    """, fetchall=True) or []
-    
-    # 6. TOP 10 CLIENTES POR CANTIDAD DE PEDIDOS
-    top_clientes = run_query("""
-        SELECT c.nombre, COUNT(p.id_pedido) as cantidad_pedidos
-        FROM cliente c
-        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
-        GROUP BY c.id_cliente, c.nombre
-        ORDER BY cantidad_pedidos DESC
-        LIMIT 10
-    """, fetchall=True) or []
-    
-    # 7. ESTADÍSTICAS GENERALES
-    total_clientes = run_query("SELECT COUNT(*) FROM cliente", fetchone=True)[0] or 0
-    total_pedidos = run_query("SELECT COUNT(*) FROM pedido", fetchone=True)[0] or 0
-    total_ingresos = run_query("SELECT COALESCE(SUM(monto), 0) FROM recibo", fetchone=True)[0] or 0
-    total_prendas = run_query("SELECT COUNT(*) FROM prenda", fetchone=True)[0] or 0
-    
-    # 8. PROMEDIO DE PRENDAS POR PEDIDO
-    promedio_prendas = run_query("""
-        SELECT AVG(cantidad) as promedio
-        FROM (
-            SELECT COUNT(*) as cantidad
-            FROM prenda
-            GROUP BY id_pedido
-        ) subq
-    """, fetchone=True)[0] or 0
-    
-    # 9. ESTADO DE PEDIDOS CON CONTEO
-    estado_pedidos_conteo = run_query("""
-        SELECT estado, COUNT(*) as cantidad
-        FROM pedido
-        GROUP BY estado
-    """, fetchall=True) or []
-    
-    # 10. TOP 5 PRENDAS MÁS SOLICITADAS
-    prendas_top = run_query("""
-        SELECT tipo, COUNT(*) as cantidad
-        FROM prenda
-        GROUP BY tipo
-        ORDER BY cantidad DESC
-        LIMIT 5
-    """, fetchall=True) or []
-    
-    # 11. CLIENTES MÁS ACTIVOS CON ESTADÍSTICAS
-    clientes_activos = run_query("""
-        SELECT 
-            c.id_cliente, 
-            c.nombre,
-            COUNT(DISTINCT CASE WHEN p.id_pedido IS NOT NULL THEN p.id_pedido END) as cantidad_pedidos,
-            COUNT(pr.id_prenda) as total_prendas,
-            COALESCE(SUM(
-                CASE 
-                    WHEN pr.tipo IS NULL THEN 0
-                    WHEN pr.tipo = 'Camisa' THEN 5000
-                    WHEN pr.tipo = 'Pantalón' THEN 6000
-                    WHEN pr.tipo = 'Vestido' THEN 8000
-                    WHEN pr.tipo = 'Chaqueta' THEN 10000
-                    WHEN pr.tipo = 'Saco' THEN 7000
-                    WHEN pr.tipo = 'Falda' THEN 5500
-                    WHEN pr.tipo = 'Blusa' THEN 4500
-                    WHEN pr.tipo = 'Abrigo' THEN 12000
-                    WHEN pr.tipo = 'Suéter' THEN 6500
-                    WHEN pr.tipo = 'Jeans' THEN 7000
-                    WHEN pr.tipo = 'Corbata' THEN 3000
-                    WHEN pr.tipo = 'Bufanda' THEN 3500
-                    WHEN pr.tipo = 'Sábana' THEN 8000
-                    WHEN pr.tipo = 'Edredón' THEN 15000
-                    WHEN pr.tipo = 'Cortina' THEN 12000
-                    ELSE 5000
-                END
-            ), 0)::numeric as gasto_total
-        FROM cliente c
-        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
-        LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
-        GROUP BY c.id_cliente, c.nombre
-        ORDER BY cantidad_pedidos DESC
-        LIMIT 15
-    """, fetchall=True) or []
-    
-    # 12. TASA DE COMPLETACIÓN
-    completados = run_query("""
-        SELECT COUNT(*) FROM pedido WHERE estado = 'Completado'
-    """, fetchone=True)[0] or 0
-    tasa_completacion = (completados / total_pedidos * 100) if total_pedidos > 0 else 0
-    
-    # 13. PROMEDIO DE GASTO POR CLIENTE
-    promedio_gasto = run_query("""
-        SELECT AVG(gasto)
-        FROM (
-            SELECT COALESCE(SUM(
-                CASE 
-                    WHEN pr.tipo IS NULL THEN 0
-                    WHEN pr.tipo = 'Camisa' THEN 5000
-                    WHEN pr.tipo = 'Pantalón' THEN 6000
-                    WHEN pr.tipo = 'Vestido' THEN 8000
-                    WHEN pr.tipo = 'Chaqueta' THEN 10000
-                    WHEN pr.tipo = 'Saco' THEN 7000
-                    WHEN pr.tipo = 'Falda' THEN 5500
-                    WHEN pr.tipo = 'Blusa' THEN 4500
-                    WHEN pr.tipo = 'Abrigo' THEN 12000
-                    WHEN pr.tipo = 'Suéter' THEN 6500
-                    WHEN pr.tipo = 'Jeans' THEN 7000
-                    WHEN pr.tipo = 'Corbata' THEN 3000
-                    WHEN pr.tipo = 'Bufanda' THEN 3500
-                    WHEN pr.tipo = 'Sábana' THEN 8000
-                    WHEN pr.tipo = 'Edredón' THEN 15000
-                    WHEN pr.tipo = 'Cortina' THEN 12000
-                    ELSE 5000
-                END
-            ), 0) as gasto
-            FROM cliente c
-            LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
-            LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
-            GROUP BY c.id_cliente
-        ) subq
-    """, fetchone=True)[0] or 0
-    
-    # 14. PEDIDOS PENDIENTES
-    pedidos_pendientes = run_query("""
-        SELECT COUNT(*) FROM pedido WHERE estado IN ('Pendiente', 'En proceso')
-    """, fetchone=True)[0] or 0
-    
-    # 15. PROMEDIO DE DÍAS PARA COMPLETAR PEDIDO
-    promedio_dias = run_query("""
-        SELECT AVG((fecha_entrega - fecha_ingreso)::integer)
-        FROM pedido
-        WHERE estado = 'Completado' AND fecha_entrega IS NOT NULL
-    """, fetchone=True)[0] or 0
+
+    # Los agregados se leen de las tablas reporte_* (ver services/reportes_service.py);
+    # antes se aplica un lote acotado de los cambios pendientes desde el último refresco.
+    try:
+        refrescar_reportes(limite=current_app.config.get('REPORTES_REFRESCO_LOTE', 200))
+        if hay_pendientes():
+            flash('Los reportes se están actualizando: algunos datos pueden no incluir los cambios más recientes.', 'info')
+    except Exception as e:
+        print(f"[ERROR] refrescar_reportes: {e}")
+
+    try:
+        datos = obtener_reportes()
+    except Exception as e:
+        print(f"[ERROR] obtener_reportes: {e}")
+        flash('Los reportes aún no están disponibles. Ejecuta las migraciones desde Configurar descuentos.', 'warning')
+        datos = {
+            "clientes_nuevos": [], "pedidos_por_dia": [], "prendas_por_tipo": [],
+            "ingresos_por_mes": [], "estado_pedidos": [], "top_clientes": [],
+            "clientes_activos": [], "prendas_top": [], "total_clientes": 0,
+            "total_pedidos": 0, "total_ingresos": 0, "total_prendas": 0,
+            "promedio_prendas": 0, "completados": 0, "promedio_gasto": 0,
+            "pedidos_pendientes": 0, "promedio_dias": 0,
+        }
+
+    clientes_nuevos = datos['clientes_nuevos']
+    pedidos_por_dia = datos['pedidos_por_dia']
+    prendas_por_tipo = datos['prendas_por_tipo']
+    ingresos_por_mes = datos['ingresos_por_mes']
+    estado_pedidos = datos['estado_pedidos']
+    top_clientes = datos['top_clientes']
+    total_pedidos = datos['total_pedidos']
+    tasa_completacion = (datos['completados'] / total_pedidos * 100) if total_pedidos > 0 else 0
     
     # Preparar datos para gráficos (formato JSON)
     graficos = {
@@ -2026,602 +1638,34 @@ def reportes():
     
     return render_template('reportes.html',
                          graficos=json.dumps(graficos),
-                         total_clientes=total_clientes,
+                         total_clientes=datos['total_clientes'],
                          total_pedidos=total_pedidos,
-                         total_ingresos=float(total_ingresos),
-                         total_prendas=total_prendas,
-                         promedio_prendas=round(float(promedio_prendas), 2),
-                         estado_pedidos=estado_pedidos_conteo,
-                         prendas_top=prendas_top,
-                         clientes_activos=clientes_activos,
+                         total_ingresos=float(datos['total_ingresos']),
+                         total_prendas=datos['total_prendas'],
+                         promedio_prendas=round(float(datos['promedio_prendas']), 2),
+                         estado_pedidos=estado_pedidos,
+                         prendas_top=datos['prendas_top'],
+                         clientes_activos=datos['clientes_activos'],
                          tasa_completacion=round(tasa_completacion, 2),
-                         promedio_gasto=round(float(promedio_gasto), 0),
-                         pedidos_pendientes=pedidos_pendientes,
-                         promedio_dias=round(float(promedio_dias), 1))
+                         promedio_gasto=round(float(datos['promedio_gasto']), 0),
+                         pedidos_pendientes=datos['pedidos_pendientes'],
+                         promedio_dias=round(float(datos['promedio_dias']), 1))
 
 
 @bp.route('/reportes/export_excel')
 @login_requerido
 @admin_requerido
 def reportes_export_excel():
-    """Exportar todos los reportes a un archivo Excel."""
+    """Encola la exportación de todos los reportes a Excel como trabajo en segundo plano."""
     if not admin_only():
         flash('Acceso denegado.', 'danger')
         return redirect(url_for('auth.index'))
     
     try:
-        from io import BytesIO
-        import pandas as pd
-        from datetime import datetime
-
-        print("\nGenerando archivo Excel...")
-
-        # Crear un buffer en memoria
-        output = BytesIO()
-
-        def safe_scalar(query, default=0):
-            try:
-                result = run_query(query, fetchone=True)
-                if not result or result[0] is None:
-                    return default
-                return result[0]
-            except Exception as e:
-                print(f"[Resumen - Error: {e}]")
-                return default
-
-        # Crear el archivo Excel con múltiples hojas
-        try:
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-
-                # Hoja 1: Resumen General Expandido (SIEMPRE se crea)
-                try:
-                    total_pedidos = safe_scalar("SELECT COUNT(*) FROM pedido", default=0)
-                    total_completados = safe_scalar("SELECT COUNT(*) FROM pedido WHERE estado = 'Completado'", default=0)
-                    total_clientes = safe_scalar("SELECT COUNT(*) FROM cliente", default=0)
-                    total_ingresos = safe_scalar("SELECT COALESCE(SUM(total), 0) FROM recibo", default=0)
-                    total_prendas = safe_scalar("SELECT COUNT(*) FROM prenda", default=0)
-
-                    # Métricas avanzadas
-                    ticket_promedio = total_ingresos / max(total_completados, 1)
-                    valor_por_prenda = total_ingresos / max(total_prendas, 1)
-                    clientes_activos_mes = safe_scalar("""
-                        SELECT COUNT(DISTINCT id_cliente) FROM pedido 
-                        WHERE fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
-                    """, default=0)
-                    clientes_recurrentes = safe_scalar("""
-                        SELECT COUNT(*) FROM (
-                            SELECT id_cliente FROM pedido GROUP BY id_cliente HAVING COUNT(*) > 1
-                        ) subq
-                    """, default=0)
-
-                    resumen_data = {
-                        'Metrica': [
-                            'Total Clientes Registrados',
-                            'Clientes Activos (Ultimos 30 dias)',
-                            'Clientes Recurrentes',
-                            'Tasa de Retencion (%)',
-                            'Total Pedidos',
-                            'Pedidos Completados',
-                            'Pedidos Pendientes',
-                            'Pedidos En Proceso',
-                            'Tasa Completacion (%)',
-                            'Total Prendas Procesadas',
-                            'Promedio Prendas por Pedido',
-                            'Total Ingresos (COP)',
-                            'Ticket Promedio (COP)',
-                            'Valor Promedio por Prenda (COP)',
-                            'Ingreso Promedio por Cliente (COP)',
-                            'Promedio Dias para Completar',
-                            'Pedidos por Dia (Promedio)',
-                            'Tasa de Crecimiento Mensual (%)'
-                        ],
-                        'Valor': [
-                            total_clientes,
-                            clientes_activos_mes,
-                            clientes_recurrentes,
-                            round((clientes_recurrentes / max(total_clientes, 1)) * 100, 2),
-                            total_pedidos,
-                            total_completados,
-                            safe_scalar("SELECT COUNT(*) FROM pedido WHERE estado = 'Pendiente'", default=0),
-                            safe_scalar("SELECT COUNT(*) FROM pedido WHERE estado = 'En proceso'", default=0),
-                            round((total_completados / max(total_pedidos, 1)) * 100, 2),
-                            total_prendas,
-                            round(safe_scalar("SELECT AVG(cnt) FROM (SELECT COUNT(*) as cnt FROM prenda GROUP BY id_pedido) subq", default=0), 2),
-                            round(total_ingresos, 2),
-                            round(ticket_promedio, 2),
-                            round(valor_por_prenda, 2),
-                            round(total_ingresos / max(total_clientes, 1), 2),
-                            round(safe_scalar("SELECT AVG((fecha_entrega - fecha_ingreso)::integer) FROM pedido WHERE estado = 'Completado' AND fecha_entrega IS NOT NULL", default=0), 1),
-                            round(safe_scalar("SELECT COUNT(*)::float / NULLIF(COUNT(DISTINCT fecha_ingreso::date), 0) FROM pedido", default=0), 2),
-                            round(safe_scalar("""
-                                SELECT CASE 
-                                    WHEN mes_anterior > 0 THEN ((mes_actual - mes_anterior)::float / mes_anterior) * 100
-                                    ELSE 0 
-                                END
-                                FROM (
-                                    SELECT 
-                                        COUNT(*) FILTER (WHERE fecha_ingreso >= DATE_TRUNC('month', CURRENT_DATE)) as mes_actual,
-                                        COUNT(*) FILTER (WHERE fecha_ingreso >= DATE_TRUNC('month', CURRENT_DATE - INTERVAL '1 month') 
-                                                         AND fecha_ingreso < DATE_TRUNC('month', CURRENT_DATE)) as mes_anterior
-                                    FROM pedido
-                                ) subq
-                            """, default=0), 2)
-                        ]
-                    }
-                    df_resumen = pd.DataFrame(resumen_data)
-                except Exception as e:
-                    df_resumen = pd.DataFrame({'Metrica': ['Error'], 'Valor': [f'No se pudo generar resumen: {e}']})
-                df_resumen.to_excel(writer, sheet_name='Resumen Ejecutivo', index=False)
-                print("[Resumen Ejecutivo]")
-
-                # Hoja 2: Estado de Pedidos con porcentajes
-                try:
-                    estado_data = run_query("""
-                        SELECT estado, COUNT(*) as cantidad
-                        FROM pedido
-                        GROUP BY estado
-                        ORDER BY cantidad DESC
-                    """, fetchall=True)
-                    if estado_data and len(estado_data) > 0:
-                        df_estado = pd.DataFrame(estado_data, columns=['Estado', 'Cantidad'])
-                        df_estado['Porcentaje'] = (df_estado['Cantidad'] / df_estado['Cantidad'].sum() * 100).round(2)
-                        df_estado.to_excel(writer, sheet_name='Estados', index=False)
-                        print("[Estados]")
-                except Exception as e:
-                    print(f"[Estados - Error: {e}]")
-
-                # Hoja 3: Prendas por Tipo (todas)
-                try:
-                    prendas_data = run_query("""
-                        SELECT tipo, COUNT(*) as cantidad
-                        FROM prenda
-                        GROUP BY tipo
-                        ORDER BY cantidad DESC
-                    """, fetchall=True)
-                    if prendas_data and len(prendas_data) > 0:
-                        df_prendas = pd.DataFrame(prendas_data, columns=['Tipo Prenda', 'Cantidad'])
-                        total_prendas_tipo = df_prendas['Cantidad'].sum()
-                        df_prendas['Porcentaje'] = (df_prendas['Cantidad'] / total_prendas_tipo * 100).round(2)
-                        df_prendas.to_excel(writer, sheet_name='Prendas por Tipo', index=False)
-                        print("[Prendas por Tipo]")
-                except Exception as e:
-                    print(f"[Prendas - Error: {e}]")
-
-                # Hoja 4: Top 50 Clientes con Analisis Detallado
-                try:
-                    clientes_data = run_query("""
-                        SELECT 
-                            c.nombre,
-                            c.email,
-                            c.telefono,
-                            COUNT(DISTINCT p.id_pedido) as total_pedidos,
-                            COUNT(DISTINCT CASE WHEN p.estado = 'Completado' THEN p.id_pedido END) as pedidos_completados,
-                            COUNT(DISTINCT CASE WHEN p.estado IN ('Pendiente', 'En proceso') THEN p.id_pedido END) as pedidos_activos,
-                            COUNT(pr.id_prenda) as total_prendas,
-                            COALESCE(SUM(r.total), 0) as total_gastado,
-                            COALESCE(AVG(r.total), 0) as ticket_promedio,
-                            MAX(p.fecha_ingreso)::date as ultimo_pedido,
-                            MIN(p.fecha_ingreso)::date as primer_pedido,
-                            EXTRACT(days FROM (MAX(p.fecha_ingreso) - MIN(p.fecha_ingreso))) / NULLIF(COUNT(DISTINCT p.id_pedido) - 1, 0) as dias_entre_pedidos
-                        FROM cliente c
-                        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
-                        LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
-                        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
-                        GROUP BY c.id_cliente, c.nombre, c.email, c.telefono
-                        HAVING COUNT(DISTINCT p.id_pedido) > 0
-                        ORDER BY total_gastado DESC, total_pedidos DESC
-                        LIMIT 50
-                    """, fetchall=True)
-                    if clientes_data and len(clientes_data) > 0:
-                        df_clientes = pd.DataFrame(clientes_data, columns=[
-                            'Nombre', 'Email', 'Telefono', 'Total Pedidos', 'Completados', 'Activos',
-                            'Total Prendas', 'Total Gastado (COP)', 'Ticket Promedio (COP)', 
-                            'Ultimo Pedido', 'Primer Pedido', 'Dias Entre Pedidos'
-                        ])
-                        df_clientes['Total Gastado (COP)'] = df_clientes['Total Gastado (COP)'].round(2)
-                        df_clientes['Ticket Promedio (COP)'] = df_clientes['Ticket Promedio (COP)'].round(2)
-                        df_clientes['Dias Entre Pedidos'] = df_clientes['Dias Entre Pedidos'].round(1)
-                        df_clientes.to_excel(writer, sheet_name='Top 50 Clientes', index=False)
-                        print("[Top 50 Clientes]")
-                except Exception as e:
-                    print(f"[Clientes - Error: {e}]")
-
-                # Hoja 5: Pedidos por Dia (ultimos 30 dias)
-                try:
-                    pedidos_dia_data = run_query("""
-                        SELECT fecha_ingreso::date as fecha, COUNT(*) as cantidad
-                        FROM pedido
-                        WHERE fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
-                        GROUP BY fecha_ingreso::date
-                        ORDER BY fecha DESC
-                    """, fetchall=True)
-                    if pedidos_dia_data and len(pedidos_dia_data) > 0:
-                        df_pedidos_dia = pd.DataFrame(pedidos_dia_data, columns=['Fecha', 'Cantidad Pedidos'])
-                        df_pedidos_dia.to_excel(writer, sheet_name='Pedidos por Dia', index=False)
-                        print("[Pedidos por Dia]")
-                except Exception as e:
-                    print(f"[Pedidos por Dia - Error: {e}]")
-
-                # Hoja 6: Clientes Nuevos por Dia (ultimos 30 dias)
-                try:
-                    clientes_nuevos_data = run_query("""
-                        SELECT p.fecha_ingreso::date as fecha, COUNT(DISTINCT p.id_cliente) as clientes
-                        FROM pedido p
-                        WHERE p.fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
-                        GROUP BY p.fecha_ingreso::date
-                        ORDER BY fecha DESC
-                    """, fetchall=True)
-                    if clientes_nuevos_data and len(clientes_nuevos_data) > 0:
-                        df_clientes_nuevos = pd.DataFrame(clientes_nuevos_data, columns=['Fecha', 'Clientes Nuevos'])
-                        df_clientes_nuevos.to_excel(writer, sheet_name='Clientes Nuevos', index=False)
-                        print("[Clientes Nuevos]")
-                except Exception as e:
-                    print(f"[Clientes Nuevos - Error: {e}]")
-
-                # Hoja 7: Ingresos por Mes (ultimos 12 meses)
-                try:
-                    ingresos_mes_data = run_query("""
-                        SELECT 
-                            TO_CHAR(fecha, 'YYYY-MM') as mes,
-                            SUM(monto) as total
-                        FROM recibo
-                        WHERE fecha >= CURRENT_DATE - INTERVAL '12 months'
-                        GROUP BY TO_CHAR(fecha, 'YYYY-MM')
-                        ORDER BY mes DESC
-                    """, fetchall=True)
-                    if ingresos_mes_data and len(ingresos_mes_data) > 0:
-                        df_ingresos_mes = pd.DataFrame(ingresos_mes_data, columns=['Mes', 'Ingresos (COP)'])
-                        df_ingresos_mes.to_excel(writer, sheet_name='Ingresos por Mes', index=False)
-                        print("[Ingresos por Mes]")
-                except Exception as e:
-                    print(f"[Ingresos por Mes - Error: {e}]")
-
-                # Hoja 8: Detalle Completo de Pedidos con Rentabilidad
-                try:
-                    pedidos_detalle_data = run_query("""
-                        SELECT 
-                            p.id_pedido,
-                            c.nombre as cliente,
-                            c.telefono,
-                            p.fecha_ingreso::date as fecha_ingreso,
-                            p.fecha_entrega::date as fecha_entrega,
-                            CASE 
-                                WHEN p.fecha_entrega IS NOT NULL AND p.estado = 'Completado'
-                                THEN (p.fecha_entrega::date - p.fecha_ingreso::date)
-                                ELSE NULL
-                            END as dias_procesamiento,
-                            p.estado,
-                            p.direccion_entrega,
-                            p.direccion_recogida,
-                            COUNT(pr.id_prenda) as cantidad_prendas,
-                            COALESCE(r.subtotal, 0) as subtotal,
-                            COALESCE(r.descuento, 0) as descuento,
-                            COALESCE(r.total, 0) as total,
-                            r.metodo_pago,
-                            p.observaciones
-                        FROM pedido p
-                        LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-                        LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
-                        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
-                        GROUP BY p.id_pedido, c.nombre, c.telefono, p.fecha_ingreso, p.fecha_entrega, 
-                                 p.estado, p.direccion_entrega, p.direccion_recogida, 
-                                 r.subtotal, r.descuento, r.total, r.metodo_pago, p.observaciones
-                        ORDER BY p.fecha_ingreso DESC
-                    """, fetchall=True)
-                    if pedidos_detalle_data and len(pedidos_detalle_data) > 0:
-                        df_pedidos_detalle = pd.DataFrame(pedidos_detalle_data, 
-                            columns=['ID Pedido', 'Cliente', 'Telefono', 'Fecha Ingreso', 'Fecha Entrega', 
-                                   'Dias Proc.', 'Estado', 'Dir. Entrega', 'Dir. Recogida', 'Cant. Prendas', 
-                                   'Subtotal (COP)', 'Descuento (COP)', 'Total (COP)', 'Metodo Pago', 'Observaciones'])
-                        df_pedidos_detalle.to_excel(writer, sheet_name='Detalle Pedidos', index=False)
-                        print("[Detalle Pedidos]")
-                except Exception as e:
-                    print(f"[Detalle Pedidos - Error: {e}]")
-
-                # Hoja 9: Todos los Clientes con estadisticas
-                try:
-                    todos_clientes_data = run_query("""
-                        SELECT 
-                            c.id_cliente,
-                            c.nombre,
-                            c.email,
-                            c.telefono,
-                            COUNT(DISTINCT p.id_pedido) as total_pedidos,
-                            COUNT(DISTINCT CASE WHEN p.estado = 'Completado' THEN p.id_pedido END) as pedidos_completados,
-                            COUNT(pr.id_prenda) as total_prendas,
-                            COALESCE(SUM(r.total), 0) as total_gastado
-                        FROM cliente c
-                        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
-                        LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
-                        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
-                        GROUP BY c.id_cliente, c.nombre, c.email, c.telefono
-                        ORDER BY total_pedidos DESC, total_gastado DESC
-                    """, fetchall=True)
-                    if todos_clientes_data and len(todos_clientes_data) > 0:
-                        df_todos_clientes = pd.DataFrame(todos_clientes_data, 
-                            columns=['ID', 'Nombre', 'Email', 'Telefono', 'Total Pedidos', 'Completados', 'Total Prendas', 'Total Gastado (COP)'])
-                        df_todos_clientes.to_excel(writer, sheet_name='Todos los Clientes', index=False)
-                        print("[Todos los Clientes]")
-                except Exception as e:
-                    print(f"[Todos Clientes - Error: {e}]")
-
-                # Hoja 10: Prendas por Pedido (analisis detallado)
-                try:
-                    prendas_pedido_data = run_query("""
-                        SELECT 
-                            p.id_pedido,
-                            c.nombre as cliente,
-                            pr.tipo,
-                            pr.color,
-                            pr.estado as estado_prenda,
-                            pr.observaciones
-                        FROM prenda pr
-                        JOIN pedido p ON pr.id_pedido = p.id_pedido
-                        JOIN cliente c ON p.id_cliente = c.id_cliente
-                        ORDER BY p.id_pedido DESC, pr.tipo
-                    """, fetchall=True)
-                    if prendas_pedido_data and len(prendas_pedido_data) > 0:
-                        df_prendas_pedido = pd.DataFrame(prendas_pedido_data,
-                            columns=['ID Pedido', 'Cliente', 'Tipo Prenda', 'Color', 'Estado', 'Observaciones'])
-                        df_prendas_pedido.to_excel(writer, sheet_name='Prendas Detalle', index=False)
-                        print("[Prendas Detalle]")
-                except Exception as e:
-                    print(f"[Prendas Detalle - Error: {e}]")
-
-                # Hoja 11: Analisis de Rentabilidad Mensual
-                try:
-                    rentabilidad_data = run_query("""
-                        SELECT 
-                            TO_CHAR(r.fecha, 'YYYY-MM') as mes,
-                            COUNT(DISTINCT r.id_pedido) as pedidos,
-                            COUNT(DISTINCT p.id_cliente) as clientes,
-                            SUM(r.subtotal) as subtotal,
-                            SUM(r.descuento) as descuentos_aplicados,
-                            SUM(r.total) as ingresos_netos,
-                            AVG(r.total) as ticket_promedio,
-                            SUM(r.subtotal) - SUM(r.total) as descuentos_totales
-                        FROM recibo r
-                        JOIN pedido p ON r.id_pedido = p.id_pedido
-                        WHERE r.fecha >= CURRENT_DATE - INTERVAL '12 months'
-                        GROUP BY TO_CHAR(r.fecha, 'YYYY-MM')
-                        ORDER BY mes DESC
-                    """, fetchall=True)
-                    if rentabilidad_data and len(rentabilidad_data) > 0:
-                        df_rentabilidad = pd.DataFrame(rentabilidad_data, columns=[
-                            'Mes', 'Pedidos', 'Clientes', 'Subtotal (COP)', 'Descuentos (COP)', 
-                            'Ingresos Netos (COP)', 'Ticket Promedio (COP)', 'Total Desc. (COP)'
-                        ])
-                        df_rentabilidad.to_excel(writer, sheet_name='Rentabilidad Mensual', index=False)
-                        print("[Rentabilidad Mensual]")
-                except Exception as e:
-                    print(f"[Rentabilidad - Error: {e}]")
-
-                # Hoja 12: Recibos Detallados
-                try:
-                    recibos_data = run_query("""
-                        SELECT 
-                            r.id_recibo,
-                            r.id_pedido,
-                            c.nombre as cliente,
-                            r.fecha::date as fecha_emision,
-                            r.subtotal,
-                            r.descuento,
-                            r.total,
-                            r.metodo_pago,
-                            r.estado as estado_pago,
-                            p.estado as estado_pedido
-                        FROM recibo r
-                        JOIN pedido p ON r.id_pedido = p.id_pedido
-                        JOIN cliente c ON p.id_cliente = c.id_cliente
-                        ORDER BY r.fecha DESC
-                    """, fetchall=True)
-                    if recibos_data and len(recibos_data) > 0:
-                        df_recibos = pd.DataFrame(recibos_data, columns=[
-                            'ID Recibo', 'ID Pedido', 'Cliente', 'Fecha Emision', 
-                            'Subtotal (COP)', 'Descuento (COP)', 'Total (COP)', 
-                            'Metodo Pago', 'Estado Pago', 'Estado Pedido'
-                        ])
-                        df_recibos.to_excel(writer, sheet_name='Recibos Detallados', index=False)
-                        print("[Recibos Detallados]")
-                except Exception as e:
-                    print(f"[Recibos - Error: {e}]")
-
-                # Hoja 13: Clientes Inactivos
-                try:
-                    inactivos_data = run_query("""
-                        SELECT 
-                            c.nombre,
-                            c.email,
-                            c.telefono,
-                            COUNT(p.id_pedido) as total_pedidos,
-                            MAX(p.fecha_ingreso)::date as ultimo_pedido,
-                            EXTRACT(days FROM (CURRENT_DATE - MAX(p.fecha_ingreso))) as dias_inactivo,
-                            COALESCE(SUM(r.total), 0) as total_gastado
-                        FROM cliente c
-                        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
-                        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
-                        GROUP BY c.id_cliente, c.nombre, c.email, c.telefono
-                        HAVING MAX(p.fecha_ingreso) < CURRENT_DATE - INTERVAL '60 days' 
-                               OR MAX(p.fecha_ingreso) IS NULL
-                        ORDER BY dias_inactivo DESC NULLS FIRST
-                        LIMIT 100
-                    """, fetchall=True)
-                    if inactivos_data and len(inactivos_data) > 0:
-                        df_inactivos = pd.DataFrame(inactivos_data, columns=[
-                            'Nombre', 'Email', 'Telefono', 'Total Pedidos', 
-                            'Ultimo Pedido', 'Dias Inactivo', 'Total Gastado (COP)'
-                        ])
-                        df_inactivos.to_excel(writer, sheet_name='Clientes Inactivos', index=False)
-                        print("[Clientes Inactivos]")
-                except Exception as e:
-                    print(f"[Inactivos - Error: {e}]")
-
-                # Hoja 14: Analisis de Descuentos Aplicados
-                try:
-                    descuentos_data = run_query("""
-                        SELECT 
-                            c.nombre as cliente,
-                            COUNT(r.id_recibo) as pedidos_con_descuento,
-                            SUM(r.descuento) as total_descuentos,
-                            AVG(r.descuento) as descuento_promedio,
-                            SUM(r.subtotal) as subtotal_acumulado,
-                            SUM(r.total) as total_pagado,
-                            (SUM(r.descuento) / NULLIF(SUM(r.subtotal), 0) * 100) as porcentaje_desc_promedio
-                        FROM recibo r
-                        JOIN pedido p ON r.id_pedido = p.id_pedido
-                        JOIN cliente c ON p.id_cliente = c.id_cliente
-                        WHERE r.descuento > 0
-                        GROUP BY c.id_cliente, c.nombre
-                        ORDER BY total_descuentos DESC
-                        LIMIT 50
-                    """, fetchall=True)
-                    if descuentos_data and len(descuentos_data) > 0:
-                        df_descuentos = pd.DataFrame(descuentos_data, columns=[
-                            'Cliente', 'Pedidos con Descuento', 'Total Descuentos (COP)', 
-                            'Descuento Promedio (COP)', 'Subtotal Acumulado (COP)', 
-                            'Total Pagado (COP)', 'Porcentaje Desc. Promedio'
-                        ])
-                        df_descuentos['Porcentaje Desc. Promedio'] = df_descuentos['Porcentaje Desc. Promedio'].round(2)
-                        df_descuentos.to_excel(writer, sheet_name='Analisis Descuentos', index=False)
-                        print("[Analisis Descuentos]")
-                except Exception as e:
-                    print(f"[Descuentos - Error: {e}]")
-
-                # Hoja 15: Prendas Mas Rentables
-                try:
-                    rentables_data = run_query("""
-                        SELECT 
-                            pr.tipo,
-                            COUNT(*) as cantidad_procesada,
-                            COUNT(DISTINCT pr.id_pedido) as pedidos,
-                            CASE 
-                                WHEN pr.tipo = 'Camisa' THEN 5000
-                                WHEN pr.tipo = 'Pantalon' THEN 6000
-                                WHEN pr.tipo = 'Vestido' THEN 8000
-                                WHEN pr.tipo = 'Chaqueta' THEN 10000
-                                WHEN pr.tipo = 'Saco' THEN 7000
-                                WHEN pr.tipo = 'Falda' THEN 5500
-                                WHEN pr.tipo = 'Blusa' THEN 4500
-                                WHEN pr.tipo = 'Abrigo' THEN 12000
-                                WHEN pr.tipo = 'Sueter' THEN 6500
-                                WHEN pr.tipo = 'Jeans' THEN 7000
-                                WHEN pr.tipo = 'Corbata' THEN 3000
-                                WHEN pr.tipo = 'Bufanda' THEN 3500
-                                WHEN pr.tipo = 'Sabana' THEN 8000
-                                WHEN pr.tipo = 'Edredon' THEN 15000
-                                WHEN pr.tipo = 'Cortina' THEN 12000
-                                ELSE 5000
-                            END as precio_unitario,
-                            COUNT(*) * CASE 
-                                WHEN pr.tipo = 'Camisa' THEN 5000
-                                WHEN pr.tipo = 'Pantalon' THEN 6000
-                                WHEN pr.tipo = 'Vestido' THEN 8000
-                                WHEN pr.tipo = 'Chaqueta' THEN 10000
-                                WHEN pr.tipo = 'Saco' THEN 7000
-                                WHEN pr.tipo = 'Falda' THEN 5500
-                                WHEN pr.tipo = 'Blusa' THEN 4500
-                                WHEN pr.tipo = 'Abrigo' THEN 12000
-                                WHEN pr.tipo = 'Sueter' THEN 6500
-                                WHEN pr.tipo = 'Jeans' THEN 7000
-                                WHEN pr.tipo = 'Corbata' THEN 3000
-                                WHEN pr.tipo = 'Bufanda' THEN 3500
-                                WHEN pr.tipo = 'Sabana' THEN 8000
-                                WHEN pr.tipo = 'Edredon' THEN 15000
-                                WHEN pr.tipo = 'Cortina' THEN 12000
-                                ELSE 5000
-                            END as ingreso_estimado
-                        FROM prenda pr
-                        GROUP BY pr.tipo
-                        ORDER BY ingreso_estimado DESC
-                    """, fetchall=True)
-                    if rentables_data and len(rentables_data) > 0:
-                        df_rentables = pd.DataFrame(rentables_data, columns=[
-                            'Tipo Prenda', 'Cantidad Procesada', 'Pedidos', 
-                            'Precio Unitario (COP)', 'Ingreso Estimado (COP)'
-                        ])
-                        df_rentables.to_excel(writer, sheet_name='Prendas Rentables', index=False)
-                        print("[Prendas Rentables]")
-                except Exception as e:
-                    print(f"[Prendas Rentables - Error: {e}]")
-
-                # Hoja 16: Rendimiento por Dia de Semana
-                try:
-                    semana_data = run_query("""
-                        SELECT 
-                            CASE EXTRACT(dow FROM fecha_ingreso)
-                                WHEN 0 THEN 'Domingo'
-                                WHEN 1 THEN 'Lunes'
-                                WHEN 2 THEN 'Martes'
-                                WHEN 3 THEN 'Miercoles'
-                                WHEN 4 THEN 'Jueves'
-                                WHEN 5 THEN 'Viernes'
-                                WHEN 6 THEN 'Sabado'
-                            END as dia_semana,
-                            EXTRACT(dow FROM fecha_ingreso) as orden,
-                            COUNT(*) as pedidos,
-                            COUNT(DISTINCT id_cliente) as clientes_unicos,
-                            COALESCE(AVG((fecha_entrega - fecha_ingreso)::integer), 0) as dias_promedio_entrega
-                        FROM pedido
-                        GROUP BY EXTRACT(dow FROM fecha_ingreso)
-                        ORDER BY orden
-                    """, fetchall=True)
-                    if semana_data and len(semana_data) > 0:
-                        df_semana = pd.DataFrame(semana_data, columns=[
-                            'Dia Semana', 'Orden', 'Pedidos', 'Clientes Unicos', 'Dias Promedio Entrega'
-                        ])
-                        df_semana = df_semana.drop('Orden', axis=1)
-                        df_semana.to_excel(writer, sheet_name='Rendimiento x Dia', index=False)
-                        print("[Rendimiento por Dia]")
-                except Exception as e:
-                    print(f"[Rendimiento Dia - Error: {e}]")
-        except Exception as e:
-            print(f"[ERROR] export_excel fallo: {e}")
-            try:
-                from openpyxl import Workbook
-                output = BytesIO()
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "Resumen"
-                ws["A1"] = "Error"
-                ws["B1"] = f"No se pudo generar el Excel: {e}"
-                wb.save(output)
-                output.seek(0)
-                from flask import send_file
-                fecha_actual = datetime.now().strftime('%Y-%m-%d_%H-%M')
-                filename = f'Reportes_LaLavanderia_{fecha_actual}.xlsx'
-                return send_file(
-                    output,
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    as_attachment=True,
-                    download_name=filename
-                )
-            except Exception as fallback_error:
-                print(f"[ERROR] export_excel fallback fallo: {fallback_error}")
-                raise
-
-        print("Preparando descarga...")
-
-        # IMPORTANTE: seek DESPUES de cerrar el writer
-        output.seek(0)
-
-        # Preparar respuesta para descarga
-        from flask import send_file
-        fecha_actual = datetime.now().strftime('%Y-%m-%d_%H-%M')
-        filename = f'Reportes_LaLavanderia_{fecha_actual}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    except ImportError as e:
-        flash(f'❌ Error: Falta instalar dependencias (pandas/openpyxl). Contacta al administrador.', 'danger')
-        print(f"Error de importación en export_excel: {e}")
-        return redirect(url_for('admin.reportes'))
+        token = encolar_trabajo('excel_reportes', id_usuario=session.get('id_usuario'))
+        return redirect(url_for('utils.trabajo_estado', token=token))
     except Exception as e:
-        flash(f'❌ Error al generar archivo Excel: {str(e)}', 'danger')
+        flash(f'❌ Error al iniciar la exportación a Excel: {str(e)}', 'danger')
         print(f"Error en export_excel: {e}")
         return redirect(url_for('admin.reportes'))
 
@@ -2638,31 +1682,11 @@ def agregar_pedido():
         return redirect(url_for('auth.login'))
     
     # Obtener rol del usuario
-    usuario = run_query(
-        "SELECT rol FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
-    rol = usuario[0].strip().lower() if usuario else 'cliente'
+    identidad = usuario_actual()
+    rol = identidad['rol'] if identidad else 'cliente'
     
-    # Prendas predefinidas con precios estimados
-    prendas_default = [
-        {'nombre': 'Camisa', 'precio': 5000},
-        {'nombre': 'Pantalón', 'precio': 6000},
-        {'nombre': 'Vestido', 'precio': 8000},
-        {'nombre': 'Chaqueta', 'precio': 10000},
-        {'nombre': 'Saco', 'precio': 7000},
-        {'nombre': 'Falda', 'precio': 5500},
-        {'nombre': 'Blusa', 'precio': 4500},
-        {'nombre': 'Abrigo', 'precio': 12000},
-        {'nombre': 'Suéter', 'precio': 6500},
-        {'nombre': 'Jeans', 'precio': 7000},
-        {'nombre': 'Corbata', 'precio': 3000},
-        {'nombre': 'Bufanda', 'precio': 3500},
-        {'nombre': 'Sábana', 'precio': 8000},
-        {'nombre': 'Edredón', 'precio': 15000},
-        {'nombre': 'Cortina', 'precio': 12000}
-    ]
+    # Prendas predefinidas con precios estimados (catálogo precio_prenda)
+    prendas_default = catalogo_prendas()
     
     if request.method == 'POST':
         try:
@@ -2672,12 +1696,7 @@ def agregar_pedido():
             if rol == 'administrador':
                 id_cliente = request.form.get('id_cliente')
             else:
-                usuario_data = run_query(
-                    "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-                    {"u": username.lower()},
-                    fetchone=True
-                )
-                id_cliente = usuario_data[0] if usuario_data else None
+                id_cliente = id_usuario_actual()
             
             if not id_cliente:
                 flash('Error al identificar el cliente.', 'danger')
@@ -2696,10 +1715,7 @@ def agregar_pedido():
                 flash('⚠️ Debes ingresar una dirección de entrega válida (mínimo 10 caracteres).', 'warning')
                 return redirect(url_for('admin.agregar_pedido'))
             
-            # 2. Asegurar que existe en tabla cliente
-            ensure_cliente_exists(id_cliente)
-            
-            # 3. Obtener prendas
+            # 2. Obtener prendas
             tipos = request.form.getlist('tipo[]')
             cantidades = request.form.getlist('cantidad[]')
             descripciones = request.form.getlist('descripcion[]')
@@ -2714,83 +1730,21 @@ def agregar_pedido():
                 flash('Debes agregar al menos una prenda.', 'warning')
                 return redirect(url_for('admin.agregar_pedido'))
             
-            # 3.1 Crear directorio para fotos si no existe
+            # 2.1 Crear directorio para fotos si no existe
             fotos_dir = os.path.join('static', 'uploads', 'prendas')
             os.makedirs(fotos_dir, exist_ok=True)
             
-            # 4. Calcular fechas
+            # 3. Calcular fechas
             total_prendas = sum(int(c) for c in cantidades if c)
             dias_entrega = 3 if total_prendas <= 5 else (5 if total_prendas <= 15 else 7)
             fecha_ingreso = datetime.now().strftime('%Y-%m-%d')
             fecha_entrega = (datetime.now() + timedelta(days=dias_entrega)).strftime('%Y-%m-%d')
             
-            # 5. Crear pedido con código de barras y direcciones
-            # IMPORTANTE: Primero calcular el descuento ANTES de crear el pedido
-
-            # 5.1. Calcular descuento según ESQUEMA CONGELADO del cliente
-            pedidos_count = run_query(
-                "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado != 'Cancelado'",
-                {"id": id_cliente},
-                fetchone=True
-            )[0] or 0
-            
-            # Obtener esquema de descuento del cliente (congelado o actual)
-            esquema_cliente = obtener_esquema_descuento_cliente(id_cliente)
-            
-            # Determinar nivel y descuento basado en el esquema del cliente
-            descuento_porcentaje_aplicado = 0
-            nivel_descuento_aplicado = None
-            
-            for nivel_config in esquema_cliente:
-                min_pedidos = nivel_config.get("min", 0)
-                max_pedidos = nivel_config.get("max")
-                
-                if pedidos_count >= min_pedidos:
-                    if max_pedidos is None or pedidos_count <= max_pedidos:
-                        descuento_porcentaje_aplicado = nivel_config.get("porcentaje", 0)
-                        nivel_descuento_aplicado = nivel_config.get("nivel")
-                        break
-            
-            # 5.2. Crear el pedido (compatible con BD con o sin columnas de descuento)
-            try:
-                # Intentar con columnas de descuento (nueva estructura)
-                result = run_query(
-                    """INSERT INTO pedido (fecha_ingreso, fecha_entrega, estado, id_cliente, direccion_recogida, direccion_entrega, porcentaje_descuento, nivel_descuento) 
-                       VALUES (:fi, :fe, :e, :ic, :dr, :de, :pd, :nd) RETURNING id_pedido""",
-                    {"fi": fecha_ingreso, "fe": fecha_entrega, "e": "Pendiente", "ic": id_cliente, "dr": direccion_recogida, "de": direccion_entrega, "pd": descuento_porcentaje_aplicado, "nd": nivel_descuento_aplicado},
-                    commit=True,
-                    fetchone=True
-                )
-            except Exception as e:
-                # Si falla (columnas no existen), usar estructura antigua
-                if "porcentaje_descuento" in str(e) or "does not exist" in str(e):
-                    result = run_query(
-                        """INSERT INTO pedido (fecha_ingreso, fecha_entrega, estado, id_cliente, direccion_recogida, direccion_entrega) 
-                           VALUES (:fi, :fe, :e, :ic, :dr, :de) RETURNING id_pedido""",
-                        {"fi": fecha_ingreso, "fe": fecha_entrega, "e": "Pendiente", "ic": id_cliente, "dr": direccion_recogida, "de": direccion_entrega},
-                        commit=True,
-                        fetchone=True
-                    )
-                else:
-                    raise e
-            
-            if not result or len(result) == 0:
-                flash('Error al crear el pedido.', 'danger')
-                return redirect(url_for('admin.agregar_pedido'))
-            
-            id_pedido = result[0]
-            
-            # 5.1. Generar código de barras único (formato: LAV-YYYYMMDD-000001)
-            codigo_barras = f"LAV-{datetime.now().strftime('%Y%m%d')}-{id_pedido:06d}"
-            
-            # 5.2. Actualizar pedido con código de barras
-            run_query(
-                "UPDATE pedido SET codigo_barras = :cb WHERE id_pedido = :id",
-                {"cb": codigo_barras, "id": id_pedido},
-                commit=True
-            )
-            
-            # 6. Procesar prendas fila por fila (cada fila puede tener su foto)
+            # 4. Procesar prendas fila por fila (cada fila puede tener su foto).
+            #    Las fotos se guardan antes de abrir la transacción con un prefijo
+            #    único, porque el id del pedido aún no existe.
+            prefijo_fotos = uuid.uuid4().hex[:12]
+            fotos_guardadas = []
             prendas_a_insertar = []
             total_costo = 0
             
@@ -2819,21 +1773,15 @@ def agregar_pedido():
                     if not foto_file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
                         continue
                     
-                    # Generar nombre único para la foto
-                    filename = secure_filename(f"{id_pedido}_{i}_{foto_file.filename}")
-                    foto_path_rel = f"uploads/prendas/{filename}"
-                    foto_path_full = os.path.join('static', foto_path_rel)
-                    
-                    # Guardar archivo
-                    foto_file.save(foto_path_full)
-                    foto_path = foto_path_rel
+                    # Generar nombre único y guardar (el contenido debe ser una imagen válida)
+                    filename = secure_filename(f"{prefijo_fotos}_{i}_{foto_file.filename}")
+                    foto_path = guardar_foto_prenda(foto_file, filename)
+                    if not foto_path:
+                        continue
+                    fotos_guardadas.append(foto_path)
                 
                 # Buscar precio
-                precio = 5000  # default
-                for prenda_def in prendas_default:
-                    if prenda_def['nombre'] == tipo:
-                        precio = prenda_def['precio']
-                        break
+                precio = precio_de(tipo)
                 
                 prendas_a_insertar.append({
                     'tipo': tipo,
@@ -2850,39 +1798,38 @@ def agregar_pedido():
                 flash('Debes agregar al menos una prenda con cantidad mayor a 0.', 'warning')
                 return redirect(url_for('admin.agregar_pedido'))
             
-            # 7. Insertar prendas en la base de datos
-            prendas_insertadas = 0
-            
-            for prenda in prendas_a_insertar:
-                tipo = prenda['tipo']
-                cantidad = prenda['cantidad']
-                descripcion = prenda['descripcion']
-                foto = prenda['foto']
-                
-                for unidad in range(cantidad):
-                    run_query(
-                        "INSERT INTO prenda (tipo, descripcion, observaciones, foto, id_pedido) VALUES (:tipo, :desc, :obs, :foto, :id_ped)",
-                        {"tipo": tipo, "desc": descripcion, "obs": '', "foto": foto, "id_ped": id_pedido},
-                        commit=True
-                    )
-                    prendas_insertadas += 1
+            # 5. Crear cliente (si falta), pedido con código de barras, prendas y
+            #    recibo en una sola transacción
+            try:
+                pedido_creado = crear_pedido(
+                    id_cliente,
+                    prendas_a_insertar,
+                    fecha_ingreso,
+                    fecha_entrega,
+                    direccion_recogida,
+                    direccion_entrega
+                )
+            except Exception:
+                # La transacción se revirtió: no dejar fotos huérfanas
+                for foto_guardada in fotos_guardadas:
+                    try:
+                        os.remove(os.path.join('static', foto_guardada))
+                    except OSError:
+                        pass
+                raise
             
-            # 8. Usar el descuento ya guardado en el pedido (no recalcular)
-            # El descuento ya está en descuento_porcentaje_aplicado y nivel_descuento_aplicado
-
-            # Calcular monto con descuento
-            monto_descuento = (total_costo * descuento_porcentaje_aplicado) / 100
-            monto_final = total_costo - monto_descuento
+            # Orientación, re-codificación y miniaturas de las fotos, fuera de la petición
+            programar_fotos(fotos_guardadas)
             
-            # 9. Crear recibo con descuento
-            run_query(
-                """INSERT INTO recibo (id_pedido, id_cliente, monto, fecha) 
-                   VALUES (:ip, :ic, :m, CURRENT_TIMESTAMP)""",
-                {"ip": id_pedido, "ic": id_cliente, "m": monto_final},
-                commit=True
-            )
+            id_pedido = pedido_creado['id_pedido']
+            codigo_barras = pedido_creado['codigo_barras']
+            prendas_insertadas = pedido_creado['total_prendas']
+            descuento_porcentaje_aplicado = pedido_creado['porcentaje_descuento']
+            nivel_descuento_aplicado = pedido_creado['nivel_descuento']
+            monto_descuento = pedido_creado['monto_descuento']
+            monto_final = pedido_creado['total']
             
-            # 10. Obtener datos del cliente para el flash
+            # 6. Obtener datos del cliente para el flash
             cliente_data = run_query(
                 """
                 SELECT COALESCE(NULLIF(c.nombre, ''), u.nombre, 'Cliente') AS nombre_cliente,
@@ -2952,20 +1899,9 @@ def agregar_pedido():
                 # Generar imagen PNG del código de barras para adjuntar al correo
                 email_attachments = []
                 try:
-                    code128 = barcode.get_barcode_class('code128')
-                    barcode_instance = code128(codigo_barras, writer=ImageWriter())
-                    barcode_buffer = BytesIO()
-                    barcode_instance.write(barcode_buffer, options={
-                        'module_width': 0.3,
-                        'module_height': 10.0,
-                        'quiet_zone': 2.0,
-                        'font_size': 10,
-                        'text_distance': 3.0,
-                        'write_text': True
-                    })
                     email_attachments.append({
                         'filename': f'barcode_{codigo_barras}.png',
-                        'content_bytes': barcode_buffer.getvalue(),
+                        'content_bytes': png_codigo_barras(codigo_barras),
                         'mime_type': 'image/png',
                         'disposition': 'attachment'
                     })
@@ -3005,28 +1941,12 @@ def agregar_pedido():
     # Obtener información de descuento del cliente actual si no es admin
     descuento_info = None
     if rol != 'administrador':
-        usuario_data = run_query(
-            "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-            {"u": username.lower()},
-            fetchone=True
-        )
-        if usuario_data:
-            id_cliente = usuario_data[0]
-            pedidos_count = run_query(
-                "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado != 'Cancelado'",
-                {"id": id_cliente},
-                fetchone=True
-            )[0] or 0
-
-            pedidos_en_ciclo = pedidos_count % 10
-            if pedidos_en_ciclo == 0 and pedidos_count > 0:
-                descuento_info = {"nivel": "Oro", "porcentaje": 15, "pedidos": pedidos_count}
-            elif pedidos_en_ciclo >= 6:
-                descuento_info = {"nivel": "Plata", "porcentaje": 10, "pedidos": pedidos_count}
-            elif pedidos_en_ciclo >= 3:
-                descuento_info = {"nivel": "Bronce", "porcentaje": 5, "pedidos": pedidos_count}
-            else:
-                descuento_info = {"nivel": "Sin nivel", "porcentaje": 0, "pedidos": pedidos_count}
+        id_cliente = id_usuario_actual()
+        if id_cliente:
+            lealtad = obtener_lealtad(id_cliente)
+            descuento_info = {"nivel": lealtad["nivel"] or "Sin nivel",
+                              "porcentaje": lealtad["porcentaje"],
+                              "pedidos": lealtad["pedidos"]}
 
     return render_template('agregar_pedido.html',
                          clientes=clientes,
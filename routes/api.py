@@ -2,10 +2,16 @@
 Blueprint de API
 API REST endpoints
 """
-from flask import Blueprint, request, session, jsonify
+from flask import Blueprint, request, session, jsonify, url_for, make_response
 from models import run_query
 from decorators import login_requerido, admin_requerido
-from helpers import crear_notificacion
+from helpers import crear_notificacion, admin_only, id_usuario_actual
+from services.precio_service import sql_join_precio, sql_precio, PRECIO_PRENDA_POR_DEFECTO
+from services.trabajos_service import obtener_trabajo, puede_ver_trabajo, ESTADO_COMPLETADO
+from services.busqueda_service import buscar_clientes
+from services.autocompletado_service import obtener_indice
+from services.notificacion_service import esperar_notificacion, contador_notificaciones
+from services.foto_service import miniatura
 
 bp = Blueprint('api', __name__)
 
@@ -34,39 +40,19 @@ def api_prendas_pedido(id_pedido):
         return jsonify({'error': 'Pedido no encontrado'}), 404
     
     if rol != 'administrador':
-        usuario = run_query(
-            "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-            {"u": username.lower()},
-            fetchone=True
-        )
-        if usuario[0] != pedido[0]:
+        if id_usuario_actual() != pedido[0]:
             return jsonify({'error': 'Acceso denegado'}), 403
     
     # Obtener prendas individuales para poder incluir las fotos
-    prendas_data = run_query("""
+    prendas_data = run_query(f"""
         SELECT 
             p.tipo,
             p.descripcion,
             p.foto,
-            CASE p.tipo
-                WHEN 'Camisa' THEN 5000
-                WHEN 'Pantalón' THEN 6000
-                WHEN 'Vestido' THEN 8000
-                WHEN 'Chaqueta' THEN 10000
-                WHEN 'Saco' THEN 7000
-                WHEN 'Falda' THEN 5500
-                WHEN 'Blusa' THEN 4500
-                WHEN 'Abrigo' THEN 12000
-                WHEN 'Suéter' THEN 6500
-                WHEN 'Jeans' THEN 7000
-                WHEN 'Corbata' THEN 3000
-                WHEN 'Bufanda' THEN 3500
-                WHEN 'Sábana' THEN 8000
-                WHEN 'Edredón' THEN 15000
-                WHEN 'Cortina' THEN 12000
-                ELSE 5000
-            END as precio
+            p.cantidad,
+            {sql_precio()} as precio
         FROM prenda p
+        {sql_join_precio('p.tipo')}
         WHERE p.id_pedido = :id
         ORDER BY p.id_prenda
     """, {"id": id_pedido}, fetchall=True)
@@ -76,13 +62,15 @@ def api_prendas_pedido(id_pedido):
         tipo = prenda[0]
         descripcion = prenda[1] or ''
         foto = prenda[2] or ''
-        precio = float(prenda[3]) if prenda[3] else 5000
+        cantidad = prenda[3] or 1
+        precio = float(prenda[4]) if prenda[4] else PRECIO_PRENDA_POR_DEFECTO
         prendas.append({
             'tipo': tipo,
-            'cantidad': 1,
+            'cantidad': cantidad,
             'descripcion': descripcion,
             'precio': precio,
-            'fotos': [foto] if foto else []
+            'fotos': [foto] if foto else [],
+            'miniaturas': [miniatura(foto)] if foto else []
         })
     
     return jsonify({'prendas': prendas})
@@ -102,20 +90,17 @@ def api_autocomplete_clientes():
     if not query or len(query) < 2:
         return jsonify([])
     
-    # Buscar clientes que coincidan con el query
-    clientes = run_query("""
-        SELECT id_usuario, nombre, email, username
-        FROM usuario
-        WHERE rol = 'cliente' 
-        AND (
-            LOWER(nombre) LIKE LOWER(:q) OR
-            LOWER(email) LIKE LOWER(:q) OR
-            LOWER(username) LIKE LOWER(:q) OR
-            CAST(id_usuario AS TEXT) LIKE :q
-        )
-        ORDER BY nombre
-        LIMIT 10
-    """, {"q": f"%{query}%"}, fetchall=True)
+    # Índice en memoria del proceso; si está desactivado o falla, consulta SQL
+    # con los índices de búsqueda
+    clientes = None
+    try:
+        indice = obtener_indice()
+        if indice is not None:
+            clientes = indice.buscar(query, limite=10)
+    except Exception as e:
+        print(f"[WARN] Índice de autocompletado no disponible: {e}")
+    if clientes is None:
+        clientes = buscar_clientes(query, limite=10)
     
     resultados = []
     for cliente in clientes:
@@ -163,17 +148,20 @@ def api_notificaciones():
     if not username:
         return jsonify({'error': 'No autorizado'}), 401
     
-    # Obtener id_usuario
-    usuario = run_query(
-        "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
+    id_usuario = id_usuario_actual()
     
-    if not usuario:
+    if not id_usuario:
         return jsonify({'error': 'Usuario no encontrado'}), 404
     
-    id_usuario = usuario[0]
+    # La versión de notificacion_contador cambia con cada notificación nueva o
+    # leída: si el navegador ya tiene esa versión se responde 304 sin cuerpo
+    contador = contador_notificaciones(id_usuario)
+    etag = f"n{id_usuario}-{contador[1]}" if contador else None
+    if etag and request.if_none_match.contains(etag):
+        respuesta = make_response('', 304)
+        respuesta.set_etag(etag)
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+        return respuesta
     
     # Obtener notificaciones (últimas 20, ordenadas por fecha)
     notificaciones = run_query("""
@@ -198,7 +186,26 @@ def api_notificaciones():
             'fecha': n[6].isoformat() if n[6] else None
         })
     
-    return jsonify(resultado)
+    respuesta = jsonify(resultado)
+    if etag:
+        respuesta.set_etag(etag)
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+
+@bp.route('/api/notificaciones/esperar')
+@login_requerido
+def api_notificaciones_esperar():
+    """
+    Long-poll: responde cuando el usuario tiene una notificación con id mayor
+    que ?ultimo= o al vencer la espera (ver services/notificacion_service.py).
+    """
+    id_usuario = id_usuario_actual()
+    if not id_usuario:
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    ultimo = request.args.get('ultimo', 0, type=int)
+    return jsonify(esperar_notificacion(id_usuario, ultimo))
 
 
 @bp.route('/api/notificaciones/no-leidas')
@@ -209,21 +216,19 @@ def api_notificaciones_no_leidas():
     if not username:
         return jsonify({'count': 0})
     
-    usuario = run_query(
-        "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
+    id_usuario = id_usuario_actual()
     
-    if not usuario:
+    if not id_usuario:
         return jsonify({'count': 0})
     
-    id_usuario = usuario[0]
-    
-    count = run_query("""
-        SELECT COUNT(*) FROM notificacion
-        WHERE id_usuario = :id AND leida = FALSE
-    """, {"id": id_usuario}, fetchone=True)[0] or 0
+    contador = contador_notificaciones(id_usuario)
+    if contador:
+        count = contador[0]
+    else:
+        count = run_query("""
+            SELECT COUNT(*) FROM notificacion
+            WHERE id_usuario = :id AND leida = FALSE
+        """, {"id": id_usuario}, fetchone=True)[0] or 0
     
     return jsonify({'count': count})
 
@@ -236,22 +241,16 @@ def api_marcar_notificacion_leida(id_notificacion):
     if not username:
         return jsonify({'error': 'No autorizado'}), 401
     
-    usuario = run_query(
-        "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
+    id_usuario = id_usuario_actual()
     
-    if not usuario:
+    if not id_usuario:
         return jsonify({'error': 'Usuario no encontrado'}), 404
     
-    id_usuario = usuario[0]
-    
     # Marcar como leída solo si pertenece al usuario
     run_query("""
         UPDATE notificacion
         SET leida = TRUE
-        WHERE id_notificacion = :id AND id_usuario = :id_usuario
+        WHERE id_notificacion = :id AND id_usuario = :id_usuario AND leida = FALSE
     """, {"id": id_notificacion, "id_usuario": id_usuario}, commit=True)
     
     return jsonify({'success': True})
@@ -265,17 +264,11 @@ def api_marcar_todas_leidas():
     if not username:
         return jsonify({'error': 'No autorizado'}), 401
     
-    usuario = run_query(
-        "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
+    id_usuario = id_usuario_actual()
     
-    if not usuario:
+    if not id_usuario:
         return jsonify({'error': 'Usuario no encontrado'}), 404
     
-    id_usuario = usuario[0]
-    
     run_query("""
         UPDATE notificacion
         SET leida = TRUE
@@ -283,3 +276,26 @@ def api_marcar_todas_leidas():
     """, {"id": id_usuario}, commit=True)
     
     return jsonify({'success': True})
+
+
+# -----------------------------------------------
+# API: ESTADO DE TRABAJOS EN SEGUNDO PLANO
+# -----------------------------------------------
+@bp.route('/api/trabajos/<token>')
+def api_trabajo_estado(token):
+    """Estado de un trabajo (exportación / recibo) para consultar desde el navegador."""
+    trabajo = obtener_trabajo(token)
+    if not trabajo or not puede_ver_trabajo(trabajo, session.get('id_usuario'), admin_only()):
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    
+    respuesta = {
+        'token': trabajo['token'],
+        'tipo': trabajo['tipo'],
+        'estado': trabajo['estado'],
+        'error': trabajo['error'],
+        'fecha_creacion': trabajo['fecha_creacion'].isoformat() if trabajo['fecha_creacion'] else None,
+        'fecha_fin': trabajo['fecha_fin'].isoformat() if trabajo['fecha_fin'] else None,
+    }
+    if trabajo['estado'] == ESTADO_COMPLETADO:
+        respuesta['url_descarga'] = url_for('utils.trabajo_descargar', token=token)
+    return jsonify(respuesta)
@@ -9,6 +9,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from models import run_query
 from services import limpiar_texto, validar_email, validar_contrasena, send_email_async
+from services.autocompletado_service import actualizar_cliente_indice
 from decorators import login_requerido
 
 bp = Blueprint('auth', __name__)
@@ -208,6 +209,7 @@ def registro():
                     },
                     commit=True
                 )
+                actualizar_cliente_indice(id_usuario, nombre, email, username)
                 
                 # Enviar correo de bienvenida (asíncrono)
                 html_bienvenida = f"""
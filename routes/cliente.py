@@ -7,8 +7,10 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from werkzeug.security import generate_password_hash, check_password_hash
 from models import run_query, ensure_cliente_exists
 from services import limpiar_texto, validar_email, validar_contrasena, send_email_async
+from services.conteo_service import en_cache, GRUPO_PEDIDO
+from services.lealtad_service import obtener_lealtad
 from decorators import login_requerido, admin_requerido
-from helpers import admin_only, obtener_esquema_descuento_cliente, ejecutar_sql_file, get_safe_redirect
+from helpers import admin_only, id_usuario_actual, obtener_esquema_descuento_cliente, ejecutar_sql_file, get_safe_redirect
 import datetime
 
 bp = Blueprint('cliente', __name__)
@@ -251,58 +253,18 @@ def cliente_inicio():
     if not username:
         return redirect(url_for('auth.login'))
     
-    # Obtener id_usuario (case-insensitive)
-    usuario = run_query(
-        "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
-    if not usuario:
+    # Obtener id_usuario del usuario en sesión
+    id_cliente = id_usuario_actual()
+    if not id_cliente:
         return redirect(url_for('auth.login'))
     
-    id_cliente = usuario[0]
-    
-    # Contar todos los pedidos del cliente (excepto cancelados)
-    pedidos_count = run_query(
-        "SELECT COUNT(*) FROM pedido WHERE id_cliente = :ic AND estado != 'Cancelado'",
-        {"ic": id_cliente},
-        fetchone=True
-    )[0]
-    
-    # Calcular nivel de descuento segun esquema configurado
-    esquema_cliente = obtener_esquema_descuento_cliente(id_cliente)
-    nivel = None
-    descuento_porcentaje = 0
-    siguiente_nivel = None
-    pedidos_faltantes = 0
-
-    for i, nivel_config in enumerate(esquema_cliente):
-        min_ped = nivel_config.get("min", 0)
-        max_ped = nivel_config.get("max")
-
-        if pedidos_count >= min_ped and (max_ped is None or pedidos_count <= max_ped):
-            nivel = nivel_config.get("nivel")
-            descuento_porcentaje = nivel_config.get("porcentaje", 0)
-
-            if i + 1 < len(esquema_cliente):
-                siguiente_nivel = esquema_cliente[i + 1].get("nivel")
-                pedidos_faltantes = esquema_cliente[i + 1].get("min") - pedidos_count
-                if pedidos_faltantes < 0:
-                    pedidos_faltantes = 0
-            else:
-                siguiente_nivel = None
-                pedidos_faltantes = 0
-            break
-
-    if not nivel and esquema_cliente:
-        primer_nivel = esquema_cliente[0]
-        nivel = "Sin nivel"
-        descuento_porcentaje = 0
-        siguiente_nivel = primer_nivel.get("nivel")
-        pedidos_faltantes = primer_nivel.get("min", 0) - pedidos_count
-        if pedidos_faltantes < 0:
-            pedidos_faltantes = 0
-
+    # Nivel de descuento precalculado (cliente_lealtad)
+    lealtad = obtener_lealtad(id_cliente)
+    pedidos_count = lealtad["pedidos"]
+    nivel = lealtad["nivel"]
+    descuento_porcentaje = lealtad["porcentaje"]
+    siguiente_nivel = lealtad["siguiente_nivel"]
+    pedidos_faltantes = lealtad["pedidos_faltantes"]
 
     iconos = {
         "Bronce": "🥉",
@@ -314,15 +276,26 @@ def cliente_inicio():
     icono = iconos.get(nivel, "⭐")
     
     # Obtener últimos 3 pedidos
-    ultimos_pedidos = run_query("""
-        SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado,
-               (SELECT COUNT(*) FROM prenda WHERE id_pedido = p.id_pedido) as cantidad_prendas,
-               ROW_NUMBER() OVER (PARTITION BY p.id_cliente ORDER BY p.fecha_ingreso ASC) as numero_pedido_cliente
-        FROM pedido p
-        WHERE p.id_cliente = :ic
-        ORDER BY p.fecha_ingreso DESC
-        LIMIT 3
-    """, {"ic": id_cliente}, fetchall=True)
+    try:
+        ultimos_pedidos = run_query("""
+            SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado,
+                   p.total_prendas as cantidad_prendas,
+                   ROW_NUMBER() OVER (PARTITION BY p.id_cliente ORDER BY p.fecha_ingreso ASC) as numero_pedido_cliente
+            FROM pedido p
+            WHERE p.id_cliente = :ic
+            ORDER BY p.fecha_ingreso DESC
+            LIMIT 3
+        """, {"ic": id_cliente}, fetchall=True)
+    except Exception:
+        ultimos_pedidos = run_query("""
+            SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado,
+                   (SELECT COALESCE(SUM(cantidad), 0) FROM prenda WHERE id_pedido = p.id_pedido) as cantidad_prendas,
+                   ROW_NUMBER() OVER (PARTITION BY p.id_cliente ORDER BY p.fecha_ingreso ASC) as numero_pedido_cliente
+            FROM pedido p
+            WHERE p.id_cliente = :ic
+            ORDER BY p.fecha_ingreso DESC
+            LIMIT 3
+        """, {"ic": id_cliente}, fetchall=True)
     
     # Calcular dinero ahorrado con descuentos
     recibos = run_query("""
@@ -333,16 +306,24 @@ def cliente_inicio():
     total_gastado = sum(float(r[0]) if r[0] else 0 for r in recibos)
     total_recibos = len(recibos)
     
-    # Estimar dinero ahorrado (si cada prenda cuesta 5000)
-    # Este es un cálculo aproximado, en producción sería mejor guardarlo en BD
-    PRICE_PER_PRENDA = 5000
-    prendas_totales = run_query(
-        "SELECT COUNT(*) FROM prenda WHERE id_pedido IN (SELECT id_pedido FROM pedido WHERE id_cliente = :ic)",
-        {"ic": id_cliente},
-        fetchone=True
-    )[0]
-    
-    monto_sin_descuentos = prendas_totales * PRICE_PER_PRENDA
+    # Dinero ahorrado: subtotal guardado de cada pedido (precio sin descuento)
+    try:
+        totales = run_query(
+            "SELECT COALESCE(SUM(subtotal), 0), COALESCE(SUM(total_prendas), 0) FROM pedido WHERE id_cliente = :ic",
+            {"ic": id_cliente},
+            fetchone=True
+        )
+        monto_sin_descuentos = float(totales[0])
+        prendas_totales = int(totales[1])
+    except Exception:
+        # Sin la migración: estimación aproximada (si cada prenda cuesta 5000)
+        PRICE_PER_PRENDA = 5000
+        prendas_totales = run_query(
+            "SELECT COALESCE(SUM(cantidad), 0) FROM prenda WHERE id_pedido IN (SELECT id_pedido FROM pedido WHERE id_cliente = :ic)",
+            {"ic": id_cliente},
+            fetchone=True
+        )[0]
+        monto_sin_descuentos = prendas_totales * PRICE_PER_PRENDA
     dinero_ahorrado = monto_sin_descuentos - total_gastado if total_gastado > 0 else 0
     
     return render_template('cliente_inicio.html',
@@ -404,26 +385,13 @@ def cliente_promociones():
         flash("No se pudo identificar al usuario.", "danger")
         return redirect(url_for('auth.login'))
     
-    # Obtener id_usuario del cliente (case-insensitive)
-    usuario = run_query(
-        "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
+    # Obtener id_usuario del cliente en sesión
+    id_usuario = id_usuario_actual()
     
-    if not usuario:
+    if not id_usuario:
         flash("Usuario no encontrado.", "danger")
         return redirect(url_for('auth.login'))
     
-    id_usuario = usuario[0]
-    
-    # Contar todos los pedidos del cliente (excepto cancelados)
-    pedidos_count = run_query(
-        "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado != 'Cancelado'",
-        {"id": id_usuario},
-        fetchone=True
-    )[0] or 0
-    
     # Obtener esquema de descuento del cliente (congelado o actual)
     esquema_cliente = obtener_esquema_descuento_cliente(id_usuario)
     
@@ -439,50 +407,14 @@ def cliente_promociones():
         tiene_esquema_congelado = False
         fecha_inicio_esquema = None
     
-    # Determinar nivel actual del cliente según su esquema
-    nivel_actual = None
-    descuento_actual = 0
-    progreso = 0
-    siguiente_nivel = None
-    pedidos_faltantes = 0
-    
-    for i, nivel_config in enumerate(esquema_cliente):
-        min_ped = nivel_config.get("min", 0)
-        max_ped = nivel_config.get("max")
-        
-        if pedidos_count >= min_ped and (max_ped is None or pedidos_count <= max_ped):
-            nivel_actual = nivel_config.get("nivel")
-            descuento_actual = nivel_config.get("porcentaje", 0)
-            
-            # Calcular progreso
-            if max_ped is not None:
-                rango = max_ped - min_ped + 1
-                en_nivel = pedidos_count - min_ped
-                progreso = (en_nivel / rango) * 100
-                
-                # Siguiente nivel
-                if i + 1 < len(esquema_cliente):
-                    siguiente_nivel = esquema_cliente[i + 1].get("nivel")
-                    pedidos_faltantes = esquema_cliente[i + 1].get("min") - pedidos_count
-                else:
-                    siguiente_nivel = "Máximo nivel"
-                    pedidos_faltantes = 0
-            else:
-                progreso = 100
-                siguiente_nivel = "Máximo nivel"
-                pedidos_faltantes = 0
-            break
-    
-    if not nivel_actual and esquema_cliente:
-        # Aún no alcanza el primer nivel
-        primer_nivel = esquema_cliente[0]
-        nivel_actual = "Sin nivel"
-        descuento_actual = 0
-        siguiente_nivel = primer_nivel.get("nivel")
-        pedidos_faltantes = primer_nivel.get("min", 0) - pedidos_count
-        if pedidos_faltantes < 0:
-            pedidos_faltantes = 0
-        progreso = (pedidos_count / primer_nivel.get("min", 1)) * 100 if primer_nivel.get("min", 0) > 0 else 0
+    # Nivel actual del cliente según su esquema (precalculado en cliente_lealtad)
+    lealtad = obtener_lealtad(id_usuario)
+    pedidos_count = lealtad["pedidos"]
+    nivel_actual = lealtad["nivel"]
+    descuento_actual = lealtad["porcentaje"]
+    progreso = lealtad["progreso"]
+    siguiente_nivel = lealtad["siguiente_nivel"] or "Máximo nivel"
+    pedidos_faltantes = lealtad["pedidos_faltantes"]
     
     # Iconos por nivel
     iconos = {
@@ -519,18 +451,12 @@ def cliente_pedidos():
         flash("No se pudo identificar al usuario.", "danger")
         return redirect(url_for('auth.login'))
     
-    # Obtener id_usuario (case-insensitive)
-    usuario = run_query(
-        "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-        {"u": username.lower()},
-        fetchone=True
-    )
+    # Obtener id_usuario del usuario en sesión
+    id_usuario = id_usuario_actual()
     
-    if not usuario:
+    if not id_usuario:
         flash("Usuario no encontrado.", "danger")
         return redirect(url_for('auth.login'))
-    
-    id_usuario = usuario[0]
 
     # Parámetros de paginación
     pagina = request.args.get('pagina', 1, type=int)
@@ -540,48 +466,54 @@ def cliente_pedidos():
     por_pagina = 10  # Mostrar 10 pedidos por página
     offset = (pagina - 1) * por_pagina
 
-    # Contar total de pedidos
-    total_count = run_query(
-        "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id",
+    # Pedidos por estado en una sola consulta, cacheada hasta el próximo cambio en pedido
+    por_estado = en_cache(GRUPO_PEDIDO, ('estados_cliente', id_usuario), lambda: dict(run_query(
+        "SELECT estado, COUNT(*) FROM pedido WHERE id_cliente = :id GROUP BY estado",
         {"id": id_usuario},
-        fetchone=True
-    )[0]
+        fetchall=True
+    ) or []))
+    total_count = sum(por_estado.values())
 
     # Obtener pedidos con conteo de prendas (con paginación)
-    pedidos = run_query("""
-        SELECT 
-            p.id_pedido, 
-            p.fecha_ingreso, 
-            p.fecha_entrega, 
-            p.estado,
-            COUNT(pr.id_prenda) as total_prendas,
-            ROW_NUMBER() OVER (ORDER BY p.fecha_ingreso ASC) as numero_pedido_cliente
-        FROM pedido p
-        LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
-        WHERE p.id_cliente = :id
-        GROUP BY p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado
-        ORDER BY p.fecha_ingreso DESC
-        LIMIT :limit OFFSET :offset
-    """, {"id": id_usuario, "limit": por_pagina, "offset": offset}, fetchall=True)
+    try:
+        # total_prendas guardado en pedido (ver migrations/add_totales_to_pedido.sql)
+        pedidos = run_query("""
+            SELECT 
+                p.id_pedido, 
+                p.fecha_ingreso, 
+                p.fecha_entrega, 
+                p.estado,
+                p.total_prendas,
+                ROW_NUMBER() OVER (ORDER BY p.fecha_ingreso ASC) as numero_pedido_cliente
+            FROM pedido p
+            WHERE p.id_cliente = :id
+            ORDER BY p.fecha_ingreso DESC
+            LIMIT :limit OFFSET :offset
+        """, {"id": id_usuario, "limit": por_pagina, "offset": offset}, fetchall=True)
+    except Exception:
+        # Si la migración aún no se aplicó, contar desde prenda
+        pedidos = run_query("""
+            SELECT 
+                p.id_pedido, 
+                p.fecha_ingreso, 
+                p.fecha_entrega, 
+                p.estado,
+                COALESCE(SUM(pr.cantidad), 0) as total_prendas,
+                ROW_NUMBER() OVER (ORDER BY p.fecha_ingreso ASC) as numero_pedido_cliente
+            FROM pedido p
+            LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
+            WHERE p.id_cliente = :id
+            GROUP BY p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado
+            ORDER BY p.fecha_ingreso DESC
+            LIMIT :limit OFFSET :offset
+        """, {"id": id_usuario, "limit": por_pagina, "offset": offset}, fetchall=True)
     
     # Estadísticas del cliente
     stats = {
         'total_pedidos': total_count,
-        'pendientes': run_query(
-            "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado = 'Pendiente'",
-            {"id": id_usuario},
-            fetchone=True
-        )[0],
-        'en_proceso': run_query(
-            "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado = 'En proceso'",
-            {"id": id_usuario},
-            fetchone=True
-        )[0],
-        'completados': run_query(
-            "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado = 'Completado'",
-            {"id": id_usuario},
-            fetchone=True
-        )[0]
+        'pendientes': por_estado.get('Pendiente', 0),
+        'en_proceso': por_estado.get('En proceso', 0),
+        'completados': por_estado.get('Completado', 0)
     }
 
     # Calcular paginación
@@ -2,23 +2,21 @@
 Blueprint de utils
 Utilidades (barcode, PDF, etc.)
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, Response, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, Response, jsonify, make_response
 from werkzeug.security import generate_password_hash
 from models import run_query, ensure_cliente_exists
 from services import limpiar_texto, validar_email, send_email_async
+from services.precio_service import sql_join_precio, sql_precio
+from services.codigo_barras_service import imagen_codigo_barras, clave_codigo_barras, CACHE_CONTROL, FORMATOS
+from services.recibo_service import recibo_en_cache
+from services.trabajos_service import encolar_trabajo, obtener_trabajo, puede_ver_trabajo, ESTADO_COMPLETADO, ESTADO_ERROR
 from decorators import login_requerido, admin_requerido
-from helpers import admin_only, obtener_esquema_descuento_cliente, ejecutar_sql_file, get_safe_redirect
+from helpers import admin_only, id_usuario_actual, obtener_esquema_descuento_cliente, ejecutar_sql_file, get_safe_redirect
 from io import BytesIO
 import pandas as pd
 import datetime
+import gzip
 import os
-import barcode
-from barcode.writer import ImageWriter
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib import colors
 from pyzbar.pyzbar import decode
 from PIL import Image as PILImage
 import cv2
@@ -133,7 +131,7 @@ def lector_barcode():
             # Obtener prendas del pedido
             try:
                 prendas = run_query("""
-                    SELECT tipo, descripcion, observaciones, foto
+                    SELECT tipo, descripcion, observaciones, foto, cantidad
                     FROM prenda
                     WHERE id_pedido = :id
                 """, {"id": pedido[0]}, fetchall=True)
@@ -182,6 +180,7 @@ def lector_barcode():
                         'tipo': p[0],
                         'descripcion': p[1] or '',
                         'observaciones': p[2] or '',
+                        'cantidad': p[4] or 1,
                         'foto': url_for('static', filename=foto_path) if foto_path else ''
                     })
 
@@ -308,43 +307,23 @@ def ver_prendas_pedido(id_pedido):
     
     # Verificar permisos (cliente solo ve sus propios pedidos, admin ve todos)
     if rol != 'administrador':
-        usuario = run_query(
-            "SELECT id_usuario FROM usuario WHERE LOWER(username) = :u",
-            {"u": username.lower()},
-            fetchone=True
-        )
-        if usuario[0] != pedido[1]:
+        if id_usuario_actual() != pedido[1]:
             flash("No tienes acceso a este pedido.", "danger")
             return redirect(url_for('cliente.cliente_pedidos'))
     
     # Obtener prendas individuales para poder incluir fotos
-    prendas = run_query("""
+    prendas = run_query(f"""
         SELECT 
-            tipo,
-            descripcion,
-            observaciones,
-            foto,
-            CASE tipo
-                WHEN 'Camisa' THEN 5000
-                WHEN 'Pantalón' THEN 6000
-                WHEN 'Vestido' THEN 8000
-                WHEN 'Chaqueta' THEN 10000
-                WHEN 'Saco' THEN 7000
-                WHEN 'Falda' THEN 5500
-                WHEN 'Blusa' THEN 4500
-                WHEN 'Abrigo' THEN 12000
-                WHEN 'Suéter' THEN 6500
-                WHEN 'Jeans' THEN 7000
-                WHEN 'Corbata' THEN 3000
-                WHEN 'Bufanda' THEN 3500
-                WHEN 'Sábana' THEN 8000
-                WHEN 'Edredón' THEN 15000
-                WHEN 'Cortina' THEN 12000
-                ELSE 5000
-            END as precio
-        FROM prenda
-        WHERE id_pedido = :id
-        ORDER BY id_prenda
+            pr.tipo,
+            pr.descripcion,
+            pr.observaciones,
+            pr.foto,
+            pr.cantidad,
+            {sql_precio()} as precio
+        FROM prenda pr
+        {sql_join_precio('pr.tipo')}
+        WHERE pr.id_pedido = :id
+        ORDER BY pr.id_prenda
     """, {"id": id_pedido}, fetchall=True)
     
     # Preparar lista de prendas individuales
@@ -356,13 +335,14 @@ def ver_prendas_pedido(id_pedido):
         descripcion = prenda[1]
         observaciones = prenda[2]
         foto = prenda[3]
-        precio = float(prenda[4])
+        cantidad = prenda[4] or 1
+        precio = float(prenda[5])
         precio_dict[tipo] = precio
-        total_costo += precio
+        total_costo += precio * cantidad
 
         prendas_lista.append({
             'tipo': tipo,
-            'cantidad': 1,
+            'cantidad': cantidad,
             'descripcion': descripcion,
             'observaciones': observaciones,
             'precio': precio,
@@ -386,253 +366,53 @@ def ver_prendas_pedido(id_pedido):
 # GENERAR RECIBO PDF
 # -----------------------------------------------
 @bp.route('/generar_recibo/<int:id_pedido>')
+@login_requerido
 def generar_recibo(id_pedido):
-    """Genera y descarga el recibo en formato PDF."""
-    try:
-        # Obtener datos del pedido (compatible con o sin columnas de descuento)
-        try:
-            # Intentar con columnas de descuento
-            pedido = run_query("""
-                SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega, p.porcentaje_descuento, p.nivel_descuento
-                FROM pedido p
-                LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-                LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
-                WHERE p.id_pedido = :id
-            """, {"id": id_pedido}, fetchone=True)
-            tiene_columnas_descuento = True
-        except Exception as e:
-            # Si falla, usar sin columnas de descuento
-            pedido = run_query("""
-                SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega
-                FROM pedido p
-                LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-                LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
-                WHERE p.id_pedido = :id
-            """, {"id": id_pedido}, fetchone=True)
-            tiene_columnas_descuento = False
-        
-        if not pedido:
-            return "Pedido no encontrado", 404
-        
-        # Obtener prendas
-        prendas = run_query("""
-            SELECT tipo, descripcion, 
-                CASE tipo
-                    WHEN 'Camisa' THEN 5000
-                    WHEN 'Pantalón' THEN 6000
-                    WHEN 'Vestido' THEN 8000
-                    WHEN 'Chaqueta' THEN 10000
-                    WHEN 'Saco' THEN 7000
-                    WHEN 'Falda' THEN 5500
-                    WHEN 'Blusa' THEN 4500
-                    WHEN 'Abrigo' THEN 12000
-                    WHEN 'Suéter' THEN 6500
-                    WHEN 'Jeans' THEN 7000
-                    WHEN 'Corbata' THEN 3000
-                    WHEN 'Bufanda' THEN 3500
-                    WHEN 'Sábana' THEN 8000
-                    WHEN 'Edredón' THEN 15000
-                    WHEN 'Cortina' THEN 12000
-                    ELSE 5000
-                END as precio
-            FROM prenda
-            WHERE id_pedido = :id
-        """, {"id": id_pedido}, fetchall=True)
-        
-        # Obtener recibo y cliente
-        recibo = run_query("""
-            SELECT r.monto, r.fecha, r.id_cliente FROM recibo r WHERE id_pedido = :id
-        """, {"id": id_pedido}, fetchone=True)
-        
-        # Calcular descuento (usar guardado si existe, sino calcular)
-        subtotal = sum(p[2] for p in prendas)
-        
-        if tiene_columnas_descuento and len(pedido) >= 11:
-            # Usar descuento guardado en el pedido
-            descuento_porcentaje = pedido[9] or 0
-            nivel_descuento = pedido[10] or "Sin nivel"
-        else:
-            # Calcular descuento (método antiguo para compatibilidad)
-            descuento_monto_calculado = 0
-            descuento_porcentaje = 0
-            nivel_descuento = "Sin nivel"
-            
-            if recibo and subtotal > 0:
-                descuento_monto_calculado = subtotal - recibo[0]
-                if descuento_monto_calculado > 0:
-                    descuento_porcentaje = int((descuento_monto_calculado / subtotal) * 100)
-                    
-                    # Determinar nivel según porcentaje
-                    if descuento_porcentaje >= 15:
-                        nivel_descuento = "Oro"
-                    elif descuento_porcentaje >= 10:
-                        nivel_descuento = "Plata"
-                    elif descuento_porcentaje >= 5:
-                        nivel_descuento = "Bronce"
-        
-        descuento_monto = (subtotal * descuento_porcentaje) / 100 if descuento_porcentaje > 0 else 0
-        
-        # Crear PDF
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Título
-        title_style = styles['Title']
-        story.append(Paragraph("RECIBO - LA LAVANDERÍA", title_style))
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Información del pedido
-        info_data = [
-            ['Pedido #:', str(pedido[0])],
-            ['Cliente:', pedido[4] or 'N/A'],
-            ['Email:', pedido[6] or 'No registrado'],
-            ['Fecha Ingreso:', str(pedido[1])],
-            ['Fecha Entrega:', str(pedido[2]) if pedido[2] else 'Por definir'],
-            ['Estado:', pedido[3]],
-        ]
-        
-        # Agregar direcciones si existen
-        if pedido[7]:  # direccion_recogida
-            info_data.append(['Dirección Recogida:', pedido[7]])
-        if pedido[8]:  # direccion_entrega
-            info_data.append(['Dirección Entrega:', pedido[8]])
-        
-        info_table = Table(info_data, colWidths=[2*inch, 4*inch])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ]))
-        story.append(info_table)
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Agregar código de barras como imagen
-        if pedido[5]:
-            story.append(Paragraph("Código de Barras:", styles['Heading3']))
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Generar imagen del código de barras
-            code128 = barcode.get_barcode_class('code128')
-            barcode_instance = code128(pedido[5], writer=ImageWriter())
-            barcode_buffer = BytesIO()
-            barcode_instance.write(barcode_buffer, options={
-                'module_width': 0.3,
-                'module_height': 10.0,
-                'quiet_zone': 2.0,
-                'font_size': 10,
-                'text_distance': 3.0,
-                'write_text': True
-            })
-            barcode_buffer.seek(0)
-            
-            # Agregar imagen al PDF
-            barcode_img = Image(barcode_buffer, width=4*inch, height=1*inch)
-            story.append(barcode_img)
-            story.append(Spacer(1, 0.3*inch))
-        
-        # Tabla de prendas
-        story.append(Paragraph("Prendas:", styles['Heading2']))
-        story.append(Spacer(1, 0.1*inch))
-        
-        prendas_data = [['Tipo', 'Descripción', 'Precio']]
-        total = 0
-        for prenda in prendas:
-            prendas_data.append([prenda[0], prenda[1] or '-', f'${prenda[2]:,}'])
-            total += prenda[2]
-        
-        prendas_table = Table(prendas_data, colWidths=[2*inch, 2.5*inch, 1.5*inch])
-        prendas_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ]))
-        story.append(prendas_table)
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Subtotal y descuento
-        if recibo:
-            # Subtotal
-            subtotal_data = [['Subtotal:', f'${subtotal:,.0f}']]
-            subtotal_table = Table(subtotal_data, colWidths=[4.5*inch, 1.5*inch])
-            subtotal_table.setStyle(TableStyle([
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ]))
-            story.append(subtotal_table)
-            
-            # Descuento si aplica
-            if descuento_monto > 0:
-                story.append(Spacer(1, 0.1*inch))
-                descuento_data = [[f'Descuento {nivel_descuento} ({descuento_porcentaje}%):', f'-${descuento_monto:,.0f}']]
-                descuento_table = Table(descuento_data, colWidths=[4.5*inch, 1.5*inch])
-                descuento_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.lightyellow),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                    ('TEXTCOLOR', (1, 0), (1, -1), colors.red),
-                    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                ]))
-                story.append(descuento_table)
-            
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Total final
-            total_data = [['TOTAL A PAGAR:', f'${recibo[0]:,.0f}']]
-            total_table = Table(total_data, colWidths=[4.5*inch, 1.5*inch])
-            total_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.lightgreen),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 14),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ]))
-            story.append(total_table)
-        
-        # Generar PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'recibo_pedido_{id_pedido}.pdf'
-        )
-    except Exception as e:
-        print(f"Error generando PDF: {e}")
-        return "Error generando PDF", 500
+    """Recibo PDF (sin fotos): desde la caché o encolado como trabajo."""
+    return encolar_recibo_pdf(id_pedido, con_fotos=False)
 
 
 # -----------------------------------------------
 # GENERAR CÓDIGO DE BARRAS
 # -----------------------------------------------
+def _respuesta_codigo_barras(codigo, descarga=False):
+    """
+    Imagen del código de barras (?formato=png|svg) con ETag y Cache-Control
+    immutable (no cambia nunca). El SVG se envía comprimido si el navegador lo acepta.
+    """
+    formato = request.args.get('formato', 'png')
+    if formato not in FORMATOS:
+        return "Formato no soportado", 400
+    mimetype = FORMATOS[formato][1]
+    comprimir = formato == 'svg' and not descarga and 'gzip' in request.accept_encodings
+    # Cada codificación es una representación distinta: ETag distinto
+    etag = clave_codigo_barras(codigo, formato) + ('-gz' if comprimir else '')
+    if request.if_none_match.contains(etag):
+        respuesta = make_response('', 304)
+    elif descarga:
+        respuesta = send_file(
+            BytesIO(imagen_codigo_barras(codigo, formato)),
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=f'barcode_{codigo}.{formato}'
+        )
+    elif comprimir:
+        respuesta = Response(gzip.compress(imagen_codigo_barras(codigo, formato)), mimetype=mimetype)
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    else:
+        respuesta = Response(imagen_codigo_barras(codigo, formato), mimetype=mimetype)
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = CACHE_CONTROL
+    if formato == 'svg':
+        respuesta.vary.add('Accept-Encoding')
+    return respuesta
+
+
 @bp.route('/barcode/<codigo>')
 def generar_barcode(codigo):
-    """Genera una imagen de código de barras en formato Code128."""
+    """Genera una imagen de código de barras en formato Code128 (PNG o SVG)."""
     try:
-        # Crear el código de barras Code128
-        code128 = barcode.get_barcode_class('code128')
-        barcode_instance = code128(codigo, writer=ImageWriter())
-        
-        # Generar la imagen en memoria
-        buffer = BytesIO()
-        barcode_instance.write(buffer, options={
-            'module_width': 0.3,
-            'module_height': 10.0,
-            'quiet_zone': 2.0,
-            'font_size': 10,
-            'text_distance': 3.0,
-            'write_text': True
-        })
-        buffer.seek(0)
-        
-        # Retornar la imagen
-        return Response(buffer.getvalue(), mimetype='image/png')
+        return _respuesta_codigo_barras(codigo)
     except Exception as e:
         print(f"Error generando código de barras: {e}")
         return "Error generando código de barras", 500
@@ -642,262 +422,114 @@ def generar_barcode(codigo):
 def descargar_barcode(codigo):
     """Descarga la imagen del código de barras."""
     try:
-        code128 = barcode.get_barcode_class('code128')
-        barcode_instance = code128(codigo, writer=ImageWriter())
-        
-        buffer = BytesIO()
-        barcode_instance.write(buffer, options={
-            'module_width': 0.3,
-            'module_height': 10.0,
-            'quiet_zone': 2.0,
-            'font_size': 10,
-            'text_distance': 3.0,
-            'write_text': True
-        })
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            mimetype='image/png',
-            as_attachment=True,
-            download_name=f'barcode_{codigo}.png'
-        )
+        return _respuesta_codigo_barras(codigo, descarga=True)
     except Exception as e:
         print(f"Error descargando código de barras: {e}")
         return "Error", 500
 
 
 @bp.route('/descargar_recibo_pdf/<int:id_pedido>')
+@login_requerido
 def descargar_recibo_pdf(id_pedido):
-    """Genera y descarga el recibo en formato PDF."""
+    """Recibo PDF (con fotos): desde la caché o encolado como trabajo."""
+    return encolar_recibo_pdf(id_pedido, con_fotos=True)
+
+
+def encolar_recibo_pdf(id_pedido, con_fotos=True):
+    """
+    Sirve el recibo PDF de un pedido desde la caché de recibos o, si la
+    versión vigente aún no se generó, lo encola como trabajo en segundo plano.
+    Un cliente solo puede pedir los recibos de sus propios pedidos.
+
+    Args:
+        id_pedido: ID del pedido
+        con_fotos: incluir la foto de cada prenda
+
+    Returns:
+        el PDF (o 304 si el navegador ya tiene esa versión), o redirección a
+        la página de estado del trabajo
+    """
     try:
-        # Obtener datos del pedido (compatible con o sin columnas de descuento)
-        try:
-            # Intentar con columnas de descuento
-            pedido = run_query("""
-                SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega, p.porcentaje_descuento, p.nivel_descuento
-                FROM pedido p
-                LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-                LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
-                WHERE p.id_pedido = :id
-            """, {"id": id_pedido}, fetchone=True)
-            tiene_columnas_descuento = True
-        except Exception as e:
-            # Si falla, usar sin columnas de descuento
-            pedido = run_query("""
-                SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega
-                FROM pedido p
-                LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
-                LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
-                WHERE p.id_pedido = :id
-            """, {"id": id_pedido}, fetchone=True)
-            tiene_columnas_descuento = False
-        
-        if not pedido:
+        if not admin_only():
+            pedido = run_query(
+                "SELECT id_cliente FROM pedido WHERE id_pedido = :id",
+                {"id": id_pedido},
+                fetchone=True
+            )
+            if not pedido or pedido[0] != id_usuario_actual():
+                return "Pedido no encontrado", 404
+
+        cache = recibo_en_cache(id_pedido, con_fotos)
+        if cache is None:
             return "Pedido no encontrado", 404
-        
-        # Obtener prendas con fotos
-        prendas = run_query("""
-            SELECT tipo, descripcion, foto,
-                CASE tipo
-                    WHEN 'Camisa' THEN 5000
-                    WHEN 'Pantalón' THEN 6000
-                    WHEN 'Vestido' THEN 8000
-                    WHEN 'Chaqueta' THEN 10000
-                    WHEN 'Saco' THEN 7000
-                    WHEN 'Falda' THEN 5500
-                    WHEN 'Blusa' THEN 4500
-                    WHEN 'Abrigo' THEN 12000
-                    WHEN 'Suéter' THEN 6500
-                    WHEN 'Jeans' THEN 7000
-                    WHEN 'Corbata' THEN 3000
-                    WHEN 'Bufanda' THEN 3500
-                    WHEN 'Sábana' THEN 8000
-                    WHEN 'Edredón' THEN 15000
-                    WHEN 'Cortina' THEN 12000
-                    ELSE 5000
-                END as precio
-            FROM prenda
-            WHERE id_pedido = :id
-            ORDER BY id_prenda
-        """, {"id": id_pedido}, fetchall=True)
-        
-        # Obtener recibo y cliente
-        recibo = run_query("""
-            SELECT r.monto, r.fecha, r.id_cliente FROM recibo r WHERE id_pedido = :id
-        """, {"id": id_pedido}, fetchone=True)
-        
-        # Calcular descuento (usar guardado si existe, sino calcular)
-        subtotal = sum(p[3] for p in prendas)
-        
-        if tiene_columnas_descuento and len(pedido) >= 11:
-            # Usar descuento guardado en el pedido
-            descuento_porcentaje = pedido[9] or 0
-            nivel_descuento = pedido[10] or "Sin nivel"
-        else:
-            # Calcular descuento (método antiguo para compatibilidad)
-            descuento_monto_calculado = 0
-            descuento_porcentaje = 0
-            nivel_descuento = "Sin nivel"
-            
-            if recibo and subtotal > 0:
-                descuento_monto_calculado = subtotal - recibo[0]
-                if descuento_monto_calculado > 0:
-                    descuento_porcentaje = int((descuento_monto_calculado / subtotal) * 100)
-                    
-                    # Determinar nivel según porcentaje
-                    if descuento_porcentaje >= 15:
-                        nivel_descuento = "Oro"
-                    elif descuento_porcentaje >= 10:
-                        nivel_descuento = "Plata"
-                    elif descuento_porcentaje >= 5:
-                        nivel_descuento = "Bronce"
-        
-        descuento_monto = (subtotal * descuento_porcentaje) / 100 if descuento_porcentaje > 0 else 0
-        
-        # Crear PDF
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Título
-        title_style = styles['Title']
-        story.append(Paragraph("RECIBO - LA LAVANDERÍA", title_style))
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Información del pedido
-        info_data = [
-            ['Pedido #:', str(pedido[0])],
-            ['Cliente:', pedido[4] or 'N/A'],
-            ['Email:', pedido[6] or 'No registrado'],
-            ['Fecha Ingreso:', str(pedido[1])],
-            ['Fecha Entrega:', str(pedido[2]) if pedido[2] else 'Por definir'],
-            ['Estado:', pedido[3]],
-        ]
-        
-        # Agregar direcciones si existen
-        if pedido[7]:  # direccion_recogida
-            info_data.append(['Dirección Recogida:', pedido[7]])
-        if pedido[8]:  # direccion_entrega
-            info_data.append(['Dirección Entrega:', pedido[8]])
-        
-        info_table = Table(info_data, colWidths=[2*inch, 4*inch])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ]))
-        story.append(info_table)
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Agregar código de barras como imagen
-        if pedido[5]:
-            story.append(Paragraph("Código de Barras:", styles['Heading3']))
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Generar imagen del código de barras
-            code128 = barcode.get_barcode_class('code128')
-            barcode_instance = code128(pedido[5], writer=ImageWriter())
-            barcode_buffer = BytesIO()
-            barcode_instance.write(barcode_buffer, options={
-                'module_width': 0.3,
-                'module_height': 10.0,
-                'quiet_zone': 2.0,
-                'font_size': 10,
-                'text_distance': 3.0,
-                'write_text': True
-            })
-            barcode_buffer.seek(0)
-            
-            # Agregar imagen al PDF
-            barcode_img = Image(barcode_buffer, width=4*inch, height=1*inch)
-            story.append(barcode_img)
-            story.append(Spacer(1, 0.3*inch))
-        
-        # Tabla de prendas
-        story.append(Paragraph("Prendas:", styles['Heading2']))
-        story.append(Spacer(1, 0.1*inch))
-        
-        prendas_data = [['Tipo', 'Descripción', 'Foto', 'Precio']]
-        total = 0
-        for prenda in prendas:
-            foto_cell = 'Sin foto'
-            if prenda[2]:
-                foto_path = os.path.join('static', prenda[2])
-                if os.path.exists(foto_path):
-                    try:
-                        foto_cell = Image(foto_path, width=0.7*inch, height=0.7*inch)
-                    except Exception:
-                        foto_cell = 'Foto no disponible'
-                else:
-                    foto_cell = 'Foto no encontrada'
-            prendas_data.append([prenda[0], prenda[1] or '-', foto_cell, f'${prenda[3]:,}'])
-            total += prenda[3]
-        
-        prendas_table = Table(prendas_data, colWidths=[1.5*inch, 2*inch, 1.2*inch, 1.3*inch])
-        prendas_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ALIGN', (3, 0), (3, -1), 'RIGHT'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        story.append(prendas_table)
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Subtotal y descuento
-        if recibo:
-            # Subtotal
-            subtotal_data = [['Subtotal:', f'${subtotal:,.0f}']]
-            subtotal_table = Table(subtotal_data, colWidths=[4.5*inch, 1.5*inch])
-            subtotal_table.setStyle(TableStyle([
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ]))
-            story.append(subtotal_table)
-            
-            # Descuento si aplica
-            if descuento_monto > 0:
-                story.append(Spacer(1, 0.1*inch))
-                descuento_data = [[f'Descuento {nivel_descuento} ({descuento_porcentaje}%):', f'-${descuento_monto:,.0f}']]
-                descuento_table = Table(descuento_data, colWidths=[4.5*inch, 1.5*inch])
-                descuento_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.lightyellow),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                    ('TEXTCOLOR', (1, 0), (1, -1), colors.red),
-                    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-                ]))
-                story.append(descuento_table)
-            
-            story.append(Spacer(1, 0.1*inch))
-            
-            # Total final
-            total_data = [['TOTAL A PAGAR:', f'${recibo[0]:,.0f}']]
-            total_table = Table(total_data, colWidths=[4.5*inch, 1.5*inch])
-            total_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.lightgreen),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 14),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ]))
-            story.append(total_table)
-        
-        # Generar PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f'recibo_pedido_{id_pedido}.pdf'
+
+        ruta, version = cache
+        if ruta:
+            respuesta = send_file(
+                ruta,
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=f'recibo_pedido_{id_pedido}.pdf',
+                etag=version
+            )
+            respuesta.headers['Cache-Control'] = 'private, no-cache'
+            return respuesta
+
+        token = encolar_trabajo(
+            'recibo_pdf',
+            {"id_pedido": id_pedido, "con_fotos": con_fotos},
+            id_usuario=session.get('id_usuario')
         )
+        return redirect(url_for('utils.trabajo_estado', token=token))
     except Exception as e:
         print(f"Error generando PDF: {e}")
         return "Error generando PDF", 500
 
+
+# -----------------------------------------------
+# TRABAJOS EN SEGUNDO PLANO (ESTADO Y DESCARGA)
+# -----------------------------------------------
+def _trabajo_autorizado(token):
+    """Devuelve el trabajo si existe y el usuario actual puede verlo; None en otro caso."""
+    trabajo = obtener_trabajo(token)
+    if not trabajo or not puede_ver_trabajo(trabajo, session.get('id_usuario'), admin_only()):
+        return None
+    return trabajo
+
+
+@bp.route('/trabajos/<token>')
+def trabajo_estado(token):
+    """Página de estado de un trabajo; se recarga sola mientras está pendiente."""
+    trabajo = _trabajo_autorizado(token)
+    if not trabajo:
+        return "Trabajo no encontrado", 404
+
+    # Los recibos se descargan directamente en cuanto están listos
+    if trabajo['estado'] == ESTADO_COMPLETADO and trabajo['tipo'] in ('recibo_pdf', 'recibos_pdf'):
+        return redirect(url_for('utils.trabajo_descargar', token=token))
+
+    base_template = 'base.html' if admin_only() else 'cliente_base.html'
+    return render_template('trabajo_estado.html',
+                         trabajo=trabajo,
+                         base_template=base_template,
+                         terminado=trabajo['estado'] in (ESTADO_COMPLETADO, ESTADO_ERROR))
+
+
+@bp.route('/trabajos/<token>/descargar')
+def trabajo_descargar(token):
+    """Descarga el archivo generado por un trabajo completado."""
+    trabajo = _trabajo_autorizado(token)
+    if not trabajo:
+        return "Trabajo no encontrado", 404
+    if trabajo['estado'] != ESTADO_COMPLETADO:
+        return redirect(url_for('utils.trabajo_estado', token=token))
+    if not trabajo['archivo'] or not os.path.exists(trabajo['archivo']):
+        return "El archivo ya no está disponible", 410
+
+    return send_file(
+        trabajo['archivo'],
+        mimetype=trabajo['mimetype'],
+        as_attachment=True,
+        download_name=trabajo['nombre_descarga']
+    )
+
@@ -0,0 +1,39 @@
+"""Archiva las notificaciones antiguas y purga el archivo (pensado para un cron diario)."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+# Permite resolver rutas desde la raiz del proyecto.
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def main() -> int:
+    """Punto de entrada para CLI (pensado para un cron / Render Cron Job).
+
+    Los plazos se configuran con NOTIFICACIONES_RETENCION_LEIDAS_DIAS,
+    NOTIFICACIONES_RETENCION_DIAS y NOTIFICACIONES_ARCHIVO_DIAS (ver config.py).
+
+    Uso:
+        python scripts/archivar_notificaciones.py
+    """
+    from app import app
+    from services.notificacion_service import archivar_notificaciones
+
+    try:
+        with app.app_context():
+            resultado = archivar_notificaciones(app)
+        print(
+            f"[OK] Notificaciones archivadas: {resultado['archivadas']}, "
+            f"purgadas del archivo: {resultado['purgadas']}"
+        )
+        return 0
+    except Exception as exc:
+        print(f"[ERROR] Fallo el archivo de notificaciones: {exc}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
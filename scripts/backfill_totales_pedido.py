@@ -0,0 +1,69 @@
+"""Calcula total_prendas, subtotal y total de los pedidos existentes (una sola vez tras la migración)."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+# Permite resolver rutas desde la raiz del proyecto.
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+LOTE = 1000
+
+
+def main() -> int:
+    """Punto de entrada para CLI.
+
+    Recorre los pedidos por lotes de id (un commit por lote, sin bloquear la
+    tabla completa) y llama a pedido_recalcular_totales() de
+    migrations/add_totales_to_pedido.sql. Al final comprueba que los pedidos
+    sin prendas hayan quedado con 0 prendas y subtotal 0.
+
+    Uso:
+        python scripts/backfill_totales_pedido.py
+    """
+    from app import app
+    from models import run_query
+
+    try:
+        with app.app_context():
+            ultimo = 0
+            procesados = 0
+            while True:
+                ids = [fila[0] for fila in run_query(
+                    "SELECT id_pedido FROM pedido WHERE id_pedido > :ultimo ORDER BY id_pedido LIMIT :lote",
+                    {"ultimo": ultimo, "lote": LOTE},
+                    fetchall=True
+                ) or []]
+                if not ids:
+                    break
+                run_query(
+                    "SELECT pedido_recalcular_totales(CAST(:ids AS integer[]))",
+                    {"ids": ids},
+                    fetchone=True,
+                    commit=True
+                )
+                procesados += len(ids)
+                ultimo = ids[-1]
+                print(f"  ... {procesados} pedidos")
+
+            # Pedidos vacíos: el LEFT JOIN con prenda no debe contar una prenda fantasma
+            vacios_mal = run_query("""
+                SELECT COUNT(*) FROM pedido p
+                WHERE NOT EXISTS (SELECT 1 FROM prenda pr WHERE pr.id_pedido = p.id_pedido)
+                  AND (p.total_prendas <> 0 OR p.subtotal <> 0)
+            """, fetchone=True)[0]
+        if vacios_mal:
+            print(f"[ERROR] {vacios_mal} pedidos sin prendas quedaron con totales distintos de 0 "
+                  "(aplicar de nuevo add_totales_to_pedido.sql y repetir)")
+            return 1
+        print(f"[OK] Totales calculados para {procesados} pedidos")
+        return 0
+    except Exception as exc:
+        print(f"[ERROR] Fallo el backfill de totales: {exc}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
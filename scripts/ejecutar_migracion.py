@@ -28,10 +28,20 @@ def parse_sql_statements(sql_text: str) -> list[str]:
         cleaned_lines.append(line)
 
     cleaned_sql = "\n".join(cleaned_lines)
-    for statement in cleaned_sql.split(";"):
-        statement = statement.strip()
-        if statement:
-            statements.append(statement)
+    # Los ';' dentro de bloques $$ ... $$ (cuerpos de funciones) no separan sentencias
+    actual = ""
+    for i, trozo in enumerate(cleaned_sql.split("$$")):
+        if i % 2:
+            actual += "$$" + trozo + "$$"
+            continue
+        partes = trozo.split(";")
+        actual += partes[0]
+        for parte in partes[1:]:
+            if actual.strip():
+                statements.append(actual.strip())
+            actual = parte
+    if actual.strip():
+        statements.append(actual.strip())
 
     return statements
 
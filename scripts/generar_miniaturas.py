@@ -0,0 +1,61 @@
+"""Genera las miniaturas de las fotos de prendas subidas antes de services/foto_service.py."""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# Permite resolver rutas desde la raiz del proyecto.
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def main() -> int:
+    """Punto de entrada para CLI.
+
+    Las fotos nuevas se procesan en segundo plano al guardar el pedido; el
+    script procesa las que aún no tienen miniatura (o todas con --todas).
+    Se ejecuta desde la raiz del proyecto (las rutas son relativas a static/).
+
+    Uso:
+        python scripts/generar_miniaturas.py
+        python scripts/generar_miniaturas.py --todas
+    """
+    parser = argparse.ArgumentParser(description="Genera miniaturas de las fotos de prendas")
+    parser.add_argument('--todas', action='store_true', help="reprocesar también las que ya tienen miniatura")
+    args = parser.parse_args()
+
+    from app import app
+    from models import run_query
+    from services.foto_service import TAMANOS, procesar_foto, ruta_miniatura
+
+    os.chdir(ROOT_DIR)
+    try:
+        with app.app_context():
+            filas = run_query(
+                "SELECT DISTINCT foto FROM prenda WHERE foto IS NOT NULL AND foto != ''",
+                fetchall=True
+            ) or []
+            lado_original = app.config.get('FOTOS_ORIGINAL_MAX', 2048)
+
+        procesadas = fallidas = 0
+        for (foto,) in filas:
+            if not args.todas and all(
+                os.path.exists(os.path.join('static', ruta_miniatura(foto, tamano))) for tamano in TAMANOS
+            ):
+                continue
+            if procesar_foto(foto, lado_original):
+                procesadas += 1
+            else:
+                fallidas += 1
+        print(f"[OK] Fotos procesadas: {procesadas} (sin archivo o ilegibles: {fallidas})")
+        return 0
+    except Exception as exc:
+        print(f"[ERROR] Fallo la generacion de miniaturas: {exc}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
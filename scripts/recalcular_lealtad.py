@@ -0,0 +1,37 @@
+"""Recalcula cliente_lealtad para todos los clientes (tras aplicar la migración o cambiar descuentos)."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+# Permite resolver rutas desde la raiz del proyecto.
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def main() -> int:
+    """Punto de entrada para CLI.
+
+    El panel de descuentos ya lanza este recálculo en segundo plano; el script
+    sirve para el llenado inicial tras create_cliente_lealtad.sql o para
+    cambios hechos directamente en la base de datos.
+
+    Uso:
+        python scripts/recalcular_lealtad.py
+    """
+    from app import app
+    from services.lealtad_service import recalcular_lealtad
+
+    try:
+        with app.app_context():
+            total = recalcular_lealtad()
+        print(f"[OK] Lealtad recalculada para {total} clientes")
+        return 0
+    except Exception as exc:
+        print(f"[ERROR] Fallo el recalculo de lealtad: {exc}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
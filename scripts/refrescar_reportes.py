@@ -0,0 +1,37 @@
+"""Refresca los reportes pre-agregados (tablas reporte_*) fuera de las peticiones web."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+# Permite resolver rutas desde la raiz del proyecto.
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def main() -> int:
+    """Punto de entrada para CLI (pensado para un cron / Render Cron Job).
+
+    Uso:
+        python scripts/refrescar_reportes.py
+        python scripts/refrescar_reportes.py --completo   # reconstruye todo el historico
+    """
+    from app import app
+    from services.reportes_service import refrescar_reportes
+
+    try:
+        with app.app_context():
+            resultado = refrescar_reportes(completo="--completo" in sys.argv[1:])
+        print(
+            f"[OK] Reportes refrescados: {resultado['dias']} dias, "
+            f"{resultado['meses']} meses, {resultado['clientes']} clientes"
+        )
+        return 0
+    except Exception as exc:
+        print(f"[ERROR] Fallo el refresco de reportes: {exc}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,10 +3,12 @@ Módulo de servicios de negocio
 """
 from .email_service import send_email_async
 from .validation_service import limpiar_texto, validar_email, validar_contrasena
+from .pedido_service import crear_pedido
 
 __all__ = [
     'send_email_async',
     'limpiar_texto',
     'validar_email',
-    'validar_contrasena'
+    'validar_contrasena',
+    'crear_pedido'
 ]
@@ -0,0 +1,275 @@
+"""
+Índice en memoria para el autocompletado de clientes
+
+Guarda en listas ordenadas los tokens normalizados (ver
+busqueda_service.normalizar) de nombre, username, email e id de cada cliente;
+una búsqueda por prefijo es una búsqueda binaria (bisect) sobre esas listas,
+sin ir a la base de datos.
+
+El índice se carga la primera vez que se usa y se mantiene con
+actualizar_cliente_indice() / eliminar_cliente_indice() desde las rutas que
+crean, editan o borran clientes. Como otros procesos (scripts, otra instancia)
+también pueden escribir en usuario, se reconstruye en segundo plano cada
+AUTOCOMPLETADO_RECARGA_SEGUNDOS.
+"""
+import bisect
+import itertools
+import re
+import threading
+import time
+
+from flask import current_app
+
+from models import run_query_stream
+from services.busqueda_service import normalizar
+
+_SEPARADORES = re.compile(r"[\s.@_\-+]+")
+
+
+def tokens_cliente(id_usuario, nombre, email, username):
+    """Tokens por los que se encuentra un cliente (palabras y valores completos)."""
+    tokens = {str(id_usuario)}
+    for valor in (nombre, email, username):
+        valor = normalizar(valor).strip()
+        if not valor:
+            continue
+        tokens.add(valor)
+        tokens.update(t for t in _SEPARADORES.split(valor) if t)
+    return tokens
+
+
+class _ListaPrefijos:
+    """Pares (clave, id) ordenados por clave, en dos listas paralelas."""
+
+    def __init__(self, pares=()):
+        pares = sorted(pares)
+        self.claves = [c for c, _ in pares]
+        self.ids = [i for _, i in pares]
+
+    def agregar(self, clave, id_usuario):
+        i = bisect.bisect_right(self.claves, clave)
+        self.claves.insert(i, clave)
+        self.ids.insert(i, id_usuario)
+
+    def quitar(self, clave, id_usuario):
+        i = bisect.bisect_left(self.claves, clave)
+        j = bisect.bisect_right(self.claves, clave, i)
+        for k in range(i, j):
+            if self.ids[k] == id_usuario:
+                del self.claves[k]
+                del self.ids[k]
+                return
+
+    def rango(self, prefijo):
+        """(inicio, fin) de las claves que empiezan por prefijo."""
+        inicio = bisect.bisect_left(self.claves, prefijo)
+        return inicio, bisect.bisect_left(self.claves, prefijo + '\uffff', inicio)
+
+
+class IndiceClientes:
+    """
+    Índice de prefijos sobre los clientes (seguro entre hilos).
+
+    - _nombres: nombre normalizado completo -> id (en orden alfabético; sirve
+      para "el nombre empieza por" y para recorrer por nombre)
+    - _palabras: cada palabra del nombre -> id
+    - _tokens: todos los tokens (nombre, email, username, id) -> id
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._nombres = _ListaPrefijos()
+        self._palabras = _ListaPrefijos()
+        self._tokens = _ListaPrefijos()
+        self._clientes = {}      # id_usuario -> (nombre, email, username)
+        self._claves = {}        # id_usuario -> (nombre normalizado, palabras, tokens)
+
+    def __len__(self):
+        return len(self._clientes)
+
+    @staticmethod
+    def _claves_de(id_usuario, nombre, email, username):
+        nombre_norm = normalizar(nombre).strip()
+        palabras = set(p for p in _SEPARADORES.split(nombre_norm) if p)
+        return nombre_norm, palabras, tokens_cliente(id_usuario, nombre, email, username)
+
+    def cargar(self, filas):
+        """Construye el índice completo a partir de filas (id, nombre, email, username)."""
+        clientes, claves = {}, {}
+        nombres, palabras, tokens = [], [], []
+        for id_usuario, nombre, email, username in filas:
+            clave = self._claves_de(id_usuario, nombre, email, username)
+            clientes[id_usuario] = (nombre, email, username)
+            claves[id_usuario] = clave
+            nombres.append((clave[0], id_usuario))
+            palabras.extend((p, id_usuario) for p in clave[1])
+            tokens.extend((t, id_usuario) for t in clave[2])
+        with self._lock:
+            self._nombres = _ListaPrefijos(nombres)
+            self._palabras = _ListaPrefijos(palabras)
+            self._tokens = _ListaPrefijos(tokens)
+            self._clientes, self._claves = clientes, claves
+
+    def eliminar(self, id_usuario):
+        with self._lock:
+            clave = self._claves.pop(id_usuario, None)
+            if clave is None:
+                return
+            nombre_norm, palabras, tokens = clave
+            self._nombres.quitar(nombre_norm, id_usuario)
+            for palabra in palabras:
+                self._palabras.quitar(palabra, id_usuario)
+            for token in tokens:
+                self._tokens.quitar(token, id_usuario)
+            del self._clientes[id_usuario]
+
+    def actualizar(self, id_usuario, nombre, email, username):
+        with self._lock:
+            self.eliminar(id_usuario)
+            clave = self._claves_de(id_usuario, nombre, email, username)
+            nombre_norm, palabras, tokens = clave
+            self._nombres.agregar(nombre_norm, id_usuario)
+            for palabra in palabras:
+                self._palabras.agregar(palabra, id_usuario)
+            for token in tokens:
+                self._tokens.agregar(token, id_usuario)
+            self._clientes[id_usuario] = (nombre, email, username)
+            self._claves[id_usuario] = clave
+
+    def _ids(self, lista, prefijo):
+        inicio, fin = lista.rango(prefijo)
+        return set(lista.ids[inicio:fin])
+
+    def _primeros_por_nombre(self, conjunto, cantidad):
+        """Los `cantidad` ids del conjunto con menor nombre."""
+        if cantidad <= 0 or not conjunto:
+            return []
+        # Conjunto denso: recorrer en orden alfabético hasta completar
+        # (en promedio cantidad * total / len(conjunto) pasos); si no, ordenar
+        if len(conjunto) * 64 >= len(self._clientes):
+            return list(itertools.islice((i for i in self._nombres.ids if i in conjunto), cantidad))
+        return sorted(conjunto, key=lambda i: (self._claves[i][0], i))[:cantidad]
+
+    def buscar(self, q, limite=10):
+        """
+        Clientes con un token que empieza por cada palabra buscada.
+
+        El orden sigue el de busqueda_service.buscar_clientes: primero aquellos
+        cuyo nombre empieza por el texto buscado, luego los que tienen una
+        palabra del nombre que empieza así y al final el resto, cada grupo por
+        nombre.
+
+        Returns:
+            lista de tuplas (id_usuario, nombre, email, username)
+        """
+        termino = normalizar(q).strip()
+        palabras = [p for p in _SEPARADORES.split(termino) if p]
+        if not palabras:
+            return []
+
+        with self._lock:
+            # 1) el nombre empieza por el texto: rango contiguo, ya ordenado por nombre
+            inicio, fin = self._nombres.rango(termino)
+            ids = self._nombres.ids[inicio:min(fin, inicio + limite)]
+
+            if len(ids) < limite:
+                # Todas las palabras buscadas deben empezar algún token
+                coinciden = None
+                for palabra in sorted(palabras, key=len, reverse=True):
+                    encontrados = self._ids(self._tokens, palabra)
+                    coinciden = encontrados if coinciden is None else coinciden & encontrados
+                    if not coinciden:
+                        break
+                coinciden = (coinciden or set()).difference(ids)
+
+                # 2) una palabra del nombre empieza por la primera palabra buscada
+                en_nombre = coinciden & self._ids(self._palabras, palabras[0])
+                ids += self._primeros_por_nombre(en_nombre, limite - len(ids))
+                # 3) el resto (email, username, id)
+                ids += self._primeros_por_nombre(coinciden - en_nombre, limite - len(ids))
+
+            return [(i,) + self._clientes[i] for i in ids]
+
+
+_indice = None
+_cargado_en = 0.0
+_recargando = False
+# Cambios recibidos durante una recarga (se aplican al índice nuevo antes de usarlo)
+_pendientes = []
+_estado_lock = threading.Lock()
+
+_SQL_CLIENTES = "SELECT id_usuario, nombre, email, username FROM usuario WHERE rol = 'cliente'"
+
+
+def _construir():
+    indice = IndiceClientes()
+    indice.cargar(run_query_stream(_SQL_CLIENTES))
+    return indice
+
+
+def _recargar_en_segundo_plano(app):
+    global _indice, _cargado_en, _recargando
+    try:
+        with app.app_context():
+            nuevo = _construir()
+        with _estado_lock:
+            for cambio in _pendientes:
+                cambio(nuevo)
+            _indice, _cargado_en = nuevo, time.monotonic()
+    except Exception as e:
+        print(f"[WARN] No se pudo recargar el índice de autocompletado: {e}")
+    finally:
+        with _estado_lock:
+            _pendientes.clear()
+            _recargando = False
+
+
+def obtener_indice():
+    """
+    Índice de clientes del proceso (se carga la primera vez que se pide).
+
+    Returns:
+        IndiceClientes, o None si el índice en memoria está desactivado
+    """
+    global _indice, _cargado_en, _recargando
+    if not current_app.config.get('AUTOCOMPLETADO_MEMORIA', True):
+        return None
+
+    if _indice is None:
+        with _estado_lock:
+            if _indice is None:
+                _indice = _construir()
+                _cargado_en = time.monotonic()
+        return _indice
+
+    recarga = current_app.config.get('AUTOCOMPLETADO_RECARGA_SEGUNDOS', 600)
+    if recarga and not _recargando and time.monotonic() - _cargado_en > recarga:
+        with _estado_lock:
+            if not _recargando:
+                _recargando = True
+                threading.Thread(
+                    target=_recargar_en_segundo_plano,
+                    args=(current_app._get_current_object(),),
+                    name='indice-clientes',
+                    daemon=True
+                ).start()
+    return _indice
+
+
+def actualizar_cliente_indice(id_usuario, nombre, email, username):
+    """Refleja en el índice un cliente creado o editado (si el índice ya está cargado)."""
+    _aplicar(lambda indice: indice.actualizar(id_usuario, nombre, email, username))
+
+
+def eliminar_cliente_indice(id_usuario):
+    """Quita un cliente del índice (si el índice ya está cargado)."""
+    _aplicar(lambda indice: indice.eliminar(id_usuario))
+
+
+def _aplicar(cambio):
+    with _estado_lock:
+        if _indice is None:
+            return
+        cambio(_indice)
+        if _recargando:
+            _pendientes.append(cambio)
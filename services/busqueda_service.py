@@ -0,0 +1,131 @@
+"""
+Servicio de búsqueda de clientes
+
+Busca sobre usuario.busqueda (nombre, username, email e id en minúsculas y sin
+tildes, mantenida por el trigger de migrations/create_busqueda_clientes.sql):
+- 3 o más caracteres: subcadena con LIKE '%q%', que usa el índice GIN de pg_trgm
+- 1-2 caracteres: prefijo con LIKE 'q%', que usa el índice text_pattern_ops
+
+Los resultados se ordenan por relevancia: primero los que empiezan por el
+texto buscado, luego los que tienen una palabra que empieza así y al final el
+resto. Si la migración aún no se aplicó se usa la búsqueda LIKE anterior.
+"""
+import time
+
+from models import run_query, transaccion
+
+# Misma tabla de reemplazos que normalizar_busqueda() en la migración
+_SIN_TILDES = str.maketrans('áàäâãéèëêíìïîóòöôõúùüûñç', 'aaaaaeeeeiiiiooooouuuunc')
+
+# Cada cuánto se vuelve a comprobar si existe la columna (mientras no exista)
+VERIFICAR_COLUMNA_CADA = 60
+
+_estado = {'disponible': False, 'verificado': 0.0}
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, igual que la columna usuario.busqueda."""
+    return (texto or '').lower().translate(_SIN_TILDES)
+
+
+def _escapar_like(texto):
+    """Escapa los comodines de LIKE para buscar el texto literal."""
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def busqueda_disponible():
+    """True si la columna usuario.busqueda existe (una vez encontrada no se vuelve a consultar)."""
+    if _estado['disponible']:
+        return True
+    ahora = time.monotonic()
+    if _estado['verificado'] and ahora - _estado['verificado'] < VERIFICAR_COLUMNA_CADA:
+        return False
+    _estado['verificado'] = ahora
+    try:
+        with transaccion():
+            fila = run_query("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'usuario' AND column_name = 'busqueda'
+            """, fetchone=True)
+        _estado['disponible'] = bool(fila)
+    except Exception:
+        _estado['disponible'] = False
+    return _estado['disponible']
+
+
+def filtro_clientes(q, columna='busqueda'):
+    """
+    Condición SQL para filtrar clientes por texto (para listados con su propio orden).
+
+    Args:
+        q: texto buscado
+        columna: columna de búsqueda (con alias de tabla si hace falta)
+
+    Returns:
+        tupla (fragmento SQL que empieza con ' AND', parámetros)
+    """
+    termino = normalizar(q.strip())
+    if not termino:
+        return "", {}
+    if not busqueda_disponible():
+        return (" AND (nombre LIKE :q OR email LIKE :q OR username LIKE :q)",
+                {"q": f"%{q}%"})
+    patron = _escapar_like(termino)
+    params = {"q_patron": f"{patron}%" if len(termino) < 3 else f"%{patron}%"}
+    condicion = f"{columna} LIKE :q_patron ESCAPE '\\'"
+    # Un número también puede ser el id exacto del cliente
+    if termino.isdigit():
+        condicion = f"({condicion} OR id_usuario = :q_id)"
+        params["q_id"] = int(termino)
+    return f" AND {condicion}", params
+
+
+def buscar_clientes(q, limite=10):
+    """
+    Clientes que coinciden con el texto, ordenados por relevancia.
+
+    Args:
+        q: texto buscado (nombre, username, email o id)
+        limite: máximo de resultados
+
+    Returns:
+        lista de tuplas (id_usuario, nombre, email, username)
+    """
+    termino = normalizar(q.strip())
+    if not termino:
+        return []
+
+    if not busqueda_disponible():
+        return run_query("""
+            SELECT id_usuario, nombre, email, username
+            FROM usuario
+            WHERE rol = 'cliente'
+            AND (
+                LOWER(nombre) LIKE LOWER(:q) OR
+                LOWER(email) LIKE LOWER(:q) OR
+                LOWER(username) LIKE LOWER(:q) OR
+                CAST(id_usuario AS TEXT) LIKE :q
+            )
+            ORDER BY nombre
+            LIMIT :limite
+        """, {"q": f"%{q.strip()}%", "limite": limite}, fetchall=True) or []
+
+    filtro, params = filtro_clientes(q)
+    patron = _escapar_like(termino)
+    params.update({
+        "prefijo": f"{patron}%",
+        "palabra": f"% {patron}%",
+        "limite": limite,
+    })
+    return run_query(f"""
+        SELECT id_usuario, nombre, email, username
+        FROM usuario
+        WHERE rol = 'cliente'{filtro}
+        ORDER BY CASE
+                     WHEN busqueda LIKE :prefijo ESCAPE '\\' THEN 0
+                     WHEN busqueda LIKE :palabra ESCAPE '\\' THEN 1
+                     ELSE 2
+                 END,
+                 nombre
+        LIMIT :limite
+    """, params, fetchall=True) or []
@@ -0,0 +1,239 @@
+"""
+Servicio de imágenes de códigos de barras
+
+Un código de barras no cambia para un mismo codigo_barras, así que la imagen
+(Code128, PNG o SVG) se genera una vez y se reutiliza en /barcode,
+/descargar_barcode y el adjunto del correo del pedido:
+
+- caché LRU en memoria (CODIGO_BARRAS_CACHE_MAX imágenes)
+- caché opcional en disco (CODIGO_BARRAS_DIR), compartida entre procesos y
+  reinicios y acotada a CODIGO_BARRAS_DIR_MAX_MB (se borran primero las
+  imágenes usadas hace más tiempo: /barcode/<codigo> acepta cualquier código)
+- la clave de caché (código + opciones de dibujo) es también el ETag de las
+  rutas, que se sirven con Cache-Control immutable
+
+Los recibos PDF no usan estas imágenes: dibujan el código con reportlab
+(dibujo_codigo_barras), en vectores y sin PIL.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from io import BytesIO
+
+import barcode
+from barcode.writer import ImageWriter, SVGWriter
+from flask import current_app
+from reportlab.graphics.barcode.code128 import Code128
+from reportlab.lib.units import inch
+
+# Cambiar si cambia la forma de dibujar: invalida las cachés y los ETag ya entregados
+VERSION_DIBUJO = 1
+
+OPCIONES_POR_DEFECTO = {
+    'module_width': 0.3,
+    'module_height': 10.0,
+    'quiet_zone': 2.0,
+    'font_size': 10,
+    'text_distance': 3.0,
+    'write_text': True
+}
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# formato -> (writer de python-barcode, mimetype)
+FORMATOS = {
+    'png': (ImageWriter, 'image/png'),
+    'svg': (SVGWriter, 'image/svg+xml'),
+}
+
+# La carpeta de disco se recorta como máximo cada RECORTAR_CADA imágenes escritas
+RECORTAR_CADA = 100
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_escrituras = {'desde_recorte': None}
+
+
+def _opciones(opciones):
+    return dict(OPCIONES_POR_DEFECTO, **(opciones or {}))
+
+
+def clave_codigo_barras(codigo, formato='png', opciones=None):
+    """
+    Clave de caché de la imagen (y ETag de las rutas); no genera la imagen.
+
+    Args:
+        codigo: texto a codificar
+        formato: 'png' o 'svg'
+        opciones: opciones del writer que reemplazan a OPCIONES_POR_DEFECTO
+
+    Returns:
+        str hexadecimal
+    """
+    datos = json.dumps([VERSION_DIBUJO, codigo, formato, _opciones(opciones)], sort_keys=True)
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()[:32]
+
+
+def _dibujar(codigo, formato, opciones):
+    """Genera la imagen Code128 con python-barcode (ImageWriter o SVGWriter)."""
+    code128 = barcode.get_barcode_class('code128')
+    buffer = BytesIO()
+    code128(codigo, writer=FORMATOS[formato][0]()).write(buffer, options=opciones)
+    return buffer.getvalue()
+
+
+def _ruta_disco(clave, formato):
+    """Ruta de la imagen en la caché de disco, o None si está desactivada."""
+    directorio = current_app.config.get('CODIGO_BARRAS_DIR')
+    if not directorio:
+        return None
+    return os.path.join(directorio, f'{clave}.{formato}')
+
+
+def _leer_disco(ruta):
+    try:
+        with open(ruta, 'rb') as archivo:
+            imagen = archivo.read()
+        # La fecha de modificación ordena el recorte (el último usado se borra al final)
+        os.utime(ruta)
+        return imagen
+    except OSError:
+        return None
+
+
+def _recortar_disco(directorio):
+    """Borra las imágenes usadas hace más tiempo hasta quedar bajo CODIGO_BARRAS_DIR_MAX_MB."""
+    maximo = current_app.config.get('CODIGO_BARRAS_DIR_MAX_MB', 50) * 1024 * 1024
+    archivos = []
+    for formato in FORMATOS:
+        for ruta in glob.glob(os.path.join(directorio, f'*.{formato}')):
+            try:
+                estado = os.stat(ruta)
+            except OSError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, ruta))
+
+    total = sum(tamano for _, tamano, _ in archivos)
+    if total <= maximo:
+        return
+    for _, tamano, ruta in sorted(archivos):
+        try:
+            os.remove(ruta)
+        except OSError:
+            continue
+        total -= tamano
+        if total <= maximo:
+            return
+
+
+def _recortar_si_corresponde(directorio):
+    """Recorta la carpeta en la primera escritura del proceso y luego cada RECORTAR_CADA."""
+    with _cache_lock:
+        escrituras = _escrituras['desde_recorte']
+        if escrituras is not None and escrituras < RECORTAR_CADA:
+            _escrituras['desde_recorte'] = escrituras + 1
+            return
+        _escrituras['desde_recorte'] = 1
+    try:
+        _recortar_disco(directorio)
+    except OSError as e:
+        print(f"[WARN] No se pudo recortar la caché de códigos de barras: {e}")
+
+
+def _guardar_disco(ruta, imagen):
+    """Escribe la imagen de forma atómica (otro proceso nunca lee un archivo a medias)."""
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f'{ruta}.{uuid.uuid4().hex}.tmp'
+        with open(temporal, 'wb') as archivo:
+            archivo.write(imagen)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        print(f"[WARN] No se pudo guardar el código de barras en disco: {e}")
+        return
+    _recortar_si_corresponde(os.path.dirname(ruta))
+
+
+def _guardar_memoria(clave, imagen):
+    maximo = current_app.config.get('CODIGO_BARRAS_CACHE_MAX', 256)
+    if maximo <= 0:
+        return
+    with _cache_lock:
+        _cache[clave] = imagen
+        _cache.move_to_end(clave)
+        while len(_cache) > maximo:
+            _cache.popitem(last=False)
+
+
+def imagen_codigo_barras(codigo, formato='png', opciones=None):
+    """
+    Imagen (Code128) del código de barras, desde la caché si ya se generó.
+
+    Args:
+        codigo: texto a codificar (p. ej. pedido.codigo_barras)
+        formato: 'png' o 'svg' (ver FORMATOS)
+        opciones: opciones del writer que reemplazan a OPCIONES_POR_DEFECTO
+
+    Returns:
+        bytes de la imagen
+
+    Raises:
+        ValueError si el formato no existe; las excepciones de python-barcode
+        si el código no se puede codificar
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de código de barras no soportado: {formato}")
+    clave = clave_codigo_barras(codigo, formato, opciones)
+    with _cache_lock:
+        imagen = _cache.get(clave)
+        if imagen is not None:
+            _cache.move_to_end(clave)
+            return imagen
+
+    ruta = _ruta_disco(clave, formato)
+    imagen = _leer_disco(ruta) if ruta else None
+    if imagen is None:
+        imagen = _dibujar(codigo, formato, _opciones(opciones))
+        if ruta:
+            _guardar_disco(ruta, imagen)
+
+    _guardar_memoria(clave, imagen)
+    return imagen
+
+
+def png_codigo_barras(codigo, opciones=None):
+    """PNG del código de barras (adjuntos de correo, descargas)."""
+    return imagen_codigo_barras(codigo, 'png', opciones)
+
+
+def dibujo_codigo_barras(codigo, ancho=4*inch, alto_barras=0.6*inch):
+    """
+    Código de barras como flowable de reportlab (vectorial, sin PIL) para los PDF.
+
+    Args:
+        codigo: texto a codificar
+        ancho: ancho total incluyendo las zonas de silencio
+        alto_barras: alto de las barras (el texto va debajo)
+
+    Returns:
+        reportlab.graphics.barcode.code128.Code128 centrado
+    """
+    # El ancho de módulo se ajusta para que códigos de distinto largo ocupen lo
+    # mismo; las zonas de silencio son fijas (por defecto crecen con el módulo)
+    silencio = 0.25*inch
+    modulos = Code128(codigo, barWidth=1, quiet=False).width
+    dibujo = Code128(
+        codigo,
+        barWidth=(ancho - 2*silencio) / modulos,
+        barHeight=alto_barras,
+        lquiet=silencio,
+        rquiet=silencio,
+        humanReadable=True
+    )
+    dibujo.hAlign = 'CENTER'
+    return dibujo
+
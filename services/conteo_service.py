@@ -0,0 +1,168 @@
+"""
+Servicio de conteos para los listados paginados
+
+Dos modos:
+- Conteo en caché: el COUNT(*) exacto de cada combinación de filtros se guarda
+  en memoria junto con la versión de su grupo de tablas (pedido o usuario).
+  Los triggers de migrations/create_conteo_version.sql avanzan la versión en
+  cada escritura, lo que invalida los conteos de ese grupo.
+- Estimación: para listados sin filtros se usa pg_class.reltuples y para los
+  filtrados la estimación de filas del planificador (EXPLAIN). Si la
+  estimación supera CONTEO_UMBRAL_ESTIMADO se muestra "~12,400" en lugar de
+  recorrer la tabla.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from models import run_query, transaccion
+
+# Grupos de conteo_version (la versión es la suma de las ranuras del grupo; los
+# triggers la avanzan en la misma transacción que la escritura)
+GRUPO_PEDIDO = 'pedido'
+GRUPO_USUARIO = 'usuario'
+
+MAX_ENTRADAS = 2000
+
+_lock = threading.Lock()
+# (grupo, clave) -> (version, guardado_en, valor)
+_cache = OrderedDict()
+
+
+def _version(grupo):
+    """Versión actual del grupo (None si la migración no se aplicó: no se cachea)."""
+    try:
+        with transaccion():
+            fila = run_query(
+                "SELECT SUM(version) FROM conteo_version WHERE grupo = :grupo",
+                {"grupo": grupo},
+                fetchone=True
+            )
+        return fila[0] if fila else None
+    except Exception:
+        return None
+
+
+def _leer(grupo, clave, version):
+    """Valor cacheado si sigue vigente, o None."""
+    if version is None:
+        return None
+    ttl = current_app.config.get('CONTEO_CACHE_SEGUNDOS', 300)
+    with _lock:
+        entrada = _cache.get((grupo, clave))
+        if entrada and entrada[0] == version and time.monotonic() - entrada[1] < ttl:
+            _cache.move_to_end((grupo, clave))
+            return entrada[2]
+    return None
+
+
+def _guardar(grupo, clave, version, valor):
+    if version is None:
+        return
+    with _lock:
+        _cache[(grupo, clave)] = (version, time.monotonic(), valor)
+        _cache.move_to_end((grupo, clave))
+        while len(_cache) > MAX_ENTRADAS:
+            _cache.popitem(last=False)
+
+
+def en_cache(grupo, clave, calcular):
+    """
+    Devuelve el valor cacheado para `clave` si la versión del grupo no cambió;
+    si cambió (o venció CONTEO_CACHE_SEGUNDOS) lo recalcula con calcular().
+
+    Args:
+        grupo: GRUPO_PEDIDO o GRUPO_USUARIO
+        clave: valor hashable que identifica el conteo
+        calcular: función sin argumentos que calcula el valor
+
+    Returns:
+        el valor (cacheado o recién calculado)
+    """
+    version = _version(grupo)
+    valor = _leer(grupo, clave, version)
+    if valor is None:
+        valor = calcular()
+        _guardar(grupo, clave, version, valor)
+    return valor
+
+
+def invalidar_conteos(grupo=None):
+    """Descarta los conteos cacheados (de un grupo o todos)."""
+    with _lock:
+        for clave in [c for c in _cache if grupo is None or c[0] == grupo]:
+            del _cache[clave]
+
+
+def _filas_tabla(tabla):
+    """Filas de la tabla según las estadísticas (None si nunca se analizó)."""
+    fila = run_query(
+        "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:tabla)",
+        {"tabla": tabla},
+        fetchone=True
+    )
+    if not fila or fila[0] is None or fila[0] < 0:
+        return None
+    return int(fila[0])
+
+
+def estimar_filas(desde_sql, params):
+    """
+    Filas que el planificador espera para `SELECT ... <desde_sql>`.
+
+    Args:
+        desde_sql: FROM ... WHERE ... de la consulta
+        params: parámetros de la consulta
+
+    Returns:
+        int o None si no se pudo estimar
+    """
+    fila = run_query(f"EXPLAIN (FORMAT JSON) SELECT 1 {desde_sql}", params, fetchone=True)
+    if not fila:
+        return None
+    plan = fila[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    try:
+        return int(plan[0]['Plan']['Plan Rows'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def contar(desde_sql, params, grupo, tabla=None):
+    """
+    Total de filas de un listado: estimado si es grande, exacto (cacheado) si no.
+
+    Args:
+        desde_sql: FROM ... WHERE ... del listado (sin ORDER BY ni LIMIT)
+        params: parámetros de la consulta
+        grupo: grupo de tablas cuya versión invalida el conteo cacheado
+        tabla: si el listado no tiene filtros, tabla cuyo reltuples es el total
+
+    Returns:
+        tupla (total, aproximado)
+    """
+    params = params or {}
+    clave = (desde_sql, tuple(sorted(params.items())))
+    version = _version(grupo)
+    total = _leer(grupo, clave, version)
+    if total is not None:
+        return total, False
+
+    umbral = current_app.config.get('CONTEO_UMBRAL_ESTIMADO', 10000)
+    if umbral:
+        try:
+            with transaccion():
+                estimado = _filas_tabla(tabla) if tabla else estimar_filas(desde_sql, params)
+        except Exception as e:
+            print(f"[WARN] No se pudo estimar el conteo: {e}")
+            estimado = None
+        if estimado is not None and estimado >= umbral:
+            return estimado, True
+
+    total = run_query(f"SELECT COUNT(*) {desde_sql}", params, fetchone=True)[0]
+    _guardar(grupo, clave, version, total)
+    return total, False
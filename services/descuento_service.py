@@ -0,0 +1,216 @@
+"""
+Servicio de esquemas de descuento por cliente
+
+Un cliente usa la configuración actual (descuento_config) salvo mientras tiene
+pedidos activos (Pendiente / En proceso): entonces conserva el esquema que se
+congeló en cliente_esquema_descuento al crear su primer pedido activo, hasta
+superar el último nivel de ese esquema.
+
+- Lectura (resolver_esquema): una sola consulta de solo lectura, sin escribir
+  aunque el esquema congelado falte o ya no aplique.
+- Escritura (sincronizar_esquema_congelado): solo en las transiciones de los
+  pedidos (crear, cambiar de estado, eliminar).
+
+descuento_config se guarda en memoria; se invalida al crear, editar o eliminar
+niveles (invalidar_config_descuento) y, para los cambios hechos por otros
+procesos, pasados DESCUENTO_CACHE_SEGUNDOS.
+"""
+import json
+import threading
+import time
+
+from flask import current_app
+
+from models import run_query, transaccion
+
+ESTADOS_ACTIVOS = ('Pendiente', 'En proceso')
+
+# Valores por defecto si no hay configuración
+ESQUEMA_POR_DEFECTO = [
+    {"nivel": "Bronce", "porcentaje": 5, "min": 0, "max": 2},
+    {"nivel": "Plata", "porcentaje": 10, "min": 3, "max": 5},
+    {"nivel": "Oro", "porcentaje": 15, "min": 6, "max": 9},
+    {"nivel": "Platino", "porcentaje": 20, "min": 10, "max": None}
+]
+
+_config_lock = threading.Lock()
+_config = {'esquema': None, 'cargado': 0.0, 'generacion': 0}
+_congelados = {'disponible': False}
+
+# Pedidos activos, pedidos sin cancelar y esquema congelado del cliente en una consulta
+_SQL_ESTADO_CLIENTE = """
+    SELECT COUNT(*) FILTER (WHERE estado IN ('Pendiente', 'En proceso')),
+           COUNT(*) FILTER (WHERE estado != 'Cancelado'),
+           {congelado}
+    FROM pedido
+    WHERE id_cliente = :id
+"""
+_SQL_CONGELADO = """(SELECT esquema_json FROM cliente_esquema_descuento
+            WHERE id_cliente = :id AND activo = true)"""
+
+
+def _copiar(esquema):
+    return [dict(nivel) for nivel in esquema]
+
+
+def esquema_actual():
+    """
+    Niveles activos de descuento_config (cacheados en memoria).
+
+    Returns:
+        lista de dicts con nivel, porcentaje, min, max
+    """
+    ttl = current_app.config.get('DESCUENTO_CACHE_SEGUNDOS', 300)
+    with _config_lock:
+        if _config['esquema'] is not None and time.monotonic() - _config['cargado'] < ttl:
+            return _copiar(_config['esquema'])
+        generacion = _config['generacion']
+
+    filas = run_query("""
+        SELECT nivel, porcentaje, pedidos_minimos, pedidos_maximos
+        FROM descuento_config
+        WHERE activo = true
+        ORDER BY pedidos_minimos ASC
+    """, fetchall=True)
+    esquema = [
+        {
+            "nivel": c[0],
+            "porcentaje": int(c[1]),
+            "min": int(c[2]),
+            "max": int(c[3]) if c[3] is not None else None
+        }
+        for c in filas or []
+    ] or ESQUEMA_POR_DEFECTO
+
+    with _config_lock:
+        # Si se invalidó mientras se leía, no guardar una versión que puede ser vieja
+        if _config['generacion'] == generacion:
+            _config['esquema'] = esquema
+            _config['cargado'] = time.monotonic()
+    return _copiar(esquema)
+
+
+def invalidar_config_descuento():
+    """Descarta la configuración cacheada (llamar tras modificar descuento_config)."""
+    with _config_lock:
+        _config['esquema'] = None
+        _config['generacion'] += 1
+
+
+def esquemas_congelados_disponible():
+    """True si existe cliente_esquema_descuento (una vez encontrada no se vuelve a consultar)."""
+    if not _congelados['disponible']:
+        fila = run_query(
+            "SELECT to_regclass('cliente_esquema_descuento') IS NOT NULL",
+            fetchone=True
+        )
+        _congelados['disponible'] = bool(fila and fila[0])
+    return _congelados['disponible']
+
+
+def estado_descuento_cliente(id_cliente):
+    """Tupla (pedidos activos, pedidos sin cancelar, esquema_json congelado o None) en una consulta."""
+    congelado = _SQL_CONGELADO if esquemas_congelados_disponible() else "NULL"
+    fila = run_query(_SQL_ESTADO_CLIENTE.format(congelado=congelado), {"id": id_cliente}, fetchone=True)
+    return (fila[0] or 0, fila[1] or 0, fila[2]) if fila else (0, 0, None)
+
+
+def _esquema_vigente(esquema_json, pedidos_count):
+    """
+    Esquema congelado si sigue vigente; None si no hay, no se puede leer o el
+    cliente ya superó su último nivel (si el último nivel es ilimitado no vence).
+    """
+    if not esquema_json:
+        return None
+    try:
+        esquema = json.loads(esquema_json)
+    except (TypeError, ValueError):
+        return None
+    if not esquema:
+        return None
+    max_ultimo = esquema[-1].get("max")
+    if max_ultimo is not None and pedidos_count > max_ultimo:
+        return None
+    return esquema
+
+
+def resolver_esquema(id_cliente):
+    """
+    Esquema de descuento que aplica al cliente (solo lectura).
+
+    - Sin pedidos activos: el esquema actual.
+    - Con pedidos activos: el esquema congelado mientras siga vigente; si no
+      hay o ya venció, el actual (que se congelará en la próxima transición).
+
+    Args:
+        id_cliente: ID del cliente
+
+    Returns:
+        lista de dicts con nivel, porcentaje, min, max
+    """
+    return esquema_para(*estado_descuento_cliente(id_cliente))
+
+
+def esquema_para(activos, pedidos_count, esquema_json):
+    """
+    Esquema que aplica a un cliente a partir de sus datos ya consultados.
+
+    Args:
+        activos: pedidos Pendiente / En proceso
+        pedidos_count: pedidos sin cancelar
+        esquema_json: esquema congelado (cliente_esquema_descuento) o None
+
+    Returns:
+        lista de dicts con nivel, porcentaje, min, max
+    """
+    if activos:
+        vigente = _esquema_vigente(esquema_json, pedidos_count)
+        if vigente is not None:
+            return vigente
+    return esquema_actual()
+
+
+def _liberar(id_cliente):
+    """Desactiva el esquema congelado (UNIQUE(id_cliente, activo): solo se guarda el último)."""
+    run_query(
+        "DELETE FROM cliente_esquema_descuento WHERE id_cliente = :id AND activo = false",
+        {"id": id_cliente},
+        commit=True
+    )
+    run_query("""
+        UPDATE cliente_esquema_descuento
+        SET activo = false
+        WHERE id_cliente = :id AND activo = true
+    """, {"id": id_cliente}, commit=True)
+
+
+def sincronizar_esquema_congelado(id_cliente):
+    """
+    Ajusta el esquema congelado del cliente tras crear, cambiar de estado o
+    eliminar un pedido: lo congela al tener pedidos activos, lo renueva si
+    superó el último nivel y lo libera cuando ya no tiene pedidos activos.
+
+    Llamar dentro de la transacción del cambio; un fallo aquí (p. ej. dos
+    pedidos simultáneos del mismo cliente) no aborta esa transacción.
+
+    Args:
+        id_cliente: ID del cliente
+    """
+    try:
+        with transaccion():
+            if not esquemas_congelados_disponible():
+                return
+            activos, pedidos_count, esquema_json = estado_descuento_cliente(id_cliente)
+            if not activos:
+                if esquema_json is not None:
+                    _liberar(id_cliente)
+                return
+            if _esquema_vigente(esquema_json, pedidos_count) is not None:
+                return
+            _liberar(id_cliente)
+            run_query("""
+                INSERT INTO cliente_esquema_descuento (id_cliente, esquema_json, activo)
+                VALUES (:id, :json, true)
+            """, {"id": id_cliente, "json": json.dumps(esquema_actual())}, commit=True)
+    except Exception as e:
+        print(f"[WARN] No se pudo actualizar el esquema de descuento del cliente {id_cliente}: {e}")
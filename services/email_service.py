@@ -1,10 +1,28 @@
 """
 Servicio de envío de correos electrónicos con SendGrid
+
+Los correos se encolan en un despachador con un número fijo de hilos y una cola
+de tamaño limitado (EmailDispatcher). Cada hilo toma de la cola varios correos
+a la vez, los agrupa y los envía con una conexión HTTP persistente; los errores
+transitorios (429 / 5xx / red) se reintentan con espera exponencial.
+
+Variables de entorno:
+    SENDGRID_API_KEY, SENDGRID_FROM_EMAIL
+    EMAIL_TRANSPORTE: sendgrid (por defecto), consola o memoria (pruebas)
+    EMAIL_WORKERS: hilos de envío (2)
+    EMAIL_COLA_MAX: correos en espera como máximo (500)
+    EMAIL_LOTE_MAX: correos tomados de la cola por envío (50)
+    EMAIL_REINTENTOS: reintentos ante errores transitorios (3)
 """
+import atexit
 import base64
+import http.client
+import json
 import os
+import queue
+import random
 import threading
-from sendgrid import SendGridAPIClient
+import time
 from sendgrid.helpers.mail import (
     Mail,
     Attachment,
@@ -15,11 +33,329 @@ from sendgrid.helpers.mail import (
     ContentId,
 )
 
+SENDGRID_HOST = 'api.sendgrid.com'
+SENDGRID_RUTA_ENVIO = '/v3/mail/send'
+# SendGrid admite hasta 1000 personalizations por petición
+SENDGRID_MAX_DESTINATARIOS = 1000
+
+
+class ErrorTransitorio(Exception):
+    """Error de envío que vale la pena reintentar (límite de tasa, 5xx, red)."""
+
+
+def _remitente():
+    """
+    Email del remitente: evita usar dominios no autenticados por DMARC.
+    Si falta la variable en Render, usa el correo operativo del proyecto.
+    """
+    from_email = os.getenv('SENDGRID_FROM_EMAIL')
+    if not from_email:
+        from_email = 'lalavanderiabogota@gmail.com'
+        print(
+            "[WARN] SENDGRID_FROM_EMAIL no configurado; usando fallback "
+            "lalavanderiabogota@gmail.com",
+            flush=True
+        )
+    return from_email
+
+
+def _agregar_adjuntos(message, attachments):
+    """Adjunta archivos opcionales (por ejemplo, código de barras del pedido)."""
+    for idx, attachment_data in enumerate(attachments or [], start=1):
+        try:
+            if not isinstance(attachment_data, dict):
+                print(f"[WARN] Adjunto #{idx} inválido: se esperaba un dict", flush=True)
+                continue
+
+            filename = attachment_data.get('filename', f'adjunto_{idx}.bin')
+            mime_type = attachment_data.get('mime_type', 'application/octet-stream')
+            disposition_value = attachment_data.get('disposition', 'attachment')
+            content_id_value = attachment_data.get('content_id')
+            content_bytes = attachment_data.get('content_bytes', attachment_data.get('content'))
+
+            if not content_bytes:
+                print(f"[WARN] Adjunto omitido ({filename}): contenido vacío", flush=True)
+                continue
+
+            if isinstance(content_bytes, str):
+                content_bytes = content_bytes.encode('utf-8')
+
+            encoded_content = base64.b64encode(content_bytes).decode('utf-8')
+
+            attachment = Attachment(
+                file_content=FileContent(encoded_content),
+                file_name=FileName(filename),
+                file_type=FileType(mime_type),
+                disposition=Disposition(disposition_value)
+            )
+
+            if content_id_value:
+                attachment.content_id = ContentId(content_id_value)
+
+            message.add_attachment(attachment)
+        except Exception as attachment_error:
+            print(f"[WARN] Error procesando adjunto #{idx}: {attachment_error}", flush=True)
+
+
+def _clave_contenido(mensaje):
+    """Correos con el mismo asunto, cuerpo y adjuntos pueden ir en una sola petición."""
+    adjuntos = tuple(
+        (a.get('filename'), a.get('content_id'), hash(a.get('content_bytes', a.get('content'))))
+        for a in (mensaje.get('attachments') or []) if isinstance(a, dict)
+    )
+    return (mensaje['asunto'], mensaje['cuerpo_html'], adjuntos)
+
+
+def agrupar_mensajes(mensajes, max_destinatarios=SENDGRID_MAX_DESTINATARIOS):
+    """
+    Agrupa los mensajes con idéntico contenido.
+
+    Returns:
+        lista de listas de mensajes; cada lista se envía en una sola petición
+    """
+    grupos = {}
+    for mensaje in mensajes:
+        grupos.setdefault(_clave_contenido(mensaje), []).append(mensaje)
+
+    lotes = []
+    for grupo in grupos.values():
+        for i in range(0, len(grupo), max_destinatarios):
+            lotes.append(grupo[i:i + max_destinatarios])
+    return lotes
+
+
+# -----------------------------------------------
+# TRANSPORTES
+# -----------------------------------------------
+class TransporteSendGrid:
+    """
+    Envía por la API v3 de SendGrid con una conexión HTTPS persistente
+    (keep-alive) por hilo de envío.
+    """
+
+    def __init__(self, api_key, timeout=15):
+        self.api_key = api_key
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPSConnection(SENDGRID_HOST, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _cerrar_conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def enviar(self, mensaje, destinatarios):
+        """Envía un mensaje a uno o varios destinatarios (una personalization por destinatario)."""
+        message = Mail(
+            from_email=_remitente(),
+            to_emails=destinatarios if len(destinatarios) > 1 else destinatarios[0],
+            subject=mensaje['asunto'],
+            html_content=mensaje['cuerpo_html'],
+            is_multiple=len(destinatarios) > 1
+        )
+        _agregar_adjuntos(message, mensaje.get('attachments'))
+
+        cuerpo = json.dumps(message.get())
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+        }
+        try:
+            conn = self._conexion()
+            conn.request('POST', SENDGRID_RUTA_ENVIO, body=cuerpo, headers=headers)
+            response = conn.getresponse()
+            detalle = response.read()  # leer completo para poder reutilizar la conexión
+        except (OSError, http.client.HTTPException) as e:
+            self._cerrar_conexion()
+            raise ErrorTransitorio(f"Error de red: {e}") from e
+
+        if response.status in (200, 201, 202):
+            return
+        if response.status == 429 or response.status >= 500:
+            raise ErrorTransitorio(f"SendGrid response: {response.status}")
+        raise RuntimeError(f"SendGrid response: {response.status} {detalle[:300]!r}")
+
+
+class TransporteConsola:
+    """Solo imprime los correos (desarrollo local sin API key)."""
+
+    def enviar(self, mensaje, destinatarios):
+        print(f"[MAIL] (consola) to={', '.join(destinatarios)} subject={mensaje['asunto']}", flush=True)
+
+
+class TransporteMemoria:
+    """Guarda los correos en una lista (pruebas)."""
+
+    def __init__(self):
+        self.enviados = []
+        self._lock = threading.Lock()
+
+    def enviar(self, mensaje, destinatarios):
+        with self._lock:
+            for destinatario in destinatarios:
+                self.enviados.append(dict(mensaje, destinatario=destinatario))
+
+
+def crear_transporte():
+    """Crea el transporte según EMAIL_TRANSPORTE (None si no se puede enviar)."""
+    tipo = os.getenv('EMAIL_TRANSPORTE', 'sendgrid').strip().lower()
+    if tipo == 'consola':
+        return TransporteConsola()
+    if tipo == 'memoria':
+        return TransporteMemoria()
+
+    sendgrid_api_key = os.getenv('SENDGRID_API_KEY')
+    if not sendgrid_api_key:
+        print("[WARN] SENDGRID_API_KEY no configurado en las variables de entorno", flush=True)
+        print("[WARN] Agrega la variable SENDGRID_API_KEY en Render", flush=True)
+        return None
+    return TransporteSendGrid(sendgrid_api_key)
+
+
+# -----------------------------------------------
+# DESPACHADOR
+# -----------------------------------------------
+class EmailDispatcher:
+    """
+    Pool fijo de hilos que envía los correos de una cola acotada.
+
+    Args:
+        transporte: objeto con enviar(mensaje, destinatarios)
+        workers: número de hilos de envío
+        cola_max: tamaño máximo de la cola
+        lote_max: correos tomados de la cola en cada vuelta
+        reintentos: reintentos ante ErrorTransitorio
+        espera_base: segundos de la primera espera entre reintentos
+    """
+
+    def __init__(self, transporte, workers=2, cola_max=500, lote_max=50, reintentos=3, espera_base=1.0):
+        self.transporte = transporte
+        self.lote_max = max(1, lote_max)
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self._cola = queue.Queue(maxsize=cola_max)
+        self._hilos = []
+        for i in range(max(1, workers)):
+            hilo = threading.Thread(target=self._trabajar, name=f'email-{i}', daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def encolar(self, mensaje, timeout=2.0):
+        """
+        Agrega un correo a la cola. Si está llena espera hasta timeout segundos
+        (contrapresión) y luego lo descarta.
+
+        Returns:
+            True si quedó encolado
+        """
+        try:
+            self._cola.put(mensaje, timeout=timeout)
+            return True
+        except queue.Full:
+            print(f"[ERROR] Cola de correos llena; se descarta el correo a {mensaje['destinatario']}", flush=True)
+            return False
+
+    def pendientes(self):
+        """Correos en espera en la cola."""
+        return self._cola.qsize()
+
+    def _tomar_lote(self):
+        """Bloquea hasta tener un correo y toma sin esperar los siguientes (hasta lote_max)."""
+        lote = [self._cola.get()]
+        # None es la señal de parada: cada hilo toma como máximo una
+        while lote[-1] is not None and len(lote) < self.lote_max:
+            try:
+                lote.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _trabajar(self):
+        while True:
+            lote = self._tomar_lote()
+            detener = None in lote
+            mensajes = [m for m in lote if m is not None]
+            try:
+                for grupo in agrupar_mensajes(mensajes):
+                    self._enviar_con_reintentos(grupo[0], [m['destinatario'] for m in grupo])
+            finally:
+                for _ in lote:
+                    self._cola.task_done()
+            if detener:
+                return
+
+    def _enviar_con_reintentos(self, mensaje, destinatarios):
+        for intento in range(self.reintentos + 1):
+            try:
+                self.transporte.enviar(mensaje, destinatarios)
+                print(f"[OK] Correo enviado a {', '.join(destinatarios)}: {mensaje['asunto']}", flush=True)
+                return True
+            except ErrorTransitorio as e:
+                if intento == self.reintentos:
+                    print(f"[ERROR] Enviando correo a {', '.join(destinatarios)} tras {intento + 1} intentos: {e}", flush=True)
+                    return False
+                espera = self.espera_base * (2 ** intento) * (0.5 + random.random())
+                print(f"[WARN] {e}; reintento en {espera:.1f}s", flush=True)
+                time.sleep(espera)
+            except Exception as e:
+                print(f"[ERROR] Enviando correo a {', '.join(destinatarios)}: {e}", flush=True)
+                return False
+        return False
+
+    def detener(self, timeout=10.0):
+        """Envía lo pendiente y detiene los hilos (espera como máximo timeout segundos)."""
+        limite = time.monotonic() + timeout
+        for _ in self._hilos:
+            try:
+                self._cola.put(None, timeout=max(0.0, limite - time.monotonic()))
+            except queue.Full:
+                break
+        for hilo in self._hilos:
+            hilo.join(max(0.0, limite - time.monotonic()))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def obtener_dispatcher():
+    """Devuelve el despachador global (lo crea la primera vez; None si no hay transporte)."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                transporte = crear_transporte()
+                if transporte is None:
+                    return None
+                _dispatcher = EmailDispatcher(
+                    transporte,
+                    workers=int(os.getenv('EMAIL_WORKERS', 2)),
+                    cola_max=int(os.getenv('EMAIL_COLA_MAX', 500)),
+                    lote_max=int(os.getenv('EMAIL_LOTE_MAX', 50)),
+                    reintentos=int(os.getenv('EMAIL_REINTENTOS', 3))
+                )
+                atexit.register(_dispatcher.detener)
+    return _dispatcher
+
+
+def configurar_dispatcher(dispatcher):
+    """Reemplaza el despachador global (por ejemplo con un TransporteMemoria en pruebas)."""
+    global _dispatcher
+    with _dispatcher_lock:
+        _dispatcher = dispatcher
+
 
 def send_email_async(destinatario, asunto, cuerpo_html, attachments=None):
     """
     Envía un correo de forma asíncrona para no bloquear la aplicación.
-    
+
     Args:
         destinatario: email del destinatario
         asunto: asunto del correo
@@ -30,90 +366,22 @@ def send_email_async(destinatario, asunto, cuerpo_html, attachments=None):
             - mime_type: tipo MIME (ej: image/png)
             - disposition: attachment/inline (opcional)
             - content_id: id para inline cid: (opcional)
+
+    Returns:
+        True si el correo quedó encolado
     """
-    def _send():
-        try:
-            print(f"[MAIL] send_email_async to={destinatario} subject={asunto}", flush=True)
-            if not destinatario or '@' not in destinatario:
-                print(f"[WARN] Email destinatario invalido: {destinatario}", flush=True)
-                return
+    print(f"[MAIL] send_email_async to={destinatario} subject={asunto}", flush=True)
+    if not destinatario or '@' not in destinatario:
+        print(f"[WARN] Email destinatario invalido: {destinatario}", flush=True)
+        return False
 
-            # Obtener API key de SendGrid
-            sendgrid_api_key = os.getenv('SENDGRID_API_KEY')
-            if not sendgrid_api_key:
-                print("[WARN] SENDGRID_API_KEY no configurado en las variables de entorno", flush=True)
-                print("[WARN] Agrega la variable SENDGRID_API_KEY en Render", flush=True)
-                return
-            
-            # Email del remitente: evita usar dominios no autenticados por DMARC.
-            # Si falta la variable en Render, usa el correo operativo del proyecto.
-            from_email = os.getenv('SENDGRID_FROM_EMAIL')
-            if not from_email:
-                from_email = 'lalavanderiabogota@gmail.com'
-                print(
-                    "[WARN] SENDGRID_FROM_EMAIL no configurado; usando fallback "
-                    "lalavanderiabogota@gmail.com",
-                    flush=True
-                )
-            
-            # Crear mensaje
-            message = Mail(
-                from_email=from_email,
-                to_emails=destinatario,
-                subject=asunto,
-                html_content=cuerpo_html
-            )
+    dispatcher = obtener_dispatcher()
+    if dispatcher is None:
+        return False
 
-            # Adjuntar archivos opcionales (por ejemplo, código de barras del pedido)
-            if attachments:
-                for idx, attachment_data in enumerate(attachments, start=1):
-                    try:
-                        if not isinstance(attachment_data, dict):
-                            print(f"[WARN] Adjunto #{idx} inválido: se esperaba un dict", flush=True)
-                            continue
-
-                        filename = attachment_data.get('filename', f'adjunto_{idx}.bin')
-                        mime_type = attachment_data.get('mime_type', 'application/octet-stream')
-                        disposition_value = attachment_data.get('disposition', 'attachment')
-                        content_id_value = attachment_data.get('content_id')
-                        content_bytes = attachment_data.get('content_bytes', attachment_data.get('content'))
-
-                        if not content_bytes:
-                            print(f"[WARN] Adjunto omitido ({filename}): contenido vacío", flush=True)
-                            continue
-
-                        if isinstance(content_bytes, str):
-                            content_bytes = content_bytes.encode('utf-8')
-
-                        encoded_content = base64.b64encode(content_bytes).decode('utf-8')
-
-                        attachment = Attachment(
-                            file_content=FileContent(encoded_content),
-                            file_name=FileName(filename),
-                            file_type=FileType(mime_type),
-                            disposition=Disposition(disposition_value)
-                        )
-
-                        if content_id_value:
-                            attachment.content_id = ContentId(content_id_value)
-
-                        message.add_attachment(attachment)
-                    except Exception as attachment_error:
-                        print(f"[WARN] Error procesando adjunto #{idx}: {attachment_error}", flush=True)
-            
-            # Enviar
-            sg = SendGridAPIClient(sendgrid_api_key)
-            response = sg.send(message)
-            
-            if response.status_code in [200, 201, 202]:
-                print(f"[OK] Correo enviado a {destinatario}: {asunto}", flush=True)
-            else:
-                print(f"[ERROR] SendGrid response: {response.status_code}", flush=True)
-                
-        except Exception as e:
-            print(f"[ERROR] Enviando correo a {destinatario}: {e}", flush=True)
-    
-    # Ejecutar en thread separado
-    thread = threading.Thread(target=_send)
-    thread.daemon = False
-    thread.start()
+    return dispatcher.encolar({
+        'destinatario': destinatario,
+        'asunto': asunto,
+        'cuerpo_html': cuerpo_html,
+        'attachments': attachments,
+    })
@@ -0,0 +1,415 @@
+"""
+Servicio de exportación de reportes a Excel
+
+El libro se escribe en modo write-only de openpyxl (las filas van directo al
+archivo, sin mantener las hojas en memoria) y las consultas grandes se leen
+por bloques con cursores del lado del servidor (run_query_stream), así la
+memoria no depende del tamaño de las tablas.
+"""
+import os
+import tempfile
+
+from models import run_query, run_query_stream
+from services.precio_service import sql_join_precio, sql_precio
+
+
+EXCEL_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Filas por bloque leídas desde la base de datos
+TAMANO_BLOQUE = 2000
+
+
+# Hojas de detalle: (nombre de hoja, encabezados, consulta)
+# __JOIN_PRECIO__ / __PRECIO__ se reemplazan al exportar por el JOIN con el
+# catálogo de precios (ver _preparar_consulta)
+HOJAS_REPORTE = [
+    ('Estados', ['Estado', 'Cantidad', 'Porcentaje'], """
+        SELECT estado, COUNT(*) as cantidad,
+               ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (), 2) as porcentaje
+        FROM pedido
+        GROUP BY estado
+        ORDER BY cantidad DESC
+    """),
+    ('Prendas por Tipo', ['Tipo Prenda', 'Cantidad', 'Porcentaje'], """
+        SELECT tipo, SUM(cantidad) as cantidad,
+               ROUND(SUM(cantidad) * 100.0 / NULLIF(SUM(SUM(cantidad)) OVER (), 0), 2) as porcentaje
+        FROM prenda
+        GROUP BY tipo
+        ORDER BY cantidad DESC
+    """),
+    ('Top 50 Clientes', [
+        'Nombre', 'Email', 'Telefono', 'Total Pedidos', 'Completados', 'Activos',
+        'Total Prendas', 'Total Gastado (COP)', 'Ticket Promedio (COP)',
+        'Ultimo Pedido', 'Primer Pedido', 'Dias Entre Pedidos'
+    ], """
+        SELECT
+            c.nombre,
+            c.email,
+            c.telefono,
+            COUNT(DISTINCT p.id_pedido) as total_pedidos,
+            COUNT(DISTINCT CASE WHEN p.estado = 'Completado' THEN p.id_pedido END) as pedidos_completados,
+            COUNT(DISTINCT CASE WHEN p.estado IN ('Pendiente', 'En proceso') THEN p.id_pedido END) as pedidos_activos,
+            COALESCE(SUM(pr.cantidad), 0) as total_prendas,
+            ROUND(COALESCE(SUM(r.total), 0)::numeric, 2) as total_gastado,
+            ROUND(COALESCE(AVG(r.total), 0)::numeric, 2) as ticket_promedio,
+            MAX(p.fecha_ingreso)::date as ultimo_pedido,
+            MIN(p.fecha_ingreso)::date as primer_pedido,
+            ROUND((EXTRACT(days FROM (MAX(p.fecha_ingreso) - MIN(p.fecha_ingreso))) / NULLIF(COUNT(DISTINCT p.id_pedido) - 1, 0))::numeric, 1) as dias_entre_pedidos
+        FROM cliente c
+        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
+        LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
+        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
+        GROUP BY c.id_cliente, c.nombre, c.email, c.telefono
+        HAVING COUNT(DISTINCT p.id_pedido) > 0
+        ORDER BY total_gastado DESC, total_pedidos DESC
+        LIMIT 50
+    """),
+    ('Pedidos por Dia', ['Fecha', 'Cantidad Pedidos'], """
+        SELECT fecha_ingreso::date as fecha, COUNT(*) as cantidad
+        FROM pedido
+        WHERE fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
+        GROUP BY fecha_ingreso::date
+        ORDER BY fecha DESC
+    """),
+    ('Clientes Nuevos', ['Fecha', 'Clientes Nuevos'], """
+        SELECT p.fecha_ingreso::date as fecha, COUNT(DISTINCT p.id_cliente) as clientes
+        FROM pedido p
+        WHERE p.fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
+        GROUP BY p.fecha_ingreso::date
+        ORDER BY fecha DESC
+    """),
+    ('Ingresos por Mes', ['Mes', 'Ingresos (COP)'], """
+        SELECT
+            TO_CHAR(fecha, 'YYYY-MM') as mes,
+            SUM(monto) as total
+        FROM recibo
+        WHERE fecha >= CURRENT_DATE - INTERVAL '12 months'
+        GROUP BY TO_CHAR(fecha, 'YYYY-MM')
+        ORDER BY mes DESC
+    """),
+    ('Detalle Pedidos', [
+        'ID Pedido', 'Cliente', 'Telefono', 'Fecha Ingreso', 'Fecha Entrega',
+        'Dias Proc.', 'Estado', 'Dir. Entrega', 'Dir. Recogida', 'Cant. Prendas',
+        'Subtotal (COP)', 'Descuento (COP)', 'Total (COP)', 'Metodo Pago', 'Observaciones'
+    ], """
+        SELECT
+            p.id_pedido,
+            c.nombre as cliente,
+            c.telefono,
+            p.fecha_ingreso::date as fecha_ingreso,
+            p.fecha_entrega::date as fecha_entrega,
+            CASE
+                WHEN p.fecha_entrega IS NOT NULL AND p.estado = 'Completado'
+                THEN (p.fecha_entrega::date - p.fecha_ingreso::date)
+                ELSE NULL
+            END as dias_procesamiento,
+            p.estado,
+            p.direccion_entrega,
+            p.direccion_recogida,
+            COALESCE((SELECT SUM(pr.cantidad) FROM prenda pr WHERE pr.id_pedido = p.id_pedido), 0) as cantidad_prendas,
+            COALESCE(r.subtotal, 0) as subtotal,
+            COALESCE(r.descuento, 0) as descuento,
+            COALESCE(r.total, 0) as total,
+            r.metodo_pago,
+            p.observaciones
+        FROM pedido p
+        LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
+        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
+        ORDER BY p.fecha_ingreso DESC
+    """),
+    ('Todos los Clientes', [
+        'ID', 'Nombre', 'Email', 'Telefono', 'Total Pedidos', 'Completados', 'Total Prendas', 'Total Gastado (COP)'
+    ], """
+        SELECT
+            c.id_cliente,
+            c.nombre,
+            c.email,
+            c.telefono,
+            COUNT(DISTINCT p.id_pedido) as total_pedidos,
+            COUNT(DISTINCT CASE WHEN p.estado = 'Completado' THEN p.id_pedido END) as pedidos_completados,
+            COALESCE(SUM(pr.cantidad), 0) as total_prendas,
+            COALESCE(SUM(r.total), 0) as total_gastado
+        FROM cliente c
+        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
+        LEFT JOIN prenda pr ON p.id_pedido = pr.id_pedido
+        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
+        GROUP BY c.id_cliente, c.nombre, c.email, c.telefono
+        ORDER BY total_pedidos DESC, total_gastado DESC
+    """),
+    ('Prendas Detalle', ['ID Pedido', 'Cliente', 'Tipo Prenda', 'Cantidad', 'Color', 'Estado', 'Observaciones'], """
+        SELECT
+            p.id_pedido,
+            c.nombre as cliente,
+            pr.tipo,
+            pr.cantidad,
+            pr.color,
+            pr.estado as estado_prenda,
+            pr.observaciones
+        FROM prenda pr
+        JOIN pedido p ON pr.id_pedido = p.id_pedido
+        JOIN cliente c ON p.id_cliente = c.id_cliente
+        ORDER BY p.id_pedido DESC, pr.tipo
+    """),
+    ('Rentabilidad Mensual', [
+        'Mes', 'Pedidos', 'Clientes', 'Subtotal (COP)', 'Descuentos (COP)',
+        'Ingresos Netos (COP)', 'Ticket Promedio (COP)', 'Total Desc. (COP)'
+    ], """
+        SELECT
+            TO_CHAR(r.fecha, 'YYYY-MM') as mes,
+            COUNT(DISTINCT r.id_pedido) as pedidos,
+            COUNT(DISTINCT p.id_cliente) as clientes,
+            SUM(r.subtotal) as subtotal,
+            SUM(r.descuento) as descuentos_aplicados,
+            SUM(r.total) as ingresos_netos,
+            AVG(r.total) as ticket_promedio,
+            SUM(r.subtotal) - SUM(r.total) as descuentos_totales
+        FROM recibo r
+        JOIN pedido p ON r.id_pedido = p.id_pedido
+        WHERE r.fecha >= CURRENT_DATE - INTERVAL '12 months'
+        GROUP BY TO_CHAR(r.fecha, 'YYYY-MM')
+        ORDER BY mes DESC
+    """),
+    ('Recibos Detallados', [
+        'ID Recibo', 'ID Pedido', 'Cliente', 'Fecha Emision',
+        'Subtotal (COP)', 'Descuento (COP)', 'Total (COP)',
+        'Metodo Pago', 'Estado Pago', 'Estado Pedido'
+    ], """
+        SELECT
+            r.id_recibo,
+            r.id_pedido,
+            c.nombre as cliente,
+            r.fecha::date as fecha_emision,
+            r.subtotal,
+            r.descuento,
+            r.total,
+            r.metodo_pago,
+            r.estado as estado_pago,
+            p.estado as estado_pedido
+        FROM recibo r
+        JOIN pedido p ON r.id_pedido = p.id_pedido
+        JOIN cliente c ON p.id_cliente = c.id_cliente
+        ORDER BY r.fecha DESC
+    """),
+    ('Clientes Inactivos', [
+        'Nombre', 'Email', 'Telefono', 'Total Pedidos',
+        'Ultimo Pedido', 'Dias Inactivo', 'Total Gastado (COP)'
+    ], """
+        SELECT
+            c.nombre,
+            c.email,
+            c.telefono,
+            COUNT(p.id_pedido) as total_pedidos,
+            MAX(p.fecha_ingreso)::date as ultimo_pedido,
+            EXTRACT(days FROM (CURRENT_DATE - MAX(p.fecha_ingreso))) as dias_inactivo,
+            COALESCE(SUM(r.total), 0) as total_gastado
+        FROM cliente c
+        LEFT JOIN pedido p ON c.id_cliente = p.id_cliente
+        LEFT JOIN recibo r ON p.id_pedido = r.id_pedido
+        GROUP BY c.id_cliente, c.nombre, c.email, c.telefono
+        HAVING MAX(p.fecha_ingreso) < CURRENT_DATE - INTERVAL '60 days'
+               OR MAX(p.fecha_ingreso) IS NULL
+        ORDER BY dias_inactivo DESC NULLS FIRST
+        LIMIT 100
+    """),
+    ('Analisis Descuentos', [
+        'Cliente', 'Pedidos con Descuento', 'Total Descuentos (COP)',
+        'Descuento Promedio (COP)', 'Subtotal Acumulado (COP)',
+        'Total Pagado (COP)', 'Porcentaje Desc. Promedio'
+    ], """
+        SELECT
+            c.nombre as cliente,
+            COUNT(r.id_recibo) as pedidos_con_descuento,
+            SUM(r.descuento) as total_descuentos,
+            AVG(r.descuento) as descuento_promedio,
+            SUM(r.subtotal) as subtotal_acumulado,
+            SUM(r.total) as total_pagado,
+            ROUND((SUM(r.descuento) / NULLIF(SUM(r.subtotal), 0) * 100)::numeric, 2) as porcentaje_desc_promedio
+        FROM recibo r
+        JOIN pedido p ON r.id_pedido = p.id_pedido
+        JOIN cliente c ON p.id_cliente = c.id_cliente
+        WHERE r.descuento > 0
+        GROUP BY c.id_cliente, c.nombre
+        ORDER BY total_descuentos DESC
+        LIMIT 50
+    """),
+    ('Prendas Rentables', [
+        'Tipo Prenda', 'Cantidad Procesada', 'Pedidos',
+        'Precio Unitario (COP)', 'Ingreso Estimado (COP)'
+    ], """
+        SELECT
+            pr.tipo,
+            SUM(pr.cantidad) as cantidad_procesada,
+            COUNT(DISTINCT pr.id_pedido) as pedidos,
+            __PRECIO__ as precio_unitario,
+            SUM(pr.cantidad) * __PRECIO__ as ingreso_estimado
+        FROM prenda pr
+        __JOIN_PRECIO__
+        GROUP BY pr.tipo, pp.precio
+        ORDER BY ingreso_estimado DESC
+    """),
+    ('Rendimiento x Dia', ['Dia Semana', 'Pedidos', 'Clientes Unicos', 'Dias Promedio Entrega'], """
+        SELECT
+            CASE EXTRACT(dow FROM fecha_ingreso)
+                WHEN 0 THEN 'Domingo'
+                WHEN 1 THEN 'Lunes'
+                WHEN 2 THEN 'Martes'
+                WHEN 3 THEN 'Miercoles'
+                WHEN 4 THEN 'Jueves'
+                WHEN 5 THEN 'Viernes'
+                WHEN 6 THEN 'Sabado'
+            END as dia_semana,
+            COUNT(*) as pedidos,
+            COUNT(DISTINCT id_cliente) as clientes_unicos,
+            COALESCE(AVG((fecha_entrega - fecha_ingreso)::integer), 0) as dias_promedio_entrega
+        FROM pedido
+        GROUP BY EXTRACT(dow FROM fecha_ingreso)
+        ORDER BY EXTRACT(dow FROM fecha_ingreso)
+    """),
+]
+
+
+def _fila_encabezado(ws, columnas):
+    """Crea la fila de encabezados en negrita para una hoja write-only."""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    negrita = Font(bold=True)
+    fila = []
+    for columna in columnas:
+        celda = WriteOnlyCell(ws, value=columna)
+        celda.font = negrita
+        fila.append(celda)
+    return fila
+
+
+def _escribir_hoja(wb, titulo, columnas, filas):
+    """
+    Escribe las filas en una hoja nueva. La hoja se crea solo si hay al menos
+    una fila (igual que antes: hojas vacías no se incluyen).
+
+    Returns:
+        número de filas escritas
+    """
+    ws = None
+    total = 0
+    for fila in filas:
+        if ws is None:
+            ws = wb.create_sheet(title=titulo)
+            ws.append(_fila_encabezado(ws, columnas))
+        ws.append(list(fila))
+        total += 1
+    return total
+
+
+def _valor_escalar(query, default=0):
+    """Ejecuta una consulta escalar devolviendo default si falla o es NULL."""
+    try:
+        result = run_query(query, fetchone=True)
+        if not result or result[0] is None:
+            return default
+        return result[0]
+    except Exception as e:
+        print(f"[Resumen - Error: {e}]")
+        return default
+
+
+def _filas_resumen():
+    """Métricas de la hoja 'Resumen Ejecutivo'."""
+    total_pedidos = _valor_escalar("SELECT COUNT(*) FROM pedido")
+    total_completados = _valor_escalar("SELECT COUNT(*) FROM pedido WHERE estado = 'Completado'")
+    total_clientes = _valor_escalar("SELECT COUNT(*) FROM cliente")
+    total_ingresos = _valor_escalar("SELECT COALESCE(SUM(total), 0) FROM recibo")
+    total_prendas = _valor_escalar("SELECT COALESCE(SUM(cantidad), 0) FROM prenda")
+
+    # Métricas avanzadas
+    ticket_promedio = total_ingresos / max(total_completados, 1)
+    valor_por_prenda = total_ingresos / max(total_prendas, 1)
+    clientes_activos_mes = _valor_escalar("""
+        SELECT COUNT(DISTINCT id_cliente) FROM pedido
+        WHERE fecha_ingreso >= CURRENT_DATE - INTERVAL '30 days'
+    """)
+    clientes_recurrentes = _valor_escalar("""
+        SELECT COUNT(*) FROM (
+            SELECT id_cliente FROM pedido GROUP BY id_cliente HAVING COUNT(*) > 1
+        ) subq
+    """)
+
+    return [
+        ('Total Clientes Registrados', total_clientes),
+        ('Clientes Activos (Ultimos 30 dias)', clientes_activos_mes),
+        ('Clientes Recurrentes', clientes_recurrentes),
+        ('Tasa de Retencion (%)', round((clientes_recurrentes / max(total_clientes, 1)) * 100, 2)),
+        ('Total Pedidos', total_pedidos),
+        ('Pedidos Completados', total_completados),
+        ('Pedidos Pendientes', _valor_escalar("SELECT COUNT(*) FROM pedido WHERE estado = 'Pendiente'")),
+        ('Pedidos En Proceso', _valor_escalar("SELECT COUNT(*) FROM pedido WHERE estado = 'En proceso'")),
+        ('Tasa Completacion (%)', round((total_completados / max(total_pedidos, 1)) * 100, 2)),
+        ('Total Prendas Procesadas', total_prendas),
+        ('Promedio Prendas por Pedido', round(_valor_escalar(
+            "SELECT AVG(cnt) FROM (SELECT SUM(cantidad) as cnt FROM prenda GROUP BY id_pedido) subq"), 2)),
+        ('Total Ingresos (COP)', round(total_ingresos, 2)),
+        ('Ticket Promedio (COP)', round(ticket_promedio, 2)),
+        ('Valor Promedio por Prenda (COP)', round(valor_por_prenda, 2)),
+        ('Ingreso Promedio por Cliente (COP)', round(total_ingresos / max(total_clientes, 1), 2)),
+        ('Promedio Dias para Completar', round(_valor_escalar(
+            "SELECT AVG((fecha_entrega - fecha_ingreso)::integer) FROM pedido WHERE estado = 'Completado' AND fecha_entrega IS NOT NULL"), 1)),
+        ('Pedidos por Dia (Promedio)', round(_valor_escalar(
+            "SELECT COUNT(*)::float / NULLIF(COUNT(DISTINCT fecha_ingreso::date), 0) FROM pedido"), 2)),
+        ('Tasa de Crecimiento Mensual (%)', round(_valor_escalar("""
+            SELECT CASE
+                WHEN mes_anterior > 0 THEN ((mes_actual - mes_anterior)::float / mes_anterior) * 100
+                ELSE 0
+            END
+            FROM (
+                SELECT
+                    COUNT(*) FILTER (WHERE fecha_ingreso >= DATE_TRUNC('month', CURRENT_DATE)) as mes_actual,
+                    COUNT(*) FILTER (WHERE fecha_ingreso >= DATE_TRUNC('month', CURRENT_DATE - INTERVAL '1 month')
+                                     AND fecha_ingreso < DATE_TRUNC('month', CURRENT_DATE)) as mes_anterior
+                FROM pedido
+            ) subq
+        """), 2)),
+    ]
+
+
+def _preparar_consulta(query):
+    """Inserta el JOIN con el catálogo de precios en las consultas que lo usan."""
+    return (query
+            .replace('__JOIN_PRECIO__', sql_join_precio('pr.tipo'))
+            .replace('__PRECIO__', sql_precio()))
+
+
+def generar_excel_reportes():
+    """
+    Genera el Excel de reportes en un archivo temporal.
+
+    Returns:
+        ruta del archivo .xlsx generado (el llamador debe borrarlo)
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+
+    # Hoja 1: Resumen General Expandido (SIEMPRE se crea)
+    try:
+        resumen = _filas_resumen()
+    except Exception as e:
+        resumen = [('Error', f'No se pudo generar resumen: {e}')]
+    _escribir_hoja(wb, 'Resumen Ejecutivo', ['Metrica', 'Valor'], resumen)
+    print("[Resumen Ejecutivo]")
+
+    for titulo, columnas, query in HOJAS_REPORTE:
+        try:
+            filas = _escribir_hoja(wb, titulo, columnas, run_query_stream(_preparar_consulta(query), chunk_size=TAMANO_BLOQUE))
+            if filas:
+                print(f"[{titulo}] {filas} filas")
+        except Exception as e:
+            print(f"[{titulo} - Error: {e}]")
+
+    fd, ruta = tempfile.mkstemp(prefix='reportes_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        wb.save(ruta)
+    except Exception:
+        os.remove(ruta)
+        raise
+    return ruta
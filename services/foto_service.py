@@ -0,0 +1,201 @@
+"""
+Servicio de fotos de prendas
+
+En la petición solo se valida la foto (el contenido tiene que ser una imagen
+PNG, JPEG o GIF legible; no basta la extensión) y se guarda tal como llegó.
+Un pool de hilos la procesa después, fuera de la petición:
+
+- corrige la orientación EXIF y re-codifica el original (como máximo
+  FOTOS_ORIGINAL_MAX px de lado), que se conserva para el zoom
+- genera miniaturas JPEG de lado fijo (TAMANOS) en uploads/prendas/miniaturas/
+
+Las páginas y los recibos PDF usan miniatura(foto, tamano), que devuelve el
+original mientras la miniatura no exista (fotos anteriores a este servicio:
+scripts/generar_miniaturas.py).
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+CARPETA_FOTOS = 'uploads/prendas'
+CARPETA_MINIATURAS = 'uploads/prendas/miniaturas'
+
+# nombre -> lado máximo en px (min: listados y recibos PDF, med: vistas de detalle)
+TAMANOS = {'min': 128, 'med': 512}
+
+# Formato detectado por PIL -> formato con el que se re-codifica el original
+FORMATOS_PERMITIDOS = {'JPEG': 'JPEG', 'PNG': 'PNG', 'GIF': None}  # GIF: se conserva (puede ser animado)
+CALIDAD_JPEG = 85
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _ruta_static(relativa):
+    return os.path.join('static', relativa)
+
+
+def ruta_miniatura(foto, tamano='min'):
+    """Ruta (relativa a static/) de la miniatura de una foto, exista o no."""
+    nombre = os.path.splitext(os.path.basename(foto))[0]
+    return f"{CARPETA_MINIATURAS}/{nombre}_{TAMANOS[tamano]}.jpg"
+
+
+def miniatura(foto, tamano='min'):
+    """
+    Miniatura de la foto si ya se generó; si no, la foto original.
+    Registrado como filtro de Jinja: {{ url_for('static', filename=foto|miniatura) }}
+
+    Args:
+        foto: ruta guardada en prenda.foto (relativa a static/)
+        tamano: clave de TAMANOS
+
+    Returns:
+        ruta relativa a static/ (o el mismo valor si foto está vacío)
+    """
+    if not foto:
+        return foto
+    ruta = ruta_miniatura(foto, tamano)
+    return ruta if os.path.exists(_ruta_static(ruta)) else foto
+
+
+def validar_foto(archivo):
+    """
+    Comprueba que el archivo subido sea una imagen permitida y de tamaño razonable.
+    Lee solo la cabecera y deja el stream al inicio.
+
+    Args:
+        archivo: FileStorage de la petición
+
+    Returns:
+        formato de PIL ('JPEG', 'PNG', 'GIF') o None si no es válida
+    """
+    maximo = current_app.config.get('FOTOS_MAX_PIXELES', 40_000_000)
+    try:
+        with Image.open(archivo.stream) as imagen:
+            formato = imagen.format
+            pixeles = imagen.width * imagen.height
+            imagen.verify()
+    except Exception:
+        return None
+    finally:
+        archivo.stream.seek(0)
+    if formato not in FORMATOS_PERMITIDOS or pixeles > maximo:
+        return None
+    return formato
+
+
+def guardar_foto_prenda(archivo, nombre):
+    """
+    Valida y guarda la foto subida en uploads/prendas/ (sin procesar).
+
+    Args:
+        archivo: FileStorage de la petición
+        nombre: nombre de archivo ya saneado (secure_filename)
+
+    Returns:
+        ruta relativa a static/ para prenda.foto, o None si la foto no es válida
+    """
+    if not validar_foto(archivo):
+        return None
+    relativa = f"{CARPETA_FOTOS}/{nombre}"
+    os.makedirs(_ruta_static(CARPETA_FOTOS), exist_ok=True)
+    archivo.save(_ruta_static(relativa))
+    return relativa
+
+
+def _guardar_atomico(imagen, ruta, formato, **opciones):
+    """Guarda la imagen sin que un lector vea el archivo a medias."""
+    temporal = f'{ruta}.{uuid.uuid4().hex}.tmp'
+    imagen.save(temporal, formato, **opciones)
+    os.replace(temporal, ruta)
+
+
+def _a_rgb(imagen):
+    """RGB para JPEG (las transparencias quedan sobre fondo blanco)."""
+    if imagen.mode in ('RGBA', 'LA', 'P'):
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        return fondo
+    return imagen.convert('RGB') if imagen.mode != 'RGB' else imagen
+
+
+def procesar_foto(foto, lado_original=2048):
+    """
+    Orienta y re-codifica el original y genera las miniaturas de una foto.
+
+    Args:
+        foto: ruta relativa a static/ (prenda.foto)
+        lado_original: lado máximo del original re-codificado
+
+    Returns:
+        True si se procesó; False si el archivo no existe o no se pudo leer
+    """
+    ruta = _ruta_static(foto)
+    try:
+        with Image.open(ruta) as abierta:
+            formato = abierta.format
+            # draft(): los JPEG grandes se decodifican ya reducidos (mucho más rápido)
+            if formato == 'JPEG':
+                abierta.draft('RGB', (lado_original, lado_original))
+            imagen = ImageOps.exif_transpose(abierta)
+            imagen.load()
+    except Exception as e:
+        print(f"[WARN] No se pudo leer la foto {foto}: {e}")
+        return False
+
+    destino = FORMATOS_PERMITIDOS.get(formato)
+    if destino:
+        original = imagen.copy()
+        original.thumbnail((lado_original, lado_original), Image.LANCZOS)
+        if destino == 'JPEG':
+            _guardar_atomico(_a_rgb(original), ruta, 'JPEG', quality=CALIDAD_JPEG, optimize=True, progressive=True)
+        else:
+            _guardar_atomico(original, ruta, destino, optimize=True)
+
+    os.makedirs(_ruta_static(CARPETA_MINIATURAS), exist_ok=True)
+    base = _a_rgb(imagen)
+    # De mayor a menor: cada miniatura se reduce desde la anterior
+    for tamano, lado in sorted(TAMANOS.items(), key=lambda t: -t[1]):
+        base = base.copy()
+        base.thumbnail((lado, lado), Image.LANCZOS)
+        _guardar_atomico(base, _ruta_static(ruta_miniatura(foto, tamano)), 'JPEG',
+                         quality=CALIDAD_JPEG, optimize=True)
+    return True
+
+
+def _obtener_pool(app):
+    """Crea el pool de hilos la primera vez que se programa una foto."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=app.config.get('FOTOS_WORKERS', 1),
+                                       thread_name_prefix='fotos')
+        return _pool
+
+
+def _procesar_en_segundo_plano(foto, lado_original):
+    try:
+        procesar_foto(foto, lado_original)
+    except Exception as e:
+        print(f"[WARN] Error procesando la foto {foto}: {e}", flush=True)
+
+
+def programar_fotos(fotos, app=None):
+    """
+    Procesa las fotos en el pool de hilos (llamar después de guardar el pedido).
+
+    Args:
+        fotos: rutas relativas a static/ (prenda.foto)
+    """
+    app = app or current_app._get_current_object()
+    lado_original = app.config.get('FOTOS_ORIGINAL_MAX', 2048)
+    pool = _obtener_pool(app)
+    for foto in fotos:
+        if foto:
+            pool.submit(_procesar_en_segundo_plano, foto, lado_original)
@@ -0,0 +1,206 @@
+"""
+Servicio de lealtad de clientes
+
+cliente_lealtad (migrations/create_cliente_lealtad.sql) guarda por cliente los
+pedidos sin cancelar, el nivel de descuento actual y el siguiente, para que
+los paneles lean una fila en lugar de contar el historial de pedidos.
+
+- registrar_cambio_pedido(): tras crear, cambiar de estado o eliminar un
+  pedido (ajusta el esquema congelado y recalcula la fila del cliente).
+- recalcular_lealtad(): recálculo masivo por lotes, necesario cuando cambia
+  descuento_config (scripts/recalcular_lealtad.py; el panel de descuentos lo
+  lanza en segundo plano con programar_recalculo).
+"""
+import threading
+
+from flask import current_app
+
+from models import run_query, run_many, transaccion
+from services.descuento_service import (
+    estado_descuento_cliente, esquema_para, sincronizar_esquema_congelado, esquemas_congelados_disponible
+)
+
+LOTE_RECALCULO = 500
+
+_tabla = {'disponible': False}
+_recalculo_lock = threading.Lock()
+_recalculo = {'corriendo': False, 'pendiente': False}
+
+_SQL_GUARDAR = """
+    INSERT INTO cliente_lealtad (id_cliente, pedidos, nivel, porcentaje, siguiente_nivel,
+                                 pedidos_faltantes, progreso, fecha_actualizacion)
+    VALUES (:id, :pedidos, :nivel, :porcentaje, :siguiente_nivel, :pedidos_faltantes, :progreso,
+            CURRENT_TIMESTAMP)
+    ON CONFLICT (id_cliente) DO UPDATE SET
+        pedidos = EXCLUDED.pedidos,
+        nivel = EXCLUDED.nivel,
+        porcentaje = EXCLUDED.porcentaje,
+        siguiente_nivel = EXCLUDED.siguiente_nivel,
+        pedidos_faltantes = EXCLUDED.pedidos_faltantes,
+        progreso = EXCLUDED.progreso,
+        fecha_actualizacion = EXCLUDED.fecha_actualizacion
+"""
+
+
+def calcular_lealtad(pedidos_count, esquema):
+    """
+    Nivel del cliente dentro de su esquema de descuento.
+
+    Args:
+        pedidos_count: pedidos del cliente (sin cancelados)
+        esquema: lista de dicts con nivel, porcentaje, min, max
+
+    Returns:
+        dict con pedidos, nivel ("Sin nivel" si no alcanza el primero),
+        porcentaje, siguiente_nivel (None en el último nivel),
+        pedidos_faltantes y progreso (0-100 dentro del nivel)
+    """
+    estado = {"pedidos": pedidos_count, "nivel": None, "porcentaje": 0,
+              "siguiente_nivel": None, "pedidos_faltantes": 0, "progreso": 0}
+
+    for i, nivel_config in enumerate(esquema):
+        min_ped = nivel_config.get("min", 0)
+        max_ped = nivel_config.get("max")
+        if pedidos_count >= min_ped and (max_ped is None or pedidos_count <= max_ped):
+            estado["nivel"] = nivel_config.get("nivel")
+            estado["porcentaje"] = nivel_config.get("porcentaje", 0)
+            if i + 1 < len(esquema):
+                estado["siguiente_nivel"] = esquema[i + 1].get("nivel")
+                estado["pedidos_faltantes"] = max(esquema[i + 1].get("min", 0) - pedidos_count, 0)
+            if max_ped is not None:
+                estado["progreso"] = (pedidos_count - min_ped) / (max_ped - min_ped + 1) * 100
+            else:
+                estado["progreso"] = 100
+            return estado
+
+    if esquema:
+        # Aún no alcanza el primer nivel
+        primer_nivel = esquema[0]
+        min_primero = primer_nivel.get("min", 0)
+        estado["nivel"] = "Sin nivel"
+        estado["siguiente_nivel"] = primer_nivel.get("nivel")
+        estado["pedidos_faltantes"] = max(min_primero - pedidos_count, 0)
+        estado["progreso"] = pedidos_count / min_primero * 100 if min_primero > 0 else 0
+    return estado
+
+
+def _calcular_cliente(id_cliente):
+    """Estado de lealtad del cliente calculado desde los pedidos (sin escribir)."""
+    activos, pedidos_count, esquema_json = estado_descuento_cliente(id_cliente)
+    return calcular_lealtad(pedidos_count, esquema_para(activos, pedidos_count, esquema_json))
+
+
+def _tabla_disponible():
+    """True si existe cliente_lealtad (una vez encontrada no se vuelve a consultar)."""
+    if not _tabla['disponible']:
+        fila = run_query("SELECT to_regclass('cliente_lealtad') IS NOT NULL", fetchone=True)
+        _tabla['disponible'] = bool(fila and fila[0])
+    return _tabla['disponible']
+
+
+def obtener_lealtad(id_cliente):
+    """
+    Estado de lealtad del cliente: la fila de cliente_lealtad o, si aún no
+    existe (cliente sin pedidos, migración sin aplicar), calculado al vuelo.
+
+    Returns:
+        dict como calcular_lealtad
+    """
+    fila = None
+    if _tabla_disponible():
+        fila = run_query("""
+            SELECT pedidos, nivel, porcentaje, siguiente_nivel, pedidos_faltantes, progreso
+            FROM cliente_lealtad
+            WHERE id_cliente = :id
+        """, {"id": id_cliente}, fetchone=True)
+    if not fila:
+        return _calcular_cliente(id_cliente)
+    return {"pedidos": fila[0], "nivel": fila[1], "porcentaje": fila[2], "siguiente_nivel": fila[3],
+            "pedidos_faltantes": fila[4], "progreso": float(fila[5])}
+
+
+def actualizar_lealtad(id_cliente):
+    """Recalcula y guarda la fila de cliente_lealtad (un fallo no aborta la transacción del llamador)."""
+    try:
+        with transaccion():
+            if not _tabla_disponible():
+                return
+            estado = _calcular_cliente(id_cliente)
+            run_query(_SQL_GUARDAR, dict(estado, id=id_cliente), commit=True)
+    except Exception as e:
+        print(f"[WARN] No se pudo actualizar la lealtad del cliente {id_cliente}: {e}")
+
+
+def registrar_cambio_pedido(id_cliente):
+    """
+    Llamar tras crear, cambiar de estado o eliminar un pedido del cliente
+    (dentro de la misma transacción): ajusta el esquema congelado y la lealtad.
+    """
+    sincronizar_esquema_congelado(id_cliente)
+    actualizar_lealtad(id_cliente)
+
+
+def recalcular_lealtad(lote=LOTE_RECALCULO):
+    """
+    Recalcula cliente_lealtad para todos los clientes, por lotes de id
+    (una consulta agregada y un executemany por lote, con un commit cada uno).
+
+    Returns:
+        número de clientes recalculados
+    """
+    congelado = ("(SELECT e.esquema_json FROM cliente_esquema_descuento e "
+                 "WHERE e.id_cliente = c.id_cliente AND e.activo = true)"
+                 if esquemas_congelados_disponible() else "NULL")
+    ultimo = 0
+    total = 0
+    while True:
+        filas = run_query(f"""
+            SELECT c.id_cliente,
+                   COUNT(p.id_pedido) FILTER (WHERE p.estado IN ('Pendiente', 'En proceso')),
+                   COUNT(p.id_pedido) FILTER (WHERE p.estado != 'Cancelado'),
+                   {congelado}
+            FROM cliente c
+            LEFT JOIN pedido p ON p.id_cliente = c.id_cliente
+            WHERE c.id_cliente > :ultimo
+            GROUP BY c.id_cliente
+            ORDER BY c.id_cliente
+            LIMIT :lote
+        """, {"ultimo": ultimo, "lote": lote}, fetchall=True) or []
+        if not filas:
+            return total
+        run_many(_SQL_GUARDAR, [
+            dict(calcular_lealtad(pedidos, esquema_para(activos, pedidos, esquema_json)), id=id_cliente)
+            for id_cliente, activos, pedidos, esquema_json in filas
+        ])
+        total += len(filas)
+        ultimo = filas[-1][0]
+
+
+def programar_recalculo(app=None):
+    """
+    Lanza recalcular_lealtad en un hilo (tras modificar descuento_config).
+    Si ya hay uno corriendo, se repite al terminar para incluir el último cambio.
+    """
+    app = app or current_app._get_current_object()
+    with _recalculo_lock:
+        if _recalculo['corriendo']:
+            _recalculo['pendiente'] = True
+            return
+        _recalculo['corriendo'] = True
+    threading.Thread(target=_recalcular_en_segundo_plano, args=(app,), name='recalculo-lealtad',
+                     daemon=True).start()
+
+
+def _recalcular_en_segundo_plano(app):
+    while True:
+        try:
+            with app.app_context():
+                total = recalcular_lealtad()
+            print(f"[INFO] Lealtad recalculada para {total} clientes", flush=True)
+        except Exception as e:
+            print(f"[WARN] No se pudo recalcular la lealtad: {e}", flush=True)
+        with _recalculo_lock:
+            if not _recalculo['pendiente']:
+                _recalculo['corriendo'] = False
+                return
+            _recalculo['pendiente'] = False
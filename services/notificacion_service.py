@@ -0,0 +1,316 @@
+"""
+Aviso de notificaciones nuevas (long-poll)
+
+/api/notificaciones/esperar deja la petición en espera hasta que el usuario
+recibe una notificación nueva o pasan NOTIFICACIONES_ESPERA_SEGUNDOS. Para
+no agotar los hilos de waitress, como mucho NOTIFICACIONES_ESPERAS_MAX
+peticiones esperan a la vez; las demás reciben "reintentar" y el navegador
+vuelve a preguntar más tarde (como el sondeo anterior).
+
+Las esperas se despiertan por un pub/sub en memoria (_ultimas +
+threading.Condition) alimentado por:
+- PostgreSQL: un hilo con LISTEN sobre el canal que avisa el trigger de
+  migrations/create_notificacion_aviso.sql (solo notificaciones confirmadas,
+  las cree este proceso u otro).
+- Sin LISTEN (otra base de datos, migración sin aplicar): crear_notificacion
+  publica directamente en este proceso.
+
+contador_notificaciones() lee las no leídas y la versión (ETag del listado)
+de notificacion_contador (migrations/create_notificacion_contador.sql).
+
+archivar_notificaciones() mueve las notificaciones antiguas a
+notificacion_archivo por lotes (ver migrations/create_notificacion_archivo.sql);
+se ejecuta con scripts/archivar_notificaciones.py o, una vez al día, en un hilo
+que lanza crear_notificacion.
+"""
+import select
+import threading
+import time
+
+from flask import current_app
+
+from models import db, run_query, transaccion, liberar_conexion_peticion
+
+CANAL = 'notificacion_nueva'
+
+# Segundos entre reintentos de la conexión LISTEN tras un error
+REINTENTO_ESCUCHA = 5
+
+_condicion = threading.Condition()
+# id_usuario -> mayor id_notificacion conocido (solo usuarios con esperas recientes)
+_ultimas = {}
+_estado = {'esperando': 0, 'escuchando': False}
+_MAX_USUARIOS = 10000
+
+_escucha = None
+_escucha_lock = threading.Lock()
+
+# Archivo de notificaciones antiguas: como mucho una ejecución en segundo plano por día
+INTERVALO_ARCHIVO = 24 * 3600
+# Pausa entre lotes para no acaparar la base de datos
+PAUSA_ENTRE_LOTES = 0.1
+_archivo = {'ultimo': 0.0, 'corriendo': False}
+_archivo_lock = threading.Lock()
+
+
+def publicar(id_usuario, id_notificacion):
+    """Registra una notificación nueva y despierta a las esperas de ese usuario."""
+    with _condicion:
+        if id_usuario in _ultimas or len(_ultimas) < _MAX_USUARIOS:
+            _ultimas[id_usuario] = max(_ultimas.get(id_usuario) or 0, id_notificacion)
+        _condicion.notify_all()
+
+
+def publicar_local(id_usuario, id_notificacion):
+    """Publica desde este proceso si no hay LISTEN (con LISTEN avisa el trigger al confirmar)."""
+    if not _estado['escuchando']:
+        publicar(id_usuario, id_notificacion)
+
+
+def contador_notificaciones(id_usuario):
+    """
+    No leídas y versión de las notificaciones del usuario (tabla
+    notificacion_contador, mantenida por triggers).
+
+    Returns:
+        tupla (no_leidas, version), o None si la migración aún no se aplicó
+    """
+    try:
+        with transaccion():
+            fila = run_query(
+                "SELECT no_leidas, version FROM notificacion_contador WHERE id_usuario = :id",
+                {"id": id_usuario},
+                fetchone=True
+            )
+    except Exception:
+        return None
+    return (fila[0], fila[1]) if fila else (0, 0)
+
+
+def _ultima_conocida(id_usuario):
+    """Mayor id_notificacion del usuario (de memoria o, la primera vez, de la base de datos)."""
+    with _condicion:
+        if id_usuario in _ultimas:
+            return _ultimas[id_usuario]
+    fila = run_query(
+        "SELECT COALESCE(MAX(id_notificacion), 0) FROM notificacion WHERE id_usuario = :id",
+        {"id": id_usuario},
+        fetchone=True
+    )
+    ultima = fila[0] if fila else 0
+    with _condicion:
+        if len(_ultimas) >= _MAX_USUARIOS:
+            _ultimas.clear()
+        # Si llegó un aviso mientras se consultaba, ese valor es más reciente
+        _ultimas[id_usuario] = max(_ultimas.get(id_usuario) or 0, ultima)
+        return _ultimas[id_usuario]
+
+
+def esperar_notificacion(id_usuario, ultimo):
+    """
+    Espera a que el usuario tenga una notificación con id mayor que `ultimo`.
+
+    Args:
+        id_usuario: usuario en sesión
+        ultimo: mayor id_notificacion que ya tiene el navegador
+
+    Returns:
+        dict con 'cambios' (bool) y 'ultimo'; 'reintentar' (segundos) si no
+        había lugar para esperar
+    """
+    _iniciar_escucha(current_app._get_current_object())
+
+    ultima = _ultima_conocida(id_usuario)
+    if ultima > ultimo:
+        return {'cambios': True, 'ultimo': ultima}
+
+    espera = current_app.config.get('NOTIFICACIONES_ESPERA_SEGUNDOS', 25)
+    maximo = current_app.config.get('NOTIFICACIONES_ESPERAS_MAX', 2)
+    with _condicion:
+        if not espera or _estado['esperando'] >= maximo:
+            return {'cambios': False, 'ultimo': ultima,
+                    'reintentar': current_app.config.get('NOTIFICACIONES_REINTENTO_SEGUNDOS', 60)}
+        _estado['esperando'] += 1
+
+    # No retener una conexión del pool mientras la petición está dormida
+    liberar_conexion_peticion()
+    try:
+        limite = time.monotonic() + espera
+        with _condicion:
+            while True:
+                ultima = _ultimas.get(id_usuario)
+                # None: la escucha se reconectó y pudo perder avisos, que el navegador recargue
+                if ultima is None or ultima > ultimo:
+                    return {'cambios': True, 'ultimo': ultima or ultimo}
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return {'cambios': False, 'ultimo': ultima}
+                _condicion.wait(restante)
+    finally:
+        with _condicion:
+            _estado['esperando'] -= 1
+
+
+def _iniciar_escucha(app):
+    """Inicia (una vez por proceso) el hilo LISTEN si la base de datos es PostgreSQL."""
+    global _escucha
+    if _escucha is not None:
+        return
+    with _escucha_lock:
+        if _escucha is None:
+            if db.engine.dialect.name != 'postgresql':
+                _escucha = False
+                return
+            _escucha = threading.Thread(target=_bucle_escucha, args=(app,), name='notificaciones', daemon=True)
+            _escucha.start()
+
+
+def _bucle_escucha(app):
+    """Mantiene una conexión con LISTEN y publica cada aviso recibido."""
+    while True:
+        conn = None
+        try:
+            # Conexión propia, fuera del pool: queda abierta mientras dure la escucha
+            with app.app_context():
+                engine = db.engine
+            cargs, cparams = engine.dialect.create_connect_args(engine.url)
+            conn = engine.dialect.connect(*cargs, **cparams)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CANAL}")
+                # Sin el trigger nadie avisa por el canal: seguir publicando en memoria
+                cur.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'trg_notificacion_aviso'")
+                _estado['escuchando'] = cur.fetchone() is not None
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    aviso = conn.notifies.pop(0)
+                    try:
+                        id_usuario, id_notificacion = (int(x) for x in aviso.payload.split(':'))
+                    except ValueError:
+                        continue
+                    publicar(id_usuario, id_notificacion)
+        except Exception as e:
+            print(f"[WARN] Escucha de notificaciones: {e}", flush=True)
+        finally:
+            if _estado['escuchando']:
+                _estado['escuchando'] = False
+                # Sin conexión se pudieron perder avisos: olvidar lo conocido y despertar a todos
+                with _condicion:
+                    _ultimas.clear()
+                    _condicion.notify_all()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(REINTENTO_ESCUCHA)
+
+
+def _por_lotes(sql, params, lote):
+    """Ejecuta una sentencia por lotes (un commit por lote) hasta que afecte menos de `lote` filas."""
+    total = 0
+    while True:
+        fila = run_query(sql, dict(params, lote=lote), fetchone=True, commit=True)
+        movidas = fila[0] if fila else 0
+        total += movidas
+        if movidas < lote:
+            return total
+        time.sleep(PAUSA_ENTRE_LOTES)
+
+
+def archivar_notificaciones(app=None):
+    """
+    Mueve a notificacion_archivo las notificaciones leídas más antiguas que
+    NOTIFICACIONES_RETENCION_LEIDAS_DIAS y todas las más antiguas que
+    NOTIFICACIONES_RETENCION_DIAS; después purga del archivo lo archivado hace
+    más de NOTIFICACIONES_ARCHIVO_DIAS (0 desactiva cada regla).
+
+    Trabaja por lotes de NOTIFICACIONES_LOTE_ARCHIVO filas, cada uno en su
+    propia transacción y con FOR UPDATE SKIP LOCKED: los bloqueos son cortos y
+    dos procesos pueden ejecutarlo a la vez sin esperarse.
+
+    Returns:
+        dict con 'archivadas' y 'purgadas'
+    """
+    app = app or current_app
+    lote = app.config.get('NOTIFICACIONES_LOTE_ARCHIVO', 1000)
+    dias_leidas = app.config.get('NOTIFICACIONES_RETENCION_LEIDAS_DIAS', 90)
+    dias = app.config.get('NOTIFICACIONES_RETENCION_DIAS', 365)
+    dias_archivo = app.config.get('NOTIFICACIONES_ARCHIVO_DIAS', 730)
+
+    condiciones = []
+    if dias_leidas:
+        condiciones.append("(leida = TRUE AND fecha_creacion < NOW() - (:dias_leidas * INTERVAL '1 day'))")
+    if dias:
+        condiciones.append("fecha_creacion < NOW() - (:dias * INTERVAL '1 day')")
+
+    archivadas = 0
+    if condiciones:
+        archivadas = _por_lotes(f"""
+            WITH lote AS (
+                SELECT id_notificacion FROM notificacion
+                WHERE {' OR '.join(condiciones)}
+                LIMIT :lote
+                FOR UPDATE SKIP LOCKED
+            ), movidas AS (
+                DELETE FROM notificacion n
+                USING lote
+                WHERE n.id_notificacion = lote.id_notificacion
+                RETURNING n.id_notificacion, n.id_usuario, n.titulo, n.mensaje, n.tipo,
+                          n.leida, n.url, n.fecha_creacion
+            ), archivadas AS (
+                INSERT INTO notificacion_archivo
+                    (id_notificacion, id_usuario, titulo, mensaje, tipo, leida, url, fecha_creacion)
+                SELECT * FROM movidas
+                ON CONFLICT (id_notificacion) DO NOTHING
+            )
+            SELECT COUNT(*) FROM movidas
+        """, {"dias_leidas": dias_leidas, "dias": dias}, lote)
+
+    purgadas = 0
+    if dias_archivo:
+        purgadas = _por_lotes("""
+            WITH lote AS (
+                SELECT id_notificacion FROM notificacion_archivo
+                WHERE fecha_archivo < NOW() - (:dias * INTERVAL '1 day')
+                LIMIT :lote
+                FOR UPDATE SKIP LOCKED
+            ), purgadas AS (
+                DELETE FROM notificacion_archivo a
+                USING lote
+                WHERE a.id_notificacion = lote.id_notificacion
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM purgadas
+        """, {"dias": dias_archivo}, lote)
+
+    return {'archivadas': archivadas, 'purgadas': purgadas}
+
+
+def programar_archivo(app):
+    """Lanza archivar_notificaciones en un hilo si pasó INTERVALO_ARCHIVO desde la última vez."""
+    with _archivo_lock:
+        ahora = time.monotonic()
+        if _archivo['corriendo'] or (_archivo['ultimo'] and ahora - _archivo['ultimo'] < INTERVALO_ARCHIVO):
+            return
+        _archivo['corriendo'] = True
+        _archivo['ultimo'] = ahora
+    threading.Thread(target=_archivar_en_segundo_plano, args=(app,), name='archivo-notificaciones',
+                     daemon=True).start()
+
+
+def _archivar_en_segundo_plano(app):
+    try:
+        with app.app_context():
+            resultado = archivar_notificaciones(app)
+        if resultado['archivadas'] or resultado['purgadas']:
+            print(f"[INFO] Notificaciones archivadas: {resultado['archivadas']}, "
+                  f"purgadas del archivo: {resultado['purgadas']}", flush=True)
+    except Exception as e:
+        print(f"[WARN] No se pudieron archivar las notificaciones: {e}", flush=True)
+    finally:
+        with _archivo_lock:
+            _archivo['corriendo'] = False
@@ -0,0 +1,288 @@
+"""
+Servicio de outbox transaccional para correos
+
+encolar_email() guarda el correo en la tabla outbox usando la conexión de la
+transacción activa, así el correo solo existe si el cambio que lo origina se
+confirma. Un hilo en segundo plano toma los pendientes en lotes
+(FOR UPDATE SKIP LOCKED, seguro con varios procesos), los envía con el
+transporte de email_service y reintenta con espera exponencial.
+
+Mientras no se aplique migrations/create_outbox.sql los correos se envían
+directamente con send_email_async (sin garantía transaccional) y el worker
+solo revisa de vez en cuando si la tabla ya existe.
+"""
+import base64
+import json
+import threading
+import time
+import traceback
+
+from flask import current_app
+
+from models import run_query
+from services.email_service import ErrorTransitorio, agrupar_mensajes, obtener_dispatcher, send_email_async
+
+ESTADO_PENDIENTE = 'pendiente'
+ESTADO_PROCESANDO = 'procesando'
+ESTADO_ENVIADO = 'enviado'
+ESTADO_ERROR = 'error'
+
+# Un mensaje "procesando" más antiguo que esto se considera abandonado (proceso reiniciado)
+MINUTOS_ABANDONO = 10
+# Los enviados se conservan este tiempo antes de purgarlos
+DIAS_RETENCION = 7
+INTERVALO_MANTENIMIENTO = 3600
+# Sin la tabla outbox, cada cuánto vuelve a comprobar el worker si ya existe (segundos)
+VERIFICAR_TABLA_CADA = 300
+
+_worker = None
+_worker_lock = threading.Lock()
+_despertar = threading.Event()
+_tabla = {'disponible': False}
+
+
+def outbox_disponible():
+    """True si existe la tabla outbox (una vez encontrada no se vuelve a consultar)."""
+    if not _tabla['disponible']:
+        fila = run_query("SELECT to_regclass('outbox') IS NOT NULL", fetchone=True)
+        _tabla['disponible'] = bool(fila and fila[0])
+    return _tabla['disponible']
+
+
+def _serializar_adjuntos(attachments):
+    """Convierte los adjuntos (bytes) a un formato apto para JSON."""
+    resultado = []
+    for adjunto in attachments or []:
+        if not isinstance(adjunto, dict):
+            continue
+        contenido = adjunto.get('content_bytes', adjunto.get('content'))
+        if isinstance(contenido, str):
+            contenido = contenido.encode('utf-8')
+        if not contenido:
+            continue
+        resultado.append({
+            'filename': adjunto.get('filename'),
+            'mime_type': adjunto.get('mime_type'),
+            'disposition': adjunto.get('disposition'),
+            'content_id': adjunto.get('content_id'),
+            'content_b64': base64.b64encode(contenido).decode('ascii'),
+        })
+    return resultado
+
+
+def _deserializar_adjuntos(adjuntos):
+    """Inverso de _serializar_adjuntos (formato que espera email_service)."""
+    resultado = []
+    for adjunto in adjuntos or []:
+        datos = {k: v for k, v in adjunto.items() if k != 'content_b64' and v is not None}
+        datos['content_bytes'] = base64.b64decode(adjunto['content_b64'])
+        resultado.append(datos)
+    return resultado
+
+
+def encolar_email(destinatario, asunto, cuerpo_html, attachments=None):
+    """
+    Guarda un correo en el outbox.
+
+    Llamar dentro de transaccion() para que el correo se confirme (o se
+    descarte) junto con el cambio que lo origina; después llamar a
+    despertar_outbox() para enviarlo sin esperar la siguiente revisión.
+
+    Args:
+        destinatario: email del destinatario
+        asunto: asunto del correo
+        cuerpo_html: contenido HTML del correo
+        attachments: adjuntos en el formato de send_email_async
+
+    Returns:
+        True si se guardó (o se encoló para envío directo), False si el
+        destinatario no es válido
+    """
+    if not destinatario or '@' not in destinatario:
+        print(f"[WARN] Email destinatario invalido: {destinatario}", flush=True)
+        return False
+
+    if not outbox_disponible():
+        # Sin la migración: envío directo, sin abortar la transacción del cambio
+        return send_email_async(destinatario, asunto, cuerpo_html, attachments)
+
+    payload = json.dumps({
+        'destinatario': destinatario,
+        'asunto': asunto,
+        'cuerpo_html': cuerpo_html,
+        'attachments': _serializar_adjuntos(attachments),
+    })
+    run_query(
+        "INSERT INTO outbox (tipo, payload) VALUES ('email', :payload)",
+        {"payload": payload},
+        commit=True
+    )
+    return True
+
+
+def init_outbox(app):
+    """
+    Inicia el worker del outbox con la primera petición atendida, para que
+    los correos pendientes de un proceso anterior se envíen aunque no lleguen
+    nuevos (los scripts que solo importan la app no lo inician).
+
+    Args:
+        app: instancia de Flask
+    """
+    @app.before_request
+    def _asegurar_worker_outbox():
+        _iniciar_worker(app)
+
+
+def despertar_outbox():
+    """Avisa al worker que hay correos nuevos (lo inicia si aún no corre)."""
+    _iniciar_worker(current_app._get_current_object())
+    _despertar.set()
+
+
+def _iniciar_worker(app):
+    """Inicia el hilo del outbox una sola vez por proceso."""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_bucle_worker, args=(app,), name='outbox', daemon=True)
+            _worker.start()
+
+
+def _bucle_worker(app):
+    """
+    Revisa el outbox cada OUTBOX_INTERVALO segundos o al ser despertado.
+    Sin la tabla, o tras errores seguidos, espera más entre revisiones.
+    """
+    intervalo = app.config.get('OUTBOX_INTERVALO', 5)
+    ultimo_mantenimiento = 0.0
+    avisado = False
+    fallos = 0
+    while True:
+        espera = intervalo
+        try:
+            with app.app_context():
+                if not outbox_disponible():
+                    if not avisado:
+                        print("[WARN] Tabla outbox no encontrada (aplicar create_outbox.sql); "
+                              "los correos se envían directamente", flush=True)
+                        avisado = True
+                    espera = VERIFICAR_TABLA_CADA
+                else:
+                    if time.monotonic() - ultimo_mantenimiento > INTERVALO_MANTENIMIENTO:
+                        ultimo_mantenimiento = time.monotonic()
+                        mantenimiento_outbox()
+                    # Procesar lotes mientras haya pendientes
+                    while procesar_outbox(app.config.get('OUTBOX_LOTE', 50)) > 0:
+                        pass
+            fallos = 0
+        except Exception as e:
+            fallos += 1
+            print(f"[ERROR] Worker de outbox: {e}", flush=True)
+            if fallos == 1:
+                traceback.print_exc()
+            espera = min(intervalo * 2 ** fallos, VERIFICAR_TABLA_CADA)
+        _despertar.wait(espera)
+        _despertar.clear()
+
+
+def mantenimiento_outbox():
+    """Recupera mensajes abandonados en 'procesando' y purga los enviados antiguos."""
+    run_query("""
+        UPDATE outbox SET estado = :pendiente
+        WHERE estado = :procesando AND fecha_proceso < NOW() - (:minutos * INTERVAL '1 minute')
+    """, {
+        "pendiente": ESTADO_PENDIENTE,
+        "procesando": ESTADO_PROCESANDO,
+        "minutos": MINUTOS_ABANDONO
+    }, commit=True)
+    run_query("""
+        DELETE FROM outbox WHERE estado = :enviado AND fecha_proceso < NOW() - (:dias * INTERVAL '1 day')
+    """, {"enviado": ESTADO_ENVIADO, "dias": DIAS_RETENCION}, commit=True)
+
+
+def procesar_outbox(lote=50):
+    """
+    Toma hasta `lote` correos pendientes y los envía.
+
+    Returns:
+        número de mensajes tomados (0 si no había pendientes)
+    """
+    filas = run_query("""
+        UPDATE outbox
+        SET estado = :procesando, intentos = intentos + 1, fecha_proceso = NOW()
+        WHERE id_outbox IN (
+            SELECT id_outbox FROM outbox
+            WHERE estado = :pendiente AND proximo_intento <= NOW()
+            ORDER BY id_outbox
+            LIMIT :lote
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id_outbox, payload, intentos
+    """, {"procesando": ESTADO_PROCESANDO, "pendiente": ESTADO_PENDIENTE, "lote": lote},
+        fetchall=True, commit=True) or []
+    if not filas:
+        return 0
+
+    dispatcher = obtener_dispatcher()
+    max_intentos = current_app.config.get('OUTBOX_MAX_INTENTOS', 5)
+
+    mensajes = []
+    for id_outbox, payload, intentos in filas:
+        try:
+            datos = json.loads(payload)
+            datos['attachments'] = _deserializar_adjuntos(datos.get('attachments'))
+        except Exception as e:
+            _marcar_fallo([id_outbox], max_intentos, max_intentos, f"Payload inválido: {e}")
+            continue
+        datos['_id_outbox'] = id_outbox
+        datos['_intentos'] = intentos
+        mensajes.append(datos)
+
+    for grupo in agrupar_mensajes(mensajes):
+        ids = [m['_id_outbox'] for m in grupo]
+        intentos = max(m['_intentos'] for m in grupo)
+        if dispatcher is None:
+            _marcar_fallo(ids, intentos, max_intentos, 'Transporte de correo no configurado')
+            continue
+        try:
+            dispatcher.transporte.enviar(grupo[0], [m['destinatario'] for m in grupo])
+            run_query("""
+                UPDATE outbox SET estado = :enviado, fecha_proceso = NOW(), ultimo_error = NULL
+                WHERE id_outbox = ANY(:ids)
+            """, {"enviado": ESTADO_ENVIADO, "ids": ids}, commit=True)
+            print(f"[OK] Outbox: {len(ids)} correo(s) enviados: {grupo[0]['asunto']}", flush=True)
+        except ErrorTransitorio as e:
+            _marcar_fallo(ids, intentos, max_intentos, str(e))
+        except Exception as e:
+            # Error permanente (ej. 400 de SendGrid): no tiene sentido reintentar
+            _marcar_fallo(ids, max_intentos, max_intentos, str(e))
+
+    return len(filas)
+
+
+def _marcar_fallo(ids, intentos, max_intentos, error):
+    """Programa el reintento con espera exponencial o marca el error definitivo."""
+    if intentos >= max_intentos:
+        print(f"[ERROR] Outbox: {len(ids)} correo(s) descartados: {error}", flush=True)
+        run_query("""
+            UPDATE outbox SET estado = :error, ultimo_error = :mensaje, fecha_proceso = NOW()
+            WHERE id_outbox = ANY(:ids)
+        """, {"error": ESTADO_ERROR, "mensaje": error[:1000], "ids": ids}, commit=True)
+        return
+
+    espera = 30 * (2 ** (intentos - 1))
+    print(f"[WARN] Outbox: reintento en {espera}s: {error}", flush=True)
+    run_query("""
+        UPDATE outbox
+        SET estado = :pendiente, ultimo_error = :mensaje,
+            proximo_intento = NOW() + (:segundos * INTERVAL '1 second')
+        WHERE id_outbox = ANY(:ids)
+    """, {
+        "pendiente": ESTADO_PENDIENTE,
+        "mensaje": error[:1000],
+        "segundos": espera,
+        "ids": ids
+    }, commit=True)
@@ -0,0 +1,167 @@
+"""
+Servicio de paginación por cursor (keyset)
+
+En lugar de LIMIT/OFFSET (cuyo costo crece con el número de página) cada
+página se pide a partir del último id mostrado: WHERE id < :cursor_id ORDER BY
+id DESC LIMIT n. Los enlaces Anterior/Siguiente llevan un cursor opaco firmado
+con SECRET_KEY que guarda el id de referencia, la posición y el total obtenido
+en la primera página, así las páginas siguientes no vuelven a contar.
+"""
+import hashlib
+import json
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+
+from models import run_query
+
+# Direcciones del cursor
+SIGUIENTE = 'sig'
+ANTERIOR = 'ant'
+ULTIMA = 'fin'
+
+_SALT = 'cursor-paginacion'
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt=_SALT)
+
+
+def huella_filtros(**filtros):
+    """Identifica una combinación de filtros y orden (el cursor solo vale para ella)."""
+    datos = json.dumps(filtros, sort_keys=True, default=str)
+    return hashlib.sha1(datos.encode('utf-8')).hexdigest()[:12]
+
+
+def codificar_cursor(direccion, id_ref, desde, total, aproximado, huella):
+    """Genera el token opaco de un cursor."""
+    return _serializer().dumps({
+        'd': direccion, 'id': id_ref, 'o': desde, 't': total, 'a': aproximado, 'f': huella
+    })
+
+
+def decodificar_cursor(token, huella):
+    """
+    Lee un cursor recibido por la URL.
+
+    Returns:
+        dict del cursor, o None si no hay cursor, la firma no es válida o
+        pertenece a otros filtros (en ese caso se muestra la primera página)
+    """
+    if not token:
+        return None
+    try:
+        cursor = _serializer().loads(token)
+    except BadSignature:
+        return None
+    if not isinstance(cursor, dict) or cursor.get('f') != huella:
+        return None
+    if cursor.get('d') not in (SIGUIENTE, ANTERIOR, ULTIMA):
+        return None
+    if cursor.get('d') != ULTIMA and not isinstance(cursor.get('id'), int):
+        return None
+    return cursor
+
+
+def paginar_keyset(query, params, columna_id, orden, token, huella,
+                   por_pagina=10, conteo=None, indice_id=0):
+    """
+    Ejecuta una consulta paginada por cursor.
+
+    Args:
+        query: SELECT con sus filtros (debe terminar en una cláusula WHERE,
+               sin ORDER BY ni LIMIT)
+        params: parámetros de la consulta
+        columna_id: columna única por la que se ordena (ej. 'p.id_pedido')
+        orden: 'asc' o 'desc'
+        token: cursor recibido (request.args['cursor']) o None
+        huella: resultado de huella_filtros() para los filtros actuales
+        por_pagina: filas por página
+        conteo: función que devuelve (total, aproximado) para los mismos
+                filtros (ver conteo_service.contar); solo se llama en la
+                primera página (None = no mostrar total)
+        indice_id: posición de columna_id en cada fila del resultado
+
+    Returns:
+        dict con filas, total, aproximado, pagina, total_paginas, registro_desde,
+        registro_hasta, cursor_anterior, cursor_siguiente y cursor_ultima
+        (los cursores son None cuando el enlace no aplica; "Primera" es la URL
+        sin cursor)
+    """
+    ascendente = orden == 'asc'
+    cursor = decodificar_cursor(token, huella)
+    direccion = cursor['d'] if cursor else None
+
+    total = cursor.get('t') if cursor else None
+    aproximado = bool(cursor.get('a')) if cursor else False
+    if cursor is None and conteo:
+        total, aproximado = conteo()
+
+    # Las páginas hacia atrás se leen en orden inverso y luego se invierten
+    invertido = direccion in (ANTERIOR, ULTIMA)
+    asc_sql = ascendente != invertido
+    sql = query
+    parametros = dict(params)
+    if direccion in (SIGUIENTE, ANTERIOR):
+        sql += f" AND {columna_id} {'>' if asc_sql else '<'} :cursor_id"
+        parametros['cursor_id'] = cursor['id']
+    sql += f" ORDER BY {columna_id} {'ASC' if asc_sql else 'DESC'} LIMIT {por_pagina + 1}"
+
+    filas = run_query(sql, parametros, fetchall=True) or []
+    hay_mas = len(filas) > por_pagina
+    filas = list(filas[:por_pagina])
+    if invertido:
+        filas.reverse()
+
+    # Retrocediendo desde "Última" el inicio puede quedar en una página corta
+    # (p. ej. 5 filas con 25 en total): se muestra la primera página completa,
+    # así los números de página vuelven a coincidir con Siguiente
+    if direccion == ANTERIOR and not hay_mas and len(filas) < por_pagina:
+        direccion = None
+        filas = run_query(
+            query + f" ORDER BY {columna_id} {'ASC' if ascendente else 'DESC'} LIMIT {por_pagina + 1}",
+            params,
+            fetchall=True
+        ) or []
+        hay_mas = len(filas) > por_pagina
+        filas = list(filas[:por_pagina])
+
+    if direccion is None:
+        hay_anterior, hay_siguiente, desde = False, hay_mas, 0
+    elif direccion == SIGUIENTE:
+        hay_anterior, hay_siguiente, desde = True, hay_mas, cursor.get('o') or 0
+    elif direccion == ANTERIOR:
+        hay_anterior, hay_siguiente = hay_mas, True
+        desde = max(cursor.get('o') or 0, 0) if hay_mas else 0
+    else:
+        hay_anterior, hay_siguiente = hay_mas, False
+        desde = max((total or 0) - len(filas), 0)
+
+    # Un cursor de una página que quedó vacía (filas borradas) vuelve al inicio
+    if not filas and cursor is not None:
+        return paginar_keyset(query, params, columna_id, orden, None, huella,
+                              por_pagina, conteo, indice_id)
+
+    def _cursor(dir_, fila, nuevo_desde):
+        id_ref = fila[indice_id] if fila is not None else None
+        return codificar_cursor(dir_, id_ref, nuevo_desde, total, aproximado, huella)
+
+    resultado = {
+        'filas': filas,
+        'total': total,
+        'aproximado': aproximado,
+        'registro_desde': desde + 1 if filas else 0,
+        'registro_hasta': desde + len(filas),
+        # La última página puede no empezar en un múltiplo de por_pagina
+        'pagina': -(-desde // por_pagina) + 1,
+        'total_paginas': max((total + por_pagina - 1) // por_pagina, 1) if total is not None else None,
+        'cursor_anterior': None,
+        'cursor_siguiente': None,
+        'cursor_ultima': None,
+    }
+    if hay_anterior:
+        resultado['cursor_anterior'] = _cursor(ANTERIOR, filas[0], max(desde - por_pagina, 0))
+    if hay_siguiente:
+        resultado['cursor_siguiente'] = _cursor(SIGUIENTE, filas[-1], desde + len(filas))
+        resultado['cursor_ultima'] = _cursor(ULTIMA, None, None)
+    return resultado
@@ -0,0 +1,216 @@
+"""
+Servicio de creación de pedidos (y filtro compartido de los listados)
+"""
+from models import run_query, run_many, transaccion, ensure_cliente_exists
+from services.descuento_service import resolver_esquema
+from services.lealtad_service import registrar_cambio_pedido
+
+
+# El código de barras (LAV-YYYYMMDD-000001) se calcula dentro del propio INSERT
+# reservando el id de la secuencia, así no hace falta un UPDATE posterior.
+_CTE_NUEVO_ID = """
+    WITH nuevo AS (
+        SELECT nextval(pg_get_serial_sequence('pedido', 'id_pedido')) AS id
+    )
+"""
+_EXPR_CODIGO_BARRAS = (
+    "'LAV-' || TO_CHAR(CURRENT_DATE, 'YYYYMMDD') || '-' || "
+    "LPAD(id::text, GREATEST(6, LENGTH(id::text)), '0')"
+)
+
+
+# (tabla, columna) -> True una vez encontrada (no se vuelve a consultar)
+_columnas = {}
+
+
+def _columna_disponible(tabla, columna):
+    """True si la columna existe (p. ej. migraciones aún sin aplicar)."""
+    if not _columnas.get((tabla, columna)):
+        fila = run_query("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = :tabla AND column_name = :columna
+        """, {"tabla": tabla, "columna": columna}, fetchone=True)
+        _columnas[(tabla, columna)] = bool(fila)
+    return _columnas[(tabla, columna)]
+
+
+# Columnas de fecha por las que se puede filtrar (parámetro -> columna)
+CAMPOS_FECHA = {'ingreso': 'p.fecha_ingreso', 'entrega': 'p.fecha_entrega'}
+
+
+def filtro_pedidos(cliente='', estado='', desde='', hasta='', campo_fecha='ingreso'):
+    """
+    Condición SQL de los filtros de pedidos (admin.pedidos y recibos masivos).
+    Supone los alias p (pedido) y c (cliente).
+
+    Args:
+        cliente: nombre (subcadena) o id del cliente
+        estado: estado exacto
+        desde, hasta: fechas YYYY-MM-DD (ambas incluidas)
+        campo_fecha: 'ingreso' o 'entrega' (ver CAMPOS_FECHA)
+
+    Returns:
+        tupla (fragmento SQL que empieza con ' AND' o vacío, parámetros)
+    """
+    filtro_where = ""
+    params = {}
+    if cliente:
+        filtro_where += " AND (LOWER(c.nombre) LIKE LOWER(:cliente) OR c.id_cliente = :cliente_id)"
+        params['cliente'] = f"%{cliente}%"
+        try:
+            params['cliente_id'] = int(cliente)
+        except ValueError:
+            params['cliente_id'] = -1
+
+    if estado:
+        filtro_where += " AND p.estado = :estado"
+        params['estado'] = estado
+
+    # Rangos sobre la columna (no DATE(columna)) para poder usar su índice
+    columna = CAMPOS_FECHA.get(campo_fecha, CAMPOS_FECHA['ingreso'])
+    if desde:
+        filtro_where += f" AND {columna} >= CAST(:desde AS DATE)"
+        params['desde'] = desde
+
+    if hasta:
+        filtro_where += f" AND {columna} < CAST(:hasta AS DATE) + 1"
+        params['hasta'] = hasta
+
+    return filtro_where, params
+
+
+def calcular_descuento(pedidos_count, esquema):
+    """
+    Determina el nivel y porcentaje de descuento según el esquema del cliente.
+
+    Args:
+        pedidos_count: pedidos del cliente (sin cancelados)
+        esquema: lista de dicts con nivel, porcentaje, min, max
+
+    Returns:
+        tupla (porcentaje, nivel); (0, None) si no aplica ningún nivel
+    """
+    for nivel_config in esquema:
+        min_pedidos = nivel_config.get("min", 0)
+        max_pedidos = nivel_config.get("max")
+
+        if pedidos_count >= min_pedidos:
+            if max_pedidos is None or pedidos_count <= max_pedidos:
+                return nivel_config.get("porcentaje", 0), nivel_config.get("nivel")
+    return 0, None
+
+
+def _insertar_pedido(datos, porcentaje, nivel):
+    """Inserta el pedido y devuelve (id_pedido, codigo_barras)."""
+    if _columna_disponible('pedido', 'porcentaje_descuento') and _columna_disponible('pedido', 'nivel_descuento'):
+        return run_query(
+            _CTE_NUEVO_ID + f"""
+            INSERT INTO pedido (id_pedido, codigo_barras, fecha_ingreso, fecha_entrega, estado, id_cliente,
+                                direccion_recogida, direccion_entrega, porcentaje_descuento, nivel_descuento)
+            SELECT id, {_EXPR_CODIGO_BARRAS}, :fi, :fe, 'Pendiente', :ic, :dr, :de, :pd, :nd
+            FROM nuevo
+            RETURNING id_pedido, codigo_barras
+            """,
+            {**datos, "pd": porcentaje, "nd": nivel},
+            fetchone=True,
+            commit=True
+        )
+    # Sin las columnas de descuento: estructura antigua
+    return run_query(
+        _CTE_NUEVO_ID + f"""
+        INSERT INTO pedido (id_pedido, codigo_barras, fecha_ingreso, fecha_entrega, estado, id_cliente,
+                            direccion_recogida, direccion_entrega)
+        SELECT id, {_EXPR_CODIGO_BARRAS}, :fi, :fe, 'Pendiente', :ic, :dr, :de
+        FROM nuevo
+        RETURNING id_pedido, codigo_barras
+        """,
+        datos,
+        fetchone=True,
+        commit=True
+    )
+
+
+def _insertar_prendas(id_pedido, prendas):
+    """Inserta las prendas del pedido en un solo executemany."""
+    filas_prenda = [
+        {"tipo": p['tipo'], "desc": p['descripcion'], "obs": '', "foto": p['foto'],
+         "cant": p['cantidad'], "id_ped": id_pedido}
+        for p in prendas
+    ]
+    if _columna_disponible('prenda', 'cantidad'):
+        run_many(
+            "INSERT INTO prenda (tipo, descripcion, observaciones, foto, cantidad, id_pedido) VALUES (:tipo, :desc, :obs, :foto, :cant, :id_ped)",
+            filas_prenda
+        )
+    else:
+        # Sin add_cantidad_to_prenda.sql: una fila por unidad (mismo lote)
+        run_many(
+            "INSERT INTO prenda (tipo, descripcion, observaciones, foto, id_pedido) VALUES (:tipo, :desc, :obs, :foto, :id_ped)",
+            [fila for fila in filas_prenda for _ in range(fila['cant'])]
+        )
+
+
+def crear_pedido(id_cliente, prendas, fecha_ingreso, fecha_entrega, direccion_recogida, direccion_entrega):
+    """
+    Crea un pedido completo (cliente, pedido, prendas y recibo) en una sola
+    conexión y una sola transacción: si algo falla no queda nada a medias.
+
+    Args:
+        id_cliente: ID del cliente (id_usuario)
+        prendas: lista de dicts con tipo, descripcion, foto, cantidad y precio
+        fecha_ingreso: fecha de recogida (YYYY-MM-DD)
+        fecha_entrega: fecha estimada de entrega (YYYY-MM-DD)
+        direccion_recogida: dirección de recogida
+        direccion_entrega: dirección de entrega
+
+    Returns:
+        dict con id_pedido, codigo_barras, total_prendas, subtotal,
+        porcentaje_descuento, nivel_descuento, monto_descuento y total
+    """
+    subtotal = sum(p['precio'] * p['cantidad'] for p in prendas)
+
+    with transaccion():
+        ensure_cliente_exists(id_cliente)
+
+        # Descuento según el ESQUEMA CONGELADO del cliente, antes de crear el pedido
+        pedidos_count = run_query(
+            "SELECT COUNT(*) FROM pedido WHERE id_cliente = :id AND estado != 'Cancelado'",
+            {"id": id_cliente},
+            fetchone=True
+        )[0] or 0
+        esquema_cliente = resolver_esquema(id_cliente)
+        porcentaje, nivel = calcular_descuento(pedidos_count, esquema_cliente)
+
+        id_pedido, codigo_barras = _insertar_pedido(
+            {"fi": fecha_ingreso, "fe": fecha_entrega, "ic": id_cliente,
+             "dr": direccion_recogida, "de": direccion_entrega},
+            porcentaje,
+            nivel
+        )
+
+        _insertar_prendas(id_pedido, prendas)
+
+        # El nuevo pedido activo congela el esquema con el que se calculó su descuento
+        # y avanza la lealtad del cliente
+        registrar_cambio_pedido(id_cliente)
+
+        monto_descuento = (subtotal * porcentaje) / 100
+        total = subtotal - monto_descuento
+
+        run_query(
+            """INSERT INTO recibo (id_pedido, id_cliente, monto, fecha)
+               VALUES (:ip, :ic, :m, CURRENT_TIMESTAMP)""",
+            {"ip": id_pedido, "ic": id_cliente, "m": total},
+            commit=True
+        )
+
+    return {
+        "id_pedido": id_pedido,
+        "codigo_barras": codigo_barras,
+        "total_prendas": sum(p['cantidad'] for p in prendas),
+        "subtotal": subtotal,
+        "porcentaje_descuento": porcentaje,
+        "nivel_descuento": nivel,
+        "monto_descuento": monto_descuento,
+        "total": total
+    }
@@ -0,0 +1,156 @@
+"""
+Servicio del catálogo de precios de prendas
+
+Los precios viven en la tabla precio_prenda (migrations/create_precio_prenda.sql).
+Las consultas SQL hacen LEFT JOIN con sql_join_precio() y las búsquedas desde
+Python usan una copia en memoria que se recarga solo cuando cambia
+precio_prenda_version (la versión se consulta como máximo cada
+VERIFICAR_VERSION_CADA segundos).
+"""
+import threading
+import time
+
+from models import run_query, transaccion
+
+# Tipos sin fila en el catálogo usan este precio
+PRECIO_PRENDA_POR_DEFECTO = 5000
+
+# Catálogo inicial; se usa mientras no exista la tabla precio_prenda
+PRECIOS_POR_DEFECTO = {
+    'Camisa': 5000,
+    'Pantalón': 6000,
+    'Vestido': 8000,
+    'Chaqueta': 10000,
+    'Saco': 7000,
+    'Falda': 5500,
+    'Blusa': 4500,
+    'Abrigo': 12000,
+    'Suéter': 6500,
+    'Jeans': 7000,
+    'Corbata': 3000,
+    'Bufanda': 3500,
+    'Sábana': 8000,
+    'Edredón': 15000,
+    'Cortina': 12000,
+}
+
+VERIFICAR_VERSION_CADA = 30
+
+_lock = threading.Lock()
+_cache = {
+    'version': None,        # versión cargada (None = sin cargar, 0 = sin tabla)
+    'verificado': 0.0,      # time.monotonic() de la última verificación
+    'precios': dict(PRECIOS_POR_DEFECTO),
+    'catalogo': [{'nombre': t, 'precio': p} for t, p in PRECIOS_POR_DEFECTO.items()],
+}
+
+
+def _version_actual():
+    """Versión del catálogo en la base de datos (0 si la tabla no existe)."""
+    try:
+        # SAVEPOINT: si la tabla no existe no se aborta la transacción del llamador
+        with transaccion():
+            fila = run_query("SELECT version FROM precio_prenda_version WHERE id = 1", fetchone=True)
+        return fila[0] if fila else 0
+    except Exception:
+        return 0
+
+
+def _numero(precio):
+    """NUMERIC -> int si es entero (el formulario muestra $5,000 y no $5,000.0)."""
+    precio = float(precio)
+    return int(precio) if precio.is_integer() else precio
+
+
+def _cargar(version):
+    """Recarga la copia en memoria desde precio_prenda."""
+    filas = run_query(
+        "SELECT tipo, precio, activo FROM precio_prenda ORDER BY orden, tipo",
+        fetchall=True
+    ) or []
+    _cache['precios'] = {tipo: _numero(precio) for tipo, precio, _ in filas}
+    _cache['catalogo'] = [
+        {'nombre': tipo, 'precio': _numero(precio)}
+        for tipo, precio, activo in filas if activo
+    ]
+    _cache['version'] = version
+
+
+def _asegurar_cache():
+    """Verifica la versión si pasó el intervalo y recarga si cambió."""
+    ahora = time.monotonic()
+    if _cache['version'] is not None and ahora - _cache['verificado'] < VERIFICAR_VERSION_CADA:
+        return
+    with _lock:
+        if _cache['version'] is not None and ahora - _cache['verificado'] < VERIFICAR_VERSION_CADA:
+            return
+        version = _version_actual()
+        if version and version != _cache['version']:
+            try:
+                _cargar(version)
+            except Exception as e:
+                print(f"[WARN] No se pudo cargar precio_prenda: {e}")
+        elif not version:
+            _cache['version'] = 0
+        _cache['verificado'] = ahora
+
+
+def invalidar_cache_precios():
+    """Fuerza la verificación de la versión en la próxima consulta."""
+    _cache['verificado'] = 0.0
+
+
+def obtener_precios():
+    """
+    Precios por tipo de prenda.
+
+    Returns:
+        dict tipo -> precio
+    """
+    _asegurar_cache()
+    return _cache['precios']
+
+
+def precio_de(tipo):
+    """Precio de un tipo de prenda (PRECIO_PRENDA_POR_DEFECTO si no está en el catálogo)."""
+    return obtener_precios().get(tipo, PRECIO_PRENDA_POR_DEFECTO)
+
+
+def catalogo_prendas():
+    """
+    Prendas activas para el formulario de pedidos.
+
+    Returns:
+        lista de dicts con nombre y precio, en el orden del catálogo
+    """
+    _asegurar_cache()
+    return _cache['catalogo']
+
+
+def sql_join_precio(columna='pr.tipo', alias='pp'):
+    """
+    Cláusula LEFT JOIN con el catálogo de precios.
+
+    El precio se lee como COALESCE(<alias>.precio, PRECIO_PRENDA_POR_DEFECTO)
+    (ver sql_precio). Si la migración aún no se aplicó se une contra una lista
+    VALUES con los precios por defecto, con las mismas columnas.
+
+    Args:
+        columna: columna SQL con el tipo de prenda
+        alias: alias de la tabla del catálogo
+
+    Returns:
+        fragmento SQL
+    """
+    _asegurar_cache()
+    if _cache['version']:
+        return f"LEFT JOIN precio_prenda {alias} ON {alias}.tipo = {columna}"
+    valores = ", ".join(
+        f"('{tipo}', {precio})" for tipo, precio in PRECIOS_POR_DEFECTO.items()
+    )
+    return f"LEFT JOIN (VALUES {valores}) AS {alias}(tipo, precio) ON {alias}.tipo = {columna}"
+
+
+def sql_precio(alias='pp'):
+    """Expresión SQL con el precio unitario (usar junto con sql_join_precio)."""
+    return f"COALESCE({alias}.precio, {PRECIO_PRENDA_POR_DEFECTO})"
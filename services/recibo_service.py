@@ -0,0 +1,568 @@
+"""
+Servicio de recibos en PDF
+
+Reúne la generación del recibo que antes estaba repetida en
+admin.generar_recibo, utils.generar_recibo y utils.descargar_recibo_pdf.
+
+Los PDF generados se guardan en disco (RECIBOS_CACHE_DIR, como máximo
+RECIBOS_CACHE_MAX_MB) con el nombre recibo_<pedido>_<f|s>_<versión>.pdf. La
+versión es un hash del contenido del recibo (pedido, prendas con su precio,
+recibo, fotos), así que un cambio en el pedido o en los precios produce otro
+archivo y el recibo de un pedido que ya no cambia se genera una sola vez.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+import uuid
+from io import BytesIO
+
+from flask import current_app
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, PageBreak
+
+from models import run_query, transaccion
+from services.codigo_barras_service import dibujo_codigo_barras
+from services.foto_service import miniatura
+from services.precio_service import sql_join_precio, sql_precio
+
+# Cambiar si cambia el diseño del recibo: invalida los PDF guardados
+VERSION_FORMATO = 1
+
+
+def obtener_datos_recibo(id_pedido):
+    """
+    Obtiene los datos necesarios para el recibo de un pedido.
+
+    Args:
+        id_pedido: ID del pedido
+
+    Returns:
+        dict con pedido, prendas, recibo, subtotal y descuento; None si el pedido no existe
+    """
+    # Obtener datos del pedido (compatible con o sin columnas de descuento)
+    try:
+        pedido = run_query("""
+            SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega, p.porcentaje_descuento, p.nivel_descuento
+            FROM pedido p
+            LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
+            LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
+            WHERE p.id_pedido = :id
+        """, {"id": id_pedido}, fetchone=True)
+        tiene_columnas_descuento = True
+    except Exception:
+        pedido = run_query("""
+            SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email, p.direccion_recogida, p.direccion_entrega
+            FROM pedido p
+            LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
+            LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
+            WHERE p.id_pedido = :id
+        """, {"id": id_pedido}, fetchone=True)
+        tiene_columnas_descuento = False
+
+    if not pedido:
+        return None
+
+    prendas = run_query(f"""
+        SELECT pr.tipo, pr.descripcion, pr.foto, pr.cantidad, {sql_precio()} as precio
+        FROM prenda pr
+        {sql_join_precio('pr.tipo')}
+        WHERE pr.id_pedido = :id
+        ORDER BY pr.id_prenda
+    """, {"id": id_pedido}, fetchall=True) or []
+
+    recibo = run_query("""
+        SELECT r.monto, r.fecha, r.id_cliente FROM recibo r WHERE id_pedido = :id
+    """, {"id": id_pedido}, fetchone=True)
+
+    return _armar_datos(pedido, prendas, recibo, tiene_columnas_descuento)
+
+
+def _armar_datos(pedido, prendas, recibo, tiene_columnas_descuento):
+    """Dict de datos del recibo (subtotal y descuento) a partir de sus filas."""
+    subtotal = sum(p[4] * p[3] for p in prendas)
+
+    if tiene_columnas_descuento and len(pedido) >= 11:
+        # Usar descuento guardado en el pedido
+        descuento_porcentaje = pedido[9] or 0
+        nivel_descuento = pedido[10] or "Sin nivel"
+    else:
+        # Calcular descuento (método antiguo para compatibilidad)
+        descuento_porcentaje = 0
+        nivel_descuento = "Sin nivel"
+
+        if recibo and subtotal > 0:
+            descuento_monto_calculado = subtotal - recibo[0]
+            if descuento_monto_calculado > 0:
+                descuento_porcentaje = int((descuento_monto_calculado / subtotal) * 100)
+
+                # Determinar nivel según porcentaje
+                if descuento_porcentaje >= 15:
+                    nivel_descuento = "Oro"
+                elif descuento_porcentaje >= 10:
+                    nivel_descuento = "Plata"
+                elif descuento_porcentaje >= 5:
+                    nivel_descuento = "Bronce"
+
+    return {
+        "pedido": pedido,
+        "prendas": prendas,
+        "recibo": recibo,
+        "subtotal": subtotal,
+        "descuento_porcentaje": descuento_porcentaje,
+        "nivel_descuento": nivel_descuento,
+        "descuento_monto": (subtotal * descuento_porcentaje) / 100 if descuento_porcentaje > 0 else 0,
+    }
+
+
+def _celda_foto(foto):
+    """Miniatura de la foto de la prenda para la tabla del recibo."""
+    if not foto:
+        return 'Sin foto'
+    foto_path = os.path.join('static', miniatura(foto, 'min'))
+    if not os.path.exists(foto_path):
+        return 'Foto no encontrada'
+    try:
+        return Image(foto_path, width=0.7*inch, height=0.7*inch)
+    except Exception:
+        return 'Foto no disponible'
+
+
+# Estilos compartidos por todos los recibos (y por todas las páginas de los recibos masivos)
+_ESTILOS = getSampleStyleSheet()
+
+_ESTILO_INFO = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+])
+
+
+def _estilo_prendas(columnas_numericas):
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('ALIGN', (columnas_numericas[0], 0), (columnas_numericas[1], -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ])
+
+
+_ESTILO_PRENDAS_CON_FOTOS = _estilo_prendas((3, 4))
+_ESTILO_PRENDAS_SIN_FOTOS = _estilo_prendas((2, 3))
+
+_ESTILO_SUBTOTAL = TableStyle([
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+])
+
+_ESTILO_DESCUENTO = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), colors.lightyellow),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+    ('TEXTCOLOR', (1, 0), (1, -1), colors.red),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+])
+
+_ESTILO_TOTAL = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), colors.lightgreen),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 14),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+])
+
+
+def _story_recibo(datos, con_fotos=True):
+    """Flowables de un recibo (título, datos, código de barras, prendas y totales)."""
+    pedido = datos['pedido']
+    recibo = datos['recibo']
+    subtotal = datos['subtotal']
+    descuento_monto = datos['descuento_monto']
+    styles = _ESTILOS
+    story = []
+
+    # Título
+    story.append(Paragraph("RECIBO - LA LAVANDERÍA", styles['Title']))
+    story.append(Spacer(1, 0.3*inch))
+
+    # Información del pedido
+    info_data = [
+        ['Pedido #:', str(pedido[0])],
+        ['Cliente:', pedido[4] or 'N/A'],
+        ['Email:', pedido[6] or 'No registrado'],
+        ['Fecha Ingreso:', str(pedido[1])],
+        ['Fecha Entrega:', str(pedido[2]) if pedido[2] else 'Por definir'],
+        ['Estado:', pedido[3]],
+    ]
+
+    # Agregar direcciones si existen
+    if pedido[7]:  # direccion_recogida
+        info_data.append(['Dirección Recogida:', pedido[7]])
+    if pedido[8]:  # direccion_entrega
+        info_data.append(['Dirección Entrega:', pedido[8]])
+
+    info_table = Table(info_data, colWidths=[2*inch, 4*inch])
+    info_table.setStyle(_ESTILO_INFO)
+    story.append(info_table)
+    story.append(Spacer(1, 0.3*inch))
+
+    # Código de barras (dibujo vectorial de reportlab)
+    if pedido[5]:
+        story.append(Paragraph("Código de Barras:", styles['Heading3']))
+        story.append(Spacer(1, 0.1*inch))
+        story.append(dibujo_codigo_barras(pedido[5]))
+        story.append(Spacer(1, 0.3*inch))
+
+    # Tabla de prendas
+    story.append(Paragraph("Prendas:", styles['Heading2']))
+    story.append(Spacer(1, 0.1*inch))
+
+    if con_fotos:
+        prendas_data = [['Tipo', 'Descripción', 'Foto', 'Cant.', 'Precio']]
+        for prenda in datos['prendas']:
+            prendas_data.append([prenda[0], prenda[1] or '-', _celda_foto(prenda[2]), str(prenda[3]), f'${prenda[4] * prenda[3]:,}'])
+        prendas_table = Table(prendas_data, colWidths=[1.4*inch, 1.8*inch, 1.1*inch, 0.6*inch, 1.1*inch])
+        prendas_table.setStyle(_ESTILO_PRENDAS_CON_FOTOS)
+    else:
+        prendas_data = [['Tipo', 'Descripción', 'Cant.', 'Precio']]
+        for prenda in datos['prendas']:
+            prendas_data.append([prenda[0], prenda[1] or '-', str(prenda[3]), f'${prenda[4] * prenda[3]:,}'])
+        prendas_table = Table(prendas_data, colWidths=[1.8*inch, 2.3*inch, 0.7*inch, 1.2*inch])
+        prendas_table.setStyle(_ESTILO_PRENDAS_SIN_FOTOS)
+
+    story.append(prendas_table)
+    story.append(Spacer(1, 0.2*inch))
+
+    # Subtotal y descuento
+    if recibo:
+        subtotal_table = Table([['Subtotal:', f'${subtotal:,.0f}']], colWidths=[4.5*inch, 1.5*inch])
+        subtotal_table.setStyle(_ESTILO_SUBTOTAL)
+        story.append(subtotal_table)
+
+        # Descuento si aplica
+        if descuento_monto > 0:
+            story.append(Spacer(1, 0.1*inch))
+            descuento_data = [[f"Descuento {datos['nivel_descuento']} ({datos['descuento_porcentaje']}%):", f'-${descuento_monto:,.0f}']]
+            descuento_table = Table(descuento_data, colWidths=[4.5*inch, 1.5*inch])
+            descuento_table.setStyle(_ESTILO_DESCUENTO)
+            story.append(descuento_table)
+
+        story.append(Spacer(1, 0.1*inch))
+
+        # Total final
+        total_table = Table([['TOTAL A PAGAR:', f'${recibo[0]:,.0f}']], colWidths=[4.5*inch, 1.5*inch])
+        total_table.setStyle(_ESTILO_TOTAL)
+        story.append(total_table)
+
+    return story
+
+
+def construir_recibo_pdf(datos, con_fotos=True):
+    """
+    Construye el PDF del recibo a partir de obtener_datos_recibo().
+
+    Args:
+        datos: dict devuelto por obtener_datos_recibo
+        con_fotos: incluir la columna con la foto de cada prenda
+
+    Returns:
+        bytes del PDF
+    """
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    doc.build(_story_recibo(datos, con_fotos=con_fotos))
+    return buffer.getvalue()
+
+
+def generar_recibo_pdf(id_pedido, con_fotos=True):
+    """
+    Genera el PDF del recibo de un pedido.
+
+    Args:
+        id_pedido: ID del pedido
+        con_fotos: incluir la foto de cada prenda
+
+    Returns:
+        bytes del PDF, o None si el pedido no existe
+    """
+    datos = obtener_datos_recibo(id_pedido)
+    if datos is None:
+        return None
+    return construir_recibo_pdf(datos, con_fotos=con_fotos)
+
+
+# -----------------------------------------------
+# RECIBOS MASIVOS
+# -----------------------------------------------
+# Pedidos por lote en iterar_datos_recibos (tres consultas por lote)
+LOTE_RECIBOS = 200
+
+_SQL_PEDIDOS_LOTE = """
+    SELECT p.id_pedido, p.fecha_ingreso, p.fecha_entrega, p.estado, c.nombre, p.codigo_barras, u.email,
+           p.direccion_recogida, p.direccion_entrega{descuento}
+    FROM pedido p
+    LEFT JOIN cliente c ON p.id_cliente = c.id_cliente
+    LEFT JOIN usuario u ON c.id_cliente = u.id_usuario
+    WHERE p.id_pedido > :ultimo{filtro}
+    ORDER BY p.id_pedido
+    LIMIT :lote
+"""
+
+
+def contar_pedidos_filtro(filtro_where, params):
+    """Pedidos que cumplen el filtro (ver pedido_service.filtro_pedidos)."""
+    fila = run_query(
+        "SELECT COUNT(*) FROM pedido p LEFT JOIN cliente c ON p.id_cliente = c.id_cliente WHERE 1=1" + filtro_where,
+        params,
+        fetchone=True
+    )
+    return fila[0] if fila else 0
+
+
+def iterar_datos_recibos(filtro_where, params, lote=LOTE_RECIBOS):
+    """
+    Datos de recibo (como obtener_datos_recibo) de los pedidos del filtro, en
+    orden de id. Se leen por lotes con tres consultas cada uno (pedidos,
+    prendas y recibos) en lugar de tres consultas por pedido.
+
+    Args:
+        filtro_where, params: resultado de pedido_service.filtro_pedidos
+        lote: pedidos por lote
+
+    Yields:
+        dict como obtener_datos_recibo
+    """
+    ultimo = 0
+    tiene_columnas_descuento = True
+    while True:
+        params_lote = dict(params, ultimo=ultimo, lote=lote)
+        pedidos = None
+        if tiene_columnas_descuento:
+            try:
+                # SAVEPOINT: sin las columnas de descuento no se aborta la transacción
+                with transaccion():
+                    pedidos = run_query(_SQL_PEDIDOS_LOTE.format(
+                        descuento=", p.porcentaje_descuento, p.nivel_descuento", filtro=filtro_where
+                    ), params_lote, fetchall=True) or []
+            except Exception:
+                tiene_columnas_descuento = False
+        if pedidos is None:
+            pedidos = run_query(_SQL_PEDIDOS_LOTE.format(descuento="", filtro=filtro_where),
+                                params_lote, fetchall=True) or []
+        if not pedidos:
+            return
+
+        ids = [p[0] for p in pedidos]
+        prendas = run_query(f"""
+            SELECT pr.id_pedido, pr.tipo, pr.descripcion, pr.foto, pr.cantidad, {sql_precio()} as precio
+            FROM prenda pr
+            {sql_join_precio('pr.tipo')}
+            WHERE pr.id_pedido = ANY(:ids)
+            ORDER BY pr.id_pedido, pr.id_prenda
+        """, {"ids": ids}, fetchall=True) or []
+        recibos = run_query("""
+            SELECT r.id_pedido, r.monto, r.fecha, r.id_cliente FROM recibo r WHERE r.id_pedido = ANY(:ids)
+        """, {"ids": ids}, fetchall=True) or []
+
+        prendas_por_pedido = {}
+        for fila in prendas:
+            prendas_por_pedido.setdefault(fila[0], []).append(tuple(fila[1:]))
+        recibo_por_pedido = {fila[0]: tuple(fila[1:]) for fila in recibos}
+
+        for pedido in pedidos:
+            yield _armar_datos(pedido, prendas_por_pedido.get(pedido[0], []),
+                               recibo_por_pedido.get(pedido[0]), tiene_columnas_descuento)
+        ultimo = ids[-1]
+
+
+class _StoryPerezosa(list):
+    """
+    Lista de flowables que se rellena a medida que reportlab la consume.
+
+    build() toma los flowables del principio de la lista (del flowables[0]);
+    aquí solo se arman los del recibo siguiente cuando quedan menos de dos,
+    así en memoria hay un recibo (y un lote de datos) a la vez y no los de
+    todo el PDF.
+    """
+
+    def __init__(self, recibos):
+        super().__init__()
+        self._recibos = iter(recibos)
+        self._rellenar()
+
+    def _rellenar(self):
+        while self._recibos is not None and super().__len__() < 2:
+            try:
+                self.extend(next(self._recibos))
+            except StopIteration:
+                self._recibos = None
+
+    def __len__(self):
+        self._rellenar()
+        return super().__len__()
+
+    def __getitem__(self, indice):
+        self._rellenar()
+        return super().__getitem__(indice)
+
+
+def construir_recibos_pdf(datos_recibos, destino, con_fotos=False):
+    """
+    Varios recibos en un solo PDF, uno por página (o más si no cabe).
+
+    Args:
+        datos_recibos: iterable de dicts como obtener_datos_recibo
+        destino: ruta del archivo o archivo abierto en modo binario
+        con_fotos: incluir la foto de cada prenda
+
+    Returns:
+        número de recibos (0 = no se escribió nada)
+    """
+    contador = {'total': 0}
+
+    def recibos():
+        for datos in datos_recibos:
+            flowables = _story_recibo(datos, con_fotos=con_fotos)
+            if contador['total']:
+                flowables.insert(0, PageBreak())
+            contador['total'] += 1
+            yield flowables
+
+    story = _StoryPerezosa(recibos())
+    if story:
+        SimpleDocTemplate(destino, pagesize=letter).build(story)
+    return contador['total']
+
+
+# -----------------------------------------------
+# CACHÉ EN DISCO
+# -----------------------------------------------
+def directorio_recibos(app=None):
+    """Carpeta de la caché de recibos (se crea si no existe)."""
+    app = app or current_app
+    ruta = app.config.get('RECIBOS_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'lalavanderia_recibos')
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+def version_recibo(datos, con_fotos=True):
+    """
+    Hash del contenido del recibo: cambia si cambia cualquier dato que se imprime.
+
+    Args:
+        datos: dict devuelto por obtener_datos_recibo
+        con_fotos: el recibo incluye las fotos (cuenta también la fecha del archivo
+            que se incrusta: la miniatura, o el original mientras no exista)
+
+    Returns:
+        str hexadecimal
+    """
+    partes = [
+        VERSION_FORMATO,
+        con_fotos,
+        tuple(datos['pedido']),
+        [tuple(p) for p in datos['prendas']],
+        tuple(datos['recibo']) if datos['recibo'] else None,
+        datos['descuento_porcentaje'],
+        datos['nivel_descuento'],
+    ]
+    if con_fotos:
+        for prenda in datos['prendas']:
+            if prenda[2]:
+                try:
+                    estado = os.stat(os.path.join('static', miniatura(prenda[2], 'min')))
+                    partes.append((prenda[2], estado.st_mtime_ns, estado.st_size))
+                except OSError:
+                    partes.append((prenda[2], None))
+    return hashlib.sha256(repr(partes).encode('utf-8')).hexdigest()[:32]
+
+
+def _ruta_cache(id_pedido, con_fotos, version):
+    return os.path.join(directorio_recibos(), f"recibo_{id_pedido}_{'f' if con_fotos else 's'}_{version}.pdf")
+
+
+def recibo_en_cache(id_pedido, con_fotos=True):
+    """
+    Busca el recibo vigente del pedido en la caché (solo consulta los datos, no genera el PDF).
+
+    Returns:
+        (ruta o None si aún no se generó, versión); None si el pedido no existe
+    """
+    datos = obtener_datos_recibo(id_pedido)
+    if datos is None:
+        return None
+    version = version_recibo(datos, con_fotos)
+    ruta = _ruta_cache(id_pedido, con_fotos, version)
+    if not os.path.exists(ruta):
+        return None, version
+    try:
+        # La fecha de modificación ordena la limpieza (el último usado se borra al final)
+        os.utime(ruta)
+    except OSError:
+        pass
+    return ruta, version
+
+
+def obtener_recibo_pdf(id_pedido, con_fotos=True):
+    """
+    Ruta del PDF vigente del recibo, generándolo y guardándolo si no está en caché.
+
+    Returns:
+        (ruta, versión); None si el pedido no existe
+    """
+    datos = obtener_datos_recibo(id_pedido)
+    if datos is None:
+        return None
+    version = version_recibo(datos, con_fotos)
+    ruta = _ruta_cache(id_pedido, con_fotos, version)
+    if os.path.exists(ruta):
+        return ruta, version
+
+    pdf = construir_recibo_pdf(datos, con_fotos=con_fotos)
+    # Escritura atómica: una petición concurrente nunca sirve un PDF a medias
+    temporal = f'{ruta}.{uuid.uuid4().hex}.tmp'
+    with open(temporal, 'wb') as archivo:
+        archivo.write(pdf)
+    os.replace(temporal, ruta)
+
+    _recortar_cache()
+    return ruta, version
+
+
+def invalidar_recibos(id_pedido):
+    """Borra los PDF guardados del pedido (llamar tras modificarlo o eliminarlo)."""
+    for ruta in glob.glob(os.path.join(directorio_recibos(), f'recibo_{id_pedido}_*.pdf')):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _recortar_cache():
+    """Borra los recibos usados hace más tiempo hasta quedar bajo RECIBOS_CACHE_MAX_MB."""
+    maximo = current_app.config.get('RECIBOS_CACHE_MAX_MB', 200) * 1024 * 1024
+    archivos = []
+    for ruta in glob.glob(os.path.join(directorio_recibos(), 'recibo_*.pdf')):
+        try:
+            estado = os.stat(ruta)
+        except OSError:
+            continue
+        archivos.append((estado.st_mtime, estado.st_size, ruta))
+
+    total = sum(tamano for _, tamano, _ in archivos)
+    if total <= maximo:
+        return
+    for _, tamano, ruta in sorted(archivos):
+        try:
+            os.remove(ruta)
+        except OSError:
+            continue
+        total -= tamano
+        if total <= maximo:
+            return
@@ -0,0 +1,358 @@
+"""
+Servicio de reportes pre-agregados (rollups)
+
+Los triggers de migrations/create_reportes_rollup.sql marcan en reporte_pendiente
+los días y clientes afectados por cada cambio; refrescar_reportes() recalcula solo
+esas claves y obtener_reportes() lee únicamente las tablas reporte_*, así el costo
+de la página de reportes no depende del tamaño del histórico.
+
+La página aplica como máximo REPORTES_REFRESCO_LOTE claves por visita; los
+atrasos grandes (la carga inicial de la migración, un cambio de precios que
+marca a todos los clientes) los procesa scripts/refrescar_reportes.py.
+"""
+from datetime import datetime
+
+from models import run_query, transaccion
+from services.precio_service import sql_join_precio, sql_precio
+
+# Clave del advisory lock que serializa los refrescos: los meses se derivan de los
+# días tomados y dos refrescos con días del mismo mes chocarían en
+# reporte_mensual_estado / reporte_mensual_prenda (DELETE + INSERT)
+_LOCK_REFRESCO = 7340001
+
+
+def _refrescar_dias(fechas):
+    """Recalcula reporte_diario para las fechas indicadas."""
+    run_query(
+        """
+        INSERT INTO reporte_diario (fecha, pedidos, clientes, ingresos)
+        SELECT d.fecha,
+               (SELECT COUNT(*) FROM pedido p WHERE p.fecha_ingreso = d.fecha),
+               (SELECT COUNT(DISTINCT p.id_cliente) FROM pedido p WHERE p.fecha_ingreso = d.fecha),
+               (SELECT COALESCE(SUM(r.monto), 0) FROM recibo r
+                WHERE r.fecha >= d.fecha AND r.fecha < d.fecha + 1)
+        FROM unnest(CAST(:fechas AS date[])) AS d(fecha)
+        ON CONFLICT (fecha) DO UPDATE SET
+            pedidos = EXCLUDED.pedidos,
+            clientes = EXCLUDED.clientes,
+            ingresos = EXCLUDED.ingresos
+        """,
+        {"fechas": fechas},
+        commit=True
+    )
+    run_query(
+        """
+        DELETE FROM reporte_diario
+        WHERE fecha = ANY(CAST(:fechas AS date[])) AND pedidos = 0 AND ingresos = 0
+        """,
+        {"fechas": fechas},
+        commit=True
+    )
+
+
+def _refrescar_meses(meses):
+    """Recalcula reporte_mensual, reporte_mensual_estado y reporte_mensual_prenda para los meses indicados."""
+    params = {"meses": meses}
+    rango_mes = "p.fecha_ingreso >= m.mes AND p.fecha_ingreso < m.mes + INTERVAL '1 month'"
+
+    run_query(
+        f"""
+        INSERT INTO reporte_mensual (mes, pedidos, prendas, pedidos_con_prendas, ingresos)
+        SELECT m.mes,
+               (SELECT COUNT(*) FROM pedido p WHERE {rango_mes}),
+               (SELECT COALESCE(SUM(pr.cantidad), 0)
+                FROM prenda pr JOIN pedido p ON p.id_pedido = pr.id_pedido
+                WHERE {rango_mes}),
+               (SELECT COUNT(DISTINCT pr.id_pedido)
+                FROM prenda pr JOIN pedido p ON p.id_pedido = pr.id_pedido
+                WHERE {rango_mes}),
+               (SELECT COALESCE(SUM(d.ingresos), 0) FROM reporte_diario d
+                WHERE d.fecha >= m.mes AND d.fecha < m.mes + INTERVAL '1 month')
+        FROM unnest(CAST(:meses AS date[])) AS m(mes)
+        ON CONFLICT (mes) DO UPDATE SET
+            pedidos = EXCLUDED.pedidos,
+            prendas = EXCLUDED.prendas,
+            pedidos_con_prendas = EXCLUDED.pedidos_con_prendas,
+            ingresos = EXCLUDED.ingresos
+        """,
+        params,
+        commit=True
+    )
+
+    run_query("DELETE FROM reporte_mensual_estado WHERE mes = ANY(CAST(:meses AS date[]))", params, commit=True)
+    run_query(
+        f"""
+        INSERT INTO reporte_mensual_estado (mes, estado, pedidos, dias_entrega, con_entrega)
+        SELECT m.mes,
+               COALESCE(p.estado, 'Sin estado'),
+               COUNT(*),
+               COALESCE(SUM(p.fecha_entrega - p.fecha_ingreso), 0),
+               COUNT(p.fecha_entrega)
+        FROM unnest(CAST(:meses AS date[])) AS m(mes)
+        JOIN pedido p ON {rango_mes}
+        GROUP BY m.mes, COALESCE(p.estado, 'Sin estado')
+        """,
+        params,
+        commit=True
+    )
+
+    run_query("DELETE FROM reporte_mensual_prenda WHERE mes = ANY(CAST(:meses AS date[]))", params, commit=True)
+    run_query(
+        f"""
+        INSERT INTO reporte_mensual_prenda (mes, tipo, cantidad)
+        SELECT m.mes, pr.tipo, SUM(pr.cantidad)
+        FROM unnest(CAST(:meses AS date[])) AS m(mes)
+        JOIN pedido p ON {rango_mes}
+        JOIN prenda pr ON pr.id_pedido = p.id_pedido
+        WHERE pr.tipo IS NOT NULL
+        GROUP BY m.mes, pr.tipo
+        """,
+        params,
+        commit=True
+    )
+
+
+def _refrescar_clientes(ids):
+    """Recalcula reporte_cliente y ajusta reporte_resumen por diferencia."""
+    anteriores = run_query(
+        "DELETE FROM reporte_cliente WHERE id_cliente = ANY(CAST(:ids AS integer[])) RETURNING gasto",
+        {"ids": ids},
+        fetchall=True,
+        commit=True
+    ) or []
+    nuevos = run_query(
+        f"""
+        INSERT INTO reporte_cliente (id_cliente, nombre, pedidos, prendas, gasto)
+        SELECT c.id_cliente,
+               c.nombre,
+               COUNT(DISTINCT p.id_pedido),
+               COALESCE(SUM(pr.cantidad), 0),
+               COALESCE(SUM(pr.cantidad * {sql_precio()}), 0)
+        FROM cliente c
+        LEFT JOIN pedido p ON p.id_cliente = c.id_cliente
+        LEFT JOIN prenda pr ON pr.id_pedido = p.id_pedido
+        {sql_join_precio('pr.tipo')}
+        WHERE c.id_cliente = ANY(CAST(:ids AS integer[]))
+        GROUP BY c.id_cliente, c.nombre
+        RETURNING gasto
+        """,
+        {"ids": ids},
+        fetchall=True,
+        commit=True
+    ) or []
+
+    run_query(
+        """
+        UPDATE reporte_resumen
+        SET clientes = clientes + :dc,
+            gasto_total = gasto_total + :dg
+        WHERE id = 1
+        """,
+        {
+            "dc": len(nuevos) - len(anteriores),
+            "dg": sum(f[0] or 0 for f in nuevos) - sum(f[0] or 0 for f in anteriores)
+        },
+        commit=True
+    )
+
+
+def _marcar_todo_pendiente():
+    """Marca todo el histórico como pendiente y reinicia los acumulados por cliente."""
+    run_query(
+        """
+        INSERT INTO reporte_pendiente (dimension, clave)
+        SELECT DISTINCT 'dia', to_char(fecha_ingreso, 'YYYY-MM-DD') FROM pedido WHERE fecha_ingreso IS NOT NULL
+        UNION
+        SELECT DISTINCT 'dia', to_char(fecha, 'YYYY-MM-DD') FROM recibo WHERE fecha IS NOT NULL
+        UNION
+        SELECT 'dia', to_char(fecha, 'YYYY-MM-DD') FROM reporte_diario
+        UNION
+        SELECT 'cliente', id_cliente::text FROM cliente
+        ON CONFLICT DO NOTHING
+        """,
+        commit=True
+    )
+    run_query("DELETE FROM reporte_cliente", commit=True)
+    run_query("UPDATE reporte_resumen SET clientes = 0, gasto_total = 0 WHERE id = 1", commit=True)
+
+
+def _tomar_pendientes(limite):
+    """
+    Quita de reporte_pendiente (y devuelve) hasta `limite` claves; None = todas.
+    SKIP LOCKED: dos refrescos simultáneos toman claves distintas sin esperarse.
+    """
+    if limite is None:
+        return run_query(
+            "DELETE FROM reporte_pendiente RETURNING dimension, clave",
+            fetchall=True,
+            commit=True
+        ) or []
+    return run_query(
+        """
+        DELETE FROM reporte_pendiente
+        WHERE (dimension, clave) IN (
+            SELECT dimension, clave FROM reporte_pendiente
+            LIMIT :limite
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING dimension, clave
+        """,
+        {"limite": limite},
+        fetchall=True,
+        commit=True
+    ) or []
+
+
+def hay_pendientes():
+    """True si quedan claves por recalcular."""
+    return bool(run_query("SELECT EXISTS (SELECT 1 FROM reporte_pendiente)", fetchone=True)[0])
+
+
+def refrescar_reportes(completo=False, limite=None):
+    """
+    Recalcula los agregados de las claves marcadas como pendientes.
+
+    Toma las claves y recalcula en la misma transacción: si otro proceso marca
+    una clave mientras tanto, queda pendiente para el siguiente refresco.
+    Un solo refresco a la vez: con límite (la página) no espera y no hace nada
+    si hay otro en curso; sin límite (el script) espera a que termine.
+
+    Args:
+        completo: reconstruir todo el histórico (corrige cualquier desvío)
+        limite: máximo de claves a recalcular (None = todas); el resto queda
+            pendiente para el siguiente refresco
+
+    Returns:
+        dict con la cantidad de días, meses y clientes recalculados
+    """
+    with transaccion():
+        if limite is None:
+            run_query("SELECT pg_advisory_xact_lock(:clave)", {"clave": _LOCK_REFRESCO}, fetchone=True)
+        elif not run_query("SELECT pg_try_advisory_xact_lock(:clave)", {"clave": _LOCK_REFRESCO}, fetchone=True)[0]:
+            return {"dias": 0, "meses": 0, "clientes": 0}
+
+        if completo:
+            _marcar_todo_pendiente()
+
+        pendientes = _tomar_pendientes(limite)
+
+        fechas = sorted({clave for dimension, clave in pendientes if dimension == 'dia'})
+        ids = sorted({int(clave) for dimension, clave in pendientes if dimension == 'cliente'})
+        meses = sorted({
+            datetime.strptime(fecha, '%Y-%m-%d').date().replace(day=1).isoformat()
+            for fecha in fechas
+        })
+
+        if fechas:
+            _refrescar_dias(fechas)
+        if meses:
+            _refrescar_meses(meses)
+        if ids:
+            _refrescar_clientes(ids)
+
+        if pendientes:
+            run_query(
+                "UPDATE reporte_resumen SET fecha_actualizacion = CURRENT_TIMESTAMP WHERE id = 1",
+                commit=True
+            )
+
+    return {"dias": len(fechas), "meses": len(meses), "clientes": len(ids)}
+
+
+def obtener_reportes():
+    """
+    Lee los datos de la página de reportes desde las tablas reporte_*.
+
+    Returns:
+        dict con las series para gráficos y los indicadores de la página
+    """
+    # Últimos 30 días
+    diario = run_query(
+        """
+        SELECT fecha, pedidos, clientes
+        FROM reporte_diario
+        WHERE fecha >= CURRENT_DATE - 30 AND pedidos > 0
+        ORDER BY fecha
+        """,
+        fetchall=True
+    ) or []
+
+    prendas_por_tipo = run_query(
+        """
+        SELECT tipo, SUM(cantidad) AS cantidad
+        FROM reporte_mensual_prenda
+        GROUP BY tipo
+        HAVING SUM(cantidad) > 0
+        ORDER BY cantidad DESC
+        """,
+        fetchall=True
+    ) or []
+
+    ingresos_por_mes = run_query(
+        """
+        SELECT mes, ingresos
+        FROM reporte_mensual
+        WHERE ingresos <> 0
+        ORDER BY mes DESC
+        LIMIT 12
+        """,
+        fetchall=True
+    ) or []
+
+    estados = run_query(
+        """
+        SELECT estado, SUM(pedidos) AS cantidad, SUM(dias_entrega), SUM(con_entrega)
+        FROM reporte_mensual_estado
+        GROUP BY estado
+        """,
+        fetchall=True
+    ) or []
+
+    clientes_activos = run_query(
+        """
+        SELECT id_cliente, nombre, pedidos, prendas, gasto
+        FROM reporte_cliente
+        ORDER BY pedidos DESC
+        LIMIT 15
+        """,
+        fetchall=True
+    ) or []
+
+    totales = run_query(
+        """
+        SELECT COALESCE(SUM(m.pedidos), 0),
+               COALESCE(SUM(m.prendas), 0),
+               COALESCE(SUM(m.pedidos_con_prendas), 0),
+               COALESCE(SUM(m.ingresos), 0),
+               (SELECT clientes FROM reporte_resumen WHERE id = 1),
+               (SELECT gasto_total FROM reporte_resumen WHERE id = 1)
+        FROM reporte_mensual m
+        """,
+        fetchone=True
+    )
+    total_pedidos, total_prendas, pedidos_con_prendas, total_ingresos, total_clientes, gasto_total = totales
+    total_clientes = total_clientes or 0
+
+    por_estado = {e[0]: e for e in estados}
+    completados = por_estado.get('Completado')
+    pendientes = sum(por_estado[e][1] for e in ('Pendiente', 'En proceso') if e in por_estado)
+
+    return {
+        "clientes_nuevos": [(f[0], f[2]) for f in diario],
+        "pedidos_por_dia": [(f[0], f[1]) for f in diario],
+        "prendas_por_tipo": prendas_por_tipo,
+        "ingresos_por_mes": ingresos_por_mes,
+        "estado_pedidos": [(e[0], e[1]) for e in estados],
+        "top_clientes": [(c[1], c[2]) for c in clientes_activos[:10]],
+        "clientes_activos": clientes_activos,
+        "prendas_top": prendas_por_tipo[:5],
+        "total_clientes": total_clientes,
+        "total_pedidos": total_pedidos,
+        "total_ingresos": total_ingresos,
+        "total_prendas": total_prendas,
+        "promedio_prendas": (total_prendas / pedidos_con_prendas) if pedidos_con_prendas else 0,
+        "completados": completados[1] if completados else 0,
+        "promedio_gasto": (gasto_total / total_clientes) if total_clientes else 0,
+        "pedidos_pendientes": pendientes,
+        "promedio_dias": (completados[2] / completados[3]) if completados and completados[3] else 0,
+    }
@@ -0,0 +1,356 @@
+"""
+Servicio de trabajos en segundo plano
+
+Las exportaciones pesadas (Excel de reportes, recibos PDF) se registran en la
+tabla trabajo y se ejecutan en un pool de hilos local, fuera del hilo de la
+petición. La petición solo encola el trabajo; el navegador consulta el estado
+y descarga el archivo cuando termina.
+"""
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from models import run_query
+
+ESTADO_PENDIENTE = 'pendiente'
+ESTADO_EN_PROCESO = 'en_proceso'
+ESTADO_COMPLETADO = 'completado'
+ESTADO_ERROR = 'error'
+
+# Cada cuánto se limpian los trabajos vencidos (segundos)
+INTERVALO_LIMPIEZA = 3600
+
+_pool = None
+_pool_lock = threading.Lock()
+_ultima_limpieza = 0.0
+
+# tipo -> función(parametros, ruta_base) que devuelve (ruta_archivo, nombre_descarga, mimetype)
+_MANEJADORES = {}
+
+
+def registrar_tipo(tipo):
+    """Decorador para registrar el manejador de un tipo de trabajo."""
+    def decorador(funcion):
+        _MANEJADORES[tipo] = funcion
+        return funcion
+    return decorador
+
+
+def directorio_trabajos(app=None):
+    """Carpeta donde se guardan los archivos generados (se crea si no existe)."""
+    app = app or current_app
+    ruta = app.config.get('TRABAJOS_DIR') or os.path.join(tempfile.gettempdir(), 'lalavanderia_trabajos')
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+def init_trabajos(app):
+    """
+    Crea el pool de trabajos con la primera petición atendida, para que los
+    trabajos interrumpidos por un reinicio se recuperen sin esperar a que se
+    encole uno nuevo (los scripts que solo importan la app no lo crean, así
+    no marcan como interrumpidos los trabajos del servidor en marcha).
+
+    Args:
+        app: instancia de Flask
+    """
+    @app.before_request
+    def _asegurar_pool_trabajos():
+        _obtener_pool(app)
+
+
+def _obtener_pool(app):
+    """
+    Crea el pool de hilos la primera vez que se necesita.
+
+    Al crearlo recupera el estado de un reinicio anterior: los trabajos
+    en_proceso abandonados (ver _marcar_abandonados) se marcan como error y los
+    pendientes se vuelven a encolar.
+    """
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=max(1, app.config.get('TRABAJOS_WORKERS', 2)),
+                thread_name_prefix='trabajo'
+            )
+            try:
+                _recuperar_trabajos(app)
+            except Exception as e:
+                print(f"[WARN] No se pudieron recuperar los trabajos pendientes: {e}")
+    return _pool
+
+
+def _marcar_abandonados(app):
+    """
+    Marca como error los trabajos en_proceso que empezaron hace más de
+    TRABAJOS_ABANDONO_MINUTOS: otro proceso (un deploy solapado, un segundo
+    worker) puede seguir ejecutando los más recientes.
+    """
+    run_query("""
+        UPDATE trabajo
+        SET estado = :error, error = 'Interrumpido por reinicio del servidor', fecha_fin = NOW()
+        WHERE estado = :en_proceso
+          AND fecha_inicio < NOW() - (:minutos * INTERVAL '1 minute')
+    """, {
+        "error": ESTADO_ERROR,
+        "en_proceso": ESTADO_EN_PROCESO,
+        "minutos": app.config.get('TRABAJOS_ABANDONO_MINUTOS', 60)
+    }, commit=True)
+
+
+def _recuperar_trabajos(app):
+    """Marca los trabajos abandonados y vuelve a encolar los pendientes."""
+    _marcar_abandonados(app)
+
+    pendientes = run_query(
+        "SELECT token FROM trabajo WHERE estado = :pendiente ORDER BY id_trabajo",
+        {"pendiente": ESTADO_PENDIENTE},
+        fetchall=True
+    ) or []
+    for (token,) in pendientes:
+        _pool.submit(_ejecutar_trabajo, app, token)
+
+
+def limpiar_trabajos_vencidos(app=None):
+    """
+    Borra los trabajos (y sus archivos) más antiguos que TRABAJOS_RETENCION_HORAS.
+
+    Returns:
+        número de trabajos eliminados
+    """
+    app = app or current_app
+    horas = app.config.get('TRABAJOS_RETENCION_HORAS', 24)
+
+    vencidos = run_query("""
+        DELETE FROM trabajo
+        WHERE fecha_creacion < NOW() - (:horas * INTERVAL '1 hour') AND estado IN (:completado, :error)
+        RETURNING archivo
+    """, {"horas": horas, "completado": ESTADO_COMPLETADO, "error": ESTADO_ERROR},
+        fetchall=True, commit=True) or []
+
+    for (archivo,) in vencidos:
+        if archivo and os.path.exists(archivo):
+            try:
+                os.remove(archivo)
+            except OSError as e:
+                print(f"[WARN] No se pudo borrar {archivo}: {e}")
+    return len(vencidos)
+
+
+def _limpiar_si_corresponde(app):
+    """Limpia los trabajos vencidos como máximo una vez cada INTERVALO_LIMPIEZA."""
+    global _ultima_limpieza
+    ahora = time.monotonic()
+    if _ultima_limpieza and ahora - _ultima_limpieza < INTERVALO_LIMPIEZA:
+        return
+    _ultima_limpieza = ahora
+    try:
+        _marcar_abandonados(app)
+        limpiar_trabajos_vencidos(app)
+    except Exception as e:
+        print(f"[WARN] Error limpiando trabajos vencidos: {e}")
+
+
+def encolar_trabajo(tipo, parametros=None, id_usuario=None):
+    """
+    Registra un trabajo y lo envía al pool de hilos.
+
+    Si ya hay un trabajo idéntico (mismo tipo, parámetros y usuario) pendiente
+    o en proceso se reutiliza en lugar de crear otro, para que los dobles clics
+    no dupliquen el trabajo.
+
+    Args:
+        tipo: tipo de trabajo registrado con registrar_tipo
+        parametros: dict serializable a JSON
+        id_usuario: usuario que lo solicita (dueño de la descarga; obligatorio)
+
+    Returns:
+        token del trabajo
+    """
+    if tipo not in _MANEJADORES:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    if id_usuario is None:
+        raise ValueError("Los trabajos requieren un usuario con sesión iniciada")
+
+    app = current_app._get_current_object()
+    pool = _obtener_pool(app)
+    _limpiar_si_corresponde(app)
+
+    parametros_json = json.dumps(parametros or {}, sort_keys=True)
+
+    existente = run_query("""
+        SELECT token FROM trabajo
+        WHERE tipo = :tipo AND parametros = :parametros
+          AND id_usuario = :id_usuario
+          AND estado IN (:pendiente, :en_proceso)
+        ORDER BY id_trabajo DESC
+        LIMIT 1
+    """, {
+        "tipo": tipo,
+        "parametros": parametros_json,
+        "id_usuario": id_usuario,
+        "pendiente": ESTADO_PENDIENTE,
+        "en_proceso": ESTADO_EN_PROCESO
+    }, fetchone=True)
+    if existente:
+        return existente[0]
+
+    token = uuid.uuid4().hex
+    run_query("""
+        INSERT INTO trabajo (token, tipo, estado, parametros, id_usuario)
+        VALUES (:token, :tipo, :estado, :parametros, :id_usuario)
+    """, {
+        "token": token,
+        "tipo": tipo,
+        "estado": ESTADO_PENDIENTE,
+        "parametros": parametros_json,
+        "id_usuario": id_usuario
+    }, commit=True)
+
+    pool.submit(_ejecutar_trabajo, app, token)
+    return token
+
+
+def _ejecutar_trabajo(app, token):
+    """Ejecuta un trabajo en un hilo del pool (con su propio contexto de aplicación)."""
+    with app.app_context():
+        # Reclamar el trabajo: solo un hilo puede pasarlo de pendiente a en_proceso
+        trabajo = run_query("""
+            UPDATE trabajo
+            SET estado = :en_proceso, fecha_inicio = NOW()
+            WHERE token = :token AND estado = :pendiente
+            RETURNING tipo, parametros
+        """, {"token": token, "en_proceso": ESTADO_EN_PROCESO, "pendiente": ESTADO_PENDIENTE},
+            fetchone=True, commit=True)
+        if not trabajo:
+            return
+
+        tipo, parametros_json = trabajo
+        try:
+            manejador = _MANEJADORES[tipo]
+            parametros = json.loads(parametros_json or '{}')
+            ruta_base = os.path.join(directorio_trabajos(app), token)
+            archivo, nombre_descarga, mimetype = manejador(parametros, ruta_base)
+
+            # Solo si sigue en_proceso (pudo marcarse como abandonado mientras tanto)
+            actualizado = run_query("""
+                UPDATE trabajo
+                SET estado = :completado, archivo = :archivo, nombre_descarga = :nombre,
+                    mimetype = :mimetype, fecha_fin = NOW()
+                WHERE token = :token AND estado = :en_proceso
+                RETURNING token
+            """, {
+                "completado": ESTADO_COMPLETADO,
+                "en_proceso": ESTADO_EN_PROCESO,
+                "archivo": archivo,
+                "nombre": nombre_descarga,
+                "mimetype": mimetype,
+                "token": token
+            }, fetchone=True, commit=True)
+            if not actualizado and os.path.exists(archivo):
+                os.remove(archivo)
+        except Exception as e:
+            print(f"[ERROR] Trabajo {tipo} ({token}) falló: {e}")
+            traceback.print_exc()
+            run_query("""
+                UPDATE trabajo
+                SET estado = :error, error = :mensaje, fecha_fin = NOW()
+                WHERE token = :token AND estado = :en_proceso
+            """, {"error": ESTADO_ERROR, "en_proceso": ESTADO_EN_PROCESO,
+                  "mensaje": str(e)[:1000], "token": token}, commit=True)
+
+
+def obtener_trabajo(token):
+    """
+    Obtiene el estado de un trabajo.
+
+    Args:
+        token: identificador público del trabajo
+
+    Returns:
+        dict con los datos del trabajo o None si no existe
+    """
+    fila = run_query("""
+        SELECT token, tipo, estado, id_usuario, archivo, nombre_descarga, mimetype,
+               error, fecha_creacion, fecha_inicio, fecha_fin
+        FROM trabajo
+        WHERE token = :token
+    """, {"token": token}, fetchone=True)
+    if not fila:
+        return None
+    return {
+        "token": fila[0],
+        "tipo": fila[1],
+        "estado": fila[2],
+        "id_usuario": fila[3],
+        "archivo": fila[4],
+        "nombre_descarga": fila[5],
+        "mimetype": fila[6],
+        "error": fila[7],
+        "fecha_creacion": fila[8],
+        "fecha_inicio": fila[9],
+        "fecha_fin": fila[10],
+    }
+
+
+def puede_ver_trabajo(trabajo, id_usuario, es_admin):
+    """El dueño del trabajo o un administrador pueden ver su estado y descargarlo."""
+    if es_admin:
+        return True
+    return trabajo['id_usuario'] is not None and trabajo['id_usuario'] == id_usuario
+
+
+# -----------------------------------------------
+# MANEJADORES
+# -----------------------------------------------
+@registrar_tipo('excel_reportes')
+def _trabajo_excel_reportes(parametros, ruta_base):
+    """Genera el Excel de reportes y lo mueve a la carpeta de trabajos."""
+    from services.exportacion_service import generar_excel_reportes, EXCEL_MIMETYPE
+
+    temporal = generar_excel_reportes()
+    archivo = ruta_base + '.xlsx'
+    shutil.move(temporal, archivo)
+    fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
+    return archivo, f'Reportes_LaLavanderia_{fecha_actual}.xlsx', EXCEL_MIMETYPE
+
+
+@registrar_tipo('recibo_pdf')
+def _trabajo_recibo_pdf(parametros, ruta_base):
+    """Genera el recibo PDF de un pedido (o lo toma de la caché de recibos)."""
+    from services.recibo_service import obtener_recibo_pdf
+
+    id_pedido = int(parametros['id_pedido'])
+    resultado = obtener_recibo_pdf(id_pedido, con_fotos=parametros.get('con_fotos', True))
+    if resultado is None:
+        raise ValueError('Pedido no encontrado')
+    # Copia propia: la limpieza de trabajos no debe borrar el archivo de la caché
+    archivo = ruta_base + '.pdf'
+    shutil.copyfile(resultado[0], archivo)
+    return archivo, f'recibo_pedido_{id_pedido}.pdf', 'application/pdf'
+
+
+@registrar_tipo('recibos_pdf')
+def _trabajo_recibos_pdf(parametros, ruta_base):
+    """Recibos (sin fotos) de todos los pedidos de un filtro en un solo PDF."""
+    from services.pedido_service import filtro_pedidos
+    from services.recibo_service import iterar_datos_recibos, construir_recibos_pdf
+
+    filtro_where, params = filtro_pedidos(**parametros.get('filtro', {}))
+    archivo = ruta_base + '.pdf'
+    if not construir_recibos_pdf(iterar_datos_recibos(filtro_where, params), archivo):
+        raise ValueError('Ningún pedido cumple el filtro')
+    fecha_actual = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
+    return archivo, f'recibos_{fecha_actual}.pdf', 'application/pdf'
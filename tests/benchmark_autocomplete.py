@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Compara el autocompletado de clientes con índice en memoria contra la consulta SQL.
+
+Sin argumentos genera clientes sintéticos y mide solo el índice en memoria
+(construcción y búsquedas). Con --sql usa la base de datos configurada
+(DATABASE_URL / credentials.py): carga el índice desde la tabla usuario y mide
+las mismas búsquedas con services.busqueda_service.buscar_clientes.
+
+USO:
+    python tests/benchmark_autocomplete.py
+    python tests/benchmark_autocomplete.py --clientes 500000 --consultas 5000
+    python tests/benchmark_autocomplete.py --sql
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+NOMBRES = ['José', 'María', 'Andrés', 'Camila', 'Sebastián', 'Valentina', 'Juan', 'Lucía',
+           'Nicolás', 'Sofía', 'Martín', 'Daniela', 'Ángela', 'Felipe', 'Natalia', 'Óscar']
+APELLIDOS = ['Pérez', 'Gómez', 'Rodríguez', 'Núñez', 'Martínez', 'López', 'Hernández',
+             'Díaz', 'Muñoz', 'Ramírez', 'Castaño', 'Vásquez', 'Ortiz', 'Suárez', 'Peña']
+
+
+def clientes_sinteticos(cantidad, semilla=42):
+    """Filas (id, nombre, email, username) con nombres en español."""
+    rnd = random.Random(semilla)
+    for i in range(1, cantidad + 1):
+        nombre = f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+        username = f"{nombre.split()[0].lower()}{i}"
+        yield i, nombre, f"{username}@correo.com", username
+
+
+def consultas_desde(filas, cantidad, semilla=7):
+    """Prefijos de 2 a 6 letras de nombres, apellidos y emails reales del conjunto."""
+    rnd = random.Random(semilla)
+    muestra = rnd.sample(filas, min(len(filas), cantidad))
+    consultas = []
+    for _, nombre, email, _ in muestra:
+        palabra = rnd.choice((nombre or '').split() + [email or ''])
+        if len(palabra) >= 2:
+            consultas.append(palabra[:rnd.randint(2, min(6, len(palabra)))])
+    return consultas
+
+
+def medir(nombre, funcion, consultas):
+    """Ejecuta la función para cada consulta y muestra percentiles en milisegundos."""
+    tiempos = []
+    for q in consultas:
+        inicio = time.perf_counter()
+        funcion(q)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    p = lambda x: tiempos[min(len(tiempos) - 1, int(len(tiempos) * x))]
+    print(f"{nombre:<22} n={len(tiempos):<6} media={statistics.mean(tiempos):8.3f} ms  "
+          f"p50={p(0.50):8.3f}  p95={p(0.95):8.3f}  p99={p(0.99):8.3f}  max={tiempos[-1]:8.3f}")
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clientes', type=int, default=200000, help='clientes sintéticos (sin --sql)')
+    parser.add_argument('--consultas', type=int, default=2000)
+    parser.add_argument('--sql', action='store_true', help='medir contra la base de datos configurada')
+    args = parser.parse_args()
+
+    from services.autocompletado_service import IndiceClientes
+
+    if args.sql:
+        from app import app
+        from models import run_query_stream
+        from services.autocompletado_service import _SQL_CLIENTES
+        from services.busqueda_service import buscar_clientes
+
+        with app.app_context():
+            inicio = time.perf_counter()
+            filas = list(run_query_stream(_SQL_CLIENTES))
+            indice = IndiceClientes()
+            indice.cargar(filas)
+            print(f"Índice cargado desde la BD: {len(indice)} clientes en "
+                  f"{time.perf_counter() - inicio:.2f} s")
+            consultas = consultas_desde(filas, args.consultas)
+            medir('SQL (buscar_clientes)', lambda q: buscar_clientes(q, limite=10), consultas)
+            medir('Memoria (índice)', lambda q: indice.buscar(q, limite=10), consultas)
+        return 0
+
+    filas = list(clientes_sinteticos(args.clientes))
+    inicio = time.perf_counter()
+    indice = IndiceClientes()
+    indice.cargar(filas)
+    print(f"Índice construido: {len(indice)} clientes en {time.perf_counter() - inicio:.2f} s")
+
+    consultas = consultas_desde(filas, args.consultas)
+    medir('Memoria (índice)', lambda q: indice.buscar(q, limite=10), consultas)
+
+    inicio = time.perf_counter()
+    for i in range(1000):
+        indice.actualizar(args.clientes + i, 'Cliente Nuevo', f'nuevo{i}@correo.com', f'nuevo{i}')
+    print(f"1000 altas incrementales: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    print("Para comparar con la consulta SQL ejecutar con --sql")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Compara el código de barras rasterizado (PNG con PIL) contra el vectorial
+(SVG para la web, dibujo de reportlab para los recibos PDF).
+
+Mide, sin caché, el tiempo de generación y los bytes de:
+- la imagen para la web: PNG (ImageWriter) vs SVG (SVGWriter, también gzip)
+- un recibo PDF con solo el código de barras: PNG incrustado vs dibujo vectorial
+
+No necesita base de datos.
+
+USO:
+    python tests/benchmark_codigo_barras.py
+    python tests/benchmark_codigo_barras.py --codigos 500
+"""
+
+import argparse
+import gzip
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+
+def codigos_sinteticos(cantidad):
+    """Códigos con el formato de pedido_service (LAV-YYYYMMDD-000001)."""
+    return [f"LAV-20260115-{i:06d}" for i in range(1, cantidad + 1)]
+
+
+def medir(nombre, funcion, codigos):
+    """Genera cada código y muestra tiempos en milisegundos y bytes medios de la salida."""
+    tiempos = []
+    tamanos = []
+    for codigo in codigos:
+        inicio = time.perf_counter()
+        salida = funcion(codigo)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        tamanos.append(len(salida))
+    tiempos.sort()
+    p = lambda x: tiempos[min(len(tiempos) - 1, int(len(tiempos) * x))]
+    print(f"{nombre:<26} n={len(tiempos):<5} media={statistics.mean(tiempos):7.3f} ms  "
+          f"p50={p(0.50):7.3f}  p95={p(0.95):7.3f}  bytes={statistics.mean(tamanos):9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--codigos', type=int, default=200)
+    args = parser.parse_args()
+
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Image
+    from services.codigo_barras_service import _dibujar, _opciones, dibujo_codigo_barras
+
+    codigos = codigos_sinteticos(args.codigos)
+
+    def png(codigo):
+        return _dibujar(codigo, 'png', _opciones(None))
+
+    def svg(codigo):
+        return _dibujar(codigo, 'svg', _opciones(None))
+
+    def pdf(flowable):
+        buffer = BytesIO()
+        SimpleDocTemplate(buffer, pagesize=letter).build([flowable])
+        return buffer.getvalue()
+
+    print("Imagen para la web")
+    medir('PNG (ImageWriter)', png, codigos)
+    medir('SVG (SVGWriter)', svg, codigos)
+    medir('SVG + gzip', lambda c: gzip.compress(svg(c)), codigos)
+
+    print("Recibo PDF (solo el código de barras)")
+    medir('PDF con PNG incrustado', lambda c: pdf(Image(BytesIO(png(c)), width=4*inch, height=1*inch)), codigos)
+    medir('PDF con dibujo reportlab', lambda c: pdf(dibujo_codigo_barras(c)), codigos)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Pruebas del despachador de correos (services.email_service.EmailDispatcher)
+con transportes en memoria: no necesita SendGrid, red ni base de datos.
+
+Comprueba que:
+- los correos con el mismo contenido se envían en una sola petición
+- los errores transitorios se reintentan con espera exponencial
+- la cola está acotada (con la cola llena encolar() descarta el correo)
+
+USO:
+    python tests/test_email_dispatcher.py
+    python -m pytest tests/test_email_dispatcher.py
+"""
+
+import sys
+import threading
+import types
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from services import email_service  # noqa: E402
+from services.email_service import EmailDispatcher, ErrorTransitorio, TransporteMemoria  # noqa: E402
+
+
+def _mensaje(destinatario, asunto='Pedido listo', cuerpo='<p>Hola</p>'):
+    return {'destinatario': destinatario, 'asunto': asunto, 'cuerpo_html': cuerpo, 'attachments': None}
+
+
+class TransporteRegistro(TransporteMemoria):
+    """TransporteMemoria que además guarda los destinatarios de cada petición."""
+
+    def __init__(self):
+        super().__init__()
+        self.peticiones = []
+
+    def enviar(self, mensaje, destinatarios):
+        with self._lock:
+            self.peticiones.append(list(destinatarios))
+        super().enviar(mensaje, destinatarios)
+
+
+class TransporteRetenido(TransporteRegistro):
+    """Retiene el primer envío hasta que la prueba lo libera (para llenar la cola)."""
+
+    def __init__(self):
+        super().__init__()
+        self.en_envio = threading.Event()
+        self.liberar = threading.Event()
+
+    def enviar(self, mensaje, destinatarios):
+        self.en_envio.set()
+        self.liberar.wait(5)
+        super().enviar(mensaje, destinatarios)
+
+
+class TransporteFallos(TransporteMemoria):
+    """Falla con ErrorTransitorio las primeras `fallos` veces."""
+
+    def __init__(self, fallos):
+        super().__init__()
+        self.fallos = fallos
+        self.intentos = 0
+
+    def enviar(self, mensaje, destinatarios):
+        self.intentos += 1
+        if self.intentos <= self.fallos:
+            raise ErrorTransitorio('SendGrid response: 503')
+        super().enviar(mensaje, destinatarios)
+
+
+class EmailDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        # Sin esperas reales y sin jitter: espera = espera_base * 2 ** intento
+        self.esperas = []
+        falso_time = types.SimpleNamespace(sleep=self.esperas.append, monotonic=email_service.time.monotonic)
+        for parche in (mock.patch.object(email_service, 'time', falso_time),
+                       mock.patch.object(email_service.random, 'random', return_value=0.5)):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def test_agrupa_correos_con_el_mismo_contenido(self):
+        transporte = TransporteRetenido()
+        dispatcher = EmailDispatcher(transporte, workers=1, lote_max=50)
+        self.assertTrue(dispatcher.encolar(_mensaje('primero@example.com', asunto='Otro')))
+        self.assertTrue(transporte.en_envio.wait(5))
+
+        # Mientras el hilo está ocupado se acumulan en la cola y salen en un solo lote
+        destinatarios = [f'cliente{i}@example.com' for i in range(10)]
+        for destinatario in destinatarios:
+            self.assertTrue(dispatcher.encolar(_mensaje(destinatario)))
+        dispatcher.encolar(_mensaje('distinto@example.com', asunto='Recibo'))
+        transporte.liberar.set()
+        dispatcher.detener(timeout=5)
+
+        self.assertEqual(transporte.peticiones, [
+            ['primero@example.com'],
+            destinatarios,
+            ['distinto@example.com'],
+        ])
+        self.assertEqual(len(transporte.enviados), 12)
+
+    def test_reintenta_errores_transitorios_con_espera_exponencial(self):
+        transporte = TransporteFallos(fallos=2)
+        dispatcher = EmailDispatcher(transporte, workers=1, reintentos=3, espera_base=1.0)
+        dispatcher.encolar(_mensaje('cliente@example.com'))
+        dispatcher.detener(timeout=5)
+
+        self.assertEqual(transporte.intentos, 3)
+        self.assertEqual(self.esperas, [1.0, 2.0])
+        self.assertEqual([m['destinatario'] for m in transporte.enviados], ['cliente@example.com'])
+
+    def test_abandona_tras_agotar_los_reintentos(self):
+        transporte = TransporteFallos(fallos=10)
+        dispatcher = EmailDispatcher(transporte, workers=1, reintentos=2, espera_base=0.5)
+        dispatcher.encolar(_mensaje('cliente@example.com'))
+        dispatcher.detener(timeout=5)
+
+        self.assertEqual(transporte.intentos, 3)
+        self.assertEqual(self.esperas, [0.5, 1.0])
+        self.assertEqual(transporte.enviados, [])
+
+    def test_cola_llena_descarta_en_lugar_de_crecer(self):
+        transporte = TransporteRetenido()
+        dispatcher = EmailDispatcher(transporte, workers=1, cola_max=3)
+        dispatcher.encolar(_mensaje('ocupado@example.com'))
+        self.assertTrue(transporte.en_envio.wait(5))
+
+        for i in range(3):
+            self.assertTrue(dispatcher.encolar(_mensaje(f'cliente{i}@example.com'), timeout=0.1))
+        self.assertFalse(dispatcher.encolar(_mensaje('sobra@example.com'), timeout=0.05))
+        self.assertEqual(dispatcher.pendientes(), 3)
+
+        transporte.liberar.set()
+        dispatcher.detener(timeout=5)
+        self.assertEqual(len(transporte.enviados), 4)
+        self.assertNotIn('sobra@example.com', [m['destinatario'] for m in transporte.enviados])
+
+
+if __name__ == '__main__':
+    unittest.main()